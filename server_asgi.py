@@ -0,0 +1,17 @@
+import sys
+import io
+sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+
+import uvicorn
+from src.webapp import create_app, db
+from src.webapp.asgi import create_asgi_app
+
+# Proxies GeoServer/Mírame en asyncio; el resto de la app Flask en hilos
+flask_app = create_app()
+app = create_asgi_app(flask_app)
+
+if __name__ == "__main__":
+    with flask_app.app_context():
+        db.create_all()
+    uvicorn.run(app, host='0.0.0.0', port=5000)
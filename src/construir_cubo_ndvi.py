@@ -0,0 +1,76 @@
+"""
+Construye / actualiza el cubo NDVI (webapp/utils/ndvi_cubo.py) con los
+mosaicos diarios UTM de data/processed/ndvi_composite.
+
+Uso:
+  cd src
+  python construir_cubo_ndvi.py                      # añade las fechas que falten
+  python construir_cubo_ndvi.py --fechas 20260219,20260224
+  python construir_cubo_ndvi.py --forzar             # reescribe también las ya presentes
+
+ndvi_diax.py añade su mosaico al cubo al terminar (NDVI_CUBE=1), así que este
+script solo hace falta para la carga inicial o para rehacer fechas.
+"""
+
+from __future__ import annotations
+
+import argparse
+import re
+import sys
+import time
+
+from project_paths import NDVI_COMPOSITE_DIR
+from webapp.utils.ndvi_cubo import NDVI_CUBE_DIR, CuboNDVI
+
+_RE_MOSAICO = re.compile(r"^ndvi_pc_(\d{8})_mosaic_utm\.tif$")
+
+
+def mosaicos_disponibles() -> dict[str, object]:
+    """{YYYYMMDD: ruta} de los mosaicos NDVI UTM diarios."""
+    out = {}
+    if NDVI_COMPOSITE_DIR.is_dir():
+        for p in NDVI_COMPOSITE_DIR.iterdir():
+            m = _RE_MOSAICO.match(p.name)
+            if m:
+                out[m.group(1)] = p
+    return dict(sorted(out.items()))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Añade los mosaicos NDVI diarios al cubo de series temporales")
+    parser.add_argument("--fechas", default="", help="Solo estas fechas YYYYMMDD (coma). Vacío = todas.")
+    parser.add_argument("--forzar", action="store_true", help="Reescribir fechas que ya están en el cubo")
+    parser.add_argument("--dir", default=str(NDVI_CUBE_DIR), help="Directorio del cubo (NDVI_CUBE_DIR)")
+    args = parser.parse_args()
+
+    mosaicos = mosaicos_disponibles()
+    if args.fechas.strip():
+        pedidas = [f.strip() for f in args.fechas.split(",") if f.strip()]
+        faltan = [f for f in pedidas if f not in mosaicos]
+        if faltan:
+            print(f"✗ Sin mosaico UTM para: {', '.join(faltan)}")
+            return 1
+        mosaicos = {f: mosaicos[f] for f in pedidas}
+
+    cubo = CuboNDVI(args.dir)
+    ya = set(cubo.fechas)
+    pendientes = {f: p for f, p in mosaicos.items() if args.forzar or f not in ya}
+
+    print("=" * 70)
+    print("CUBO NDVI — SERIES TEMPORALES POR PÍXEL")
+    print("=" * 70)
+    print(f"Cubo:       {cubo.directorio} ({len(ya)} fechas)")
+    print(f"Mosaicos:   {len(mosaicos)} | a escribir: {len(pendientes)}")
+
+    t_global = time.perf_counter()
+    for fecha, ruta in pendientes.items():
+        t0 = time.perf_counter()
+        slot = cubo.anadir_tif(fecha, ruta)
+        print(f"  ✓ {fecha} -> slot {slot} ({time.perf_counter() - t0:.1f}s)")
+
+    print(f"\n✓ {len(cubo.fechas)} fechas en el cubo ({time.perf_counter() - t_global:.1f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+decodificacion_ndvi.py
+----------------------
+Decodificación de los GeoTIFF NDVI/índices a float32 con NaN, sea cual sea el
+``NDVI_FORMATO`` con que se escribieron (ver ``ndvi_pipeline/formato_ndvi.py``):
+float32 con NaN o int16 × 10000 con nodata -32768.
+
+Única implementación para los scripts (``ndvi_pipeline.formato_ndvi`` la
+reexporta) y para la webapp (``webapp/utils/ndvi_formato.py``). Solo depende de
+numpy: ``ndvi_pipeline`` no importa Flask y la webapp no importa
+``ndvi_pipeline``, así que vive fuera de los dos paquetes.
+
+La escala de los enteros es la de los metadatos scale/offset de GDAL que
+escribe ``formato_ndvi.marcar_escala`` (y que ``warp_a_3857`` copia al 3857);
+un ráster entero sin ellos se devuelve tal cual, en float32.
+"""
+
+from __future__ import annotations
+
+import numpy as np
+
+def parametros_decodificacion(src, banda: int = 1) -> tuple[float, float, float | None]:
+    """(escala, offset, nodata) para ``decodificar_array``."""
+    return float(src.scales[banda - 1]), float(src.offsets[banda - 1]), src.nodata
+
+
+def decodificar_array(datos: np.ndarray, escala: float, offset: float, nodata) -> np.ndarray:
+    """Datos tal como están en el fichero -> float32 con NaN en nodata."""
+    if datos.dtype.kind == "f":
+        out = datos.astype(np.float32, copy=True)
+        if nodata is not None and not np.isnan(nodata):
+            out[datos == nodata] = np.nan
+        return out
+    out = datos.astype(np.float32)
+    if escala != 1.0 or offset != 0.0:
+        out *= np.float32(escala)
+        out += np.float32(offset)
+    if nodata is not None:
+        out[datos == nodata] = np.nan
+    return out
+
+
+def decodificar(datos: np.ndarray, src, banda: int = 1) -> np.ndarray:
+    return decodificar_array(datos, *parametros_decodificacion(src, banda))
+
+
+def leer_ndvi(src, banda: int = 1, **kwargs) -> np.ndarray:
+    """``src.read(banda, **kwargs)`` decodificado a float32 con NaN, sea cual sea el formato."""
+    return decodificar(src.read(banda, **kwargs), src, banda)
@@ -12,7 +12,6 @@ from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from scipy.spatial import cKDTree
 import rasterio
-from rasterio.mask import mask as rasterio_mask
 import pyproj
 from shapely import wkt as shapely_wkt
 from shapely.ops import transform as shapely_transform
@@ -22,6 +21,8 @@ from webapp.config import Config
 ROOT = Path(__file__).resolve().parent
 sys.path.insert(0, str(ROOT))
 from project_paths import DATOS_SALIDA_DIR, ndvi_mosaic_mas_reciente  # noqa: E402
+from ndvi_pipeline.formato_ndvi import leer_ndvi  # noqa: E402
+from ndvi_pipeline.zonal import EtiquetasRecintos, valores_geometria  # noqa: E402
 
 engine  = create_engine(Config.SQLALCHEMY_DATABASE_URI)
 Session = sessionmaker(bind=engine)
@@ -207,85 +208,94 @@ def validar_interpolacion(df, col_nombre, datos, puntos_cultivos_lonlat):
               f"diff={diff:.3f} | dist={dist_km:.1f}km{alerta}")
 
 
-def muestrear_ndvi_zonal(df, ruta_raster):
+def geometrias_en_crs(df, raster_crs):
+    """(geometrías de ``df`` en ``raster_crs`` o None, nº errores WKT, nº errores de reproyección)."""
+    transformer = pyproj.Transformer.from_crs(
+        "EPSG:4326", raster_crs, always_xy=True
+    )
+
+    def reproyectar(geom):
+        return shapely_transform(
+            lambda x, y: transformer.transform(x, y),
+            geom
+        )
+
+    geoms       = [None] * len(df)
+    n_error_wkt = 0
+    n_error_prj = 0
+    for i, wkt_str in enumerate(df["geometry_wkt"]):
+        try:
+            geom_wgs84 = shapely_wkt.loads(wkt_str)
+        except Exception:
+            n_error_wkt += 1
+            continue
+        try:
+            geoms[i] = reproyectar(geom_wgs84)
+        except Exception:
+            n_error_prj += 1
+
+    return geoms, n_error_wkt, n_error_prj
+
+
+def muestrear_ndvi_zonal(df, ruta_raster, geometrias=None):
+    """
+    Media NDVI de cada recinto de ``df``. ``geometrias``: (crs, resultado de
+    ``geometrias_en_crs``) ya calculado por el llamador; si falta o el ráster
+    está en otro CRS se reproyecta aquí.
+    """
     print(f"🛰️  Leyendo NDVI (estadística zonal): {ruta_raster}")
     with rasterio.open(ruta_raster) as src:
         raster_crs = src.crs
         nodata_val = src.nodata
         bounds     = src.bounds
+        transform  = src.transform
         raster_box = shapely_box(bounds.left, bounds.bottom, bounds.right, bounds.top)
 
         print(f"  CRS del raster : {raster_crs}")
         print(f"  NoData value   : {nodata_val}")
         print(f"  Procesando {len(df):,} recintos...")
 
-        transformer = pyproj.Transformer.from_crs(
-            "EPSG:4326", raster_crs, always_xy=True
-        )
+        # float32 o int16 escalado: siempre float32 con NaN en nodata
+        valores = leer_ndvi(src)
 
-        def reproyectar(geom):
-            return shapely_transform(
-                lambda x, y: transformer.transform(x, y),
-                geom
-            )
-
-        ndvi_vals   = np.full(len(df), np.nan)
-        n_validos   = 0
-        n_pequenos  = 0
-        n_vacios    = 0
-        n_fuera     = 0
-        n_error_wkt = 0
-
-        for i, wkt_str in enumerate(df["geometry_wkt"]):
-            try:
-                geom_wgs84 = shapely_wkt.loads(wkt_str)
-            except Exception:
-                n_error_wkt += 1
-                continue
-
-            try:
-                geom_proj = reproyectar(geom_wgs84)
-            except Exception:
-                n_fuera += 1
-                continue
-
-            if not geom_proj.intersects(raster_box):
-                n_fuera += 1
-                continue
-
-            def extraer_pixeles(all_touched):
-                pixeles, _ = rasterio_mask(
-                    src,
-                    [geom_proj],
-                    crop=True,
-                    nodata=nodata_val if nodata_val is not None else np.nan,
-                    all_touched=all_touched,
-                )
-                arr = pixeles[0].astype(float)
-                if nodata_val is not None:
-                    arr[arr == nodata_val] = np.nan
-                return arr[~np.isnan(arr)]
-
-            try:
-                validos = extraer_pixeles(all_touched=False)
-                if len(validos) == 0:
-                    validos = extraer_pixeles(all_touched=True)
-                    if len(validos) > 0:
-                        n_pequenos += 1
-                if len(validos) == 0:
-                    n_vacios += 1
-                else:
-                    ndvi_vals[i] = validos.mean()
-                    n_validos   += 1
-            except Exception:
-                n_fuera += 1
-
-        print(f"  ✅ Con píxeles válidos      : {n_validos:,}")
-        print(f"  🔹 Recintos muy pequeños   : {n_pequenos:,}  (resueltos con all_touched)")
-        print(f"  ⬜ Sin píxeles válidos      : {n_vacios:,}  (nubes / nodata completo)")
-        print(f"  🔲 Fuera del raster        : {n_fuera:,}")
-        if n_error_wkt:
-            print(f"  ❌ Error WKT               : {n_error_wkt:,}")
+    if geometrias is not None and geometrias[0] == raster_crs:
+        geoms, n_error_wkt, n_fuera = geometrias[1]
+    else:
+        geoms, n_error_wkt, n_fuera = geometrias_en_crs(df, raster_crs)
+    dentro = [i for i, g in enumerate(geoms) if g is not None and g.intersects(raster_box)]
+    n_fuera += sum(g is not None for g in geoms) - len(dentro)
+
+    # Media de todos los recintos de una pasada (ráster de etiquetas en caché)
+    etiquetas = EtiquetasRecintos.construir(
+        [geoms[i] for i in dentro], dentro, transform, raster_crs, valores.shape
+    )
+    zonal = etiquetas.estadisticas(valores)
+
+    ndvi_vals  = np.full(len(df), np.nan)
+    n_validos  = 0
+    n_pequenos = 0
+    n_vacios   = 0
+
+    for k, i in enumerate(dentro):
+        if zonal["count"][k] > 0:
+            ndvi_vals[i] = zonal["mean"][k]
+            n_validos   += 1
+            continue
+        # Ningún centro de píxel dentro: recinto muy pequeño -> all_touched
+        validos = valores_geometria(valores, transform, geoms[i], all_touched=True)
+        if len(validos) == 0:
+            n_vacios += 1
+        else:
+            ndvi_vals[i] = validos.mean()
+            n_validos   += 1
+            n_pequenos  += 1
+
+    print(f"  ✅ Con píxeles válidos      : {n_validos:,}")
+    print(f"  🔹 Recintos muy pequeños   : {n_pequenos:,}  (resueltos con all_touched)")
+    print(f"  ⬜ Sin píxeles válidos      : {n_vacios:,}  (nubes / nodata completo)")
+    print(f"  🔲 Fuera del raster        : {n_fuera:,}")
+    if n_error_wkt:
+        print(f"  ❌ Error WKT               : {n_error_wkt:,}")
 
     return ndvi_vals
 
@@ -393,9 +403,13 @@ def main():
     print()
 
     # ── NDVI ──────────────────────────────────────────────────────────────
-    df["ndvi"]            = muestrear_ndvi_zonal(df, RASTER_NDVI)
-    df["ndvi_24-02-2026"] = muestrear_ndvi_zonal(df, RASTER_NDVI.replace("20260301", "20260224"))
-    df["ndvi_19-02-2026"] = muestrear_ndvi_zonal(df, RASTER_NDVI.replace("20260301", "20260219"))
+    # Las tres fechas comparten rejilla: las geometrías se reproyectan una sola vez
+    with rasterio.open(RASTER_NDVI) as src:
+        crs_ndvi = src.crs
+    geometrias = (crs_ndvi, geometrias_en_crs(df, crs_ndvi))
+    df["ndvi"]            = muestrear_ndvi_zonal(df, RASTER_NDVI, geometrias)
+    df["ndvi_24-02-2026"] = muestrear_ndvi_zonal(df, RASTER_NDVI.replace("20260301", "20260224"), geometrias)
+    df["ndvi_19-02-2026"] = muestrear_ndvi_zonal(df, RASTER_NDVI.replace("20260301", "20260219"), geometrias)
 
     # ── Limpieza final y guardado ─────────────────────────────────────────
     df   = df.drop(columns=["lon", "lat"])
@@ -0,0 +1,202 @@
+"""
+Suavizado NDVI y fenología de todos los recintos (ndvi_pipeline/fenologia.py).
+
+Para cada campaña (1 sept - 31 ago, identificada por el año en que termina)
+lee de una vez las medias NDVI de indices_raster, suaviza las series de todos
+los recintos en lotes vectorizados y guarda en public.fenologia_recinto la
+curva (NDVI × 10000 cada PASO_DIAS días) y las métricas: inicio, pico,
+senescencia, amplitud e integral. /api/grafica-ndvi y
+/api/comparativa-campanias dibujan esa curva en vez de las medias brutas.
+
+Uso:
+  cd src
+  python fenologia_recintos.py                       # campaña en curso y las 2 anteriores
+  python fenologia_recintos.py --campanias 2025,2026 --metodo savgol
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine
+
+from ndvi_pipeline.fenologia import PASO_DIAS, matriz_campania, metricas_fenologia, suavizar
+from webapp.config import Config
+
+# ==================== CONFIGURACIÓN ====================
+
+FENO_METODO = os.getenv("FENO_METODO", "whittaker")          # whittaker | savgol
+FENO_LAMBDA = float(os.getenv("FENO_LAMBDA", "50"))
+FENO_LOTE = int(os.getenv("FENO_LOTE", "50000"))              # recintos por lote de suavizado
+ESCALA_CURVA = 10000                                          # curva en smallint (NDVI × 10000)
+
+engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
+
+SQL_TABLA = """
+CREATE TABLE IF NOT EXISTS public.fenologia_recinto (
+    id_recinto        integer    NOT NULL,
+    campania          smallint   NOT NULL,   -- año en que termina (2025/2026 -> 2026)
+    metodo            text       NOT NULL,
+    paso_dias         smallint   NOT NULL,
+    inicio_curva      date       NOT NULL,   -- 1 de septiembre: fecha del nodo 0
+    curva             smallint[] NOT NULL,   -- NDVI suavizado × 10000; NULL fuera de las observaciones
+    n_obs             smallint   NOT NULL,
+    n_atipicos        smallint   NOT NULL,
+    fecha_inicio      date,
+    fecha_pico        date,
+    pico_valor        real,
+    fecha_senescencia date,
+    amplitud          real,
+    integral          real,                  -- NDVI·día sobre la base entre inicio y senescencia
+    actualizado       timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (id_recinto, campania)
+)
+"""
+
+COLUMNAS = (
+    "id_recinto", "campania", "metodo", "paso_dias", "inicio_curva", "curva", "n_obs", "n_atipicos",
+    "fecha_inicio", "fecha_pico", "pico_valor", "fecha_senescencia", "amplitud", "integral",
+)
+
+
+def campania_actual(hoy: date | None = None) -> int:
+    hoy = hoy or date.today()
+    return hoy.year + 1 if hoy.month >= 9 else hoy.year
+
+
+def limites_campania(campania: int) -> tuple[date, date]:
+    return date(campania - 1, 9, 1), date(campania, 9, 1)
+
+
+# ==================== LECTURA ====================
+
+def leer_observaciones(conn, inicio: date, fin: date) -> pd.DataFrame:
+    """(id_recinto, dia, valor) de NDVI de la campaña, con un único COPY."""
+    buf = io.StringIO()
+    with conn.cursor() as cur:
+        cur.copy_expert(
+            "COPY (SELECT id_recinto, fecha_ndvi::date - DATE '{ini}' AS dia, valor_medio "
+            "FROM public.indices_raster "
+            "WHERE tipo_indice = 'NDVI' AND valor_medio IS NOT NULL "
+            "AND fecha_ndvi >= DATE '{ini}' AND fecha_ndvi < DATE '{fin}') TO STDOUT WITH CSV".format(
+                ini=inicio.isoformat(), fin=fin.isoformat()),
+            buf,
+        )
+    buf.seek(0)
+    return pd.read_csv(buf, header=None, names=["id_recinto", "dia", "valor"],
+                       dtype={"id_recinto": np.int64, "dia": np.int64, "valor": np.float64})
+
+
+# ==================== ESCRITURA ====================
+
+def _fecha(inicio: date, dias: float) -> str:
+    return "\\N" if np.isnan(dias) else (inicio + timedelta(days=int(dias))).isoformat()
+
+
+def _real(v: float) -> str:
+    return "\\N" if not np.isfinite(v) else f"{v:.4f}"
+
+
+def filas_copy(ids, campania: int, inicio: date, suav, metr: dict, metodo: str) -> str:
+    """Líneas en formato texto de COPY para un lote de recintos."""
+    escalada = np.rint(np.clip(np.nan_to_num(suav.curva), -1, 1) * ESCALA_CURVA).astype(np.int64)
+    texto = np.where(np.isnan(suav.curva), "NULL", escalada.astype(str))
+    lineas = []
+    for k, id_recinto in enumerate(ids):
+        if suav.n_obs[k] == 0:
+            continue
+        arr = ",".join(texto[k])
+        lineas.append("\t".join((
+            str(int(id_recinto)), str(campania), metodo, str(PASO_DIAS), inicio.isoformat(),
+            "{" + arr + "}", str(int(suav.n_obs[k])), str(int(suav.n_atipicos[k])),
+            _fecha(inicio, metr["inicio_dia"][k]), _fecha(inicio, metr["pico_dia"][k]),
+            _real(metr["pico_valor"][k]), _fecha(inicio, metr["senescencia_dia"][k]),
+            _real(metr["amplitud"][k]), _real(metr["integral"][k]),
+        )))
+    return "\n".join(lineas) + ("\n" if lineas else "")
+
+
+def procesar_campania(conn, campania: int, metodo: str, lam: float) -> int:
+    inicio, fin = limites_campania(campania)
+    n_nodos = (fin - inicio).days // PASO_DIAS + 1
+
+    t0 = time.perf_counter()
+    obs = leer_observaciones(conn, inicio, fin)
+    print(f"\n[FENO] Campaña {campania - 1}/{campania}: {len(obs):,} observaciones "
+          f"({time.perf_counter() - t0:.1f}s)")
+    if obs.empty:
+        return 0
+
+    ids, fila = np.unique(obs["id_recinto"].to_numpy(), return_inverse=True)
+    y = matriz_campania(fila, obs["dia"].to_numpy(), obs["valor"].to_numpy(), len(ids), n_nodos)
+    del obs
+    print(f"[FENO] {len(ids):,} recintos × {n_nodos} nodos de {PASO_DIAS} días | método {metodo}")
+
+    t0 = time.perf_counter()
+    buf = io.StringIO()
+    ciclos = 0
+    for a in range(0, len(ids), FENO_LOTE):
+        suav = suavizar(y[a:a + FENO_LOTE], metodo=metodo, lam=lam)
+        metr = metricas_fenologia(suav.curva)
+        ciclos += int(np.isfinite(metr["pico_dia"]).sum())
+        buf.write(filas_copy(ids[a:a + FENO_LOTE], campania, inicio, suav, metr, metodo))
+        print(f"  … {min(a + FENO_LOTE, len(ids)):,}/{len(ids):,} recintos")
+    print(f"[FENO] ✓ Suavizado y métricas en {time.perf_counter() - t0:.1f}s "
+          f"({ciclos:,} recintos con ciclo)")
+
+    # Campaña completa: se sustituye en una transacción
+    t0 = time.perf_counter()
+    buf.seek(0)
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM public.fenologia_recinto WHERE campania = %s", (campania,))
+        cur.copy_expert(f"COPY public.fenologia_recinto ({', '.join(COLUMNAS)}) FROM STDIN", buf)
+        n = cur.rowcount
+    conn.commit()
+    print(f"[FENO] ✓ {n:,} filas en public.fenologia_recinto ({time.perf_counter() - t0:.1f}s)")
+    return n
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Suavizado NDVI y fenología por recinto")
+    parser.add_argument("--campanias", default="",
+                        help="Años de fin de campaña (coma). Vacío = la actual y las 2 anteriores.")
+    parser.add_argument("--metodo", choices=("whittaker", "savgol"), default=FENO_METODO)
+    parser.add_argument("--lambda", dest="lam", type=float, default=FENO_LAMBDA,
+                        help="Suavidad de Whittaker (mayor = más suave)")
+    args = parser.parse_args()
+
+    if args.campanias.strip():
+        campanias = [int(c) for c in args.campanias.split(",") if c.strip()]
+    else:
+        actual = campania_actual()
+        campanias = [actual - 2, actual - 1, actual]
+
+    print("=" * 70)
+    print("FENOLOGÍA NDVI POR RECINTO")
+    print("=" * 70)
+
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SQL_TABLA)
+        conn.commit()
+        for campania in campanias:
+            procesar_campania(conn, campania, args.metodo, args.lam)
+    except Exception as e:
+        conn.rollback()
+        print(f"\n[FENO] ✗ ERROR: {e!r}")
+        return 1
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,19 +7,33 @@ Uso:
   python generate_thumbnails.py --fechas 20260219,20260224,20260301
   python generate_thumbnails.py --fechas 19/02/2026,24/02/2026,01/03/2026 --force
   python generate_thumbnails.py --recintos 12,45,78 --workers 8
+  python generate_thumbnails.py --backend archivos          # PNG sueltos en static/thumbnails
+  python generate_thumbnails.py --importar --fechas 20260219 # PNG sueltos -> archivo SQLite
+
+Por defecto (THUMB_STORE=sqlite) los thumbnails se guardan en un único archivo
+SQLite (webapp/utils/thumbnails_store.py) que sirve /api/thumbnails/<fecha>/<id>.png.
+
+Incremental: el manifiesto del archivo guarda por recinto y fecha el hash de la
+geometría, la firma del ráster NDVI y el hash de la ventana NDVI del recinto.
+Sin --force solo se regeneran los recintos cuya geometría o ventana ha cambiado,
+y una ejecución interrumpida continúa donde se quedó. Los recintos se leen en
+streaming (cursor de servidor) empezando por los de usuarios activos.
 """
 
 from __future__ import annotations
 
 import argparse
 import gc
+import hashlib
+import io
 import json
 import os
 import sys
 import time
-from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
 from datetime import datetime
 from multiprocessing import shared_memory
+from pathlib import Path
 
 import numpy as np
 import rasterio
@@ -30,10 +44,12 @@ from scipy.ndimage import gaussian_filter
 from shapely import wkb
 from shapely.ops import transform as shapely_transform
 from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
 
+from ndvi_pipeline.formato_ndvi import decodificar_array, parametros_decodificacion
 from project_paths import NDVI_COMPOSITE_DIR, PROJECT_ROOT
 from webapp.config import Config
+from webapp.utils.ndvi_colormap import ndvi_to_rgba
+from webapp.utils.thumbnails_store import THUMB_STORE, ArchivoThumbnails, ids_en_carpeta
 
 # ==================== CONFIGURACIÓN ====================
 
@@ -45,9 +61,14 @@ FECHAS_DEFECTO = ("20260219", "20260224", "20260301")
 START_FROM_ID = 0
 LOG_INTERVAL = 500
 MIN_VALID_PIXELS_PERCENT = 5.0
+# Filas por transacción al escribir en el archivo SQLite
+THUMB_BATCH_SIZE = int(os.getenv("THUMB_BATCH_SIZE", "1000"))
+# Recintos leídos por viaje del cursor de servidor
+THUMB_CHUNK = int(os.getenv("THUMB_CHUNK", "2000"))
+# Tareas pendientes por proceso (acota memoria: no hay un future por recinto)
+EN_VUELO_POR_WORKER = int(os.getenv("THUMB_EN_VUELO", "8"))
 
 engine = create_engine(Config.SQLALCHEMY_DATABASE_URI)
-Session = sessionmaker(bind=engine)
 
 # Estado por proceso hijo (shared memory del raster)
 _WORKER: dict = {}
@@ -121,37 +142,6 @@ def rellenar_ndvi_inteligente(ndvi_array: np.ndarray) -> np.ndarray | None:
     return filled
 
 
-def ndvi_to_rgba_discrete(ndvi: np.ndarray) -> np.ndarray:
-    h, w = ndvi.shape
-    rgba = np.zeros((h, w, 4), dtype=np.uint8)
-    valid = np.isfinite(ndvi)
-    if not np.any(valid):
-        return rgba
-
-    ranges_colors = [
-        (-0.2, 0.0, (165, 0, 38)),
-        (0.0, 0.1, (215, 48, 39)),
-        (0.1, 0.2, (244, 109, 67)),
-        (0.2, 0.3, (253, 174, 97)),
-        (0.3, 0.4, (254, 224, 139)),
-        (0.4, 0.5, (255, 255, 191)),
-        (0.5, 0.6, (217, 239, 139)),
-        (0.6, 0.7, (166, 217, 106)),
-        (0.7, 0.8, (102, 189, 99)),
-        (0.8, 0.9, (26, 152, 80)),
-        (0.9, 1.0, (0, 104, 55)),
-    ]
-
-    rgba[valid & (ndvi < -0.2)] = [0, 0, 0, 255]
-    for vmin, vmax, color in ranges_colors:
-        mask = valid & (ndvi >= vmin) & (ndvi < vmax)
-        if np.any(mask):
-            rgba[mask] = [*color, 255]
-    rgba[valid & (ndvi >= 1.0)] = [0, 104, 55, 255]
-    rgba[~valid, 3] = 0
-    return rgba
-
-
 def get_polygons_from_geometry(geometria):
     if geometria.geom_type == "Polygon":
         return [geometria]
@@ -192,15 +182,14 @@ def generar_thumbnail_pil(
     ndvi_data: np.ndarray,
     window_transform,
     geometria,
-    output_path: str,
     border_px: int = 2,
-) -> float | None:
-    """Genera PNG con PIL (mucho más rápido que matplotlib)."""
+) -> bytes | None:
+    """Genera el PNG con PIL (mucho más rápido que matplotlib); None si no hay datos suficientes."""
     ndvi_filled = rellenar_ndvi_inteligente(ndvi_data)
     if ndvi_filled is None:
         return None
 
-    rgba = ndvi_to_rgba_discrete(np.clip(ndvi_filled, -0.2, 1.0))
+    rgba = ndvi_to_rgba(np.clip(ndvi_filled, -0.2, 1.0))
     h, w = rgba.shape[:2]
     img = Image.fromarray(rgba, "RGBA")
 
@@ -242,13 +231,9 @@ def generar_thumbnail_pil(
         if len(pts) >= 2:
             draw.line(pts + [pts[0]], fill=(0, 0, 0, 255), width=border_px)
 
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    cropped.save(output_path, "PNG", optimize=True)
-
-    valid_mask = ~np.isnan(ndvi_data) & np.isfinite(ndvi_data)
-    if np.any(valid_mask):
-        return float(np.mean(ndvi_data[valid_mask]))
-    return None
+    buf = io.BytesIO()
+    cropped.save(buf, "PNG", optimize=True)
+    return buf.getvalue()
 
 
 # ==================== WORKERS ====================
@@ -259,9 +244,9 @@ def _worker_init(
     dtype_str: str,
     transform_vals: tuple,
     crs: int,
-    output_dir: str,
-    skip_existing: bool,
+    output_dir: str | None,
     geom_srid: int,
+    decodificacion: tuple,
 ):
     shm = shared_memory.SharedMemory(name=shm_name)
     _WORKER["data"] = np.ndarray(shape, dtype=np.dtype(dtype_str), buffer=shm.buf)
@@ -269,9 +254,9 @@ def _worker_init(
     _WORKER["crs"] = crs
     _WORKER["width"] = shape[1]
     _WORKER["height"] = shape[0]
-    _WORKER["output_dir"] = output_dir
-    _WORKER["skip_existing"] = skip_existing
+    _WORKER["output_dir"] = output_dir  # None = el PNG vuelve al proceso principal (archivo SQLite)
     _WORKER["geom_srid"] = geom_srid
+    _WORKER["decodificacion"] = decodificacion  # (escala, offset, nodata) del GeoTIFF
     _WORKER["transformer"] = (
         Transformer.from_crs(f"EPSG:{geom_srid}", f"EPSG:{crs}", always_xy=True)
         if geom_srid != crs
@@ -279,12 +264,21 @@ def _worker_init(
     )
 
 
-def _worker_process(item: tuple[int, bytes]) -> str:
-    id_recinto, geom_wkb = item
-    output_png = os.path.join(_WORKER["output_dir"], f"{id_recinto}.png")
+def hash_ventana(ndvi_data: np.ndarray, window_transform) -> str:
+    """Hash de los píxeles NDVI (y su posición) que entran en el thumbnail."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(np.ascontiguousarray(ndvi_data).tobytes())
+    h.update(repr(tuple(window_transform)[:6]).encode())
+    return h.hexdigest()
+
 
-    if _WORKER["skip_existing"] and os.path.exists(output_png):
-        return "skipped"
+def _worker_process(item: tuple[int, bytes, str | None]) -> tuple[str, bytes | None, str | None]:
+    """
+    (estado, PNG, hash de la ventana). El PNG solo se devuelve si no se
+    escribe aquí como fichero; si la ventana NDVI coincide con la del
+    manifiesto no se renderiza (``unchanged``).
+    """
+    id_recinto, geom_wkb, hash_previo = item
 
     geometria = wkb.loads(geom_wkb)
     if _WORKER["transformer"] is not None:
@@ -300,52 +294,79 @@ def _worker_process(item: tuple[int, bytes]) -> str:
 
     ndvi_data, window_transform = extraer_ventana_raster(geometria, raster)
     if ndvi_data is None:
-        return "no_overlap"
+        return "no_overlap", None, None
+
+    hv = hash_ventana(ndvi_data, window_transform)
+    if hv == hash_previo:
+        return "unchanged", None, hv
+
+    ndvi_data = decodificar_array(ndvi_data, *_WORKER["decodificacion"])
+    png = generar_thumbnail_pil(ndvi_data, window_transform, geometria)
+    if png is None:
+        return "insufficient_data", None, hv
+    if _WORKER["output_dir"] is not None:
+        with open(os.path.join(_WORKER["output_dir"], f"{id_recinto}.png"), "wb") as f:
+            f.write(png)
+        return "success", None, hv
+    return "success", png, hv
+
+
+# ==================== RECINTOS (STREAMING) ====================
+
+def _filtro_recintos(recinto_ids: list[int] | None) -> tuple[str, dict]:
+    if recinto_ids:
+        return "r.id_recinto = ANY(:ids)", {"ids": recinto_ids}
+    return "r.id_recinto >= :start", {"start": START_FROM_ID}
+
+
+def contar_recintos(recinto_ids: list[int] | None) -> int:
+    where, params = _filtro_recintos(recinto_ids)
+    with engine.connect() as conn:
+        return int(conn.execute(text(f"SELECT count(*) FROM recintos r WHERE {where}"), params).scalar())
+
+
+def iterar_recintos(recinto_ids: list[int] | None, chunk: int = THUMB_CHUNK):
+    """
+    (id_recinto, WKB) con cursor de servidor, leídos de ``chunk`` en ``chunk``.
+    Primero los recintos de usuarios activos (los que se ven en la webapp).
+    """
+    where, params = _filtro_recintos(recinto_ids)
+    sql = text(
+        "SELECT r.id_recinto, r.geom FROM recintos r "
+        "LEFT JOIN usuarios u ON u.id_usuario = r.id_propietario "
+        f"WHERE {where} "
+        "ORDER BY (u.activo IS TRUE) DESC, r.id_recinto"
+    )
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=chunk).execute(sql, params)
+        for filas in result.partitions(chunk):
+            for id_recinto, geom in filas:
+                if isinstance(geom, memoryview):
+                    geom = geom.tobytes()
+                elif isinstance(geom, str):
+                    geom = bytes.fromhex(geom)
+                yield int(id_recinto), bytes(geom)
 
-    result = generar_thumbnail_pil(ndvi_data, window_transform, geometria, output_png)
-    if result is None:
-        return "insufficient_data"
-    return "success"
 
+def hash_geometria(geom_wkb: bytes) -> str:
+    return hashlib.blake2b(geom_wkb, digest_size=16).hexdigest()
 
-def cargar_recintos(recinto_ids: list[int] | None) -> list[tuple[int, bytes]]:
-    session = Session()
-    try:
-        if recinto_ids:
-            rows = session.execute(
-                text(
-                    "SELECT id_recinto, geom FROM recintos "
-                    "WHERE id_recinto = ANY(:ids) ORDER BY id_recinto"
-                ),
-                {"ids": recinto_ids},
-            ).fetchall()
-        else:
-            rows = session.execute(
-                text(
-                    "SELECT id_recinto, geom FROM recintos "
-                    "WHERE id_recinto >= :start ORDER BY id_recinto"
-                ),
-                {"start": START_FROM_ID},
-            ).fetchall()
-    finally:
-        session.close()
-
-    out: list[tuple[int, bytes]] = []
-    for id_recinto, geom in rows:
-        if isinstance(geom, memoryview):
-            geom = geom.tobytes()
-        elif isinstance(geom, str):
-            geom = bytes.fromhex(geom)
-        out.append((int(id_recinto), bytes(geom)))
-    return out
+
+def firma_raster(tif_path: Path) -> str:
+    """Firma barata del ráster NDVI (nombre, tamaño y mtime): si cambia se revisan las ventanas."""
+    st = tif_path.stat()
+    return f"{tif_path.name}:{st.st_size}:{st.st_mtime_ns}"
 
 
 def procesar_fecha(
     fecha_str: str,
-    recintos: list[tuple[int, bytes]],
+    recinto_ids: list[int] | None,
     *,
     skip_existing: bool,
     workers: int,
+    backend: str = THUMB_STORE,
+    archivo: ArchivoThumbnails | None = None,
+    chunk: int = THUMB_CHUNK,
 ) -> dict[str, int]:
     tif_path = resolve_ndvi_tif(fecha_str)
     meta_path = NDVI_COMPOSITE_DIR / f"ndvi_pc_{fecha_str}_mosaic.json"
@@ -355,18 +376,69 @@ def procesar_fecha(
         return {"error": 1}
 
     fecha_out = fecha_desde_meta(meta_path, fecha_str)
-    output_dir = str(THUMBNAILS_BASE_DIR / fecha_out)
-    os.makedirs(output_dir, exist_ok=True)
+    # El archivo SQLite guarda el manifiesto también con backend "archivos"
+    archivo = archivo or ArchivoThumbnails(Config.THUMB_ARCHIVE_PATH)
+    if backend == "sqlite":
+        output_dir = None
+        destino = f"{archivo.ruta} (fecha {fecha_out})"
+    else:
+        output_dir = str(THUMBNAILS_BASE_DIR / fecha_out)
+        os.makedirs(output_dir, exist_ok=True)
+        destino = output_dir
+
+    stats = {
+        "success": 0,
+        "skipped": 0,
+        "unchanged": 0,
+        "no_overlap": 0,
+        "insufficient_data": 0,
+        "error": 0,
+    }
+
+    # Sin --force: manifiesto de la fecha + thumbnails ya en el almacén de destino.
+    # El manifiesto es común a los dos backends: un recinto con PNG ("success" o
+    # "unchanged") solo se omite si está en el destino actual (al cambiar de backend se regenera)
+    firma = firma_raster(tif_path)
+    manifiesto: dict = {}
+    previos: set[int] = set()
+    if skip_existing:
+        manifiesto = archivo.manifiesto(fecha_out)
+        previos = archivo.existentes(fecha_out) if output_dir is None else ids_en_carpeta(output_dir)
+
+    total = contar_recintos(recinto_ids)
 
     print(f"\n{'─'*60}")
     print(f"  Fecha NDVI: {fecha_out}  ←  {tif_path.name}")
-    print(f"  Salida:     {output_dir}")
+    print(f"  Salida:     {destino}")
     print(f"  Workers:    {workers}")
+    print(f"  Recintos:   {total} (en manifiesto: {len(manifiesto)})")
 
     t0 = time.perf_counter()
 
+    def tareas():
+        """Recintos a (re)generar con su hash de geometría; cuenta los omitidos."""
+        for id_recinto, geom in iterar_recintos(recinto_ids, chunk):
+            hg = hash_geometria(geom)
+            previo = manifiesto.get(id_recinto)
+            if previo is not None:
+                falta_png = previo[3] in ("success", "unchanged") and id_recinto not in previos
+                if previo[0] == hg and previo[1] == firma and not falta_png:
+                    stats["skipped"] += 1
+                    continue
+                # Misma geometría y ráster distinto: el worker compara la ventana
+                hash_previo = previo[2] if previo[0] == hg and not falta_png else None
+            elif id_recinto in previos:
+                stats["skipped"] += 1
+                continue
+            else:
+                hash_previo = None
+            yield (id_recinto, geom, hash_previo), hg
+
+    # En memoria compartida tal como está en el fichero (int16 escalado = la mitad que float32);
+    # cada worker decodifica solo la ventana de su recinto
     with rasterio.open(tif_path) as src:
         data = src.read(1)
+        decodificacion = parametros_decodificacion(src)
         transform = src.transform
         crs = src.crs.to_epsg()
 
@@ -375,80 +447,94 @@ def procesar_fecha(
     np.copyto(shared, data)
     del data
 
-    stats = {
-        "success": 0,
-        "skipped": 0,
-        "no_overlap": 0,
-        "insufficient_data": 0,
-        "error": 0,
-    }
-
     transform_vals = (transform.a, transform.b, transform.c, transform.d, transform.e, transform.f)
+    initargs = (shm.name, shared.shape, str(shared.dtype), transform_vals, crs, output_dir, 4326, decodificacion)
+    hechos = 0
+
+    def _registrar(escritor, rid: int, hg: str, resultado: tuple) -> None:
+        nonlocal hechos
+        estado, png, hv = resultado
+        if png is not None:
+            escritor.put(fecha_out, rid, png)
+        escritor.marcar(fecha_out, rid, hg, firma, hv, estado)
+        stats[estado] = stats.get(estado, 0) + 1
+        hechos += 1
+        if hechos % LOG_INTERVAL == 0:
+            _log_progreso(hechos + stats["skipped"], total, stats)
 
     try:
-        if workers <= 1:
-            _worker_init(
-                shm.name,
-                shared.shape,
-                str(shared.dtype),
-                transform_vals,
-                crs,
-                output_dir,
-                skip_existing,
-                4326,
-            )
-            for idx, item in enumerate(recintos, 1):
-                try:
-                    result = _worker_process(item)
-                    stats[result] = stats.get(result, 0) + 1
-                except Exception as e:
-                    print(f"  Error recinto {item[0]}: {e}")
-                    stats["error"] += 1
-                if idx % LOG_INTERVAL == 0 or idx == len(recintos):
-                    _log_progreso(idx, len(recintos), stats)
-        else:
-            with ProcessPoolExecutor(
-                max_workers=workers,
-                initializer=_worker_init,
-                initargs=(
-                    shm.name,
-                    shared.shape,
-                    str(shared.dtype),
-                    transform_vals,
-                    crs,
-                    output_dir,
-                    skip_existing,
-                    4326,
-                ),
-            ) as pool:
-                futures = {pool.submit(_worker_process, item): item[0] for item in recintos}
-                done = 0
-                for fut in as_completed(futures):
-                    done += 1
-                    rid = futures[fut]
+        # El manifiesto se confirma junto con cada lote: una ejecución
+        # interrumpida se reanuda desde el último lote escrito
+        with archivo.escritor(THUMB_BATCH_SIZE) as escritor:
+            if workers <= 1:
+                _worker_init(*initargs)
+                for item, hg in tareas():
                     try:
-                        result = fut.result()
-                        stats[result] = stats.get(result, 0) + 1
+                        _registrar(escritor, item[0], hg, _worker_process(item))
                     except Exception as e:
-                        print(f"  Error recinto {rid}: {e}")
+                        print(f"  Error recinto {item[0]}: {e}")
                         stats["error"] += 1
-                    if done % LOG_INTERVAL == 0 or done == len(recintos):
-                        _log_progreso(done, len(recintos), stats)
+            else:
+                with ProcessPoolExecutor(
+                    max_workers=workers,
+                    initializer=_worker_init,
+                    initargs=initargs,
+                ) as pool:
+                    # Como mucho EN_VUELO_POR_WORKER tareas por proceso pendientes a la vez
+                    en_vuelo: dict = {}
+                    max_en_vuelo = workers * EN_VUELO_POR_WORKER
+
+                    def _recoger(terminados) -> None:
+                        for fut in terminados:
+                            rid, hg = en_vuelo.pop(fut)
+                            try:
+                                _registrar(escritor, rid, hg, fut.result())
+                            except Exception as e:
+                                print(f"  Error recinto {rid}: {e}")
+                                stats["error"] += 1
+
+                    for item, hg in tareas():
+                        if len(en_vuelo) >= max_en_vuelo:
+                            terminados, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                            _recoger(terminados)
+                        en_vuelo[pool.submit(_worker_process, item)] = (item[0], hg)
+                    _recoger(list(as_completed(en_vuelo)))
     finally:
         shm.close()
         shm.unlink()
         gc.collect()
 
+    _log_progreso(hechos + stats["skipped"], total, stats)
     elapsed = time.perf_counter() - t0
-    print(f"  ✓ {fecha_out} en {elapsed:.1f}s — generados: {stats['success']}, omitidos: {stats['skipped']}")
+    print(
+        f"  ✓ {fecha_out} en {elapsed:.1f}s — generados: {stats['success']}, "
+        f"sin cambios: {stats['unchanged']}, omitidos: {stats['skipped']}"
+    )
     return stats
 
 
+def importar_carpetas(fechas: list[str], archivo: ArchivoThumbnails) -> int:
+    """Migra los PNG sueltos de static/thumbnails/<fecha>/ al archivo SQLite."""
+    total = 0
+    with archivo.escritor(THUMB_BATCH_SIZE) as escritor:
+        for fecha in fechas:
+            carpeta = THUMBNAILS_BASE_DIR / fecha
+            ids = sorted(ids_en_carpeta(carpeta))
+            for id_recinto in ids:
+                with open(carpeta / f"{id_recinto}.png", "rb") as f:
+                    escritor.put(fecha, id_recinto, f.read())
+            print(f"  ✓ {fecha}: {len(ids)} PNG importados")
+            total += len(ids)
+    print(f"📦 {total} thumbnails en {archivo.ruta}")
+    return total
+
+
 def _log_progreso(done: int, total: int, stats: dict[str, int]) -> None:
     print(
         f"  … {done}/{total} | ok={stats['success']} "
         f"sin_datos={stats['insufficient_data']} "
         f"sin_solape={stats['no_overlap']} "
+        f"sin_cambios={stats['unchanged']} "
         f"omitidos={stats['skipped']} err={stats['error']}"
     )
 
@@ -475,7 +561,24 @@ def main() -> int:
     parser.add_argument(
         "--force",
         action="store_true",
-        help="Regenerar aunque el PNG ya exista",
+        help="Regenerar todo, aunque el manifiesto indique que no hay cambios",
+    )
+    parser.add_argument(
+        "--chunk",
+        type=int,
+        default=THUMB_CHUNK,
+        help="Recintos por lectura del cursor de servidor",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=("sqlite", "archivos"),
+        default=THUMB_STORE,
+        help="sqlite = archivo único (THUMB_ARCHIVE_PATH); archivos = PNG sueltos en static/thumbnails",
+    )
+    parser.add_argument(
+        "--importar",
+        action="store_true",
+        help="Solo importar al archivo SQLite los PNG sueltos ya generados de las fechas",
     )
     args = parser.parse_args()
 
@@ -485,12 +588,16 @@ def main() -> int:
         print(f"✗ {e}")
         return 1
 
+    if args.importar:
+        importar_carpetas(fechas, ArchivoThumbnails(Config.THUMB_ARCHIVE_PATH))
+        return 0
+
     recinto_ids: list[int] | None = None
     if args.recintos.strip():
         recinto_ids = [int(x.strip()) for x in args.recintos.split(",") if x.strip()]
 
-    recintos = cargar_recintos(recinto_ids)
-    if not recintos:
+    n_recintos = contar_recintos(recinto_ids)
+    if not n_recintos:
         print("✗ No hay recintos que procesar")
         return 1
 
@@ -498,25 +605,32 @@ def main() -> int:
     print("GENERADOR DE THUMBNAILS NDVI — MULTI-FECHA + PARALELO (PIL)")
     print("=" * 70)
     print(f"Fechas:   {', '.join(fechas)}")
-    print(f"Recintos: {len(recintos)}")
+    print(f"Recintos: {n_recintos}")
     print(f"Workers:  {args.workers}")
     print(f"Force:    {args.force}")
+    print(f"Backend:  {args.backend}")
 
     total_stats = {
         "success": 0,
         "skipped": 0,
+        "unchanged": 0,
         "no_overlap": 0,
         "insufficient_data": 0,
         "error": 0,
     }
 
+    archivo = ArchivoThumbnails(Config.THUMB_ARCHIVE_PATH)
+
     t_global = time.perf_counter()
     for fecha in fechas:
         stats = procesar_fecha(
             fecha,
-            recintos,
+            recinto_ids,
             skip_existing=not args.force,
             workers=args.workers,
+            backend=args.backend,
+            archivo=archivo,
+            chunk=args.chunk,
         )
         for k, v in stats.items():
             total_stats[k] = total_stats.get(k, 0) + v
@@ -526,10 +640,11 @@ def main() -> int:
     print("=" * 70)
     print(f"Tiempo total: {time.perf_counter() - t_global:.1f}s")
     print(f"Thumbnails generados: {total_stats['success']}")
-    print(f"Omitidos (ya existían): {total_stats['skipped']}")
+    print(f"Sin cambios (ventana NDVI igual): {total_stats['unchanged']}")
+    print(f"Omitidos (manifiesto al día): {total_stats['skipped']}")
     print(f"Sin datos / sin solape: {total_stats['insufficient_data'] + total_stats['no_overlap']}")
     print(f"Errores: {total_stats['error']}")
-    print(f"Carpeta base: {THUMBNAILS_BASE_DIR}")
+    print(f"Destino: {archivo.ruta if args.backend == 'sqlite' else THUMBNAILS_BASE_DIR}")
     return 0 if total_stats["error"] == 0 else 1
 
 
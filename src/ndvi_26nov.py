@@ -25,12 +25,10 @@ import geopandas as gpd
 from shapely.geometry import box, mapping, shape
 from scipy import ndimage
 
-from PIL import Image
-
 import math
 import rasterio
 from rasterio.warp import (
-    reproject, Resampling, transform_bounds, transform_geom, calculate_default_transform
+    reproject, Resampling, transform_bounds, transform_geom
 )
 from rasterio.transform import from_bounds
 from rasterio.windows import from_bounds as window_from_bounds
@@ -40,10 +38,11 @@ from rasterio.io import MemoryFile
 from dotenv import load_dotenv
 from sqlalchemy import text
 from webapp import create_app, db
+from webapp.utils.ndvi_warp import warp_tif_to_3857
+from webapp.utils.ndvi_colormap import guardar_png_ndvi
 
-# Planetary Computer
-from pystac_client import Client
-import planetary_computer as pc
+# Planetary Computer (o búsquedas grabadas: STAC_MODE=record/replay)
+from ndvi_pipeline.catalogo_stac import STAC_MODE, buscar_items
 
 
 print("[NDVI-PC] Script de NDVI - FECHA ESPECÍFICA: 26 Nov 2025")
@@ -110,14 +109,9 @@ def search_planetary_computer_single_date(bbox, target_date, window_days, cloud_
         Item de STAC más cercano a la fecha objetivo
     """
     try:
-        print(f"[SEARCH] Conectando con Planetary Computer...")
+        print(f"[SEARCH] Conectando con Planetary Computer (STAC_MODE={STAC_MODE})...")
         print(f"[SEARCH] Fecha objetivo: {target_date.strftime('%Y-%m-%d')}")
         
-        catalog = Client.open(
-            "https://planetarycomputer.microsoft.com/api/stac/v1",
-            modifier=pc.sign_inplace
-        )
-        
         # Ventana de búsqueda
         start_dt = target_date - timedelta(days=window_days)
         end_dt = target_date + timedelta(days=window_days)
@@ -128,14 +122,7 @@ def search_planetary_computer_single_date(bbox, target_date, window_days, cloud_
         print(f"[SEARCH] Nubes máx: {cloud_max}%")
         
         # BÚSQUEDA SIN FILTROS - Luego filtramos manualmente
-        search = catalog.search(
-            collections=["sentinel-2-l2a"],
-            bbox=bbox,
-            datetime=date_range,
-            limit=100
-        )
-        
-        items = list(search.items())
+        items = buscar_items(bbox, date_range, limit=100)
         
         print(f"[SEARCH] ✓ Productos encontrados (sin filtrar): {len(items)}")
         
@@ -278,72 +265,6 @@ def compute_ndvi(red, nir):
     return np.where(den == 0, np.nan, (nir - red) / den)
 
 
-def ndvi_to_rgba(ndvi):
-    """Convertir NDVI a imagen RGBA según tabla de colores estándar"""
-    h, w = ndvi.shape
-    rgba = np.zeros((h, w, 4), dtype=np.uint8)
-    valid = np.isfinite(ndvi)
-    
-    if not np.any(valid):
-        return rgba
-
-    ranges_colors = [
-        (-0.2, 0.0, (165, 0, 38)),
-        (0.0, 0.1, (215, 48, 39)),
-        (0.1, 0.2, (244, 109, 67)),
-        (0.2, 0.3, (253, 174, 97)),
-        (0.3, 0.4, (254, 224, 139)),
-        (0.4, 0.5, (255, 255, 191)),
-        (0.5, 0.6, (217, 239, 139)),
-        (0.6, 0.7, (166, 217, 106)),
-        (0.7, 0.8, (102, 189, 99)),
-        (0.8, 0.9, (26, 152, 80)),
-        (0.9, 1.0, (0, 104, 55)),
-    ]
-    
-    rgba[valid & (ndvi < -0.2)] = [0, 0, 0, 255]
-    
-    for vmin, vmax, color in ranges_colors:
-        mask = valid & (ndvi >= vmin) & (ndvi < vmax)
-        if np.any(mask):
-            rgba[mask] = [*color, 255]
-    
-    rgba[valid & (ndvi >= 1.0)] = [0, 104, 55, 255]
-    rgba[~valid, 3] = 0
-    
-    return rgba
-
-
-def warp_tif_to_3857(src_tif: str, dst_tif: str):
-    """Reproyectar a EPSG:3857 para visualización web"""
-    dst_crs = "EPSG:3857"
-    with rasterio.open(src_tif) as src:
-        transform, width, height = calculate_default_transform(
-            src.crs, dst_crs, src.width, src.height, *src.bounds
-        )
-        kwargs = src.meta.copy()
-        kwargs.update({
-            "crs": dst_crs,
-            "transform": transform,
-            "width": width,
-            "height": height,
-            "nodata": src.nodata,
-        })
-
-        with rasterio.open(dst_tif, "w", **kwargs) as dst:
-            reproject(
-                source=rasterio.band(src, 1),
-                destination=rasterio.band(dst, 1),
-                src_transform=src.transform,
-                src_crs=src.crs,
-                dst_transform=transform,
-                dst_crs=dst_crs,
-                resampling=Resampling.bilinear,
-                src_nodata=src.nodata,
-                dst_nodata=src.nodata,
-            )
-
-
 def compute_grid_from_bbox_meters(bbox4326, dst_crs, res_m, max_dim=None):
     """Calcular grid de salida en metros"""
     minx, miny, maxx, maxy = bbox4326
@@ -707,8 +628,7 @@ def main():
         print(f"[OUTPUT] ✓ GeoTIFF 3857 -> {tif_path_3857.name}")
         
         # PNG
-        rgba = ndvi_to_rgba(composite)
-        Image.fromarray(rgba, mode="RGBA").save(str(png_path), format="PNG", optimize=True)
+        guardar_png_ndvi(composite, str(png_path))
         print(f"[OUTPUT] ✓ PNG -> {png_path.name}")
         
         # Metadata JSON
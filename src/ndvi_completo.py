@@ -27,12 +27,10 @@ import geopandas as gpd
 from shapely.geometry import box, mapping, shape
 from scipy import ndimage
 
-from PIL import Image
-
 import math
 import rasterio
 from rasterio.warp import (
-    reproject, Resampling, transform_bounds, transform_geom, calculate_default_transform
+    reproject, Resampling, transform_bounds, transform_geom
 )
 from rasterio.transform import from_bounds
 from rasterio.windows import from_bounds as window_from_bounds
@@ -41,10 +39,11 @@ from rasterio.features import geometry_mask
 from dotenv import load_dotenv
 from sqlalchemy import text
 from webapp import create_app, db
+from webapp.utils.ndvi_warp import warp_tif_to_3857
+from webapp.utils.ndvi_colormap import tif_a_png
 
-# Planetary Computer
-from pystac_client import Client
-import planetary_computer as pc
+# Planetary Computer (o búsquedas grabadas: STAC_MODE=record/replay)
+from ndvi_pipeline.catalogo_stac import STAC_MODE, buscar_items
 
 
 print("[NDVI-TEMPORAL] Script de NDVI - COMPOSITE TEMPORAL ÓPTIMO v1.4")
@@ -102,24 +101,12 @@ QUALITY_WEIGHTS = {
 def search_planetary_computer_temporal(bbox, start_date, end_date, cloud_max):
     """Buscar TODAS las imágenes Sentinel-2 L2A en la ventana temporal."""
     try:
-        print(f"[SEARCH] Conectando con Planetary Computer...")
+        print(f"[SEARCH] Conectando con Planetary Computer (STAC_MODE={STAC_MODE})...")
         print(f"[SEARCH] Período: {start_date.strftime('%Y-%m-%d')} → {end_date.strftime('%Y-%m-%d')}")
         
-        catalog = Client.open(
-            "https://planetarycomputer.microsoft.com/api/stac/v1",
-            modifier=pc.sign_inplace
-        )
-        
         date_range = f"{start_date.strftime('%Y-%m-%d')}/{end_date.strftime('%Y-%m-%d')}"
         
-        search = catalog.search(
-            collections=["sentinel-2-l2a"],
-            bbox=bbox,
-            datetime=date_range,
-            limit=MAX_ITEMS
-        )
-        
-        items = list(search.items())
+        items = buscar_items(bbox, date_range, limit=MAX_ITEMS)
         print(f"[SEARCH] ✓ Productos encontrados: {len(items)}")
         
         if not items:
@@ -220,72 +207,6 @@ def compute_ndvi(red, nir):
     return np.where(den == 0, np.nan, (nir - red) / den)
 
 
-def ndvi_to_rgba(ndvi):
-    """Convertir NDVI a imagen RGBA"""
-    h, w = ndvi.shape
-    rgba = np.zeros((h, w, 4), dtype=np.uint8)
-    valid = np.isfinite(ndvi)
-    
-    if not np.any(valid):
-        return rgba
-
-    ranges_colors = [
-        (-0.2, 0.0, (165, 0, 38)),
-        (0.0, 0.1, (215, 48, 39)),
-        (0.1, 0.2, (244, 109, 67)),
-        (0.2, 0.3, (253, 174, 97)),
-        (0.3, 0.4, (254, 224, 139)),
-        (0.4, 0.5, (255, 255, 191)),
-        (0.5, 0.6, (217, 239, 139)),
-        (0.6, 0.7, (166, 217, 106)),
-        (0.7, 0.8, (102, 189, 99)),
-        (0.8, 0.9, (26, 152, 80)),
-        (0.9, 1.0, (0, 104, 55)),
-    ]
-    
-    rgba[valid & (ndvi < -0.2)] = [0, 0, 0, 255]
-    
-    for vmin, vmax, color in ranges_colors:
-        mask = valid & (ndvi >= vmin) & (ndvi < vmax)
-        if np.any(mask):
-            rgba[mask] = [*color, 255]
-    
-    rgba[valid & (ndvi >= 1.0)] = [0, 104, 55, 255]
-    rgba[~valid, 3] = 0
-    
-    return rgba
-
-
-def warp_tif_to_3857(src_tif: str, dst_tif: str):
-    """Reproyectar a EPSG:3857"""
-    dst_crs = "EPSG:3857"
-    with rasterio.open(src_tif) as src:
-        transform, width, height = calculate_default_transform(
-            src.crs, dst_crs, src.width, src.height, *src.bounds
-        )
-        kwargs = src.meta.copy()
-        kwargs.update({
-            "crs": dst_crs,
-            "transform": transform,
-            "width": width,
-            "height": height,
-            "nodata": src.nodata,
-        })
-
-        with rasterio.open(dst_tif, "w", **kwargs) as dst:
-            reproject(
-                source=rasterio.band(src, 1),
-                destination=rasterio.band(dst, 1),
-                src_transform=src.transform,
-                src_crs=src.crs,
-                dst_transform=transform,
-                dst_crs=dst_crs,
-                resampling=Resampling.bilinear,
-                src_nodata=src.nodata,
-                dst_nodata=src.nodata,
-            )
-
-
 def compute_grid_from_bbox_meters(bbox4326, dst_crs, res_m, max_dim=None):
     """Calcular grid de salida"""
     minx, miny, maxx, maxy = bbox4326
@@ -741,11 +662,7 @@ def main():
 
         # PNG - Generado desde el composite en EPSG:3857
         print(f"[OUTPUT] Generando PNG desde EPSG:3857...")
-        with rasterio.open(str(tif_path_3857)) as src_3857:
-            composite_3857 = src_3857.read(1)
-
-        rgba = ndvi_to_rgba(composite_3857)
-        Image.fromarray(rgba, mode="RGBA").save(str(png_path), format="PNG", optimize=True)
+        tif_a_png(str(tif_path_3857), str(png_path))
         print(f"[OUTPUT] ✓ PNG (EPSG:3857) -> {png_path.name}")
         
         # Metadata
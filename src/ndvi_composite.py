@@ -7,6 +7,9 @@ Genera un NDVI completo del ROI usando MÚLTIPLES TILES de Sentinel-2.
 
 import os
 import json
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
 from collections import defaultdict
@@ -15,26 +18,32 @@ import numpy as np
 import geopandas as gpd
 from shapely.geometry import box, mapping
 from scipy import ndimage
-from scipy.interpolate import griddata
-
-from PIL import Image
 
 import math
 import rasterio
+from rasterio.errors import RasterioError
 from rasterio.warp import (
-    reproject, Resampling, transform_bounds, calculate_default_transform
+    reproject, transform_bounds
 )
 from rasterio.transform import from_bounds
-from rasterio.windows import from_bounds as window_from_bounds
+from rasterio.windows import transform as window_transform
 from rasterio.merge import merge
 
 from dotenv import load_dotenv
 from sqlalchemy import text
 from webapp import create_app, db
+from webapp.utils.ndvi_colormap import guardar_png_ndvi, tif_a_png
+from webapp.utils.ndvi_warp import warp_tif_to_3857
+from ndvi_pipeline.compositor import MODO_MEJOR_PIXEL, componer_por_bloques, percentil_modo
+from ndvi_pipeline.cribado_scl import S2_CRIBADO, S2_CRIBADO_COBERTURA, cribar_items
+from ndvi_pipeline.estado_composite import EstadoComposite
+from ndvi_pipeline.formato_ndvi import NDVI_FORMATO, codificar, marcar_escala, perfil_ndvi
+from ndvi_pipeline.gap_fill import rellenar_gaps
+from ndvi_pipeline.indices import evaluar_indices, indices_desde_texto
+from ndvi_pipeline.lector_s2 import LectorConcurrente, entorno_gdal, leer_banda_bbox, metricas, ventana_huella
 
-# Planetary Computer
-from pystac_client import Client
-import planetary_computer as pc
+# Planetary Computer (o búsquedas grabadas: STAC_MODE=record/replay)
+from ndvi_pipeline.catalogo_stac import STAC_MODE, buscar_items
 
 
 print("[NDVI-COMPOSITE-FULL] Script de NDVI Composite - Cobertura Completa")
@@ -64,16 +73,38 @@ MAX_IMAGES_PER_TILE = int(os.getenv("MAX_COMPOSITE_IMAGES", "30"))
 CLOUD_BUFFER_PIXELS = int(os.getenv("CLOUD_BUFFER_PIXELS", "3"))
 FILL_LARGE_GAPS = os.getenv("FILL_LARGE_GAPS", "1") == "1"
 MAX_GAP_SIZE_PIXELS = int(os.getenv("MAX_GAP_SIZE_PIXELS", "50"))  # Más agresivo
+GAP_FILL_METHOD = os.getenv("GAP_FILL_METHOD", "griddata")  # griddata (lineal) | edt (vecino más cercano, más rápido)
 
 # PARÁMETROS DE PROCESAMIENTO
 NDVI_RES_M = float(os.getenv("NDVI_RES_M", "10"))
-NDVI_MAX_DIM = int(os.getenv("NDVI_MAX_DIM", "15000"))  # Aumentado
+NDVI_MAX_DIM = int(os.getenv("NDVI_MAX_DIM", "15000"))  # Aumentado (solo composite en memoria)
+# Composite por bloques de NDVI_BLOCK_SIZE² px escritos directamente a GeoTIFF (0 = todo en memoria)
+NDVI_BLOCK_SIZE = int(os.getenv("NDVI_BLOCK_SIZE", "1024"))
+# Composite incremental por bloques: estado en NDVI_STATE_DIR (data/estado/ndvi_composite)
+NDVI_INCREMENTAL = os.getenv("NDVI_INCREMENTAL", "1") == "1"
+# Regla del composite por bloques: mejor_pixel (score calidad × peso temporal), mediana o pNN
+# (percentil de las observaciones válidas, p. ej. p25; pila de fechas en disco, sin incremental)
+NDVI_COMPOSITE_MODO = os.getenv("NDVI_COMPOSITE_MODO", MODO_MEJOR_PIXEL).strip().lower()
+# Índices a componer de la misma lectura (ndvi_pipeline/indices.py), p. ej. "NDVI,NDWI,EVI".
+# NDVI va siempre el primero: decide qué observación gana en cada píxel (solo por bloques)
+NDVI_INDICES = ("NDVI", *(n for n in indices_desde_texto(os.getenv("NDVI_INDICES", "NDVI")) if n != "NDVI"))
 DEBUG_MODE = os.getenv("DEBUG_MODE", "1") == "1"
+# Fechas en paralelo (1 = secuencial): por bloques, hilos que leen y mezclan las fechas de cada bloque;
+# en memoria, procesos, y NDVI_DATE_MEM_MB acota las fechas en vuelo (cada una = NDVI + calidad
+# float32 del tamaño de la ROI en memoria compartida)
+NDVI_DATE_WORKERS = int(os.getenv("NDVI_DATE_WORKERS", "1"))
+NDVI_DATE_MEM_MB = float(os.getenv("NDVI_DATE_MEM_MB", "2048"))
 
 # CLOUD MASKING
 INVALID_SCL = {0, 1, 3, 8, 9, 10, 11}  # Removido 7 (nubes baja prob) para más cobertura
 SHADOW_SCL = {2, 3}
 
+# Lecturas COG concurrentes (hilos: S2_READ_THREADS)
+LECTOR_S2 = LectorConcurrente(debug=DEBUG_MODE)
+
+# Estado por proceso hijo del composite por fechas (huecos de memoria compartida)
+_WORKER: dict = {}
+
 # PESOS DE CALIDAD PARA COMPOSITE
 QUALITY_WEIGHTS = {
     4: 1.0,   # Vegetación
@@ -155,138 +186,25 @@ def fill_gaps_aggressive(ndvi, max_gap_size=50):
     """
     Rellena gaps de forma MÁS AGRESIVA usando interpolación espacial.
     Esencial para composite multi-tile.
+    El trabajo lo hace ndvi_pipeline.gap_fill (cada hueco en su caja, no en la imagen completa).
     """
     if not FILL_LARGE_GAPS:
         return ndvi
     
-    filled = ndvi.copy()
-    invalid_mask = ~np.isfinite(filled)
+    filled, resumen = rellenar_gaps(ndvi, max_gap_size, modo=GAP_FILL_METHOD, debug=DEBUG_MODE)
     
-    if not np.any(invalid_mask):
+    if resumen["grupos"] == 0:
         return filled
     
-    # Etiquetar regiones de gaps
-    labeled_gaps, num_gaps = ndimage.label(invalid_mask)
-    
-    print(f"[GAPS] Detectados {num_gaps} grupos de píxeles inválidos")
-    
-    filled_count = 0
-    large_gaps_count = 0
-    
-    for gap_id in range(1, num_gaps + 1):
-        gap_mask = (labeled_gaps == gap_id)
-        gap_size = gap_mask.sum()
-        
-        # Rellenar gaps pequeños y medianos
-        if gap_size > max_gap_size:
-            large_gaps_count += 1
-            continue
-        
-        # Dilatar más para gaps grandes
-        dilation_iters = min(5, max(2, int(np.sqrt(gap_size) / 2)))
-        structure = ndimage.generate_binary_structure(2, 2)
-        dilated = ndimage.binary_dilation(gap_mask, structure=structure, iterations=dilation_iters)
-        
-        neighbor_mask = dilated & ~gap_mask & np.isfinite(filled)
-        
-        if not np.any(neighbor_mask):
-            continue
-        
-        neighbor_coords = np.column_stack(np.where(neighbor_mask))
-        neighbor_values = filled[neighbor_mask]
-        gap_coords = np.column_stack(np.where(gap_mask))
-        
-        try:
-            # Usar linear para gaps pequeños, nearest para grandes
-            method = 'linear' if gap_size < 100 else 'nearest'
-            interpolated = griddata(neighbor_coords, neighbor_values, gap_coords, method=method)
-            
-            # Fallback a nearest si linear falla
-            if np.any(~np.isfinite(interpolated)):
-                interpolated = griddata(neighbor_coords, neighbor_values, gap_coords, method='nearest')
-            
-            filled[gap_mask] = interpolated
-            filled_count += gap_size
-            
-        except Exception as e:
-            if DEBUG_MODE:
-                print(f"[GAPS] Error interpolando gap {gap_id} (size={gap_size}): {e}")
-            continue
-    
-    if filled_count > 0:
-        print(f"[GAPS] ✓ Rellenados {filled_count:,} píxeles")
-    if large_gaps_count > 0:
-        print(f"[GAPS] ⚠ {large_gaps_count} gaps grandes (>{max_gap_size} px) sin rellenar")
+    print(f"[GAPS] Detectados {resumen['grupos']} grupos de píxeles inválidos")
+    if resumen["rellenados"] > 0:
+        print(f"[GAPS] ✓ Rellenados {resumen['rellenados']:,} píxeles ({GAP_FILL_METHOD})")
+    if resumen["grandes"] > 0:
+        print(f"[GAPS] ⚠ {resumen['grandes']} gaps grandes (>{max_gap_size} px) sin rellenar")
     
     return filled
 
 
-def ndvi_to_rgba(ndvi):
-    """Convertir NDVI a imagen RGBA"""
-    h, w = ndvi.shape
-    rgba = np.zeros((h, w, 4), dtype=np.uint8)
-    valid = np.isfinite(ndvi)
-    
-    if not np.any(valid):
-        return rgba
-
-    ranges_colors = [
-        (-0.2, 0.0, (165, 0, 38)),
-        (0.0, 0.1, (215, 48, 39)),
-        (0.1, 0.2, (244, 109, 67)),
-        (0.2, 0.3, (253, 174, 97)),
-        (0.3, 0.4, (254, 224, 139)),
-        (0.4, 0.5, (255, 255, 191)),
-        (0.5, 0.6, (217, 239, 139)),
-        (0.6, 0.7, (166, 217, 106)),
-        (0.7, 0.8, (102, 189, 99)),
-        (0.8, 0.9, (26, 152, 80)),
-        (0.9, 1.0, (0, 104, 55)),
-    ]
-    
-    rgba[valid & (ndvi < -0.2)] = [0, 0, 0, 255]
-    
-    for vmin, vmax, color in ranges_colors:
-        mask = valid & (ndvi >= vmin) & (ndvi < vmax)
-        if np.any(mask):
-            rgba[mask] = [*color, 255]
-    
-    rgba[valid & (ndvi >= 1.0)] = [0, 104, 55, 255]
-    rgba[~valid, 3] = 0
-    
-    return rgba
-
-
-def warp_tif_to_3857(src_tif: str, dst_tif: str):
-    """Reproyectar a EPSG:3857"""
-    dst_crs = "EPSG:3857"
-    with rasterio.open(src_tif) as src:
-        transform, width, height = calculate_default_transform(
-            src.crs, dst_crs, src.width, src.height, *src.bounds
-        )
-        kwargs = src.meta.copy()
-        kwargs.update({
-            "crs": dst_crs,
-            "transform": transform,
-            "width": width,
-            "height": height,
-            "nodata": src.nodata,
-        })
-
-        with rasterio.open(dst_tif, "w", **kwargs) as dst:
-            reproject(
-                source=rasterio.band(src, 1),
-                destination=rasterio.band(dst, 1),
-                src_transform=src.transform,
-                src_crs=src.crs,
-                dst_transform=transform,
-                dst_crs=dst_crs,
-                resampling=Resampling.bilinear,
-                src_nodata=src.nodata,
-                dst_nodata=src.nodata,
-            )
-
-
 def compute_grid_from_bbox_meters(bbox4326, dst_crs, res_m, max_dim=None):
     """Calcular grid de salida"""
     minx, miny, maxx, maxy = bbox4326
@@ -354,27 +272,15 @@ def search_planetary_computer_all_tiles(bbox, start_date, end_date, cloud_max, m
         dict: {fecha: [lista de items de esa fecha]}
     """
     try:
-        print(f"[SEARCH] Conectando con Planetary Computer...")
+        print(f"[SEARCH] Conectando con Planetary Computer (STAC_MODE={STAC_MODE})...")
         print(f"[SEARCH] Ventana temporal: {start_date.strftime('%Y-%m-%d')} a {end_date.strftime('%Y-%m-%d')}")
         print(f"[SEARCH] BBox: {bbox}")
         print(f"[SEARCH] BUSCANDO EN TODAS LAS TILES QUE INTERSECTAN EL ROI")
         
-        catalog = Client.open(
-            "https://planetarycomputer.microsoft.com/api/stac/v1",
-            modifier=pc.sign_inplace
-        )
-        
         date_range = f"{start_date.strftime('%Y-%m-%d')}/{end_date.strftime('%Y-%m-%d')}"
         
         # Búsqueda SIN limit para obtener TODAS las imágenes
-        search = catalog.search(
-            collections=["sentinel-2-l2a"],
-            bbox=bbox,
-            datetime=date_range,
-            limit=500  # Aumentado significativamente
-        )
-        
-        items = list(search.items())
+        items = buscar_items(bbox, date_range, limit=500)
         
         print(f"[SEARCH] ✓ Items encontrados: {len(items)}")
         
@@ -433,52 +339,10 @@ def search_planetary_computer_all_tiles(bbox, start_date, end_date, cloud_max, m
 # ============================================================================
 
 def read_band_window_cog(item, band_key, bbox_4326, dst_transform, dst_crs, width, height):
-    """Lee banda con manejo robusto de variantes"""
-    
-    variants_map = {
-        'B04': ['B04', 'red', 'b04'],
-        'B08': ['B08', 'nir', 'b08', 'nir08'],
-        'SCL': ['SCL', 'scl'],
-    }
-    
-    asset = None
-    for variant in variants_map.get(band_key, [band_key]):
-        if variant in item.assets:
-            asset = item.assets[variant]
-            break
-    
-    if not asset:
-        return None
-    
-    href = asset.href
-    
+    """Lee banda con manejo robusto de variantes (ndvi_pipeline.lector_s2)"""
     try:
-        with rasterio.open(href) as src:
-            src_bbox = transform_bounds("EPSG:4326", src.crs, *bbox_4326, densify_pts=21)
-            window = window_from_bounds(*src_bbox, transform=src.transform)
-            data = src.read(1, window=window)
-            src_transform_win = src.window_transform(window)
-            src_crs = src.crs
-            src_nodata = src.nodata
-        
-        if band_key == 'SCL':
-            resampling_method = Resampling.nearest
-            dtype = np.int16
-        else:
-            resampling_method = Resampling.bilinear
-            dtype = np.float32
-        
-        reprojected = reproject_to_grid(
-            data, src_transform_win, src_crs,
-            dst_transform, dst_crs, width, height,
-            resampling_method,
-            src_nodata=src_nodata,
-            dst_dtype=dtype
-        )
-        
-        return reprojected
-        
-    except Exception as e:
+        return leer_banda_bbox(item, band_key, bbox_4326, dst_transform, dst_crs, width, height)
+    except (RasterioError, OSError) as e:  # Solo E/S, como LectorConcurrente._leer
         if DEBUG_MODE:
             print(f"[BAND] ✗ Error leyendo {band_key}: {e}")
         return None
@@ -488,50 +352,105 @@ def read_band_window_cog(item, band_key, bbox_4326, dst_transform, dst_crs, widt
 # COMPOSITE MULTI-TILE
 # ============================================================================
 
-def merge_tiles_same_date(items, bbox_4326, dst_transform, dst_crs, width, height, date_key):
+def indices_y_calidad_tile(bandas, indices=NDVI_INDICES):
+    """
+    Índices enmascarados (nubes con buffer) y score de calidad de una tile ya
+    reproyectada a la rejilla, a partir de {banda: array} (B02...B08 y SCL).
+    Cada banda se normaliza y enmascara una vez aunque la usen varios índices.
+    """
+    scl = bandas.get('SCL')
+    invalid = enhanced_cloud_mask(scl, CLOUD_BUFFER_PIXELS) if scl is not None else None
+    
+    refl = {}
+    for banda, datos in bandas.items():
+        if banda == 'SCL' or datos is None:
+            continue
+        # Normalizar
+        r = datos.astype(np.float32) / 10000.0
+        r[(r <= 0) | (r > 1)] = np.nan
+        # Cloud masking
+        if invalid is not None:
+            r[invalid] = np.nan
+        refl[banda] = r
+    
+    if scl is not None:
+        quality_scores = compute_pixel_quality_score(scl)
+    else:
+        quality_scores = np.ones(next(iter(refl.values())).shape, dtype=np.float32) * 0.5
+    
+    return evaluar_indices(refl, indices), quality_scores
+
+
+def ndvi_y_calidad_tile(red, nir, scl):
+    """
+    NDVI enmascarado (nubes con buffer) y score de calidad de una tile ya
+    reproyectada a la rejilla. Lo usa el merge en memoria.
+    """
+    valores, quality_scores = indices_y_calidad_tile({'B04': red, 'B08': nir, 'SCL': scl}, ("NDVI",))
+    return valores["NDVI"], quality_scores
+
+
+def merge_tiles_same_date(items, bbox_4326, dst_transform, dst_crs, width, height, date_key, salida=None):
     """
     Combina múltiples tiles del mismo día en un NDVI único.
     CLAVE para solucionar el problema de corte.
+    
+    Cada tile se reproyecta, enmascara y mezcla solo en la ventana de su
+    huella sobre la rejilla (``ventana_huella``, con el buffer de nubes como
+    halo): fuera de ella sería todo nodata. La mezcla se hace en su sitio
+    sobre los arrays del día, así que memoria y CPU crecen con la superficie
+    que cubren las tiles y no con nº de tiles × ROI.
+    
+    ``salida``: (ndvi, calidad) ya reservados (p. ej. en memoria compartida)
+    donde escribir el resultado en vez de crear arrays nuevos.
     """
     print(f"\n[MERGE] Combinando {len(items)} tiles de {date_key}")
     
     # Arrays para acumular
-    merged_ndvi = np.full((height, width), np.nan, dtype=np.float32)
-    merged_quality = np.zeros((height, width), dtype=np.float32)
+    if salida is None:
+        merged_ndvi = np.full((height, width), np.nan, dtype=np.float32)
+        merged_quality = np.zeros((height, width), dtype=np.float32)
+    else:
+        merged_ndvi, merged_quality = salida
+        merged_ndvi.fill(np.nan)
+        merged_quality.fill(0)
+    
+    # Ventana de cada tile en la rejilla (el halo cubre la dilatación del buffer de nubes)
+    ventanas = {
+        item.id: ventana_huella(item, dst_transform, dst_crs, width, height, halo=CLOUD_BUFFER_PIXELS + 1)
+        for item in items
+    }
+    fuera = [item for item in items if ventanas[item.id] is None]
+    if fuera:
+        print(f"[MERGE]   {len(fuera)} tiles no tocan la rejilla - OMITIDAS")
+    items = [item for item in items if ventanas[item.id] is not None]
+    
+    def leer(item, band_key):
+        win = ventanas[item.id]
+        return read_band_window_cog(
+            item, band_key, bbox_4326, window_transform(win, dst_transform), dst_crs,
+            int(win.width), int(win.height),
+        )
     
-    for idx, item in enumerate(items, 1):
+    # Bandas de todas las tiles del día en paralelo (S2_READ_THREADS)
+    lecturas = LECTOR_S2.bandas_items(items, ('B04', 'B08', 'SCL'), leer)
+    
+    for idx, (item, bandas) in enumerate(lecturas, 1):
         tile_id = item.properties.get('s2:mgrs_tile', f'tile{idx}')
         clouds = item.properties.get('eo:cloud_cover', -1)
+        win = ventanas[item.id]
         
-        print(f"[MERGE]   Tile {idx}/{len(items)}: {tile_id} | Nubes: {clouds:.1f}%")
+        print(f"[MERGE]   Tile {idx}/{len(items)}: {tile_id} | Nubes: {clouds:.1f}% | "
+              f"ventana {int(win.width)} x {int(win.height)} px "
+              f"({100 * win.width * win.height / (width * height):.0f}% de la ROI)")
         
-        # Leer bandas
-        red = read_band_window_cog(item, 'B04', bbox_4326, dst_transform, dst_crs, width, height)
-        nir = read_band_window_cog(item, 'B08', bbox_4326, dst_transform, dst_crs, width, height)
-        scl = read_band_window_cog(item, 'SCL', bbox_4326, dst_transform, dst_crs, width, height)
+        red, nir, scl = bandas['B04'], bandas['B08'], bandas['SCL']
         
         if red is None or nir is None:
             print(f"[MERGE]     ✗ Faltan bandas - OMITIDA")
             continue
         
-        # Normalizar
-        red = red.astype(np.float32) / 10000.0
-        nir = nir.astype(np.float32) / 10000.0
-        
-        red[(red <= 0) | (red > 1)] = np.nan
-        nir[(nir <= 0) | (nir > 1)] = np.nan
-        
-        # Cloud masking
-        if scl is not None:
-            invalid = enhanced_cloud_mask(scl, CLOUD_BUFFER_PIXELS)
-            red[invalid] = np.nan
-            nir[invalid] = np.nan
-            quality_scores = compute_pixel_quality_score(scl)
-        else:
-            quality_scores = np.ones((height, width), dtype=np.float32) * 0.5
-        
-        # NDVI
-        ndvi = compute_ndvi(red, nir)
+        ndvi, quality_scores = ndvi_y_calidad_tile(red, nir, scl)
         valid = np.isfinite(ndvi)
         
         if not np.any(valid):
@@ -541,11 +460,16 @@ def merge_tiles_same_date(items, bbox_4326, dst_transform, dst_crs, width, heigh
         valid_count = valid.sum()
         print(f"[MERGE]     ✓ Píxeles válidos: {valid_count:,}")
         
+        # Vistas de la ventana en los arrays del día: se actualizan en su sitio
+        filas, cols = win.toslices()
+        sub_ndvi = merged_ndvi[filas, cols]
+        sub_quality = merged_quality[filas, cols]
+        
         # Actualizar donde el nuevo score es mejor O donde no hay datos
-        update_mask = valid & ((quality_scores > merged_quality) | ~np.isfinite(merged_ndvi))
+        update_mask = valid & ((quality_scores > sub_quality) | ~np.isfinite(sub_ndvi))
         
-        merged_ndvi[update_mask] = ndvi[update_mask]
-        merged_quality[update_mask] = quality_scores[update_mask]
+        sub_ndvi[update_mask] = ndvi[update_mask]
+        sub_quality[update_mask] = quality_scores[update_mask]
     
     # Estadísticas del merge
     final_valid = np.isfinite(merged_ndvi)
@@ -556,10 +480,102 @@ def merge_tiles_same_date(items, bbox_4326, dst_transform, dst_crs, width, heigh
     return merged_ndvi, merged_quality
 
 
-def build_multi_tile_composite(items_by_date, bbox_4326, dst_transform, dst_crs, width, height):
+def _worker_fechas_init(nombres_shm: list[str], shape: tuple[int, int]):
+    huecos = []
+    for nombre in nombres_shm:
+        shm = shared_memory.SharedMemory(name=nombre)
+        datos = np.ndarray((2, *shape), dtype=np.float32, buffer=shm.buf)
+        huecos.append((shm, datos))
+    _WORKER["huecos"] = huecos
+
+
+def _worker_fecha(hueco: int, items, bbox_4326, dst_transform, dst_crs, width, height, date_key) -> int:
+    """Merge de las tiles de una fecha escrito en el hueco ``hueco`` de memoria compartida."""
+    datos = _WORKER["huecos"][hueco][1]
+    with entorno_gdal():
+        merge_tiles_same_date(
+            items, bbox_4326, dst_transform, dst_crs, width, height, date_key, salida=(datos[0], datos[1])
+        )
+    return hueco
+
+
+def _fechas_en_paralelo(items_by_date, sorted_dates, bbox_4326, dst_transform, dst_crs, width, height,
+                        workers: int, mem_mb: float):
+    """
+    (idx, NDVI del día, calidad del día) de cada fecha en el orden de
+    ``sorted_dates``, con los merges repartidos entre ``workers`` procesos.
+    
+    Cada fecha en vuelo ocupa un hueco de memoria compartida (NDVI + calidad
+    de la ROI) reservado por el proceso principal; ``mem_mb`` fija cuántos
+    huecos hay. Los resultados que llegan antes de tiempo esperan en su hueco
+    y se entregan en orden de fecha, así que el composite es el mismo que en
+    secuencial. Los arrays entregados son vistas del hueco: solo valen hasta
+    pedir la siguiente fecha.
+    """
+    bytes_fecha = 2 * width * height * 4
+    n_huecos = max(1, min(len(sorted_dates), int(mem_mb * 1e6 // bytes_fecha)))
+    workers = max(1, min(workers, n_huecos))
+    print(f"[DATES] {workers} procesos | {n_huecos} fechas en vuelo como máximo "
+          f"({n_huecos * bytes_fecha / 1e6:.0f} MB de memoria compartida)")
+    
+    huecos = []
+    try:
+        for _ in range(n_huecos):
+            shm = shared_memory.SharedMemory(create=True, size=bytes_fecha)
+            huecos.append((shm, np.ndarray((2, height, width), dtype=np.float32, buffer=shm.buf)))
+        # spawn: los hijos no heredan hilos del lector ni datasets GDAL abiertos
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_worker_fechas_init,
+            initargs=([shm.name for shm, _ in huecos], (height, width)),
+        ) as pool:
+            libres = list(range(n_huecos))
+            pendientes = iter(enumerate(sorted_dates))
+            en_vuelo: dict = {}
+            listos: dict[int, int] = {}  # idx de fecha -> hueco con su resultado
+            siguiente = 0
+            
+            while siguiente < len(sorted_dates):
+                # La fecha más antigua sin entregar siempre está en vuelo o lista: no hay bloqueo
+                while libres:
+                    tarea = next(pendientes, None)
+                    if tarea is None:
+                        break
+                    idx, date_key = tarea
+                    fut = pool.submit(
+                        _worker_fecha, libres.pop(), items_by_date[date_key], bbox_4326,
+                        dst_transform, dst_crs, width, height, date_key,
+                    )
+                    en_vuelo[fut] = idx
+                
+                if siguiente not in listos:
+                    terminados, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                    for fut in terminados:
+                        listos[en_vuelo.pop(fut)] = fut.result()
+                
+                while siguiente in listos:
+                    hueco = listos.pop(siguiente)
+                    datos = huecos[hueco][1]
+                    yield siguiente, datos[0], datos[1]
+                    libres.append(hueco)
+                    siguiente += 1
+    finally:
+        for shm, _ in huecos:
+            shm.close()
+            shm.unlink()
+
+
+def build_multi_tile_composite(items_by_date, bbox_4326, dst_transform, dst_crs, width, height,
+                               workers=NDVI_DATE_WORKERS, mem_mb=NDVI_DATE_MEM_MB):
     """
     Construye composite usando MÚLTIPLES FECHAS, cada una con MÚLTIPLES TILES.
     Solución definitiva al problema de corte.
+    
+    Con ``workers`` > 1 el merge de cada fecha se hace en otro proceso
+    (``_fechas_en_paralelo``) y aquí solo se pliega, en el mismo orden que en
+    secuencial: mismo resultado con los núcleos ocupados mientras se
+    decodifica. Las métricas de lectura quedan en los procesos hijos.
     """
     
     print(f"\n{'='*80}")
@@ -577,24 +593,15 @@ def build_multi_tile_composite(items_by_date, bbox_4326, dst_transform, dst_crs,
     dates_used = 0
     total_tiles = 0
     
-    for idx, date_key in enumerate(sorted_dates):
-        items = items_by_date[date_key]
-        total_tiles += len(items)
-        
-        print(f"\n[DATE {idx+1}/{len(sorted_dates)}] Procesando: {date_key} ({len(items)} tiles)")
-        
-        # MERGE: Combinar todas las tiles de este día
-        day_ndvi, day_quality = merge_tiles_same_date(
-            items, bbox_4326, dst_transform, dst_crs, width, height, date_key
-        )
-        
+    def plegar(idx, day_ndvi, day_quality):
+        nonlocal dates_processed, dates_used
         dates_processed += 1
         
         # ¿Hay datos válidos en este día?
         valid = np.isfinite(day_ndvi)
         if not np.any(valid):
             print(f"[DATE {idx+1}] ✗ Sin datos válidos después del merge")
-            continue
+            return
         
         dates_used += 1
         
@@ -612,6 +619,28 @@ def build_multi_tile_composite(items_by_date, bbox_4326, dst_transform, dst_crs,
         pixels_updated = update_mask.sum()
         print(f"[DATE {idx+1}] ✓ Píxeles actualizados en composite final: {pixels_updated:,}")
     
+    if workers > 1 and len(sorted_dates) > 1:
+        total_tiles = sum(len(items_by_date[d]) for d in sorted_dates)
+        for idx, day_ndvi, day_quality in _fechas_en_paralelo(
+            items_by_date, sorted_dates, bbox_4326, dst_transform, dst_crs, width, height, workers, mem_mb
+        ):
+            date_key = sorted_dates[idx]
+            n_tiles = len(items_by_date[date_key])
+            print(f"\n[DATE {idx+1}/{len(sorted_dates)}] Plegando: {date_key} ({n_tiles} tiles)")
+            plegar(idx, day_ndvi, day_quality)
+    else:
+        for idx, date_key in enumerate(sorted_dates):
+            items = items_by_date[date_key]
+            total_tiles += len(items)
+            
+            print(f"\n[DATE {idx+1}/{len(sorted_dates)}] Procesando: {date_key} ({len(items)} tiles)")
+            
+            # MERGE: Combinar todas las tiles de este día
+            day_ndvi, day_quality = merge_tiles_same_date(
+                items, bbox_4326, dst_transform, dst_crs, width, height, date_key
+            )
+            plegar(idx, day_ndvi, day_quality)
+    
     # Estadísticas finales
     final_valid = np.isfinite(best_ndvi)
     coverage = 100 * final_valid.sum() / best_ndvi.size
@@ -663,7 +692,8 @@ def build_multi_tile_composite(items_by_date, bbox_4326, dst_transform, dst_crs,
 def main():
     app = create_app()
     
-    with app.app_context():
+    # Opciones HTTP/caché de GDAL para los COG (los hilos del lector entran en su propio Env)
+    with app.app_context(), entorno_gdal():
         print(f"\n{'='*80}")
         print("CONFIGURACIÓN")
         print(f"{'='*80}")
@@ -673,6 +703,13 @@ def main():
         print(f"Cobertura nubes máx: {CLOUD_MAX}%")
         print(f"Buffer nubes: {CLOUD_BUFFER_PIXELS}px")
         print(f"Relleno gaps: {'SÍ' if FILL_LARGE_GAPS else 'NO'} (hasta {MAX_GAP_SIZE_PIXELS}px)")
+        print(f"Formato GeoTIFF: {NDVI_FORMATO}")
+        print(f"Modo composite: {NDVI_COMPOSITE_MODO}")
+        if NDVI_BLOCK_SIZE > 0:
+            print(f"Fechas en paralelo: {NDVI_DATE_WORKERS} hilos por bloque")
+        else:
+            print(f"Fechas en paralelo: {NDVI_DATE_WORKERS} procesos (hasta {NDVI_DATE_MEM_MB:.0f} MB en vuelo)")
+        percentil_modo(NDVI_COMPOSITE_MODO)  # Falla pronto si el modo no existe
         
         # ROI
         bbox = get_roi_bbox_from_gpkg()
@@ -686,36 +723,37 @@ def main():
             print("\n❌ No se encontraron imágenes")
             return 1
         
-        # Grid
+        # Grid (por bloques no hace falta limitar dimensiones: se trabaja a NDVI_RES_M)
         dst_crs = "EPSG:25830"
+        por_bloques = NDVI_BLOCK_SIZE > 0
         width, height, dst_transform, _ = compute_grid_from_bbox_meters(
-            bbox, dst_crs, NDVI_RES_M, NDVI_MAX_DIM
+            bbox, dst_crs, NDVI_RES_M, None if por_bloques else NDVI_MAX_DIM
         )
         
         print(f"\n[GRID] {width} x {height} px | {NDVI_RES_M}m/px | {dst_crs}")
         
-        # Composite
-        composite, meta = build_multi_tile_composite(
-            items_by_date, bbox, dst_transform, dst_crs, width, height
-        )
-        
-        if composite is None:
-            print("\n❌ Fallo al crear composite")
-            return 1
-        
-        # Estadísticas
-        valid = composite[np.isfinite(composite)]
-        
-        print(f"\n{'='*80}")
-        print("ESTADÍSTICAS FINALES")
-        print(f"{'='*80}")
-        print(f"  NDVI min:     {valid.min():.3f}")
-        print(f"  NDVI max:     {valid.max():.3f}")
-        print(f"  NDVI mean:    {valid.mean():.3f}")
-        print(f"  NDVI median:  {np.median(valid):.3f}")
-        print(f"  Std dev:      {valid.std():.3f}")
+        modo_composite = NDVI_COMPOSITE_MODO if por_bloques else MODO_MEJOR_PIXEL
+        if modo_composite != NDVI_COMPOSITE_MODO:
+            print(f"⚠️ NDVI_COMPOSITE_MODO={NDVI_COMPOSITE_MODO} solo se aplica por bloques (NDVI_BLOCK_SIZE > 0): se usa mejor_pixel")
+        
+        # Cribado por SCL de overviews: fuera items sin píxeles útiles y fechas que ya no aportan
+        informe_cribado = None
+        if S2_CRIBADO:
+            print(f"\n{'='*80}")
+            print("CRIBADO DE ESCENAS (SCL overview)")
+            print(f"{'='*80}")
+            items_by_date, informe_cribado = cribar_items(
+                items_by_date, bbox, dst_transform, dst_crs, width, height,
+                scl_validas=set(QUALITY_WEIGHTS) - INVALID_SCL,
+                scl_optimas={c for c, w in QUALITY_WEIGHTS.items() if w == max(QUALITY_WEIGHTS.values())},
+                # Con mediana/percentil cuentan todas las fechas: sin corte por cobertura
+                cobertura_objetivo=S2_CRIBADO_COBERTURA if modo_composite == MODO_MEJOR_PIXEL else None,
+                debug=DEBUG_MODE,
+            )
+            if not items_by_date:
+                print("\n❌ Ninguna escena con píxeles útiles sobre la ROI")
+                return 1
         
-        # Guardar
         static_ndvi_dir = Path(app.root_path) / "static" / "ndvi"
         static_ndvi_dir.mkdir(parents=True, exist_ok=True)
         
@@ -725,35 +763,124 @@ def main():
         tif_3857 = static_ndvi_dir / f"ndvi_multitile_{ts}_3857.tif"
         png = static_ndvi_dir / f"ndvi_multitile_{ts}.png"
         json_file = static_ndvi_dir / f"ndvi_multitile_{ts}.json"
+        tif_fechas = static_ndvi_dir / f"ndvi_multitile_{ts}_fechas.tif"
+        # Índices adicionales (NDVI_INDICES): un GeoTIFF UTM y otro 3857 por índice
+        indices_extra = NDVI_INDICES[1:] if por_bloques else ()
+        tifs_indices = {
+            n: (static_ndvi_dir / f"ndvi_multitile_{ts}_{n.lower()}_utm.tif",
+                static_ndvi_dir / f"ndvi_multitile_{ts}_{n.lower()}_3857.tif")
+            for n in indices_extra
+        }
+        if len(NDVI_INDICES) > 1 and not por_bloques:
+            print(f"⚠️ NDVI_INDICES={','.join(NDVI_INDICES)} solo se aplica por bloques (NDVI_BLOCK_SIZE > 0): se genera solo NDVI")
+        incremental = por_bloques and NDVI_INCREMENTAL and modo_composite == MODO_MEJOR_PIXEL
+        
+        # Composite
+        composite = None
+        stats_indices = {}
+        if por_bloques:
+            print(f"\n{'='*80}")
+            print(f"CONSTRUYENDO COMPOSITE MULTI-TILE POR BLOQUES ({NDVI_BLOCK_SIZE} px)")
+            print(f"{'='*80}")
+            meta = componer_por_bloques(
+                items_by_date, dst_transform, dst_crs, width, height, tif_utm,
+                indices_y_calidad_tile,
+                tam_bloque=NDVI_BLOCK_SIZE,
+                halo=CLOUD_BUFFER_PIXELS,
+                max_gap_size=MAX_GAP_SIZE_PIXELS if FILL_LARGE_GAPS else 0,
+                modo_gaps=GAP_FILL_METHOD,
+                debug=DEBUG_MODE,
+                dias_ventana=LOOKBACK_DAYS,
+                estado=EstadoComposite(indices=NDVI_INDICES) if incremental else None,
+                parametros={
+                    "cloud_buffer_px": CLOUD_BUFFER_PIXELS,
+                    "invalid_scl": sorted(INVALID_SCL),
+                    "quality_weights": {str(k): v for k, v in QUALITY_WEIGHTS.items()},
+                },
+                salida_fechas=tif_fechas if modo_composite == MODO_MEJOR_PIXEL else None,
+                indices=NDVI_INDICES,
+                salidas_indices={n: utm for n, (utm, _) in tifs_indices.items()},
+                modo=modo_composite,
+                hilos_fechas=NDVI_DATE_WORKERS,
+            )
+            stats = meta.pop("statistics")
+            stats_indices = meta.pop("statistics_by_index")
+            meta.pop("index_files")
+            print(f"[BLOQUES] Cobertura ANTES gaps: {meta['coverage_before_gaps_pct']:.2f}% | "
+                  f"DESPUÉS: {meta['final_coverage_pct']:.2f}%")
+            if stats is None:
+                print("\n❌ Composite sin píxeles válidos")
+                return 1
+        else:
+            composite, meta = build_multi_tile_composite(
+                items_by_date, bbox, dst_transform, dst_crs, width, height
+            )
+            
+            metricas.imprimir()
+            
+            if composite is None:
+                print("\n❌ Fallo al crear composite")
+                return 1
+            
+            valid = composite[np.isfinite(composite)]
+            stats = {
+                "min": float(valid.min()),
+                "max": float(valid.max()),
+                "mean": float(valid.mean()),
+                "median": float(np.median(valid)),
+                "std": float(valid.std()),
+            }
         
+        # Estadísticas
         print(f"\n{'='*80}")
-        print("GUARDANDO ARCHIVOS")
+        print("ESTADÍSTICAS FINALES")
         print(f"{'='*80}")
+        print(f"  NDVI min:     {stats['min']:.3f}")
+        print(f"  NDVI max:     {stats['max']:.3f}")
+        print(f"  NDVI mean:    {stats['mean']:.3f}")
+        print(f"  NDVI median:  {stats['median']:.3f}")
+        print(f"  Std dev:      {stats['std']:.3f}")
+        for nombre in indices_extra:
+            s_idx = stats_indices.get(nombre)
+            if s_idx:
+                print(f"  {nombre:<5} min/mean/max: {s_idx['min']:.3f} / {s_idx['mean']:.3f} / {s_idx['max']:.3f}")
         
-        # GeoTIFF UTM
-        profile = {
-            "driver": "GTiff",
-            "height": height,
-            "width": width,
-            "count": 1,
-            "dtype": "float32",
-            "crs": dst_crs,
-            "transform": dst_transform,
-            "nodata": np.nan,
-            "compress": "deflate",
-        }
+        # Guardar
+        print(f"\n{'='*80}")
+        print("GUARDANDO ARCHIVOS")
+        print(f"{'='*80}")
         
-        with rasterio.open(str(tif_utm), "w", **profile) as dst:
-            dst.write(composite.astype(np.float32), 1)
+        # GeoTIFF UTM (por bloques ya está escrito)
+        if composite is not None:
+            profile = perfil_ndvi({
+                "driver": "GTiff",
+                "height": height,
+                "width": width,
+                "count": 1,
+                "crs": dst_crs,
+                "transform": dst_transform,
+                "compress": "deflate",
+            })
+            
+            with rasterio.open(str(tif_utm), "w", **profile) as dst:
+                marcar_escala(dst)
+                dst.write(codificar(composite, profile["dtype"]), 1)
         print(f"[✓] {tif_utm.name}")
+        if tif_fechas.exists():
+            print(f"[✓] {tif_fechas.name} (fecha de cada píxel, días desde 1970-01-01)")
         
         # 3857
         warp_tif_to_3857(str(tif_utm), str(tif_3857))
         print(f"[✓] {tif_3857.name}")
+        for nombre, (utm, web) in tifs_indices.items():
+            warp_tif_to_3857(str(utm), str(web))
+            print(f"[✓] {utm.name} | {web.name}")
         
         # PNG
-        rgba = ndvi_to_rgba(composite)
-        Image.fromarray(rgba, mode="RGBA").save(str(png), format="PNG", optimize=True)
+        if composite is not None:
+            guardar_png_ndvi(composite, str(png))
+        else:
+            tif_a_png(str(tif_utm), str(png))
         print(f"[✓] {png.name}")
         
         # JSON metadata
@@ -777,23 +904,30 @@ def main():
                 "cloud_buffer_px": CLOUD_BUFFER_PIXELS,
                 "gap_filling": FILL_LARGE_GAPS,
                 "max_gap_size_px": MAX_GAP_SIZE_PIXELS,
+                "block_size_px": NDVI_BLOCK_SIZE,
+                "incremental": bool(incremental),
+                "composite_mode": modo_composite,
+                "date_workers": NDVI_DATE_WORKERS,
+                "storage_format": NDVI_FORMATO,
+                "prescreen": informe_cribado,
             },
             "composite_stats": meta,
             "bbox_4326": [minx, miny, maxx, maxy],
             "grid": {"width": width, "height": height, "res_m": NDVI_RES_M},
             "crs": dst_crs,
-            "statistics": {
-                "min": float(valid.min()),
-                "max": float(valid.max()),
-                "mean": float(valid.mean()),
-                "median": float(np.median(valid)),
-                "std": float(valid.std()),
-            },
+            "statistics": stats,
+            "indices": list(NDVI_INDICES[:1] + indices_extra),
+            "statistics_by_index": stats_indices or {"NDVI": stats},
             "files": {
                 "utm_tif": tif_utm.name,
                 "epsg3857_tif": tif_3857.name,
                 "png": png.name,
                 "metadata": json_file.name,
+                "dates_tif": tif_fechas.name if tif_fechas.exists() else None,
+                "indices": {
+                    n: {"utm_tif": utm.name, "epsg3857_tif": web.name}
+                    for n, (utm, web) in tifs_indices.items()
+                },
             }
         }
         
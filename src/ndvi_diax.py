@@ -9,7 +9,8 @@ CAMBIOS v2.1:
 - Crea mosaico combinando múltiples imágenes
 - Usa weighted average para áreas de solapamiento
 - Prioriza píxeles de mejor calidad
-- ✓ Thumbnails organizados en carpetas por fecha: static/thumbnails/YYYYMMDD/{id}.png
+- ✓ Thumbnails por fecha: archivo SQLite servido en api/thumbnails/YYYYMMDD/{id}.png
+  (THUMB_STORE=archivos: static/thumbnails/YYYYMMDD/{id}.png)
 
 Autor: Sistema GIS
 Fecha: 2025
@@ -25,25 +26,30 @@ import geopandas as gpd
 from shapely.geometry import box, mapping, shape
 from scipy import ndimage
 
-from PIL import Image
-
 import math
 import rasterio
+from rasterio.errors import RasterioError
 from rasterio.warp import (
-    reproject, Resampling, transform_bounds, transform_geom, calculate_default_transform
+    reproject, transform_bounds, transform_geom
 )
-from rasterio.transform import from_bounds
-from rasterio.windows import from_bounds as window_from_bounds
-from rasterio.features import geometry_mask
+from rasterio.transform import array_bounds, from_bounds
 from rasterio.io import MemoryFile
 
 from dotenv import load_dotenv
 from sqlalchemy import text
 from webapp import create_app, db
+from webapp.utils.ndvi_colormap import guardar_png_ndvi
+from webapp.utils.ndvi_cubo import CuboNDVI
+from webapp.utils.ndvi_warp import warp_tif_to_3857
+from webapp.utils.thumbnails_store import ruta_thumbnail
+from ndvi_pipeline.carga_indices import cargar_indices_raster
+from ndvi_pipeline.formato_ndvi import NDVI_FORMATO, codificar, marcar_escala, perfil_ndvi
+from ndvi_pipeline.indices import bandas_necesarias, evaluar_indices, indices_desde_texto
+from ndvi_pipeline.lector_s2 import LectorConcurrente, entorno_gdal, leer_banda_bbox, metricas
+from ndvi_pipeline.zonal import EtiquetasRecintos
 
-# Planetary Computer
-from pystac_client import Client
-import planetary_computer as pc
+# Planetary Computer (o búsquedas grabadas: STAC_MODE=record/replay)
+from ndvi_pipeline.catalogo_stac import STAC_MODE, buscar_items
 
 
 print("[NDVI-PC] Script de NDVI - MOSAICO MULTI-TILE v2.1")
@@ -80,14 +86,22 @@ USE_WEIGHTED_COMPOSITE = os.getenv("USE_WEIGHTED_COMPOSITE", "1") == "1"
 NDVI_RES_M = float(os.getenv("NDVI_RES_M", "10"))
 NDVI_MAX_DIM = int(os.getenv("NDVI_MAX_DIM", "12000"))
 DEBUG_MODE = os.getenv("DEBUG_MODE", "1") == "1"
+# Índices calculados de la misma lectura (ndvi_pipeline/indices.py), p. ej. "NDVI,NDWI,EVI".
+# NDVI va siempre: decide qué tiles se aceptan y da nombre a los ficheros
+NDVI_INDICES = ("NDVI", *(n for n in indices_desde_texto(os.getenv("NDVI_INDICES", "NDVI")) if n != "NDVI"))
 
 
 INVALID_SCL = {0, 1, 3, 8, 9, 10, 11}  
 SHADOW_SCL = {2, 3}
 WATER_SCL = {6}
 
+# Lecturas COG concurrentes (hilos: S2_READ_THREADS)
+LECTOR_S2 = LectorConcurrente(debug=DEBUG_MODE)
+
 # BBDD
 DB_BATCH_SIZE = int(os.getenv("NDVI_DB_BATCH_SIZE", "500"))
+NDVI_DB_COPY = os.getenv("NDVI_DB_COPY", "1") == "1"  # 0 = INSERT ... ON CONFLICT por lotes
+NDVI_CUBE = os.getenv("NDVI_CUBE", "1") == "1"  # añadir el mosaico al cubo de series (webapp/utils/ndvi_cubo.py)
 DB_PROGRESS_EVERY = int(os.getenv("NDVI_DB_PROGRESS_EVERY", "500"))
 
 
@@ -103,14 +117,9 @@ def search_planetary_computer_all_tiles(bbox, target_date, window_days, cloud_ma
         Lista de items STAC que intersectan el ROI
     """
     try:
-        print(f"[SEARCH] Conectando con Planetary Computer...")
+        print(f"[SEARCH] Conectando con Planetary Computer (STAC_MODE={STAC_MODE})...")
         print(f"[SEARCH] Fecha objetivo: {target_date.strftime('%Y-%m-%d')}")
         
-        catalog = Client.open(
-            "https://planetarycomputer.microsoft.com/api/stac/v1",
-            modifier=pc.sign_inplace
-        )
-        
         # Ventana de búsqueda
         start_dt = target_date - timedelta(days=window_days)
         end_dt = target_date + timedelta(days=window_days)
@@ -121,14 +130,7 @@ def search_planetary_computer_all_tiles(bbox, target_date, window_days, cloud_ma
         print(f"[SEARCH] Nubes máx: {cloud_max}%")
         
         # Búsqueda sin filtros
-        search = catalog.search(
-            collections=["sentinel-2-l2a"],
-            bbox=bbox,
-            datetime=date_range,
-            limit=100
-        )
-        
-        items = list(search.items())
+        items = buscar_items(bbox, date_range, limit=100)
         
         print(f"[SEARCH] ✓ Productos encontrados: {len(items)}")
         
@@ -264,72 +266,6 @@ def compute_ndvi(red, nir):
     return np.where(den == 0, np.nan, (nir - red) / den)
 
 
-def ndvi_to_rgba(ndvi):
-    """Convertir NDVI a imagen RGBA según tabla de colores estándar"""
-    h, w = ndvi.shape
-    rgba = np.zeros((h, w, 4), dtype=np.uint8)
-    valid = np.isfinite(ndvi)
-    
-    if not np.any(valid):
-        return rgba
-
-    ranges_colors = [
-        (-0.2, 0.0, (165, 0, 38)),
-        (0.0, 0.1, (215, 48, 39)),
-        (0.1, 0.2, (244, 109, 67)),
-        (0.2, 0.3, (253, 174, 97)),
-        (0.3, 0.4, (254, 224, 139)),
-        (0.4, 0.5, (255, 255, 191)),
-        (0.5, 0.6, (217, 239, 139)),
-        (0.6, 0.7, (166, 217, 106)),
-        (0.7, 0.8, (102, 189, 99)),
-        (0.8, 0.9, (26, 152, 80)),
-        (0.9, 1.0, (0, 104, 55)),
-    ]
-    
-    rgba[valid & (ndvi < -0.2)] = [0, 0, 0, 255]
-    
-    for vmin, vmax, color in ranges_colors:
-        mask = valid & (ndvi >= vmin) & (ndvi < vmax)
-        if np.any(mask):
-            rgba[mask] = [*color, 255]
-    
-    rgba[valid & (ndvi >= 1.0)] = [0, 104, 55, 255]
-    rgba[~valid, 3] = 0
-    
-    return rgba
-
-
-def warp_tif_to_3857(src_tif: str, dst_tif: str):
-    """Reproyectar a EPSG:3857 para visualización web"""
-    dst_crs = "EPSG:3857"
-    with rasterio.open(src_tif) as src:
-        transform, width, height = calculate_default_transform(
-            src.crs, dst_crs, src.width, src.height, *src.bounds
-        )
-        kwargs = src.meta.copy()
-        kwargs.update({
-            "crs": dst_crs,
-            "transform": transform,
-            "width": width,
-            "height": height,
-            "nodata": src.nodata,
-        })
-
-        with rasterio.open(dst_tif, "w", **kwargs) as dst:
-            reproject(
-                source=rasterio.band(src, 1),
-                destination=rasterio.band(dst, 1),
-                src_transform=src.transform,
-                src_crs=src.crs,
-                dst_transform=transform,
-                dst_crs=dst_crs,
-                resampling=Resampling.bilinear,
-                src_nodata=src.nodata,
-                dst_nodata=src.nodata,
-            )
-
-
 def compute_grid_from_bbox_meters(bbox4326, dst_crs, res_m, max_dim=None):
     """Calcular grid de salida en metros"""
     minx, miny, maxx, maxy = bbox4326
@@ -381,82 +317,11 @@ def read_band_window_cog(item, band_key, bbox_4326, dst_transform, dst_crs, widt
     
     CORREGIDO: Calcula la intersección real entre el tile y el ROI para evitar
     devolver NaN en áreas donde el tile no tiene cobertura.
+    (Lectura en ndvi_pipeline.lector_s2, con métricas de latencia/bytes)
     """
-    
-    asset = item.assets.get(band_key)
-    
-    if not asset:
-        asset = item.assets.get(band_key.lower())
-    
-    if not asset:
-        variants = {
-            'B04': ['red', 'B04', 'b04'],
-            'B08': ['nir', 'B08', 'b08', 'nir08'],
-            'SCL': ['scl', 'SCL'],
-            'QA60': ['qa60', 'QA60']
-        }
-        
-        for variant in variants.get(band_key, []):
-            if variant in item.assets:
-                asset = item.assets[variant]
-                break
-    
-    if not asset:
-        return None
-    
-    href = asset.href
-    
     try:
-        with rasterio.open(href) as src:
-            # Obtener bounds del tile en su CRS nativo
-            tile_bounds = src.bounds
-            
-            # Convertir ROI bbox a CRS del tile
-            src_bbox = transform_bounds(
-                "EPSG:4326", src.crs,
-                *bbox_4326, densify_pts=21
-            )
-            
-            # Calcular INTERSECCIÓN entre tile y ROI
-            # Esto evita pedir datos fuera del tile
-            intersection_bbox = (
-                max(tile_bounds.left, src_bbox[0]),    # minx
-                max(tile_bounds.bottom, src_bbox[1]),  # miny
-                min(tile_bounds.right, src_bbox[2]),   # maxx
-                min(tile_bounds.top, src_bbox[3])      # maxy
-            )
-            
-            # Verificar si hay intersección válida
-            if intersection_bbox[0] >= intersection_bbox[2] or intersection_bbox[1] >= intersection_bbox[3]:
-                # No hay intersección - este tile no cubre esta área del ROI
-                return None
-            
-            # Leer solo la ventana de intersección
-            window = window_from_bounds(*intersection_bbox, transform=src.transform)
-            data = src.read(1, window=window)
-            src_transform_win = src.window_transform(window)
-            src_crs = src.crs
-            src_nodata = src.nodata
-        
-        if band_key in ['SCL', 'QA60']:
-            resampling_method = Resampling.nearest
-            dtype = np.int16 if band_key == 'SCL' else np.uint16
-        else:
-            resampling_method = Resampling.bilinear
-            dtype = np.float32
-        
-        # Reproyectar al grid de salida
-        reprojected = reproject_to_grid(
-            data, src_transform_win, src_crs,
-            dst_transform, dst_crs, width, height,
-            resampling_method,
-            src_nodata=src_nodata,
-            dst_dtype=dtype
-        )
-        
-        return reprojected
-        
-    except Exception as e:
+        return leer_banda_bbox(item, band_key, bbox_4326, dst_transform, dst_crs, width, height)
+    except (RasterioError, OSError) as e:  # Solo E/S, como LectorConcurrente._leer
         if DEBUG_MODE:
             print(f"[BAND] ✗ Error leyendo {band_key} de {item.id}: {e}")
         return None
@@ -477,38 +342,46 @@ def _item_cloud_cover(item):
 # PROCESAMIENTO NDVI CON MOSAICO MULTI-TILE
 # ============================================================================
 
-def process_item_to_ndvi_enhanced(item, bbox_4326, dst_transform, dst_crs, width, height):
-    """Procesar STAC Item a NDVI con cloud masking mejorado"""
+def process_item_to_indices_enhanced(item, bbox_4326, dst_transform, dst_crs, width, height, bandas=None,
+                                     indices=None):
+    """
+    Procesar STAC Item a NDVI (y el resto de ``indices``) con cloud masking mejorado.
+    ``bandas``: {banda: array} ya leídas (LectorConcurrente); si no, se leen aquí.
+    Devuelve ({índice: valores}, fracción válida del NDVI, pesos de calidad).
+    """
+    indices = indices or NDVI_INDICES
     
     tile_id = item.id
     print(f"\n[TILE] Procesando: {tile_id}")
     
-    red = read_band_window_cog(item, 'B04', bbox_4326, dst_transform, dst_crs, width, height)
-    nir = read_band_window_cog(item, 'B08', bbox_4326, dst_transform, dst_crs, width, height)
+    if bandas is None:
+        bandas = {
+            band_key: read_band_window_cog(item, band_key, bbox_4326, dst_transform, dst_crs, width, height)
+            for band_key in bandas_necesarias(indices)
+        }
     
-    if red is None or nir is None:
+    if bandas['B04'] is None or bandas['B08'] is None:
         print(f"[TILE] ✗ Faltan bandas espectrales en {tile_id}")
         return None, 0.0, None
     
-    red = red.astype(np.float32)
-    nir = nir.astype(np.float32)
-    
-    red[red == 0] = np.nan
-    nir[nir == 0] = np.nan
-    red[(red < 0) | (red > 10000)] = np.nan
-    nir[(nir < 0) | (nir > 10000)] = np.nan
-    
-    red = red / 10000.0
-    nir = nir / 10000.0
+    # Reflectancias: cada banda se enmascara una vez aunque la usen varios índices
+    refl = {}
+    for band_key, datos in bandas.items():
+        if band_key == 'SCL' or datos is None:
+            continue
+        r = datos.astype(np.float32)
+        r[r == 0] = np.nan
+        r[(r < 0) | (r > 10000)] = np.nan
+        refl[band_key] = r / 10000.0
     
-    scl = read_band_window_cog(item, 'SCL', bbox_4326, dst_transform, dst_crs, width, height)
+    scl = bandas['SCL']
     
     quality_weights = None
     
     if scl is not None:
         invalid = enhanced_cloud_mask(scl, None)
-        red[invalid] = np.nan
-        nir[invalid] = np.nan
+        for r in refl.values():
+            r[invalid] = np.nan
         
         cloud_pct = 100 * invalid.sum() / invalid.size
         print(f"[TILE] Píxeles filtrados: {cloud_pct:.1f}%")
@@ -518,84 +391,105 @@ def process_item_to_ndvi_enhanced(item, bbox_4326, dst_transform, dst_crs, width
     else:
         print(f"[TILE] ⚠ SCL no disponible en {tile_id}")
     
-    ndvi = compute_ndvi(red, nir)
-    valid_frac = float(np.isfinite(ndvi).sum()) / float(ndvi.size)
+    valores = evaluar_indices(refl, indices)
+    valid_frac = float(np.isfinite(valores['NDVI']).sum()) / float(valores['NDVI'].size)
     
     print(f"[TILE] Cobertura válida: {valid_frac*100:.1f}%")
     
-    return ndvi, valid_frac, quality_weights
+    return valores, valid_frac, quality_weights
 
 
-def create_mosaic_from_items(items, bbox_4326, dst_transform, dst_crs, width, height):
+def create_mosaic_from_items(items, bbox_4326, dst_transform, dst_crs, width, height, indices=None):
     """
-    Crear mosaico NDVI combinando múltiples tiles
+    Crear mosaico NDVI (y uno por índice de ``indices``) combinando múltiples tiles
     
     Estrategia:
     - Usa weighted average en zonas de solapamiento
     - Prioriza píxeles de mejor calidad
+    - La unión de bandas de todos los índices se lee una sola vez por tile
+    
+    Devuelve {índice: mosaico} o None.
     """
+    indices = indices or NDVI_INDICES
     print(f"\n{'='*70}")
-    print(f"CREANDO MOSAICO DE {len(items)} TILES")
+    print(f"CREANDO MOSAICO DE {len(items)} TILES ({', '.join(indices)})")
     print(f"{'='*70}")
     
-    # Arrays acumuladores
-    ndvi_sum = np.zeros((height, width), dtype=np.float32)
-    weight_sum = np.zeros((height, width), dtype=np.float32)
+    # Arrays acumuladores (uno por índice: cada índice tiene sus propios huecos)
+    sumas = {n: np.zeros((height, width), dtype=np.float32) for n in indices}
+    pesos = {n: np.zeros((height, width), dtype=np.float32) for n in indices}
     
     tiles_procesados = 0
     
-    for idx, item in enumerate(items, 1):
+    def leer(item, band_key):
+        return read_band_window_cog(item, band_key, bbox_4326, dst_transform, dst_crs, width, height)
+    
+    # Bandas de varios tiles a la vez (S2_READ_THREADS), entregados en orden
+    lecturas = LECTOR_S2.bandas_items(items, bandas_necesarias(indices), leer)
+    
+    for idx, (item, bandas) in enumerate(lecturas, 1):
         print(f"\n[MOSAIC] Tile {idx}/{len(items)}")
         
-        ndvi, valid_frac, quality_weights = process_item_to_ndvi_enhanced(
-            item, bbox_4326, dst_transform, dst_crs, width, height
+        valores, valid_frac, quality_weights = process_item_to_indices_enhanced(
+            item, bbox_4326, dst_transform, dst_crs, width, height, bandas=bandas, indices=indices
         )
         
-        if ndvi is None or valid_frac < MIN_VALID_COVERAGE:
+        if valores is None or valid_frac < MIN_VALID_COVERAGE:
             print(f"[MOSAIC] ✗ Tile rechazado (cobertura {valid_frac*100:.1f}% < {MIN_VALID_COVERAGE*100:.0f}%)")
             continue
         
-        # Máscara de píxeles válidos
-        valid_mask = np.isfinite(ndvi)
-        
-        if not np.any(valid_mask):
+        if not np.any(np.isfinite(valores['NDVI'])):
             print(f"[MOSAIC] ✗ Tile sin píxeles válidos")
             continue
         
-        # Pesos para este tile
-        if quality_weights is not None and USE_WEIGHTED_COMPOSITE:
-            tile_weights = quality_weights.copy()
-        else:
-            tile_weights = np.ones_like(ndvi, dtype=np.float32)
-        
-        # Solo donde hay datos válidos
-        tile_weights[~valid_mask] = 0
-        
-        # Acumular
-        ndvi_safe = np.nan_to_num(ndvi, nan=0.0)
-        ndvi_sum += ndvi_safe * tile_weights
-        weight_sum += tile_weights
+        for nombre in indices:
+            arr = valores[nombre]
+            if arr is None:
+                continue  # Falta alguna banda del índice en este tile
+            
+            # Máscara de píxeles válidos
+            valid_mask = np.isfinite(arr)
+            
+            # Pesos para este tile
+            if quality_weights is not None and USE_WEIGHTED_COMPOSITE:
+                tile_weights = quality_weights.copy()
+            else:
+                tile_weights = np.ones_like(arr, dtype=np.float32)
+            
+            # Solo donde hay datos válidos
+            tile_weights[~valid_mask] = 0
+            
+            # Acumular
+            sumas[nombre] += np.nan_to_num(arr, nan=0.0) * tile_weights
+            pesos[nombre] += tile_weights
         
         tiles_procesados += 1
         print(f"[MOSAIC] ✓ Tile añadido al mosaico")
     
+    metricas.imprimir("[MOSAIC]")
+    
     if tiles_procesados == 0:
         print(f"\n[MOSAIC] ✗ No se pudo procesar ningún tile")
         return None
     
     # Calcular mosaico final
-    composite = np.where(weight_sum > 0, ndvi_sum / weight_sum, np.nan)
-    
-    valid_composite = composite[np.isfinite(composite)]
-    valid_frac = len(valid_composite) / composite.size
+    mosaicos = {
+        n: np.where(pesos[n] > 0, sumas[n] / pesos[n], np.nan)
+        for n in indices
+    }
     
     print(f"\n[MOSAIC] {'='*60}")
     print(f"[MOSAIC] ✓ Mosaico completado")
     print(f"[MOSAIC] Tiles procesados: {tiles_procesados}/{len(items)}")
-    print(f"[MOSAIC] Cobertura final: {valid_frac*100:.1f}%")
-    print(f"[MOSAIC] NDVI - min: {valid_composite.min():.3f}, max: {valid_composite.max():.3f}, mean: {valid_composite.mean():.3f}")
+    for nombre, composite in mosaicos.items():
+        valid_composite = composite[np.isfinite(composite)]
+        valid_frac = len(valid_composite) / composite.size
+        if nombre == 'NDVI':
+            print(f"[MOSAIC] Cobertura final: {valid_frac*100:.1f}%")
+        if valid_composite.size:
+            print(f"[MOSAIC] {nombre} - min: {valid_composite.min():.3f}, max: {valid_composite.max():.3f}, mean: {valid_composite.mean():.3f}")
     
-    return composite
+    return mosaicos
 
 
 # ============================================================================
@@ -613,41 +507,6 @@ def fetch_recintos_geojson():
     return [(int(r.id_recinto), r.geojson, int(r.srid) if r.srid else 4326) for r in rows]
 
 
-def zonal_stats_for_geom_fast(dataset, geom):
-    """Calcular estadísticas zonales para una geometría"""
-    minx, miny, maxx, maxy = geom.bounds
-    win = window_from_bounds(minx, miny, maxx, maxy, transform=dataset.transform)
-    win = win.round_offsets().round_lengths()
-    
-    if win.width <= 0 or win.height <= 0:
-        return None
-
-    arr = dataset.read(1, window=win).astype(np.float32)
-    if not np.any(np.isfinite(arr)):
-        return None
-
-    win_transform = dataset.window_transform(win)
-    m = geometry_mask(
-        [mapping(geom)],
-        transform=win_transform,
-        out_shape=arr.shape,
-        invert=True
-    )
-
-    vals = arr[m]
-    vals = vals[np.isfinite(vals)]
-    
-    if vals.size == 0:
-        return None
-
-    return {
-        "mean": float(vals.mean()),
-        "min": float(vals.min()),
-        "max": float(vals.max()),
-        "std": float(vals.std()),
-    }
-
-
 # ============================================================================
 # FUNCIÓN PRINCIPAL
 # ============================================================================
@@ -655,7 +514,8 @@ def zonal_stats_for_geom_fast(dataset, geom):
 def main():
     app = create_app()
     
-    with app.app_context():
+    # Opciones HTTP/caché de GDAL para los COG (los hilos del lector entran en su propio Env)
+    with app.app_context(), entorno_gdal():
         print(f"\n{'='*70}")
         print("CONFIGURACIÓN")
         print(f"{'='*70}")
@@ -703,14 +563,15 @@ def main():
         print(f"[GRID] Resolución: {NDVI_RES_M}m/píxel")
         print(f"[GRID] CRS: {dst_crs}")
         
-        # Crear mosaico
-        composite = create_mosaic_from_items(
+        # Crear mosaico (uno por índice, misma lectura de bandas)
+        mosaicos = create_mosaic_from_items(
             items, bbox, dst_transform, dst_crs, width, height
         )
         
-        if composite is None:
+        if mosaicos is None:
             print(f"\n[ERROR] No se pudo crear el mosaico")
             return 1
+        composite = mosaicos["NDVI"]
         
         # Estadísticas finales
         valid_ndvi = composite[np.isfinite(composite)]
@@ -737,35 +598,65 @@ def main():
         tif_path_3857 = ndvi_dir / f"ndvi_pc_{fecha_str}_mosaic_3857.tif"
         png_path = ndvi_dir / f"ndvi_pc_{fecha_str}_mosaic.png"
         meta_path = ndvi_dir / f"ndvi_pc_{fecha_str}_mosaic.json"
+        # Resto de índices: {índice}_pc_YYYYMMDD_mosaic_utm.tif / _3857.tif
+        tifs_indices = {
+            n: (ndvi_dir / f"{n.lower()}_pc_{fecha_str}_mosaic_utm.tif",
+                ndvi_dir / f"{n.lower()}_pc_{fecha_str}_mosaic_3857.tif")
+            for n in NDVI_INDICES[1:]
+        }
         
         print(f"\n{'='*70}")
         print("GUARDANDO ARCHIVOS")
         print(f"{'='*70}")
         
-        # GeoTIFF UTM
-        profile = {
+        # GeoTIFF UTM (NDVI_FORMATO: float32 o int16 ×10000, ver ndvi_pipeline/formato_ndvi.py)
+        profile = perfil_ndvi({
             "driver": "GTiff",
             "height": composite.shape[0],
             "width": composite.shape[1],
             "count": 1,
-            "dtype": "float32",
             "crs": dst_crs,
             "transform": dst_transform,
-            "nodata": np.nan,
             "compress": "deflate",
-        }
+        })
         
         with rasterio.open(str(tif_path), "w", **profile) as dst:
-            dst.write(composite.astype(np.float32), 1)
-        print(f"[OUTPUT] ✓ GeoTIFF UTM -> {tif_path.name}")
+            marcar_escala(dst)
+            dst.write(codificar(composite, profile["dtype"]), 1)
+        print(f"[OUTPUT] ✓ GeoTIFF UTM ({NDVI_FORMATO}) -> {tif_path.name}")
         
         # Reproyectar a EPSG:3857
         warp_tif_to_3857(str(tif_path), str(tif_path_3857))
         print(f"[OUTPUT] ✓ GeoTIFF 3857 -> {tif_path_3857.name}")
         
+        # Corte temporal en el cubo NDVI (series por píxel / recinto)
+        if NDVI_CUBE:
+            try:
+                slot = CuboNDVI().anadir(fecha_str, composite.astype(np.float32), dst_crs, dst_transform)
+                print(f"[CUBO] ✓ {fecha_str} -> slot {slot}")
+            except Exception as e:
+                print(f"[CUBO] ⚠️ No se pudo añadir al cubo NDVI: {e}")
+        
+        stats_indices = {}
+        for nombre, (utm, web) in tifs_indices.items():
+            arr = mosaicos[nombre].astype(np.float32)
+            with rasterio.open(str(utm), "w", **profile) as dst:
+                marcar_escala(dst)
+                dst.write(codificar(arr, profile["dtype"]), 1)
+                dst.update_tags(INDICE=nombre)
+            warp_tif_to_3857(str(utm), str(web))
+            valid_idx = arr[np.isfinite(arr)]
+            stats_indices[nombre] = {
+                "min": float(valid_idx.min()),
+                "max": float(valid_idx.max()),
+                "mean": float(valid_idx.mean()),
+                "median": float(np.median(valid_idx)),
+                "std": float(valid_idx.std()),
+            } if valid_idx.size else None
+            print(f"[OUTPUT] ✓ {nombre} -> {utm.name} | {web.name}")
+        
         # PNG
-        rgba = ndvi_to_rgba(composite)
-        Image.fromarray(rgba, mode="RGBA").save(str(png_path), format="PNG", optimize=True)
+        guardar_png_ndvi(composite, str(png_path))
         print(f"[OUTPUT] ✓ PNG -> {png_path.name}")
         
         # Metadata JSON
@@ -787,7 +678,8 @@ def main():
                 "cloud_buffer_pixels": CLOUD_BUFFER_PIXELS,
                 "composite_method": "weighted_mosaic",
                 "quality_weighting": USE_WEIGHTED_COMPOSITE,
-                "cog_optimized": True
+                "cog_optimized": True,
+                "storage_format": NDVI_FORMATO
             },
             "bbox_4326": [minx2, miny2, maxx2, maxy2],
             "bounds_leaflet": [[miny2, minx2], [maxy2, maxx2]],
@@ -802,11 +694,17 @@ def main():
                 "median": float(np.median(valid_ndvi)),
                 "std": float(valid_ndvi.std()),
             },
+            "indices": list(NDVI_INDICES),
+            "statistics_by_index": stats_indices,
             "files": {
                 "utm_tif": tif_path.name,
                 "epsg3857_tif": tif_path_3857.name,
                 "png": png_path.name,
-                "metadata": meta_path.name
+                "metadata": meta_path.name,
+                "indices": {
+                    n: {"utm_tif": utm.name, "epsg3857_tif": web.name}
+                    for n, (utm, web) in tifs_indices.items()
+                },
             }
         }
         
@@ -851,8 +749,9 @@ def main():
                    epsg, resolucion_m, valor_medio, valor_min, valor_max, 
                    desviacion_std, ruta_raster, ruta_ndvi)
                 VALUES
-                  (:id_imagen, :id_recinto, :tipo, :fecha_calc, :fecha_ndvi, 
-                   :epsg, :res, :mean, :min, :max, :std, :ruta_raster, :ruta_ndvi)
+                  (:id_imagen, :id_recinto, :tipo_indice, :fecha_calculo, :fecha_ndvi, 
+                   :epsg, :resolucion_m, :valor_medio, :valor_min, :valor_max, 
+                   :desviacion_std, :ruta_raster, :ruta_ndvi)
                 ON CONFLICT (id_imagen, id_recinto, tipo_indice)
                 DO UPDATE SET
                   fecha_calculo  = EXCLUDED.fecha_calculo,
@@ -873,61 +772,76 @@ def main():
             rows_to_insert = []
             inserted = 0
             
-            with rasterio.open(str(tif_path)) as ds:
-                ds_crs = ds.crs
-                ds_bounds = ds.bounds
-                
-                for id_recinto, gj, srid in recintos:
-                    try:
-                        geom_rec = shape(json.loads(gj))
-                        geom_proj_gj = transform_geom(
-                            f"EPSG:{srid}", ds_crs, 
-                            mapping(geom_rec), precision=6
-                        )
-                        geom_proj = shape(geom_proj_gj)
-                        
-                        if not geom_proj.intersects(box(*ds_bounds)):
-                            continue
-                        
-                        stats = zonal_stats_for_geom_fast(ds, geom_proj)
-                        
-                        if not stats or not np.isfinite(stats["mean"]):
-                            continue
-                        
-                        # *** RUTA CORREGIDA: Carpeta por fecha ***
-                        rows_to_insert.append({
-                            "id_imagen": int(id_imagen),
-                            "id_recinto": int(id_recinto),
-                            "tipo": "NDVI",
-                            "fecha_calc": datetime.now(timezone.utc),
-                            "fecha_ndvi": ndvi_date,
-                            "epsg": int(dst_crs.split(':')[1]),
-                            "res": float(NDVI_RES_M),
-                            "mean": stats["mean"],
-                            "min": stats["min"],
-                            "max": stats["max"],
-                            "std": stats["std"],
-                            "ruta_raster": ruta_rel,
-                            "ruta_ndvi": f"static/thumbnails/{fecha_str}/{id_recinto}.png",
-                        })
-                        inserted += 1
-                        
-                        if len(rows_to_insert) >= DB_BATCH_SIZE:
-                            db.session.execute(sql_idx, rows_to_insert)
-                            rows_to_insert.clear()
+            # Geometrías en la rejilla del mosaico (las que no la tocan se descartan)
+            oeste, sur, este, norte = array_bounds(height, width, dst_transform)
+            grid_box = box(oeste, sur, este, norte)
+            ids_zonal, geoms_zonal = [], []
+            for id_recinto, gj, srid in recintos:
+                try:
+                    geom_rec = shape(json.loads(gj))
+                    geom_proj_gj = transform_geom(
+                        f"EPSG:{srid}", dst_crs, 
+                        mapping(geom_rec), precision=6
+                    )
+                    geom_proj = shape(geom_proj_gj)
                     
-                    except Exception as e:
-                        if DEBUG_MODE:
-                            print(f"[BBDD] Error en recinto {id_recinto}: {e}")
+                    if geom_proj.intersects(grid_box):
+                        ids_zonal.append(id_recinto)
+                        geoms_zonal.append(geom_proj)
+                
+                except Exception as e:
+                    if DEBUG_MODE:
+                        print(f"[BBDD] Error en recinto {id_recinto}: {e}")
+                    continue
+            
+            # Estadísticas de todos los recintos de una pasada (ráster de etiquetas en caché,
+            # el mismo para todos los índices)
+            etiquetas = EtiquetasRecintos.construir(
+                geoms_zonal, ids_zonal, dst_transform, dst_crs, composite.shape
+            )
+            rutas_indices = {"NDVI": ruta_rel}
+            for nombre, (utm, _) in tifs_indices.items():
+                rutas_indices[nombre] = str(Path("data") / "processed" / "ndvi_composite" / utm.name)
+            
+            fecha_calc = datetime.now(timezone.utc)
+            for nombre in NDVI_INDICES:
+                zonal = etiquetas.estadisticas(mosaicos[nombre].astype(np.float32))
+                for i, id_recinto in enumerate(ids_zonal):
+                    if zonal["count"][i] == 0 or not np.isfinite(zonal["mean"][i]):
                         continue
+                    
+                    # *** RUTA CORREGIDA: Carpeta por fecha ***
+                    rows_to_insert.append({
+                        "id_imagen": int(id_imagen),
+                        "id_recinto": int(id_recinto),
+                        "tipo_indice": nombre,
+                        "fecha_calculo": fecha_calc,
+                        "fecha_ndvi": ndvi_date,
+                        "epsg": int(dst_crs.split(':')[1]),
+                        "resolucion_m": float(NDVI_RES_M),
+                        "valor_medio": float(zonal["mean"][i]),
+                        "valor_min": float(zonal["min"][i]),
+                        "valor_max": float(zonal["max"][i]),
+                        "desviacion_std": float(zonal["std"][i]),
+                        "ruta_raster": rutas_indices[nombre],
+                        "ruta_ndvi": ruta_thumbnail(fecha_str, id_recinto),
+                    })
+                    if nombre == "NDVI":
+                        inserted += 1
             
-            if rows_to_insert:
-                db.session.execute(sql_idx, rows_to_insert)
+            if NDVI_DB_COPY:
+                # COPY binario a tabla temporal + un único merge, en la misma transacción
+                cargar_indices_raster(db.session.connection().connection, rows_to_insert)
+            else:
+                for inicio in range(0, len(rows_to_insert), DB_BATCH_SIZE):
+                    db.session.execute(sql_idx, rows_to_insert[inicio:inicio + DB_BATCH_SIZE])
             
             db.session.commit()
             
             print(f"[BBDD] ✓ Recintos actualizados: {inserted}")
-            print(f"[BBDD] ✓ Formato ruta thumbnails: static/thumbnails/{fecha_str}/{{id}}.png")
+            if len(NDVI_INDICES) > 1:
+                print(f"[BBDD] ✓ Filas por índice ({', '.join(NDVI_INDICES)}): {len(rows_to_insert)} en total")
+            print(f"[BBDD] ✓ Formato ruta thumbnails: {ruta_thumbnail(fecha_str, '{id}')}")
         
         except Exception as e:
             db.session.rollback()
@@ -941,7 +855,7 @@ def main():
         print(f"\n✓ Mosaico creado con {len(items)} tiles")
         print(f"✓ Cobertura completa del ROI")
         print(f"✓ Recintos actualizados: {inserted}")
-        print(f"✓ Thumbnails: static/thumbnails/{fecha_str}/")
+        print(f"✓ Thumbnails: {ruta_thumbnail(fecha_str, '{id}')} (generate_thumbnails.py --fechas {fecha_str})")
         
         return 0
 
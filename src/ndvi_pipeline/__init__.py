@@ -0,0 +1,9 @@
+"""
+Piezas reutilizables de los scripts de NDVI (ndvi_composite.py, ndvi_diax.py...).
+No dependen de Flask: la webapp no importa nada de aquí (la decodificación
+compartida está en ``src/decodificacion_ndvi.py``).
+"""
+
+from .gap_fill import rellenar_gaps
+
+__all__ = ["rellenar_gaps"]
@@ -0,0 +1,156 @@
+"""
+cache_ventanas.py
+-----------------
+Caché local de ventanas COG ya descargadas (datos crudos de la banda, antes
+de reproyectar), para que las ejecuciones diarias con ``LOOKBACK_DAYS``
+amplio solo descarguen las escenas nuevas.
+
+- Clave: hash de (id del item STAC, banda, ventana pedida). La ventana se
+  describe con lo que se conoce sin abrir el COG (bbox EPSG:4326 de la ROI o
+  rejilla destino del bloque), así que un acierto no hace ninguna petición HTTP.
+- Valor: ``.npz`` comprimido con el array, la transformada de la ventana, el
+  CRS y el nodata del origen. "El item no cubre la ventana" también se guarda.
+- Expulsión LRU por tamaño total (``S2_CACHE_MAX_GB``): la fecha de
+  modificación hace de último acceso y se actualiza en cada acierto.
+- Escrituras atómicas (tmp + ``os.replace``): varios procesos pueden
+  compartir el directorio.
+
+Los items de Sentinel-2 L2A no cambian una vez publicados (un reprocesado
+genera otro id), así que las entradas no caducan por tiempo.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+from affine import Affine
+
+from project_paths import PROJECT_ROOT
+
+S2_CACHE = os.getenv("S2_CACHE", "1") == "1"
+S2_CACHE_DIR = Path(os.getenv("S2_CACHE_DIR", str(PROJECT_ROOT / "data" / "cache" / "s2_ventanas")))
+S2_CACHE_MAX_GB = float(os.getenv("S2_CACHE_MAX_GB", "20"))
+
+
+@dataclass
+class VentanaCruda:
+    """Ventana leída del COG; ``data`` None = el item no cubre la zona pedida."""
+
+    data: np.ndarray | None
+    transform: Affine | None = None
+    crs: str | None = None
+    nodata: float | None = None
+
+
+class CacheVentanas:
+    def __init__(self, directorio: Path, max_bytes: int):
+        self.directorio = Path(directorio)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._total: int | None = None
+
+    @staticmethod
+    def clave(item_id: str, band_key: str, *ventana) -> str:
+        texto = "|".join([item_id, band_key, *(repr(v) for v in ventana)])
+        return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+    def _ruta(self, clave: str) -> Path:
+        # Dos niveles para no tener cientos de miles de ficheros en un directorio
+        return self.directorio / clave[:2] / f"{clave}.npz"
+
+    def get(self, clave: str) -> VentanaCruda | None:
+        ruta = self._ruta(clave)
+        try:
+            with np.load(ruta, allow_pickle=False) as z:
+                if not bool(z["cubre"]):
+                    ventana = VentanaCruda(None)
+                else:
+                    nodata = float(z["nodata"]) if bool(z["tiene_nodata"]) else None
+                    ventana = VentanaCruda(
+                        z["data"], Affine(*z["transform"].tolist()), str(z["crs"]), nodata,
+                    )
+        except (OSError, KeyError, ValueError):
+            return None
+        try:
+            os.utime(ruta)
+        except OSError:
+            pass
+        return ventana
+
+    def put(self, clave: str, ventana: VentanaCruda) -> None:
+        ruta = self._ruta(clave)
+        tmp = ruta.with_name(f"{ruta.stem}.{os.getpid()}.{threading.get_ident()}.tmp.npz")
+        try:
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            if ventana.data is None:
+                np.savez_compressed(tmp, cubre=False)
+            else:
+                np.savez_compressed(
+                    tmp,
+                    cubre=True,
+                    data=ventana.data,
+                    transform=np.asarray(tuple(ventana.transform)[:6], dtype=np.float64),
+                    crs=np.asarray(ventana.crs),
+                    tiene_nodata=ventana.nodata is not None,
+                    nodata=np.float64(ventana.nodata if ventana.nodata is not None else 0),
+                )
+            os.replace(tmp, ruta)
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar la ventana en caché {ruta.name}: {e}")
+            tmp.unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            if self._total is None:
+                self._total = self._tamano_total()
+            else:
+                self._total += ruta.stat().st_size
+            excedido = self._total > self.max_bytes
+        if excedido:
+            self.expulsar()
+
+    def _ficheros(self) -> list[tuple[float, int, Path]]:
+        salida = []
+        for ruta in self.directorio.glob("*/*.npz"):
+            if ruta.name.endswith(".tmp.npz"):
+                continue
+            try:
+                st = ruta.stat()
+            except OSError:
+                continue
+            salida.append((st.st_mtime, st.st_size, ruta))
+        return salida
+
+    def _tamano_total(self) -> int:
+        return sum(tam for _, tam, _ in self._ficheros())
+
+    def expulsar(self, objetivo: float = 0.9) -> int:
+        """Borra las entradas menos usadas hasta quedar en ``objetivo`` × máximo. Devuelve bytes liberados."""
+        with self._lock:
+            ficheros = sorted(self._ficheros())
+            total = sum(tam for _, tam, _ in ficheros)
+            liberados = 0
+            limite = self.max_bytes * objetivo
+            for _, tam, ruta in ficheros:
+                if total - liberados <= limite:
+                    break
+                try:
+                    ruta.unlink()
+                    liberados += tam
+                except OSError:
+                    pass  # otro proceso ya la ha borrado
+            self._total = total - liberados
+        if liberados:
+            print(f"[CACHE-S2] Expulsadas entradas antiguas: {liberados / 1e9:.2f} GB liberados")
+        return liberados
+
+
+def cache_desde_entorno() -> CacheVentanas | None:
+    if not S2_CACHE:
+        return None
+    return CacheVentanas(S2_CACHE_DIR, int(S2_CACHE_MAX_GB * 1e9))
@@ -0,0 +1,176 @@
+"""
+carga_indices.py
+----------------
+Carga masiva de estadísticas por recinto en ``public.indices_raster``.
+
+Con las estadísticas zonales en una pasada, el cuello de botella pasa a ser
+la escritura: ``INSERT ... ON CONFLICT`` por lotes manda cada fila como
+parámetros SQL y actualiza los índices fila a fila. Aquí:
+
+1. las filas se serializan en el formato binario de ``COPY`` (sin pasar por
+   texto) y se envían en flujo con ``COPY ... FROM STDIN`` a una tabla de
+   carga temporal (``TEMP ... ON COMMIT DROP``: no escribe WAL, es de la
+   sesión y no aparece en ``public``);
+2. una única sentencia ``INSERT ... SELECT ... ON CONFLICT DO UPDATE`` las
+   fusiona en ``indices_raster``. Si una clave (imagen, recinto, tipo) llega
+   repetida gana la última, como con los lotes.
+
+Todo va en la transacción de la conexión que se pasa (la del ``INSERT`` de
+``public.imagenes``), y la tabla de carga se borra al terminar.
+
+Las fechas sin zona horaria (``datetime`` naive) se interpretan como hora
+local del proceso (igual que ``datetime.timestamp()``) y se convierten a UTC
+antes de codificarlas; las que tienen zona se respetan.
+"""
+
+from __future__ import annotations
+
+import io
+import struct
+from collections.abc import Iterator
+import time
+from datetime import datetime, timezone
+
+_EPOCA_PG = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+_INT4 = struct.Struct(">ii")      # longitud + valor
+_INT8 = struct.Struct(">iq")
+_FLOAT8 = struct.Struct(">id")
+_NULL = struct.pack(">i", -1)
+_CABECERA = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_FIN = struct.pack(">h", -1)
+
+
+def _int4(v) -> bytes:
+    return _NULL if v is None else _INT4.pack(4, int(v))
+
+
+def _float8(v) -> bytes:
+    return _NULL if v is None else _FLOAT8.pack(8, float(v))
+
+
+def _texto(v) -> bytes:
+    if v is None:
+        return _NULL
+    b = str(v).encode("utf-8")
+    return struct.pack(">i", len(b)) + b
+
+
+def _timestamptz(v) -> bytes:
+    if v is None:
+        return _NULL
+    if v.tzinfo is None:
+        v = v.astimezone()  # Naive = hora local del proceso
+    d = v - _EPOCA_PG
+    return _INT8.pack(8, (d.days * 86400 + d.seconds) * 1_000_000 + d.microseconds)
+
+
+# (columna, tipo en la tabla de carga, codificador binario)
+COLUMNAS = (
+    ("id_imagen", "integer", _int4),
+    ("id_recinto", "integer", _int4),
+    ("tipo_indice", "text", _texto),
+    ("fecha_calculo", "timestamptz", _timestamptz),
+    ("fecha_ndvi", "timestamptz", _timestamptz),
+    ("epsg", "integer", _int4),
+    ("resolucion_m", "double precision", _float8),
+    ("valor_medio", "double precision", _float8),
+    ("valor_min", "double precision", _float8),
+    ("valor_max", "double precision", _float8),
+    ("desviacion_std", "double precision", _float8),
+    ("ruta_raster", "text", _texto),
+    ("ruta_ndvi", "text", _texto),
+)
+_CAMPOS = struct.pack(">h", len(COLUMNAS) + 1)  # + orden de llegada
+
+
+def filas_copy_binario(filas) -> Iterator[bytes]:
+    """Flujo ``COPY ... (FORMAT binary)``: cabecera, una tupla por fila y fin."""
+    yield _CABECERA
+    codificadores = [(nombre, cod) for nombre, _, cod in COLUMNAS]
+    for orden, fila in enumerate(filas):
+        partes = [_CAMPOS, _INT8.pack(8, orden)]
+        partes.extend(cod(fila.get(nombre)) for nombre, cod in codificadores)
+        yield b"".join(partes)
+    yield _FIN
+
+
+class _FlujoLectura(io.RawIOBase):
+    """Fichero de solo lectura sobre un generador de bytes (lo consume ``copy_expert``)."""
+
+    def __init__(self, trozos, tam_buffer: int = 1 << 20):
+        self._trozos = iter(trozos)
+        self._buffer = bytearray()
+        self._tam = tam_buffer
+        self.bytes = 0
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        objetivo = self._tam if n is None or n < 0 else n
+        while len(self._buffer) < objetivo:
+            try:
+                self._buffer += next(self._trozos)
+            except StopIteration:
+                break
+        datos = bytes(self._buffer[:objetivo])
+        del self._buffer[:objetivo]
+        self.bytes += len(datos)
+        return datos
+
+
+def cargar_indices_raster(conexion, filas, tabla: str = "public.indices_raster") -> dict:
+    """
+    ``conexion``: conexión DBAPI de psycopg2 (p. ej. ``db.session.connection().connection``).
+    ``filas``: iterable de dicts con las claves de ``COLUMNAS``. No hace commit.
+    Devuelve {"filas", "bytes", "segundos_copy", "segundos_merge", "filas_s"}.
+    """
+    carga = "indices_raster_carga"
+    definicion = ", ".join(f"{nombre} {tipo}" for nombre, tipo, _ in COLUMNAS)
+    cols = ", ".join(nombre for nombre, _, _ in COLUMNAS)
+    actualizar = ",\n    ".join(
+        f"{nombre} = EXCLUDED.{nombre}" for nombre, _, _ in COLUMNAS
+        if nombre not in ("id_imagen", "id_recinto", "tipo_indice")
+    )
+
+    t0 = time.perf_counter()
+    with conexion.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS pg_temp.{carga}")
+        cur.execute(f"CREATE TEMP TABLE {carga} (orden bigint, {definicion}) ON COMMIT DROP")
+
+        flujo = _FlujoLectura(filas_copy_binario(filas))
+        cur.copy_expert(f"COPY {carga} (orden, {cols}) FROM STDIN WITH (FORMAT binary)", flujo)
+        n = cur.rowcount
+        t1 = time.perf_counter()
+
+        cur.execute(f"""
+            INSERT INTO {tabla} ({cols})
+            SELECT {cols}
+            FROM (
+                SELECT DISTINCT ON (id_imagen, id_recinto, tipo_indice) *
+                FROM {carga}
+                ORDER BY id_imagen, id_recinto, tipo_indice, orden DESC
+            ) ultimas
+            ON CONFLICT (id_imagen, id_recinto, tipo_indice)
+            DO UPDATE SET
+                {actualizar}
+        """)
+        t2 = time.perf_counter()
+
+        # Si algo falla, el rollback del llamador también deshace el CREATE;
+        # si no, se borra ya para poder cargar otra vez en la misma transacción
+        cur.execute(f"DROP TABLE pg_temp.{carga}")
+
+    total = t2 - t0
+    resumen = {
+        "filas": n,
+        "bytes": flujo.bytes,
+        "segundos_copy": t1 - t0,
+        "segundos_merge": t2 - t1,
+        "filas_s": n / total if total > 0 else 0.0,
+    }
+    print(f"[COPY] ✓ {n:,} filas en {total:.2f}s ({resumen['filas_s']:,.0f} filas/s) | "
+          f"COPY {resumen['segundos_copy']:.2f}s ({flujo.bytes / 1e6:.1f} MB) + "
+          f"merge {resumen['segundos_merge']:.2f}s")
+    return resumen
@@ -0,0 +1,213 @@
+"""
+catalogo_stac.py
+----------------
+Búsqueda de escenas Sentinel-2 L2A para los scripts NDVI con tres modos
+(``STAC_MODE``):
+
+- ``live`` (por defecto): Planetary Computer con ``pystac_client``, hrefs
+  firmados con ``planetary_computer.sign_inplace`` (lo de siempre).
+- ``record``: igual que ``live`` y además guarda cada búsqueda en
+  ``STAC_CACHE_DIR`` (un JSON por combinación de colecciones, bbox y rango de
+  fechas, con los items ya firmados).
+- ``replay``: no abre ninguna conexión. Devuelve la búsqueda grabada con los
+  mismos parámetros o, si no la hay, filtra por colección, bbox y fechas
+  todos los items de ``STAC_CACHE_DIR`` (otras búsquedas grabadas y el
+  catálogo local de ``scripts/benchmark/fixtures_s2.py``).
+
+Las firmas SAS de Planetary Computer caducan (parámetro ``se`` del href).
+En ``replay`` un href caducado se vuelve a firmar si ``STAC_REFIRMAR=1`` y
+hay red; si no, se deja tal cual: las ventanas ya leídas salen de la caché
+de ``cache_ventanas`` (clave = id del item), que no abre el COG.
+"""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import os
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+from project_paths import PROJECT_ROOT
+
+STAC_MODE = os.getenv("STAC_MODE", "live").strip().lower()   # live | record | replay
+STAC_URL = os.getenv("STAC_URL", "https://planetarycomputer.microsoft.com/api/stac/v1")
+STAC_CACHE_DIR = Path(os.getenv("STAC_CACHE_DIR", str(PROJECT_ROOT / "data" / "cache" / "stac")))
+STAC_REFIRMAR = os.getenv("STAC_REFIRMAR", "0") == "1"
+
+MODOS = ("live", "record", "replay")
+COLECCION_S2 = "sentinel-2-l2a"
+# Catálogo que escribe el generador de escenas sintéticas
+CATALOGO_LOCAL = "catalogo_local.json"
+
+
+class BusquedaNoGrabada(LookupError):
+    """``replay`` sin ningún item grabado que cumpla la búsqueda."""
+
+
+# ==================== CLAVE DE BÚSQUEDA ====================
+
+def parametros_busqueda(collections, bbox, datetime_rango: str) -> dict:
+    """
+    Parámetros normalizados de una búsqueda. El ``limit`` de pystac_client es
+    el tamaño de página, no cambia el resultado y no forma parte de la clave.
+    """
+    return {
+        "collections": sorted(collections),
+        "bbox": [round(float(v), 6) for v in bbox],
+        "datetime": datetime_rango,
+    }
+
+
+def clave_busqueda(parametros: dict) -> str:
+    texto = json.dumps(parametros, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()[:20]
+
+
+def _ruta_busqueda(directorio: Path, clave: str) -> Path:
+    return directorio / f"busqueda_{clave}.json"
+
+
+# ==================== FIRMAS ====================
+
+def _expiracion(href: str) -> datetime | None:
+    """Fecha ``se`` del token SAS de un href firmado (None si no lo lleva)."""
+    se = parse_qs(urlsplit(href).query).get("se")
+    if not se:
+        return None
+    try:
+        return datetime.fromisoformat(se[0].replace("Z", "+00:00"))
+    except ValueError:
+        return None
+
+
+def firmas_caducadas(items, margen_min: int = 5) -> int:
+    """Nº de assets con el token SAS caducado (o a menos de ``margen_min``)."""
+    limite = datetime.now(timezone.utc) + timedelta(minutes=margen_min)
+    n = 0
+    for item in items:
+        for asset in item.assets.values():
+            exp = _expiracion(asset.href)
+            if exp is not None and exp <= limite:
+                n += 1
+    return n
+
+
+def _refirmar(items) -> None:
+    import planetary_computer as pc
+
+    for item in items:
+        for asset in item.assets.values():
+            if _expiracion(asset.href) is not None:
+                partes = urlsplit(asset.href)
+                asset.href = urlunsplit((partes.scheme, partes.netloc, partes.path, "", ""))
+        pc.sign_inplace(item)
+
+
+# ==================== GRABACIÓN ====================
+
+def guardar_busqueda(directorio: Path, parametros: dict, items) -> Path:
+    """FeatureCollection con los items (hrefs firmados) y los parámetros; escritura atómica."""
+    directorio.mkdir(parents=True, exist_ok=True)
+    ruta = _ruta_busqueda(directorio, clave_busqueda(parametros))
+    coleccion = {
+        "type": "FeatureCollection",
+        "parametros": parametros,
+        "grabado": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "features": [item.to_dict() for item in items],
+    }
+    tmp = ruta.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(coleccion), encoding="utf-8")
+    os.replace(tmp, ruta)
+    return ruta
+
+
+def _leer_features(ruta: Path) -> list[dict]:
+    with open(ruta, encoding="utf-8") as f:
+        return json.load(f).get("features", [])
+
+
+# ==================== REPLAY ====================
+
+def _intervalo(datetime_rango: str) -> tuple[date, date]:
+    """'YYYY-MM-DD/YYYY-MM-DD' (o una sola fecha) -> días inicial y final incluidos."""
+    a, _, b = datetime_rango.partition("/")
+    inicio = date.fromisoformat(a[:10]) if a and a != ".." else date.min
+    fin = date.fromisoformat(b[:10]) if b and b != ".." else (date.max if b else inicio)
+    return inicio, fin
+
+
+def _cumple(feature: dict, collections, bbox, inicio: date, fin: date) -> bool:
+    if feature.get("collection") and feature["collection"] not in collections:
+        return False
+    fb = feature.get("bbox")
+    if fb and (fb[0] > bbox[2] or fb[2] < bbox[0] or fb[1] > bbox[3] or fb[3] < bbox[1]):
+        return False
+    dia = date.fromisoformat(feature["properties"]["datetime"][:10])
+    return inicio <= dia <= fin
+
+
+def features_grabados(collections, bbox, datetime_rango: str, directorio: Path) -> list[dict]:
+    """Items grabados que cumplen la búsqueda, sin duplicados y del más reciente al más antiguo."""
+    parametros = parametros_busqueda(collections, bbox, datetime_rango)
+    exacta = _ruta_busqueda(directorio, clave_busqueda(parametros))
+    if exacta.is_file():
+        return _leer_features(exacta)
+
+    inicio, fin = _intervalo(datetime_rango)
+    por_id = {}
+    for ruta in sorted(glob.glob(str(directorio / "*.json"))):
+        for feature in _leer_features(Path(ruta)):
+            if feature["id"] not in por_id and _cumple(feature, parametros["collections"], bbox, inicio, fin):
+                por_id[feature["id"]] = feature
+    return sorted(por_id.values(), key=lambda f: f["properties"]["datetime"], reverse=True)
+
+
+# ==================== BÚSQUEDA ====================
+
+def buscar_items(bbox, datetime_rango: str, collections=(COLECCION_S2,), limit: int = 100,
+                 modo: str | None = None, directorio: Path | str | None = None) -> list:
+    """
+    Items STAC (``pystac.Item``) de ``collections`` que intersectan ``bbox``
+    (EPSG:4326) en ``datetime_rango`` ('YYYY-MM-DD/YYYY-MM-DD'), según el modo.
+    """
+    modo = (modo or STAC_MODE).lower()
+    if modo not in MODOS:
+        raise ValueError(f"STAC_MODE desconocido: {modo!r} (usa {', '.join(MODOS)})")
+    directorio = Path(directorio) if directorio else STAC_CACHE_DIR
+    collections = list(collections)
+
+    if modo == "replay":
+        from pystac import Item
+
+        features = features_grabados(collections, bbox, datetime_rango, directorio)
+        if not features:
+            raise BusquedaNoGrabada(
+                f"Sin items grabados en {directorio} para {datetime_rango} y bbox {list(bbox)} "
+                f"(graba con STAC_MODE=record o genera escenas con scripts/benchmark/fixtures_s2.py)"
+            )
+        items = [Item.from_dict(f) for f in features]
+        caducadas = firmas_caducadas(items)
+        print(f"[STAC] Replay: {len(items)} items de {directorio}")
+        if caducadas:
+            if STAC_REFIRMAR:
+                _refirmar(items)
+                print(f"[STAC] ✓ {caducadas} hrefs con firma caducada vueltos a firmar")
+            else:
+                print(f"[STAC] ⚠ {caducadas} hrefs con firma caducada: solo se leerán las ventanas en caché "
+                      f"(STAC_REFIRMAR=1 para firmarlos de nuevo)")
+        return items
+
+    import planetary_computer as pc
+    from pystac_client import Client
+
+    catalog = Client.open(STAC_URL, modifier=pc.sign_inplace)
+    search = catalog.search(collections=collections, bbox=bbox, datetime=datetime_rango, limit=limit)
+    items = list(search.items())
+
+    if modo == "record":
+        ruta = guardar_busqueda(directorio, parametros_busqueda(collections, bbox, datetime_rango), items)
+        print(f"[STAC] ✓ Búsqueda grabada: {ruta.name} ({len(items)} items)")
+    return items
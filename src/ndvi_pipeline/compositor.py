@@ -0,0 +1,660 @@
+"""
+compositor.py
+-------------
+Composite NDVI multi-fecha / multi-tile por bloques, con memoria acotada.
+
+``build_multi_tile_composite`` mantiene arrays del tamaño de la ROI por fecha
+(NDVI del día, calidad, mejor NDVI, score...) y por eso ``NDVI_MAX_DIM``
+rebaja la resolución. Aquí la rejilla destino se recorre en bloques de
+``tam_bloque``² px: para cada bloque se leen solo las ventanas de cada item
+que lo cubren, se aplica la misma regla de composición (merge de tiles del
+día por calidad, luego mejor score con peso temporal) y el resultado se
+escribe directamente en un GeoTIFF en teselas. La memoria pico depende del
+tamaño de bloque, no de la ROI, así que se puede trabajar a 10 m sin reducir.
+
+- Cada bloque se lee con un halo de ``halo`` px (el buffer de nubes dilata la
+  máscara SCL); el halo se descarta al escribir, de modo que la máscara en el
+  borde del bloque es la misma que en la imagen completa.
+- El relleno de huecos se hace en una segunda pasada, bloque a bloque con un
+  halo de ``max_gap_size + 6`` px: cualquier hueco de hasta ``max_gap_size``
+  px que toque el bloque cabe entero en la ventana, y uno mayor recortado por
+  el borde sigue midiendo más del límite, así que no se rellena.
+- Las estadísticas (min, max, media, desviación) son exactas; la mediana se
+  obtiene de un histograma de 4000 clases en [-1, 1] (resolución 0,0005).
+- Con un ``EstadoComposite`` el composite es incremental: se guardan mejor
+  NDVI, calidad y fecha por píxel y cada ejecución solo pliega las escenas
+  nuevas y retira las que salen de la ventana.
+- Los GeoTIFF de salida van en ``formato`` (``formato_ndvi.py``: float32 o
+  int16 escalado); el estado incremental sigue en float32.
+- Varios índices (``indices``, ver ``indices.py``) salen de la misma lectura:
+  se lee una vez la unión de sus bandas por ventana y se evalúan todos a la
+  vez. El primero decide qué observación gana en cada píxel y el resto toma
+  el valor de esa misma observación; se escribe un GeoTIFF por índice.
+- ``modo`` = ``mediana`` / ``pNN``: percentil de las observaciones válidas en
+  vez del mejor píxel. Es más robusto frente a nubes y sombras no detectadas,
+  pero no se puede plegar fecha a fecha: cada bloque apila sus fechas en un
+  memmap en disco y la memoria sigue acotada por el bloque.
+- Con ``hilos_fechas`` > 1 las fechas de cada bloque se leen y mezclan en
+  paralelo (un hilo por fecha; numpy y GDAL sueltan el GIL) y se pliegan o
+  apilan en orden de fecha: mismo resultado que en secuencial, en los tres
+  modos y con varios índices. En vuelo hay como mucho ``hilos_fechas`` + 1
+  días del tamaño del bloque ampliado.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import tempfile
+import warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import date
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+from rasterio.windows import transform as window_transform
+
+from .estado_composite import EstadoComposite, dia_desde_fecha, fecha_desde_dia
+from .formato_ndvi import NDVI_FORMATO, codificar, leer_ndvi, marcar_escala, perfil_ndvi
+from .gap_fill import rellenar_gaps
+from .indices import INDICES, bandas_necesarias
+from .lector_s2 import READ_THREADS, LectorConcurrente, PoolDatasets, entorno_gdal, leer_banda_item_rejilla, metricas
+
+BINS_MEDIANA = 4000
+# Peso temporal de una escena con la antigüedad de la ventana (el de la más reciente es 1)
+PESO_MIN_VENTANA = 0.7
+
+# Modos: "mejor_pixel" (por defecto), "mediana" o "pNN" (percentil NN de las observaciones válidas)
+MODO_MEJOR_PIXEL = "mejor_pixel"
+# Pila de fechas por bloque (memmap) de los modos mediana/percentil: directorio (None = temporal del sistema)
+# y filas por franja al calcular el percentil (memoria = nº fechas × filas × tam_bloque × 4 B)
+NDVI_PILA_DIR = os.getenv("NDVI_PILA_DIR") or None
+NDVI_PILA_FILAS = int(os.getenv("NDVI_PILA_FILAS", "64"))
+
+# {banda: array | None} en la rejilla -> ({índice: valores}, calidad)
+IndicesYCalidad = Callable[[dict], tuple[dict, np.ndarray]]
+
+
+def ventanas_bloques(width: int, height: int, tam: int):
+    for fila in range(0, height, tam):
+        for col in range(0, width, tam):
+            yield Window(col, fila, min(tam, width - col), min(tam, height - fila))
+
+
+def ampliar_ventana(win: Window, halo: int, width: int, height: int) -> Window:
+    c0 = max(int(win.col_off) - halo, 0)
+    r0 = max(int(win.row_off) - halo, 0)
+    c1 = min(int(win.col_off + win.width) + halo, width)
+    r1 = min(int(win.row_off + win.height) + halo, height)
+    return Window(c0, r0, c1 - c0, r1 - r0)
+
+
+def _recorte(win: Window, ext: Window) -> tuple[slice, slice]:
+    """Slices del bloque ``win`` dentro del array leído con la ventana ampliada ``ext``."""
+    r = int(win.row_off - ext.row_off)
+    c = int(win.col_off - ext.col_off)
+    return slice(r, r + int(win.height)), slice(c, c + int(win.width))
+
+
+def perfil_salida(dst_transform, dst_crs, width: int, height: int) -> dict:
+    return {
+        "driver": "GTiff",
+        "height": height,
+        "width": width,
+        "count": 1,
+        "dtype": "float32",
+        "crs": dst_crs,
+        "transform": dst_transform,
+        "nodata": np.nan,
+        "compress": "deflate",
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "BIGTIFF": "IF_SAFER",
+    }
+
+
+class _Estadisticas:
+    """Acumula min/max/media/desviación exactas y un histograma para la mediana."""
+
+    def __init__(self, rango: tuple[float, float] = (-1.0, 1.0)):
+        self.rango = rango
+        self.n = 0
+        self.suma = 0.0
+        self.suma2 = 0.0
+        self.minimo = np.inf
+        self.maximo = -np.inf
+        self.hist = np.zeros(BINS_MEDIANA, dtype=np.int64)
+
+    def add(self, valores: np.ndarray):
+        if valores.size == 0:
+            return
+        v = valores.astype(np.float64)
+        self.n += v.size
+        self.suma += float(v.sum())
+        self.suma2 += float(np.square(v).sum())
+        self.minimo = min(self.minimo, float(v.min()))
+        self.maximo = max(self.maximo, float(v.max()))
+        self.hist += np.histogram(np.clip(v, *self.rango), bins=BINS_MEDIANA, range=self.rango)[0]
+
+    def resultado(self) -> dict | None:
+        if self.n == 0:
+            return None
+        media = self.suma / self.n
+        acumulado = np.cumsum(self.hist)
+        i = int(np.searchsorted(acumulado, self.n / 2))
+        ancho = (self.rango[1] - self.rango[0]) / BINS_MEDIANA
+        return {
+            "min": self.minimo,
+            "max": self.maximo,
+            "mean": media,
+            "median": self.rango[0] + (i + 0.5) * ancho,
+            "std": float(np.sqrt(max(self.suma2 / self.n - media * media, 0.0))),
+        }
+
+
+def percentil_modo(modo: str) -> float | None:
+    """None para ``mejor_pixel``, 50 para ``mediana`` y NN para ``pNN``."""
+    modo = modo.strip().lower()
+    if modo == MODO_MEJOR_PIXEL:
+        return None
+    if modo == "mediana":
+        return 50.0
+    m = re.fullmatch(r"p(\d{1,2}(?:\.\d+)?|100)", modo)
+    if m is None:
+        raise ValueError(f"Modo de composite desconocido: {modo!r} (mejor_pixel, mediana o pNN)")
+    return float(m.group(1))
+
+
+def pendiente_temporal(dias_ventana: int) -> float:
+    return -np.log(PESO_MIN_VENTANA) / max(dias_ventana, 1)
+
+
+def clave_pixel(calidad, dia, k: float) -> np.ndarray:
+    """
+    log(calidad × peso temporal) salvo una constante que solo depende del día
+    de ejecución: comparar claves = comparar scores, hoy o dentro de un mes.
+    """
+    with np.errstate(divide="ignore"):
+        return np.log(np.asarray(calidad, dtype=np.float64)) + np.asarray(dia, dtype=np.float64) * k
+
+
+def _componer_bloque(lector, leer, fechas, items_by_date, indices_y_calidad, indices, t_ext, dst_crs, w, h,
+                     recorte, k, inicial, hilos_fechas: int = 1):
+    """
+    Pliega las fechas ``fechas`` (cualquier orden) sobre ``inicial`` =
+    ({índice: valores}, calidad, fecha) del núcleo del bloque, o sobre un
+    bloque vacío si es None. Empates de score: gana la fecha más reciente,
+    como al recorrer de nueva a vieja. ``indices[0]`` decide la validez.
+    """
+    principal = indices[0]
+    alto = recorte[0].stop - recorte[0].start
+    ancho = recorte[1].stop - recorte[1].start
+    if inicial is None:
+        best = {n: np.full((alto, ancho), np.nan, dtype=np.float32) for n in indices}
+        best_cal = np.zeros((alto, ancho), dtype=np.float32)
+        best_dia = np.zeros((alto, ancho), dtype=np.uint16)
+    else:
+        best = {n: a.copy() for n, a in inicial[0].items()}
+        best_cal, best_dia = inicial[1].copy(), inicial[2].copy()
+    best_clave = np.where(best_dia > 0, clave_pixel(best_cal, best_dia, k), -np.inf)
+
+    def cerrar_dia(fecha, day_vals, day_quality):
+        calidad = day_quality[recorte]
+        valid = np.isfinite(day_vals[principal][recorte]) & (calidad > 0)
+        if not np.any(valid):
+            return
+        dia = dia_desde_fecha(fecha)
+        clave = clave_pixel(calidad, dia, k)
+        update = valid & ((clave > best_clave) | ((clave == best_clave) & (dia > best_dia)))
+        for n in indices:
+            best[n][update] = day_vals[n][recorte][update]
+        best_cal[update] = calidad[update]
+        best_dia[update] = dia
+        best_clave[update] = clave[update]
+
+    for fecha, day_vals, day_quality in _dias_bloque(lector, leer, fechas, items_by_date, indices_y_calidad,
+                                                     indices, w, h, hilos_fechas):
+        cerrar_dia(fecha, day_vals, day_quality)
+
+    return best, best_cal, best_dia
+
+
+def _dia_vacio(indices, w, h):
+    return {n: np.full((h, w), np.nan, dtype=np.float32) for n in indices}, np.zeros((h, w), dtype=np.float32)
+
+
+def _mezclar_item(day_vals, day_quality, bandas, indices_y_calidad, indices):
+    """Mezcla un item en el día (``day_vals``, ``day_quality``): gana la tile de más calidad."""
+    principal = indices[0]
+    if any(bandas[b] is None for b in INDICES[principal].bandas):
+        return
+
+    valores, quality = indices_y_calidad(bandas)
+    valid = np.isfinite(valores[principal])
+    if not np.any(valid):
+        return
+
+    update = valid & ((quality > day_quality) | ~np.isfinite(day_vals[principal]))
+    for n in indices:
+        if valores.get(n) is None:
+            day_vals[n][update] = np.nan  # Falta alguna banda del índice en este item
+        else:
+            day_vals[n][update] = valores[n][update]
+    day_quality[update] = quality[update]
+
+
+def _items_fecha(items_by_date, fecha):
+    # Items de una fecha por id: mismo desempate entre tiles en cada ejecución
+    return sorted(items_by_date[fecha], key=lambda it: it.id)
+
+
+def _dia_bloque(lector, leer, items, bandas_leer, indices_y_calidad, indices, w, h):
+    """Un día en la ventana leída: sus ``items`` leídos y mezclados por calidad."""
+    day_vals, day_quality = _dia_vacio(indices, w, h)
+    for _, bandas in lector.bandas_items(items, bandas_leer, leer):
+        _mezclar_item(day_vals, day_quality, bandas, indices_y_calidad, indices)
+    return day_vals, day_quality
+
+
+def _dias_bloque(lector, leer, fechas, items_by_date, indices_y_calidad, indices, w, h, hilos_fechas: int = 1):
+    """
+    (fecha, {índice: valores del día}, calidad del día) en la ventana leída,
+    con las tiles de cada fecha mezcladas por calidad, en el orden de ``fechas``.
+
+    Con ``hilos_fechas`` > 1 cada fecha se lee y mezcla en un hilo, con como
+    mucho ``hilos_fechas`` fechas adelantadas; se entregan igualmente en el
+    orden de ``fechas``.
+    """
+    bandas_leer = bandas_necesarias(indices)
+    if hilos_fechas > 1 and len(fechas) > 1:
+        with ThreadPoolExecutor(max_workers=hilos_fechas, thread_name_prefix="fechas-bloque") as pool:
+            pendientes = iter(fechas)
+            en_vuelo: deque = deque()
+
+            def lanzar():
+                fecha = next(pendientes, None)
+                if fecha is not None:
+                    en_vuelo.append((fecha, pool.submit(
+                        _dia_bloque, lector, leer, _items_fecha(items_by_date, fecha), bandas_leer,
+                        indices_y_calidad, indices, w, h,
+                    )))
+
+            for _ in range(hilos_fechas):
+                lanzar()
+            while en_vuelo:
+                fecha, futuro = en_vuelo.popleft()
+                day_vals, day_quality = futuro.result()
+                lanzar()
+                yield fecha, day_vals, day_quality
+        return
+
+    # Todos los (fecha, item) en orden: el lector adelanta lecturas también entre fechas
+    pares = [(fecha, item) for fecha in fechas for item in _items_fecha(items_by_date, fecha)]
+    fechas_pares = iter([fecha for fecha, _ in pares])
+    dia_actual = None
+    day_vals = day_quality = None
+
+    for _, bandas in lector.bandas_items([item for _, item in pares], bandas_leer, leer):
+        fecha = next(fechas_pares)
+        if fecha != dia_actual:
+            if dia_actual is not None:
+                yield dia_actual, day_vals, day_quality
+            dia_actual = fecha
+            day_vals, day_quality = _dia_vacio(indices, w, h)
+        _mezclar_item(day_vals, day_quality, bandas, indices_y_calidad, indices)
+
+    if dia_actual is not None:
+        yield dia_actual, day_vals, day_quality
+
+
+def _apilar_bloque(lector, leer, fechas, items_by_date, indices_y_calidad, indices, w, h, recorte, pilas,
+                   hilos_fechas: int = 1):
+    """
+    Escribe en ``pilas[índice][i]`` (memmap en disco) los valores válidos del
+    núcleo del bloque de cada fecha con datos (NaN el resto). Devuelve el nº
+    de capas escritas, el nº de observaciones válidas por píxel y las fechas
+    con datos.
+    """
+    principal = indices[0]
+    alto = recorte[0].stop - recorte[0].start
+    ancho = recorte[1].stop - recorte[1].start
+    n_obs = np.zeros((alto, ancho), dtype=np.uint16)
+    capas = 0
+    con_datos = []
+    for fecha, day_vals, day_quality in _dias_bloque(lector, leer, fechas, items_by_date, indices_y_calidad,
+                                                 indices, w, h, hilos_fechas):
+        valid = np.isfinite(day_vals[principal][recorte]) & (day_quality[recorte] > 0)
+        if not np.any(valid):
+            continue
+        for n in indices:
+            capa = pilas[n][capas, :alto, :ancho]
+            capa[...] = np.nan
+            capa[valid] = day_vals[n][recorte][valid]
+        n_obs += valid
+        capas += 1
+        con_datos.append(fecha)
+    return capas, n_obs, con_datos
+
+
+def _percentil_pila(pila, capas: int, alto: int, ancho: int, q: float, filas: int) -> np.ndarray:
+    """Percentil ``q`` (NaN ignorados) por píxel de las ``capas`` primeras capas, por franjas de ``filas``."""
+    out = np.full((alto, ancho), np.nan, dtype=np.float32)
+    if capas == 0:
+        return out
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # Píxeles sin ninguna observación: NaN
+        for f0 in range(0, alto, filas):
+            franja = np.asarray(pila[:capas, f0:f0 + filas, :ancho])
+            if q == 50:
+                out[f0:f0 + filas] = np.nanmedian(franja, axis=0)
+            else:
+                out[f0:f0 + filas] = np.nanpercentile(franja, q, axis=0)
+    return out
+
+
+def _rellenar_por_bloques(origen: Path, salida: Path, tam_bloque: int, max_gap_size: int, modo: str, debug: bool,
+                          rango: tuple[float, float] = (-1.0, 1.0)):
+    halo = max_gap_size + 6
+    rellenados = 0
+    estad = _Estadisticas(rango)
+    with rasterio.open(origen) as src:
+        perfil = src.profile
+        with rasterio.open(salida, "w", **perfil) as dst:
+            marcar_escala(dst)
+            for win in ventanas_bloques(src.width, src.height, tam_bloque):
+                ext = ampliar_ventana(win, halo, src.width, src.height)
+                datos = leer_ndvi(src, window=ext)
+                recorte = _recorte(win, ext)
+                huecos = int(np.isnan(datos[recorte]).sum())
+                if huecos:
+                    datos, _ = rellenar_gaps(datos, max_gap_size, modo=modo, debug=debug)
+                nucleo = datos[recorte]
+                rellenados += huecos - int(np.isnan(nucleo).sum())
+                dst.write(codificar(nucleo, perfil["dtype"]), 1, window=win)
+                estad.add(nucleo[np.isfinite(nucleo)])
+    return rellenados, estad
+
+
+def _cambios_estado(items_by_date: dict, previos: dict[str, str] | None):
+    """
+    (fechas a plegar, días invalidados). Una fecha que ya estaba en el estado
+    pero con otros items (tile publicada tarde, item fuera de la ventana...)
+    invalida sus píxeles y se vuelve a plegar entera.
+    """
+    fechas = sorted(items_by_date.keys(), reverse=True)
+    if previos is None:
+        return fechas, np.array([], dtype=np.uint16)
+
+    antes: dict[str, set] = {}
+    for item_id, fecha in previos.items():
+        antes.setdefault(fecha, set()).add(item_id)
+    ahora = {str(f): {item.id for item in items_by_date[f]} for f in fechas}
+
+    a_plegar = [f for f in fechas if antes.get(str(f)) != ahora[str(f)]]
+    invalidas = [f for f in antes if antes[f] != ahora.get(f)]
+    dias = np.array([dia_desde_fecha(date.fromisoformat(f)) for f in invalidas], dtype=np.uint16)
+    return a_plegar, dias
+
+
+def ruta_indice(salida: Path, nombre: str) -> Path:
+    """GeoTIFF de un índice secundario junto al composite principal: ``<stem>_<índice>.tif``."""
+    return salida.with_name(f"{salida.stem}_{nombre.lower()}{salida.suffix}")
+
+
+def componer_por_bloques(
+    items_by_date: dict,
+    dst_transform,
+    dst_crs,
+    width: int,
+    height: int,
+    salida,
+    indices_y_calidad: IndicesYCalidad,
+    tam_bloque: int = 1024,
+    halo: int = 3,
+    max_gap_size: int = 0,
+    modo_gaps: str = "griddata",
+    debug: bool = False,
+    dias_ventana: int = 200,
+    estado: EstadoComposite | None = None,
+    parametros: dict | None = None,
+    salida_fechas=None,
+    indices: tuple[str, ...] = ("NDVI",),
+    salidas_indices: dict | None = None,
+    formato: str = NDVI_FORMATO,
+    modo: str = MODO_MEJOR_PIXEL,
+    hilos_fechas: int = 1,
+) -> dict:
+    """
+    Escribe el composite de ``indices[0]`` en ``salida`` (GeoTIFF en teselas
+    en ``formato``: float32 con NaN o int16 escalado, ver ``formato_ndvi``) y
+    el de cada índice restante en ``salidas_indices[nombre]`` (por defecto
+    ``ruta_indice``). Devuelve la metadata del composite con ``statistics``
+    (índice principal),
+    ``statistics_by_index``, ``index_files`` y ``coverage_before_gaps_pct``.
+    ``max_gap_size`` = 0 desactiva el relleno.
+
+    ``indices_y_calidad`` recibe las bandas de ``bandas_necesarias(indices)``
+    de un item en la rejilla del bloque y devuelve los índices y la calidad.
+
+    Score de un píxel = calidad × PESO_MIN_VENTANA ** (edad / ``dias_ventana``):
+    el orden entre dos escenas no depende del día de ejecución, así que con
+    ``estado`` solo se pliegan las escenas nuevas sobre el composite anterior y
+    el resultado es el mismo que recomponiendo la ventana completa. Los bloques
+    con píxeles de una fecha que ya no está en la ventana (o cuyos items han
+    cambiado) se recomponen desde cero. ``parametros`` entra en la firma del
+    estado (lo que cambie ``indices_y_calidad``). ``salida_fechas``: GeoTIFF
+    uint16 con la fecha de cada píxel (días desde 1970-01-01, 0 = sin dato).
+
+    ``modo`` = ``mediana`` o ``pNN``: en vez del mejor píxel, percentil de las
+    observaciones válidas (nubes enmascaradas, tiles del día mezcladas por
+    calidad) de todas las fechas; cada índice por separado. Las fechas del
+    bloque se apilan en un memmap en disco (``NDVI_PILA_DIR``) y el percentil
+    se calcula por franjas de ``NDVI_PILA_FILAS`` filas, así que la memoria no
+    crece con el nº de fechas. Sin estado incremental ni GeoTIFF de fechas.
+
+    ``hilos_fechas`` > 1: las fechas de cada bloque se leen y mezclan en
+    paralelo y se pliegan (o apilan) en orden, con el mismo resultado.
+    """
+    indices = tuple(indices)
+    principal = indices[0]
+    salida = Path(salida)
+    salidas = {principal: salida}
+    for nombre in indices[1:]:
+        salidas[nombre] = Path((salidas_indices or {}).get(nombre) or ruta_indice(salida, nombre))
+    fechas = sorted(items_by_date.keys(), reverse=True)  # Más recientes primero
+    total_tiles = sum(len(items_by_date[d]) for d in fechas)
+    perfil = perfil_salida(dst_transform, dst_crs, width, height)
+    perfil_indices = perfil_ndvi(perfil, formato)
+    k = pendiente_temporal(dias_ventana)
+    q = percentil_modo(modo)
+    if q is not None and (estado is not None or salida_fechas is not None):
+        print(f"[BLOQUES] Modo {modo}: sin estado incremental ni GeoTIFF de fechas")
+        estado, salida_fechas = None, None
+    if estado is not None and estado.indices != indices:
+        raise ValueError(f"El estado guarda {estado.indices} y se piden {indices}")
+
+    firma = {
+        "rejilla": [list(dst_transform)[:6], str(dst_crs), width, height],
+        "tam_bloque": tam_bloque,
+        "halo": halo,
+        "dias_ventana": dias_ventana,
+        "peso_min": PESO_MIN_VENTANA,
+        "indices": list(indices),
+        "parametros": parametros or {},
+    }
+    previos = estado.cargar(firma) if estado is not None else None
+    a_plegar, dias_invalidos = _cambios_estado(items_by_date, previos)
+    fallidos: set[str] = set()
+
+    if max_gap_size > 0:
+        destinos = {n: r.with_name(r.stem + "_sin_rellenar.tif") for n, r in salidas.items()}
+    else:
+        destinos = dict(salidas)
+    bloques = list(ventanas_bloques(width, height, tam_bloque))
+    pixeles_fecha: dict[int, int] = {}
+    fechas_con_datos: set = set()
+    observaciones = 0
+    validos = 0
+    reconstruidos = 0
+    estad = {n: _Estadisticas(INDICES[n].rango) for n in indices}
+
+    print(f"[BLOQUES] {width} x {height} px en {len(bloques)} bloques de {tam_bloque} px (halo {halo} px)")
+    if hilos_fechas > 1:
+        print(f"[BLOQUES] Fechas en paralelo: {hilos_fechas} hilos por bloque")
+    if len(indices) > 1:
+        print(f"[BLOQUES] Índices: {', '.join(indices)} (bandas {', '.join(bandas_necesarias(indices))})")
+    if previos is not None:
+        print(f"[ESTADO] Incremental: {len(a_plegar)} fechas nuevas o cambiadas, "
+              f"{len(dias_invalidos)} fechas a retirar")
+
+    metricas.reset()
+    n_bandas = len(bandas_necesarias(indices))
+    lector = LectorConcurrente(debug=debug, prefetch=max(2, 2 * READ_THREADS // n_bandas))
+    perfil_fechas = {**perfil, "dtype": "uint16", "nodata": 0}
+    if estado is not None:
+        estado.abrir(perfil, leer=previos is not None)
+    try:
+        with ExitStack() as pila:
+            pila.enter_context(entorno_gdal())
+            pila.enter_context(lector)
+            pool = pila.enter_context(PoolDatasets())
+            dst = {n: pila.enter_context(rasterio.open(r, "w", **perfil_indices)) for n, r in destinos.items()}
+            for n, ds in dst.items():
+                ds.update_tags(INDICE=n)
+                marcar_escala(ds)
+            dst_fechas = None
+            if salida_fechas is not None:
+                dst_fechas = pila.enter_context(rasterio.open(salida_fechas, "w", **perfil_fechas))
+                dst_fechas.update_tags(FECHA_ORIGEN="1970-01-01", UNIDAD="dias")
+            pilas = {}
+            mb_pila = 0.0
+            if q is not None:
+                dir_pila = Path(pila.enter_context(
+                    tempfile.TemporaryDirectory(prefix="pila_ndvi_", dir=NDVI_PILA_DIR)))
+                forma = (max(len(fechas), 1), min(tam_bloque, height), min(tam_bloque, width))
+                pilas = {n: np.memmap(dir_pila / f"{n.lower()}.dat", dtype=np.float32, mode="w+", shape=forma)
+                         for n in indices}
+                pila.callback(pilas.clear)  # Cerrar los memmap antes de borrar el directorio (Windows)
+                mb_pila = len(indices) * int(np.prod(forma)) * 4 / 1e6
+                print(f"[BLOQUES] Modo {modo}: pila de {forma[0]} fechas en {dir_pila} ({mb_pila:.0f} MB en disco)")
+
+            for n, win in enumerate(bloques, 1):
+                ext = ampliar_ventana(win, halo, width, height)
+                t_ext = window_transform(ext, dst_transform)
+                w, h = int(ext.width), int(ext.height)
+                recorte = _recorte(win, ext)
+
+                def leer(item, band_key, t_ext=t_ext, w=w, h=h):  # Rejilla de este bloque, no la del último
+                    try:
+                        return leer_banda_item_rejilla(pool, item, band_key, t_ext, dst_crs, w, h)
+                    except Exception:
+                        fallidos.add(item.id)  # No se da por plegado: se reintenta la próxima vez
+                        raise
+
+                if q is not None:
+                    capas, n_obs, con_datos = _apilar_bloque(
+                        lector, leer, fechas, items_by_date, indices_y_calidad, indices, w, h, recorte, pilas,
+                        hilos_fechas,
+                    )
+                    valores = {nombre: _percentil_pila(pilas[nombre], capas, int(win.height), int(win.width),
+                                                       q, NDVI_PILA_FILAS)
+                               for nombre in indices}
+                    dia = None
+                    fechas_con_datos.update(con_datos)
+                    observaciones += int(n_obs.sum())
+                else:
+                    inicial = estado.leer_bloque(win) if previos is not None else None
+                    plegar = a_plegar
+                    if inicial is None or (dias_invalidos.size and np.isin(inicial[2], dias_invalidos).any()):
+                        inicial, plegar = None, fechas
+                        reconstruidos += 1
+
+                    if plegar:
+                        valores, calidad, dia = _componer_bloque(
+                            lector, leer, plegar, items_by_date, indices_y_calidad, indices,
+                            t_ext, dst_crs, w, h, recorte, k, inicial, hilos_fechas,
+                        )
+                    else:
+                        valores, calidad, dia = inicial
+
+                for nombre in indices:
+                    dst[nombre].write(codificar(valores[nombre], perfil_indices["dtype"]), 1, window=win)
+                if dst_fechas is not None:
+                    dst_fechas.write(dia, 1, window=win)
+                if estado is not None:
+                    estado.escribir_bloque(win, valores, calidad, dia)
+
+                if dia is not None:
+                    for d, c in zip(*np.unique(dia[dia > 0], return_counts=True)):
+                        pixeles_fecha[int(d)] = pixeles_fecha.get(int(d), 0) + int(c)
+                validos += int(np.isfinite(valores[principal]).sum())
+                if max_gap_size <= 0:
+                    for nombre in indices:
+                        v = valores[nombre]
+                        estad[nombre].add(v[np.isfinite(v)])
+
+                if n % 10 == 0 or n == len(bloques):
+                    print(f"[BLOQUES] {n}/{len(bloques)} bloques | cobertura acumulada {100 * validos / (width * height):.2f}%")
+    except BaseException:
+        if estado is not None:
+            estado.descartar()
+        raise
+
+    if estado is not None:
+        plegados = {item.id: str(f) for f in fechas for item in items_by_date[f] if item.id not in fallidos}
+        estado.confirmar(firma, plegados)
+        if fallidos:
+            print(f"[ESTADO] ⚠️ {len(fallidos)} items con errores de lectura: se reintentarán en la próxima ejecución")
+
+    coverage = 100 * validos / (width * height)
+    metricas.imprimir("[BLOQUES]")
+    if previos is not None:
+        print(f"[ESTADO] Bloques recompuestos desde cero: {reconstruidos}/{len(bloques)}")
+
+    if max_gap_size > 0:
+        print(f"\n[GAPS] Rellenando gaps por bloques (hasta {max_gap_size} px, {modo_gaps})...")
+        for nombre in indices:
+            rellenados, estad[nombre] = _rellenar_por_bloques(
+                destinos[nombre], salidas[nombre], tam_bloque, max_gap_size, modo_gaps, debug, INDICES[nombre].rango,
+            )
+            os.remove(destinos[nombre])
+            print(f"[GAPS] ✓ {nombre}: rellenados {rellenados:,} píxeles")
+
+    coverage_final = 100 * estad[principal].n / (width * height)
+    # Fechas que aportan algún píxel al composite, más recientes primero
+    if q is None:
+        dates_used_list = [str(fecha_desde_dia(d)) for d in sorted(pixeles_fecha, reverse=True)]
+    else:
+        dates_used_list = [str(f) for f in sorted(fechas_con_datos, reverse=True)]
+
+    return {
+        "dates_searched": len(fechas),
+        "dates_processed": len(a_plegar),
+        "dates_used": len(dates_used_list),
+        "total_tiles": total_tiles,
+        "coverage_before_gaps_pct": float(coverage),
+        "final_coverage_pct": float(coverage_final),
+        "dates_used_list": dates_used_list,
+        "pixels_per_date": {str(fecha_desde_dia(d)): c for d, c in sorted(pixeles_fecha.items(), reverse=True)},
+        "composite_method": ("multi_tile_multi_date_best_pixel_blockwise" if q is None
+                             else f"multi_tile_multi_date_percentile_{q:g}_blockwise"),
+        "composite_mode": modo,
+        "temporal_weight": (f"quality * {PESO_MIN_VENTANA} ** (age_days / {dias_ventana})" if q is None else None),
+        "observations_per_pixel_mean": (observaciones / (width * height)) if q is not None else None,
+        "date_stack_mb": mb_pila,
+        "incremental": previos is not None,
+        "blocks_rebuilt": reconstruidos,
+        "block_size": tam_bloque,
+        "date_threads": hilos_fechas,
+        "storage_format": formato,
+        "indices": list(indices),
+        "index_files": {n: str(r) for n, r in salidas.items()},
+        "statistics": estad[principal].resultado(),
+        "statistics_by_index": {n: e.resultado() for n, e in estad.items()},
+    }
@@ -0,0 +1,138 @@
+"""
+cribado_scl.py
+--------------
+Cribado de escenas por la SCL antes de leer ninguna banda a resolución
+completa.
+
+``eo:cloud_cover`` es el % de nubes de toda la escena (110 km), no de la ROI.
+Aquí se lee, de cada item candidato, solo la SCL de su overview más pequeña
+sobre el bbox de la ROI (unas pocas teselas por COG, y con la caché de
+ventanas ninguna en las ejecuciones siguientes), reproyectada a una rejilla
+gruesa (``S2_CRIBADO_RES_M``, 320 m por defecto) alineada con la rejilla
+destino, y:
+
+1. Se calcula la fracción útil de cada item sobre la ROI (clases SCL que el
+   composite acepta) y se descartan los que no llegan a ``S2_CRIBADO_MIN_UTIL``.
+2. Se recorren las fechas de la más reciente a la más antigua acumulando los
+   píxeles gruesos con una observación de calidad máxima (vegetación o suelo
+   desnudo). Una fecha más antigua no puede ganar en esos píxeles (misma
+   calidad y menos peso temporal), así que cuando la cobertura acumulada
+   llega a ``S2_CRIBADO_COBERTURA`` de lo que cubren los candidatos no se
+   añaden más fechas. Solo vale para el composite de mejor píxel: con
+   mediana o percentil cuentan todas las observaciones y el corte se desactiva
+   (``cobertura_objetivo=None``).
+
+Es una estimación a la resolución de la overview: un claro más pequeño que
+un píxel grueso puede no verse. Con el composite incremental, una fecha que
+deja de entrar retira sus píxeles del estado como cualquier fecha que sale
+de la ventana.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import time
+
+import numpy as np
+from affine import Affine
+
+from .lector_s2 import READ_THREADS, LectorConcurrente, leer_banda_overview_bbox, metricas
+
+S2_CRIBADO = os.getenv("S2_CRIBADO", "1") == "1"
+S2_CRIBADO_RES_M = float(os.getenv("S2_CRIBADO_RES_M", "320"))
+S2_CRIBADO_MIN_UTIL = float(os.getenv("S2_CRIBADO_MIN_UTIL", "0.005"))
+S2_CRIBADO_COBERTURA = float(os.getenv("S2_CRIBADO_COBERTURA", "0.99"))
+
+
+def rejilla_gruesa(dst_transform, width: int, height: int, res_m: float):
+    """(transform, ancho, alto) de una rejilla ``res_m`` alineada con la destino (factor entero)."""
+    factor = max(1, int(round(res_m / abs(dst_transform.a))))
+    return dst_transform * Affine.scale(factor), math.ceil(width / factor), math.ceil(height / factor)
+
+
+def cribar_items(items_by_date: dict, bbox_4326, dst_transform, dst_crs, width: int, height: int,
+                 scl_validas, scl_optimas, min_util: float = S2_CRIBADO_MIN_UTIL,
+                 cobertura_objetivo: float | None = S2_CRIBADO_COBERTURA, res_m: float = S2_CRIBADO_RES_M,
+                 debug: bool = False) -> tuple[dict, dict]:
+    """
+    Devuelve (items_by_date filtrado, informe). ``scl_validas``: clases que el
+    composite usa; ``scl_optimas``: las de calidad máxima. Un item cuya SCL no
+    se puede leer se conserva. Con ``cobertura_objetivo`` None solo se
+    descartan los items con poca fracción útil.
+    """
+    t0 = time.perf_counter()
+    t_g, w_g, h_g = rejilla_gruesa(dst_transform, width, height, res_m)
+    validas = np.array(sorted(scl_validas), dtype=np.int16)
+    optimas = np.array(sorted(scl_optimas), dtype=np.int16)
+    fechas = sorted(items_by_date.keys(), reverse=True)
+    items = [item for f in fechas for item in sorted(items_by_date[f], key=lambda it: it.id)]
+    print(f"[CRIBADO] SCL de {len(items)} items en {len(fechas)} fechas | rejilla {w_g} x {h_g} px "
+          f"({abs(t_g.a):.0f} m)")
+
+    def leer(item, band_key):
+        return leer_banda_overview_bbox(item, band_key, bbox_4326, t_g, dst_crs, w_g, h_g)
+
+    # id -> (con datos, útil, óptimo) en la rejilla gruesa; None = SCL no disponible
+    mascaras: dict[str, tuple | None] = {}
+    utiles: dict[str, float] = {}
+    metricas.reset()
+    with LectorConcurrente(hilos=READ_THREADS, prefetch=2 * READ_THREADS, debug=debug) as lector:
+        for item, bandas in lector.bandas_items(items, ("SCL",), leer):
+            scl = bandas["SCL"]
+            if scl is None:
+                mascaras[item.id] = None
+                continue
+            util = np.isin(scl, validas)
+            mascaras[item.id] = (scl > 0, util, np.isin(scl, optimas))
+            utiles[item.id] = float(util.mean())
+
+    descartados = {i for i, u in utiles.items() if u < min_util}
+    cubrible = np.zeros((h_g, w_g), dtype=bool)
+    for item_id, m in mascaras.items():
+        if m is not None and item_id not in descartados:
+            cubrible |= m[0]
+    n_cubrible = int(cubrible.sum())
+
+    cubierto = np.zeros((h_g, w_g), dtype=bool)
+    salida: dict = {}
+    sin_items = []
+    cobertura = 0.0
+    for fecha in fechas:
+        conservados = [it for it in items_by_date[fecha] if it.id not in descartados]
+        if not conservados:
+            sin_items.append(fecha)
+            continue
+        if cobertura_objetivo is not None and n_cubrible and cobertura >= cobertura_objetivo:
+            break
+        salida[fecha] = conservados
+        for it in conservados:
+            m = mascaras.get(it.id)
+            if m is not None:
+                cubierto |= m[2]
+        cobertura = float(cubierto.sum()) / n_cubrible if n_cubrible else 0.0
+
+    restantes = [f for f in fechas if f not in salida and f not in sin_items]
+    ranking = sorted(utiles.items(), key=lambda kv: kv[1], reverse=True)
+    informe = {
+        "resolution_m": float(abs(t_g.a)),
+        "items_candidates": len(items),
+        "items_without_scl": sum(1 for m in mascaras.values() if m is None),
+        "items_dropped_low_usable": len(descartados),
+        "dates_candidates": len(fechas),
+        "dates_kept": len(salida),
+        "dates_dropped_no_items": len(sin_items),
+        "dates_skipped_after_coverage": len(restantes),
+        "estimated_optimal_coverage_pct": 100 * cobertura,
+        "min_usable": min_util,
+        "coverage_target": cobertura_objetivo,
+        "seconds": time.perf_counter() - t0,
+    }
+
+    metricas.imprimir("[CRIBADO]")
+    for item_id, u in ranking[:5]:
+        print(f"[CRIBADO]   {item_id}: {100 * u:.1f}% útil sobre la ROI")
+    print(f"[CRIBADO] ✓ {len(salida)}/{len(fechas)} fechas | {len(descartados)} items sin píxeles útiles "
+          f"(< {100 * min_util:.1f}%) | {len(restantes)} fechas antiguas omitidas con cobertura "
+          f"{100 * cobertura:.1f}% ({informe['seconds']:.1f}s)")
+    return salida, informe
@@ -0,0 +1,196 @@
+"""
+estado_composite.py
+-------------------
+Estado persistente del composite NDVI por bloques, para que cada ejecución
+solo pliegue las escenas nuevas en lugar de recomponer toda la ventana.
+
+El estado es un directorio de generación (``gen-000001``, ``gen-000002``...)
+con GeoTIFF en teselas sobre la rejilla del composite y un JSON:
+
+- ``ndvi.tif``    (float32, NaN = sin dato): mejor NDVI antes de rellenar huecos;
+  con varios índices, una capa por índice (``evi.tif``, ``ndre.tif``...) con
+  el valor de la misma observación;
+- ``calidad.tif`` (float32, 0 = sin dato): score de calidad SCL del píxel elegido;
+- ``fecha.tif``   (uint16, 0 = sin dato): fecha de adquisición del píxel elegido,
+  en días desde 1970-01-01;
+- ``estado.json``: firma (rejilla + parámetros que cambian el resultado) e
+  items ya plegados con su fecha.
+
+El fichero ``actual`` de ``NDVI_STATE_DIR`` tiene el nombre de la generación
+vigente. Cada ejecución escribe capas y JSON en una generación nueva y al
+final sustituye ``actual`` con un único ``os.replace``, así que la
+confirmación es atómica: una ejecución interrumpida (o un fallo a mitad de
+confirmar) deja la generación anterior intacta. Después se borran las
+generaciones antiguas.
+
+Si la firma no coincide con la de la ejecución actual el estado se ignora y
+se recompone todo.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import shutil
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import rasterio
+
+from project_paths import PROJECT_ROOT
+
+NDVI_STATE_DIR = Path(os.getenv("NDVI_STATE_DIR", str(PROJECT_ROOT / "data" / "estado" / "ndvi_composite")))
+
+ORIGEN_DIAS = date(1970, 1, 1).toordinal()
+
+PUNTERO = "actual"
+PREFIJO_GENERACION = "gen-"
+
+# capa -> (dtype, nodata); los índices son capas float32 con NaN
+CAPA_INDICE = ("float32", np.nan)
+CAPAS = {
+    "ndvi": CAPA_INDICE,
+    "calidad": ("float32", 0.0),
+    "fecha": ("uint16", 0),
+}
+
+
+def capas_estado(indices=("NDVI",)) -> dict:
+    capas = {nombre.lower(): CAPA_INDICE for nombre in indices}
+    capas.update({"calidad": CAPAS["calidad"], "fecha": CAPAS["fecha"]})
+    return capas
+
+
+def dia_desde_fecha(fecha: date) -> int:
+    return fecha.toordinal() - ORIGEN_DIAS
+
+
+def fecha_desde_dia(dia: int) -> date:
+    return date.fromordinal(int(dia) + ORIGEN_DIAS)
+
+
+def perfil_capa(perfil_base: dict, capa: str) -> dict:
+    dtype, nodata = CAPAS.get(capa, CAPA_INDICE)
+    return {**perfil_base, "dtype": dtype, "nodata": nodata}
+
+
+def _normalizar(firma: dict) -> dict:
+    # Tuplas -> listas, claves -> str: así se compara con lo leído del JSON
+    return json.loads(json.dumps(firma, sort_keys=True))
+
+
+class EstadoComposite:
+    def __init__(self, directorio=NDVI_STATE_DIR, indices=("NDVI",)):
+        self.directorio = Path(directorio)
+        self.indices = tuple(indices)
+        self.capas = capas_estado(self.indices)
+        self._lectura: dict = {}
+        self._escritura: dict = {}
+        self._nueva: str | None = None
+
+    @property
+    def ruta_puntero(self) -> Path:
+        return self.directorio / PUNTERO
+
+    def generacion_actual(self) -> str | None:
+        """Nombre de la generación vigente según ``actual`` (None si no hay estado)."""
+        try:
+            nombre = self.ruta_puntero.read_text(encoding="utf-8").strip()
+        except FileNotFoundError:
+            return None
+        valido = nombre.startswith(PREFIJO_GENERACION) and nombre[len(PREFIJO_GENERACION):].isdigit()
+        return nombre if valido else None
+
+    def ruta_json(self, generacion: str) -> Path:
+        return self.directorio / generacion / "estado.json"
+
+    def ruta(self, capa: str, generacion: str) -> Path:
+        return self.directorio / generacion / f"{capa}.tif"
+
+    def cargar(self, firma: dict) -> dict[str, str] | None:
+        """Items plegados ``{item_id: 'YYYY-MM-DD'}``, o None si no hay estado compatible."""
+        generacion = self.generacion_actual()
+        if generacion is None:
+            return None
+        try:
+            datos = json.loads(self.ruta_json(generacion).read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"[ESTADO] ⚠️ estado.json de {generacion} ilegible ({e}): se recompone todo")
+            return None
+        if datos.get("firma") != _normalizar(firma):
+            print("[ESTADO] La rejilla o los parámetros han cambiado: se recompone todo")
+            return None
+        if not all(self.ruta(capa, generacion).exists() for capa in self.capas):
+            print(f"[ESTADO] ⚠️ Faltan capas en {generacion}: se recompone todo")
+            return None
+        return dict(datos.get("items", {}))
+
+    def _siguiente_generacion(self) -> str:
+        actual = self.generacion_actual()
+        n = int(actual[len(PREFIJO_GENERACION):]) if actual else 0
+        return f"{PREFIJO_GENERACION}{n + 1:06d}"
+
+    # ---- lectura/escritura por bloques ----
+
+    def abrir(self, perfil_base: dict, leer: bool):
+        """Abre las capas de la generación vigente (si ``leer``) y las de una generación nueva."""
+        self._nueva = self._siguiente_generacion()
+        nueva = self.directorio / self._nueva
+        shutil.rmtree(nueva, ignore_errors=True)  # Restos de una ejecución interrumpida
+        nueva.mkdir(parents=True)
+        if leer:
+            actual = self.generacion_actual()
+            self._lectura = {capa: rasterio.open(self.ruta(capa, actual)) for capa in self.capas}
+        self._escritura = {
+            capa: rasterio.open(self.ruta(capa, self._nueva), "w", **perfil_capa(perfil_base, capa))
+            for capa in self.capas
+        }
+
+    def leer_bloque(self, win) -> tuple[dict, np.ndarray, np.ndarray]:
+        """({índice: valores}, calidad, fecha) del estado anterior en la ventana ``win``."""
+        valores = {n: self._lectura[n.lower()].read(1, window=win) for n in self.indices}
+        return valores, self._lectura["calidad"].read(1, window=win), self._lectura["fecha"].read(1, window=win)
+
+    def escribir_bloque(self, win, valores: dict, calidad, fecha):
+        datos = {**{n.lower(): valores[n] for n in self.indices}, "calidad": calidad, "fecha": fecha}
+        for capa, arr in datos.items():
+            self._escritura[capa].write(arr.astype(self.capas[capa][0], copy=False), 1, window=win)
+
+    def cerrar(self):
+        for ds in (*self._lectura.values(), *self._escritura.values()):
+            ds.close()
+        self._lectura, self._escritura = {}, {}
+
+    def descartar(self):
+        """Ejecución fallida: se borra la generación nueva y la vigente sigue valiendo."""
+        self.cerrar()
+        if self._nueva is not None:
+            shutil.rmtree(self.directorio / self._nueva, ignore_errors=True)
+            self._nueva = None
+
+    def confirmar(self, firma: dict, items: dict[str, str]):
+        """Completa la generación nueva y la hace vigente sustituyendo ``actual`` de una vez."""
+        self.cerrar()
+        nueva, self._nueva = self._nueva, None
+        try:
+            with rasterio.open(self.ruta("fecha", nueva), "r+") as ds:
+                ds.update_tags(FECHA_ORIGEN="1970-01-01", UNIDAD="dias")
+            self.ruta_json(nueva).write_text(
+                json.dumps({"firma": _normalizar(firma), "items": items}, indent=2, sort_keys=True),
+                encoding="utf-8",
+            )
+            tmp = self.ruta_puntero.with_name(PUNTERO + ".tmp")
+            tmp.write_text(nueva, encoding="utf-8")
+            os.replace(tmp, self.ruta_puntero)
+        except BaseException:
+            shutil.rmtree(self.directorio / nueva, ignore_errors=True)
+            raise
+        self._limpiar(nueva)
+        print(f"[ESTADO] ✓ Estado guardado en {self.directorio / nueva} ({len(items)} items)")
+
+    def _limpiar(self, vigente: str):
+        """Borra las generaciones anteriores a ``vigente``."""
+        for ruta in self.directorio.iterdir():
+            if ruta.is_dir() and ruta.name.startswith(PREFIJO_GENERACION) and ruta.name != vigente:
+                shutil.rmtree(ruta, ignore_errors=True)
@@ -0,0 +1,254 @@
+"""
+fenologia.py
+------------
+Suavizado de las series NDVI por recinto y métricas fenológicas, para todos
+los recintos a la vez (una fila de matriz por recinto).
+
+1. ``matriz_campania``: las medias de ``indices_raster`` de una campaña
+   (1 sept - 31 ago) se agrupan en nodos regulares de ``paso`` días; si caen
+   varias en el mismo nodo se queda la mayor (las nubes bajan el NDVI).
+2. ``suavizar``: Whittaker (penalización de segundas diferencias, por
+   defecto) o Savitzky-Golay, iterando con rechazo de valores atípicos: las
+   observaciones muy por debajo de la curva (nubes, sombras) pierden el peso
+   y se vuelve a ajustar (envolvente superior, como TIMESAT).
+   El sistema pentadiagonal de Whittaker se resuelve con una Cholesky en
+   banda vectorizada sobre todas las filas: un bucle de ``T`` pasos sobre
+   arrays de ``n`` recintos en lugar de ``n`` sistemas.
+3. ``metricas_fenologia``: inicio de campaña (cruce ascendente del
+   ``umbral`` de la amplitud), pico (fecha y valor), senescencia (cruce
+   descendente tras el pico) e integral del NDVI sobre la base entre ambos.
+
+No depende de la base de datos: ``fenologia_recintos.py`` lee y escribe.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.signal import savgol_filter
+
+PASO_DIAS = 5
+LAMBDA_WHITTAKER = 50.0
+ITERACIONES = 3
+MIN_OBSERVACIONES = 6
+UMBRAL_FENOLOGIA = 0.2     # fracción de la amplitud (TIMESAT usa 0,2)
+AMPLITUD_MINIMA = 0.1      # sin ciclo apreciable por debajo de esta amplitud
+
+
+# ==================== MATRIZ DE OBSERVACIONES ====================
+
+def matriz_campania(filas: np.ndarray, dias: np.ndarray, valores: np.ndarray,
+                    n_filas: int, n_nodos: int, paso: int = PASO_DIAS) -> np.ndarray:
+    """
+    (n_filas, n_nodos) con NaN donde no hay observación. ``filas`` es el
+    índice de recinto de cada observación y ``dias`` los días desde el inicio
+    de la campaña.
+    """
+    nodo = np.clip(np.rint(dias / paso).astype(np.int64), 0, n_nodos - 1)
+    y = np.full((n_filas, n_nodos), -np.inf, dtype=np.float64)
+    np.maximum.at(y, (filas, nodo), valores)
+    y[np.isinf(y)] = np.nan
+    return y
+
+
+# ==================== SUAVIZADO ====================
+
+def _whittaker(y: np.ndarray, w: np.ndarray, lam: float) -> np.ndarray:
+    """
+    Resuelve (W + lam·D'D) z = W y para todas las filas, con D la matriz de
+    segundas diferencias. Cholesky en banda (ancho 2) vectorizada por filas.
+    """
+    n, t = y.shape
+    # Diagonales de D'D (segundas diferencias)
+    p0 = np.full(t, 6.0)
+    p0[[0, -1]] = 1.0
+    p0[[1, -2]] = 5.0
+    p1 = np.full(t - 1, -4.0)
+    p1[[0, -1]] = -2.0
+
+    a = w + lam * p0           # diagonal principal (n, t)
+    b = lam * p1               # primera subdiagonal (t-1,)
+    c = lam                    # segunda subdiagonal (constante)
+    r = w * np.nan_to_num(y)
+
+    d0 = np.empty((n, t))
+    d1 = np.zeros((n, t))
+    d2 = np.zeros((n, t))
+    for i in range(t):
+        s = a[:, i].copy()
+        if i >= 1:
+            s -= d1[:, i - 1] ** 2
+        if i >= 2:
+            s -= d2[:, i - 2] ** 2
+        d0[:, i] = np.sqrt(np.maximum(s, 1e-12))
+        if i + 1 < t:
+            num = b[i] - (d2[:, i - 1] * d1[:, i - 1] if i >= 1 else 0.0)
+            d1[:, i] = num / d0[:, i]
+        if i + 2 < t:
+            d2[:, i] = c / d0[:, i]
+
+    # L u = r
+    u = np.empty((n, t))
+    for i in range(t):
+        v = r[:, i].copy()
+        if i >= 1:
+            v -= d1[:, i - 1] * u[:, i - 1]
+        if i >= 2:
+            v -= d2[:, i - 2] * u[:, i - 2]
+        u[:, i] = v / d0[:, i]
+    # L' z = u
+    z = np.empty((n, t))
+    for i in range(t - 1, -1, -1):
+        v = u[:, i].copy()
+        if i + 1 < t:
+            v -= d1[:, i] * z[:, i + 1]
+        if i + 2 < t:
+            v -= d2[:, i] * z[:, i + 2]
+        z[:, i] = v / d0[:, i]
+    return z
+
+
+def _interpolar_huecos(y: np.ndarray) -> np.ndarray:
+    """Interpolación lineal de los NaN de cada fila (extremos: valor más próximo)."""
+    n, t = y.shape
+    x = np.arange(t)
+    validos = ~np.isnan(y)
+    # Índice del último / siguiente nodo válido de cada posición
+    izq = np.where(validos, x, -1)
+    np.maximum.accumulate(izq, axis=1, out=izq)
+    der = np.where(validos, x, t)
+    der = np.minimum.accumulate(der[:, ::-1], axis=1)[:, ::-1]
+    filas = np.arange(n)[:, None]
+    yi = y[filas, np.clip(izq, 0, t - 1)]
+    yd = y[filas, np.clip(der, 0, t - 1)]
+    yi = np.where(izq < 0, yd, yi)
+    yd = np.where(der >= t, yi, yd)
+    frac = np.where((izq >= 0) & (der < t), (x - izq) / np.maximum(der - izq, 1), 0.0)
+    return np.where(validos, y, yi + (yd - yi) * frac)
+
+
+def _savgol(y: np.ndarray, w: np.ndarray, ventana: int, orden: int) -> np.ndarray:
+    # Los nodos sin peso se rellenan interpolando entre los que sí lo tienen
+    return savgol_filter(_interpolar_huecos(np.where(w > 0, y, np.nan)), ventana, orden, axis=1, mode="interp")
+
+
+@dataclass
+class Suavizado:
+    curva: np.ndarray          # (n, T) NDVI suavizado
+    pesos: np.ndarray          # (n, T) 1 = observación usada, 0 = sin dato o atípica
+    n_obs: np.ndarray          # (n,) observaciones válidas
+    n_atipicos: np.ndarray     # (n,) observaciones descartadas
+
+
+def suavizar(y: np.ndarray, metodo: str = "whittaker", lam: float = LAMBDA_WHITTAKER,
+             iteraciones: int = ITERACIONES, ventana: int = 7, orden: int = 2,
+             min_obs: int = MIN_OBSERVACIONES) -> Suavizado:
+    """
+    Curva suavizada de cada fila de ``y`` (NaN = sin observación). En cada
+    iteración se descartan las observaciones por debajo de la curva más de
+    ``max(0,05; 2,5·MAD)`` de los residuos de la fila. Las filas con menos de
+    ``min_obs`` observaciones quedan a NaN, y la curva no se extrapola fuera
+    de la primera y la última observación.
+    """
+    validos = np.isfinite(y)
+    w = validos.astype(np.float64)
+    n_obs = validos.sum(axis=1)
+    suficientes = n_obs >= min_obs
+
+    z = np.full(y.shape, np.nan)
+    if not suficientes.any():
+        return Suavizado(z, w * 0, n_obs, np.zeros(len(y), dtype=np.int64))
+
+    ys, ws = y[suficientes], w[suficientes]
+    ys0 = np.where(np.isfinite(ys), ys, 0.0)
+    for it in range(iteraciones + 1):
+        zs = _whittaker(ys0, ws, lam) if metodo == "whittaker" else _savgol(ys0, ws, ventana, orden)
+        if it == iteraciones:
+            break
+        resid = np.where(ws > 0, ys0 - zs, np.nan)
+        with np.errstate(invalid="ignore"):
+            mad = 1.4826 * np.nanmedian(np.abs(resid - np.nanmedian(resid, axis=1, keepdims=True)),
+                                        axis=1, keepdims=True)
+            umbral = np.maximum(0.05, 2.5 * np.nan_to_num(mad))
+            atipicos = resid < -umbral
+        # Nunca se deja una fila por debajo del mínimo de observaciones
+        quedan = (ws > 0).sum(axis=1) - atipicos.sum(axis=1)
+        atipicos[quedan < min_obs] = False
+        if not atipicos.any():
+            break
+        ws = np.where(atipicos, 0.0, ws)
+
+    z[suficientes] = zs
+    t = y.shape[1]
+    primera = np.argmax(validos, axis=1)
+    ultima = t - 1 - np.argmax(validos[:, ::-1], axis=1)
+    x = np.arange(t)[None, :]
+    z[(x < primera[:, None]) | (x > ultima[:, None])] = np.nan
+    w_final = np.zeros_like(w)
+    w_final[suficientes] = ws
+    n_atipicos = n_obs - w_final.sum(axis=1).astype(np.int64)
+    n_atipicos[~suficientes] = 0
+    return Suavizado(z, w_final, n_obs, n_atipicos)
+
+
+# ==================== MÉTRICAS FENOLÓGICAS ====================
+
+def metricas_fenologia(z: np.ndarray, paso: int = PASO_DIAS, umbral: float = UMBRAL_FENOLOGIA,
+                       amplitud_minima: float = AMPLITUD_MINIMA) -> dict[str, np.ndarray]:
+    """
+    Métricas por fila sobre la curva suavizada (días desde el inicio de la
+    campaña; NaN si no hay ciclo):
+
+    - ``pico_dia`` / ``pico_valor``: máximo de la curva.
+    - ``base``: mínimo antes del pico (para el inicio) y después (senescencia).
+    - ``inicio_dia``: último cruce ascendente de base + umbral·amplitud antes del pico.
+    - ``senescencia_dia``: primer cruce descendente tras el pico.
+    - ``integral``: suma de (curva - base) entre inicio y senescencia (NDVI·día).
+    """
+    n, t = z.shape
+    x = np.arange(t)
+    sin_dato = np.isnan(z).all(axis=1)
+    zz = np.where(np.isnan(z), -np.inf, z)
+    pico = np.argmax(zz, axis=1)
+    pico_valor = zz[np.arange(n), pico]
+
+    antes = x[None, :] <= pico[:, None]
+    despues = x[None, :] >= pico[:, None]
+    base_ini = np.nanmin(np.where(antes & ~np.isnan(z), z, np.inf), axis=1)
+    base_fin = np.nanmin(np.where(despues & ~np.isnan(z), z, np.inf), axis=1)
+    amp_ini = pico_valor - base_ini
+    amp_fin = pico_valor - base_fin
+
+    nivel_ini = base_ini + umbral * amp_ini
+    nivel_fin = base_fin + umbral * amp_fin
+
+    con_dato = ~np.isnan(z)
+    primer_nodo = np.argmax(con_dato, axis=1)
+    ultimo_nodo = t - 1 - np.argmax(con_dato[:, ::-1], axis=1)
+
+    # Inicio: primer nodo antes del pico desde el que la curva ya no baja del nivel
+    bajo_ini = antes & (z < nivel_ini[:, None])
+    ultimo_bajo = np.where(bajo_ini.any(axis=1), t - 1 - np.argmax(bajo_ini[:, ::-1], axis=1), -1)
+    inicio = np.maximum(ultimo_bajo + 1, primer_nodo)
+    # Senescencia: primer nodo tras el pico por debajo del nivel
+    bajo_fin = despues & (z < nivel_fin[:, None])
+    senescencia = np.where(bajo_fin.any(axis=1), np.argmax(bajo_fin, axis=1), ultimo_nodo)
+
+    dentro = (x[None, :] >= inicio[:, None]) & (x[None, :] <= senescencia[:, None]) & con_dato
+    base = np.minimum(base_ini, base_fin)
+    integral = np.where(dentro, z - base[:, None], 0.0).clip(min=0).sum(axis=1) * paso
+
+    ciclo = ~sin_dato & (np.minimum(amp_ini, amp_fin) >= amplitud_minima)
+
+    def _f(v):
+        return np.where(ciclo, v.astype(np.float64), np.nan)
+
+    return {
+        "inicio_dia": _f(inicio * paso),
+        "pico_dia": _f(pico * paso),
+        "pico_valor": np.where(sin_dato, np.nan, pico_valor),
+        "senescencia_dia": _f(senescencia * paso),
+        "amplitud": _f(np.maximum(amp_ini, amp_fin)),
+        "integral": _f(integral),
+    }
@@ -0,0 +1,80 @@
+"""
+formato_ndvi.py
+---------------
+Formato en disco de los GeoTIFF NDVI (y demás índices normalizados).
+
+``NDVI_FORMATO``:
+
+- ``float32`` (por defecto): como hasta ahora, NaN = sin dato, deflate.
+- ``int16``: NDVI × 10000 redondeado (paso 0,0001, muy por debajo del ruido
+  de Sentinel-2), nodata -32768, ZSTD con predictor horizontal y teselas de
+  256 px. La mitad de bytes en disco y en page cache que float32 antes de
+  comprimir, y el predictor sobre enteros comprime mejor que deflate sobre
+  float. La escala va en los metadatos scale/offset de GDAL, así que QGIS y
+  ``gdalinfo`` ven valores reales.
+
+Los lectores (thumbnails, ETP, riego, teselas y PNG del visor) no miran el
+formato: ``leer_ndvi`` / ``decodificar`` devuelven siempre float32 con NaN.
+Se reexportan de ``decodificacion_ndvi.py`` (en ``src/``), la única
+implementación, que también usa la webapp (``webapp/utils/ndvi_formato.py``).
+"""
+
+from __future__ import annotations
+
+import os
+
+import numpy as np
+
+from decodificacion_ndvi import (  # noqa: F401 (reexportados)
+    decodificar,
+    decodificar_array,
+    leer_ndvi,
+    parametros_decodificacion,
+)
+
+NDVI_FORMATO = os.getenv("NDVI_FORMATO", "float32").lower()
+NDVI_ZSTD_LEVEL = int(os.getenv("NDVI_ZSTD_LEVEL", "9"))
+
+FORMATOS = ("float32", "int16")
+ESCALA_INT16 = 1e-4
+NODATA_INT16 = -32768
+_MAX_INT16 = 32767
+
+
+def perfil_ndvi(perfil: dict, formato: str = NDVI_FORMATO) -> dict:
+    """``perfil`` (driver, rejilla, CRS...) con dtype, nodata y compresión de ``formato``."""
+    if formato == "float32":
+        return {**perfil, "dtype": "float32", "nodata": np.nan}
+    if formato != "int16":
+        raise ValueError(f"NDVI_FORMATO desconocido: {formato!r} (opciones: {', '.join(FORMATOS)})")
+    perfil = {k: v for k, v in perfil.items() if k.lower() != "compress"}
+    return {
+        **perfil,
+        "dtype": "int16",
+        "nodata": NODATA_INT16,
+        "compress": "zstd",
+        "zstd_level": NDVI_ZSTD_LEVEL,
+        "predictor": 2,
+        "tiled": True,
+        "blockxsize": 256,
+        "blockysize": 256,
+        "BIGTIFF": "IF_SAFER",
+    }
+
+
+def codificar(valores: np.ndarray, dtype) -> np.ndarray:
+    """Valores reales (NaN = sin dato) -> array en el dtype del perfil."""
+    if np.dtype(dtype).kind == "f":
+        return np.asarray(valores, dtype=np.float32)
+    valores = np.asarray(valores, dtype=np.float32)
+    out = np.full(valores.shape, NODATA_INT16, dtype=np.int16)
+    ok = np.isfinite(valores)
+    out[ok] = np.clip(np.rint(valores[ok] / ESCALA_INT16), -_MAX_INT16, _MAX_INT16)
+    return out
+
+
+def marcar_escala(dst) -> None:
+    """Escribe scale/offset en un dataset entero recién abierto en escritura."""
+    if np.dtype(dst.dtypes[0]).kind in "iu":
+        dst.scales = (ESCALA_INT16,) * dst.count
+        dst.offsets = (0.0,) * dst.count
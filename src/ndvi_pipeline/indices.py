@@ -0,0 +1,108 @@
+"""
+indices.py
+----------
+Registro de índices espectrales calculables a partir de bandas Sentinel-2.
+
+Cada índice declara las bandas que necesita y una expresión vectorizada
+sobre reflectancias (float32, 0-1, NaN = sin dato/nube). Los scripts leen una
+sola vez la unión de bandas de los índices pedidos (``bandas_necesarias``),
+preparan las reflectancias con su propio enmascarado y evalúan todos los
+índices en la misma pasada (``evaluar_indices``).
+
+Para añadir un índice basta con ``registrar_indice(Indice(...))``.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+BANDA_CALIDAD = "SCL"
+
+
+@dataclass(frozen=True)
+class Indice:
+    nombre: str                                   # valor de indices_raster.tipo_indice
+    bandas: tuple[str, ...]
+    formula: Callable[[dict], np.ndarray]         # {banda: reflectancia} -> índice
+    rango: tuple[float, float] = (-1.0, 1.0)      # rango de visualización
+    descripcion: str = ""
+
+
+def dif_normalizada(a, b):
+    """(a - b) / (a + b), NaN donde el denominador es 0 (como compute_ndvi)."""
+    den = a + b
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(den == 0, np.nan, (a - b) / den)
+
+
+def _evi(r):
+    den = r["B08"] + 6.0 * r["B04"] - 7.5 * r["B02"] + 1.0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(den == 0, np.nan, 2.5 * (r["B08"] - r["B04"]) / den)
+
+
+def _savi(r, l=0.5):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (1.0 + l) * (r["B08"] - r["B04"]) / (r["B08"] + r["B04"] + l)
+
+
+INDICES: dict[str, Indice] = {}
+
+
+def registrar_indice(indice: Indice) -> Indice:
+    INDICES[indice.nombre.upper()] = indice
+    return indice
+
+
+registrar_indice(Indice(
+    "NDVI", ("B04", "B08"), lambda r: dif_normalizada(r["B08"], r["B04"]),
+    descripcion="Vigor de la vegetación",
+))
+registrar_indice(Indice(
+    "NDWI", ("B03", "B08"), lambda r: dif_normalizada(r["B03"], r["B08"]),
+    descripcion="Agua en superficie (McFeeters, verde/NIR)",
+))
+registrar_indice(Indice(
+    "SAVI", ("B04", "B08"), _savi, rango=(-1.5, 1.5),
+    descripcion="NDVI corregido por suelo (L = 0,5)",
+))
+registrar_indice(Indice(
+    "EVI", ("B02", "B04", "B08"), _evi, rango=(-1.0, 1.0),
+    descripcion="NDVI mejorado, menos saturación en vegetación densa",
+))
+registrar_indice(Indice(
+    "NDRE", ("B05", "B08"), lambda r: dif_normalizada(r["B08"], r["B05"]),
+    descripcion="Clorofila / nitrógeno (borde rojo, B05 a 20 m)",
+))
+
+
+def indices_desde_texto(texto: str) -> tuple[str, ...]:
+    """"NDVI, evi" -> ("NDVI", "EVI"); error si alguno no está registrado."""
+    nombres = tuple(dict.fromkeys(n.strip().upper() for n in texto.split(",") if n.strip()))
+    desconocidos = [n for n in nombres if n not in INDICES]
+    if desconocidos:
+        raise ValueError(f"Índices no registrados: {', '.join(desconocidos)} (disponibles: {', '.join(INDICES)})")
+    return nombres or ("NDVI",)
+
+
+def bandas_necesarias(nombres, calidad: bool = True) -> tuple[str, ...]:
+    """Unión ordenada de las bandas de los índices (+ SCL para nubes y calidad)."""
+    bandas = dict.fromkeys(b for n in nombres for b in INDICES[n].bandas)
+    if calidad:
+        bandas[BANDA_CALIDAD] = None
+    return tuple(bandas)
+
+
+def evaluar_indices(reflectancias: dict, nombres) -> dict:
+    """{nombre: array} de todos los índices pedidos; None si falta alguna de sus bandas."""
+    salida = {}
+    for n in nombres:
+        indice = INDICES[n]
+        if any(reflectancias.get(b) is None for b in indice.bandas):
+            salida[n] = None
+        else:
+            salida[n] = indice.formula(reflectancias)
+    return salida
@@ -0,0 +1,495 @@
+"""
+lector_s2.py
+------------
+Lectura de bandas Sentinel-2 (COG de Planetary Computer) sobre una rejilla
+destino (EPSG:25830) o un bloque de ella.
+
+- ``asset_href`` resuelve las variantes de nombre de banda (B04/red...).
+- ``PoolDatasets`` mantiene abiertos los COG entre bloques: abrir un COG
+  remoto cuesta una o dos peticiones HTTP (cabecera + IFD) y el compositor
+  por bloques lee cada item muchas veces.
+- ``leer_banda_rejilla`` lee solo la ventana del COG que cubre la rejilla
+  (más un margen para el remuestreo bilineal) y la reproyecta a ella;
+  ``leer_banda_bbox`` hace lo mismo a partir del bbox EPSG:4326 de la ROI
+  (la lectura de los scripts NDVI). ``leer_banda_overview_bbox`` lee esa
+  ventana desde la overview más pequeña del COG (cribado por SCL).
+- ``ventana_huella`` acota la parte de la rejilla que puede tener datos de
+  un item (bbox de su huella STAC), para no reproyectar tiles a la ROI entera.
+- ``LectorConcurrente`` lanza las lecturas banda/item en un pool de hilos
+  acotado y entrega los resultados en orden, con un número máximo de items
+  en vuelo para que la memoria no crezca con el nº de tiles.
+- ``entorno_gdal`` aplica las opciones HTTP/caché de GDAL para COG remotos
+  (multiplexado HTTP/2, fusión de rangos consecutivos, caché VSI, sin
+  listar directorios al abrir). ``rasterio.Env`` es por hilo: cada lectura
+  del pool entra en su propio entorno con las mismas opciones.
+- ``metricas`` acumula latencia y bytes leídos (ventana decodificada) por banda.
+- Las ventanas crudas pasan por la caché local de ``cache_ventanas`` (S2_CACHE).
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.errors import RasterioError
+from rasterio.transform import array_bounds
+from rasterio.warp import Resampling, reproject, transform_bounds
+from rasterio.windows import Window, WindowError
+from rasterio.windows import from_bounds as window_from_bounds
+
+from .cache_ventanas import VentanaCruda, cache_desde_entorno
+
+VARIANTES_BANDA = {
+    'B02': ['B02', 'blue', 'b02'],
+    'B03': ['B03', 'green', 'b03'],
+    'B04': ['B04', 'red', 'b04'],
+    'B05': ['B05', 'rededge1', 'rededge', 'b05'],
+    'B08': ['B08', 'nir', 'b08', 'nir08'],
+    'SCL': ['SCL', 'scl'],
+    'QA60': ['QA60', 'qa60'],
+}
+
+READ_THREADS = int(os.getenv("S2_READ_THREADS", "8"))
+# Items (con todas sus bandas) leídos por delante del que se está procesando.
+# En los scripts que leen la ROI completa cada item en vuelo son 3 arrays del
+# tamaño de la rejilla: 0 = solo las bandas del item actual en paralelo.
+READ_PREFETCH = int(os.getenv("S2_READ_PREFETCH", "1"))
+
+OPCIONES_GDAL = {
+    "GDAL_HTTP_MULTIPLEX": "YES",
+    "GDAL_HTTP_VERSION": "2",
+    "GDAL_HTTP_MERGE_CONSECUTIVE_RANGES": "YES",
+    "GDAL_DISABLE_READDIR_ON_OPEN": "EMPTY_DIR",
+    "CPL_VSIL_CURL_ALLOWED_EXTENSIONS": ".tif,.tiff,.TIF,.TIFF",
+    "VSI_CACHE": "TRUE",
+    "VSI_CACHE_SIZE": os.getenv("GDAL_VSI_CACHE_SIZE", str(64 * 1024 * 1024)),
+    "GDAL_CACHEMAX": int(os.getenv("GDAL_CACHEMAX", "512")),  # rasterio.Env exige entero (MB)
+    "GDAL_HTTP_MAX_RETRY": "3",
+    "GDAL_HTTP_RETRY_DELAY": "1",
+}
+
+# Píxeles de origen extra alrededor de la ventana (núcleo del bilineal)
+MARGEN_ORIGEN = 2
+# Margen (m) alrededor de la huella STAC de un item: las huellas van simplificadas
+HUELLA_MARGEN_M = float(os.getenv("S2_HUELLA_MARGEN_M", "300"))
+
+
+def entorno_gdal(**extra) -> rasterio.Env:
+    return rasterio.Env(**{**OPCIONES_GDAL, **extra})
+
+
+class MetricasLectura:
+    """Latencia y bytes por lectura, agregados por banda (seguro entre hilos)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._tiempos: dict[str, list[float]] = defaultdict(list)
+            self._bytes: dict[str, int] = defaultdict(int)
+            self._errores: dict[str, int] = defaultdict(int)
+            self._cache: dict[str, list[int]] = defaultdict(lambda: [0, 0])
+
+    def registrar(self, banda: str, segundos: float, nbytes: int = 0, ok: bool = True):
+        with self._lock:
+            self._tiempos[banda].append(segundos)
+            self._bytes[banda] += nbytes
+            if not ok:
+                self._errores[banda] += 1
+
+    def registrar_cache(self, banda: str, acierto: bool):
+        with self._lock:
+            self._cache[banda][0 if acierto else 1] += 1
+
+    def resumen(self) -> dict:
+        with self._lock:
+            salida = {}
+            for banda, tiempos in self._tiempos.items():
+                t = np.asarray(tiempos)
+                salida[banda] = {
+                    "lecturas": int(t.size),
+                    "errores": self._errores[banda],
+                    "mb": round(self._bytes[banda] / 1e6, 2),
+                    "p50_ms": round(float(np.percentile(t, 50)) * 1000, 1),
+                    "p95_ms": round(float(np.percentile(t, 95)) * 1000, 1),
+                    "total_s": round(float(t.sum()), 2),
+                }
+            return salida
+
+    def imprimir(self, prefijo: str = "[LECTURA]"):
+        for banda, r in sorted(self.resumen().items()):
+            print(f"{prefijo} {banda}: {r['lecturas']} lecturas ({r['errores']} errores) | "
+                  f"{r['mb']} MB | p50 {r['p50_ms']} ms | p95 {r['p95_ms']} ms")
+        with self._lock:
+            cache = {b: tuple(v) for b, v in self._cache.items()}
+        for banda, (aciertos, fallos) in sorted(cache.items()):
+            print(f"{prefijo} {banda}: caché {aciertos} aciertos / {fallos} descargas")
+
+
+metricas = MetricasLectura()
+cache_ventanas = cache_desde_entorno()
+
+
+def asset_href(item, band_key: str) -> str | None:
+    for variant in VARIANTES_BANDA.get(band_key, [band_key]):
+        if variant in item.assets:
+            return item.assets[variant].href
+    return None
+
+
+def reproyectar_a_rejilla(data, src_transform, src_crs, dst_transform, dst_crs,
+                          width, height, resampling, src_nodata=None, dst_dtype=np.float32):
+    """Igual que reproject_to_grid de los scripts NDVI: NaN (float) o 0 (entero) fuera de datos."""
+    dst_nodata = np.nan if np.issubdtype(dst_dtype, np.floating) else 0
+    dst = np.full((height, width), dst_nodata, dtype=dst_dtype)
+    reproject(
+        source=data,
+        destination=dst,
+        src_transform=src_transform,
+        src_crs=src_crs,
+        dst_transform=dst_transform,
+        dst_crs=dst_crs,
+        resampling=resampling,
+        src_nodata=src_nodata,
+        dst_nodata=dst_nodata,
+    )
+    return dst
+
+
+class PoolDatasets:
+    """
+    Datasets rasterio abiertos por href, con cierre LRU al superar
+    ``max_abiertos``. Un dataset GDAL no se puede usar desde dos hilos a la
+    vez, así que cada hilo tiene su propio juego de datasets.
+    """
+
+    def __init__(self, max_abiertos: int = 256):
+        self.max_abiertos = max_abiertos
+        self._local = threading.local()
+        self._todos: list[OrderedDict] = []
+        self._lock = threading.Lock()
+
+    def _abiertos(self) -> OrderedDict:
+        abiertos = getattr(self._local, "abiertos", None)
+        if abiertos is None:
+            abiertos = self._local.abiertos = OrderedDict()
+            with self._lock:
+                self._todos.append(abiertos)
+        return abiertos
+
+    def get(self, href: str):
+        abiertos = self._abiertos()
+        src = abiertos.get(href)
+        if src is not None:
+            abiertos.move_to_end(href)
+            return src
+        src = rasterio.open(href)
+        abiertos[href] = src
+        while len(abiertos) > self.max_abiertos:
+            _, viejo = abiertos.popitem(last=False)
+            viejo.close()
+        return src
+
+    def close(self):
+        with self._lock:
+            for abiertos in self._todos:
+                for src in abiertos.values():
+                    src.close()
+                abiertos.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def ventana_origen(src, dst_transform, dst_crs, width, height, margen: int = MARGEN_ORIGEN) -> Window | None:
+    """Ventana (entera, recortada al dataset) del COG que cubre la rejilla; None si no solapa."""
+    minx, miny, maxx, maxy = array_bounds(height, width, dst_transform)
+    src_bounds = transform_bounds(dst_crs, src.crs, minx, miny, maxx, maxy, densify_pts=21)
+    win = window_from_bounds(*src_bounds, transform=src.transform)
+    win = Window(win.col_off - margen, win.row_off - margen,
+                 win.width + 2 * margen, win.height + 2 * margen).round_offsets().round_lengths()
+    try:
+        win = win.intersection(Window(0, 0, src.width, src.height))
+    except WindowError:
+        return None
+    if win.width <= 0 or win.height <= 0:
+        return None
+    return win
+
+
+def ventana_huella(item, dst_transform, dst_crs, width, height, halo: int = 0,
+                   margen_m: float = HUELLA_MARGEN_M) -> Window | None:
+    """
+    Ventana (entera) de la rejilla que puede tener datos del item: ``item.bbox``
+    (EPSG:4326) en ``dst_crs`` ampliado ``margen_m`` metros y ``halo`` px,
+    recortada a la rejilla. Fuera de ella la banda reproyectada es todo
+    nodata. Sin bbox en el item, la rejilla completa; None si no la toca.
+    """
+    bbox = getattr(item, "bbox", None)
+    if not bbox:
+        return Window(0, 0, width, height)
+    minx, miny, maxx, maxy = transform_bounds("EPSG:4326", dst_crs, *bbox, densify_pts=21)
+    win = window_from_bounds(minx - margen_m, miny - margen_m, maxx + margen_m, maxy + margen_m,
+                             transform=dst_transform)
+    c0 = max(int(np.floor(win.col_off)) - halo, 0)
+    r0 = max(int(np.floor(win.row_off)) - halo, 0)
+    c1 = min(int(np.ceil(win.col_off + win.width)) + halo, width)
+    r1 = min(int(np.ceil(win.row_off + win.height)) + halo, height)
+    if c1 <= c0 or r1 <= r0:
+        return None
+    return Window(c0, r0, c1 - c0, r1 - r0)
+
+
+def _remuestreo(band_key: str):
+    if band_key == 'SCL':
+        return Resampling.nearest, np.int16
+    if band_key == 'QA60':
+        return Resampling.nearest, np.uint16
+    return Resampling.bilinear, np.float32
+
+
+def _leer_ventana(src, band_key: str, win: Window) -> np.ndarray:
+    t0 = time.perf_counter()
+    ok = False
+    nbytes = 0
+    try:
+        data = src.read(1, window=win)
+        ok = True
+        nbytes = data.nbytes
+        return data
+    finally:
+        metricas.registrar(band_key, time.perf_counter() - t0, nbytes, ok)
+
+
+def _reproyectar(cruda: VentanaCruda, band_key: str, dst_transform, dst_crs, width, height):
+    resampling, dtype = _remuestreo(band_key)
+    return reproyectar_a_rejilla(
+        cruda.data, cruda.transform, cruda.crs,
+        dst_transform, dst_crs, width, height,
+        resampling, src_nodata=cruda.nodata, dst_dtype=dtype,
+    )
+
+
+def _cruda_rejilla(src, band_key: str, dst_transform, dst_crs, width, height) -> VentanaCruda:
+    win = ventana_origen(src, dst_transform, dst_crs, width, height)
+    if win is None:
+        return VentanaCruda(None)
+    data = _leer_ventana(src, band_key, win)
+    return VentanaCruda(data, src.window_transform(win), src.crs.to_wkt(), src.nodata)
+
+
+def _ventana_bbox(src, bbox_4326) -> Window | None:
+    """Ventana del COG en la intersección entre el tile y el bbox EPSG:4326; None si no solapan."""
+    tile_bounds = src.bounds
+    src_bbox = transform_bounds("EPSG:4326", src.crs, *bbox_4326, densify_pts=21)
+    interseccion = (
+        max(tile_bounds.left, src_bbox[0]),
+        max(tile_bounds.bottom, src_bbox[1]),
+        min(tile_bounds.right, src_bbox[2]),
+        min(tile_bounds.top, src_bbox[3]),
+    )
+    if interseccion[0] >= interseccion[2] or interseccion[1] >= interseccion[3]:
+        return None
+    return window_from_bounds(*interseccion, transform=src.transform)
+
+
+def _cruda_bbox(href: str, band_key: str, bbox_4326) -> VentanaCruda:
+    with rasterio.open(href) as src:
+        win = _ventana_bbox(src, bbox_4326)
+        if win is None:
+            return VentanaCruda(None)
+        data = _leer_ventana(src, band_key, win)
+        return VentanaCruda(data, src.window_transform(win), src.crs.to_wkt(), src.nodata)
+
+
+def _cruda_overview_bbox(href: str, band_key: str, bbox_4326, factor_sin_overviews: int) -> VentanaCruda:
+    """
+    Ventana del bbox leída a la resolución de la overview más pequeña del COG
+    (GDAL sirve la lectura submuestreada desde la overview: solo se descargan
+    sus teselas). Sin overviews se submuestrea ``factor_sin_overviews`` veces.
+    """
+    with rasterio.open(href) as src:
+        win = _ventana_bbox(src, bbox_4326)
+        if win is None:
+            return VentanaCruda(None)
+        factores = src.overviews(1)
+        f = factores[-1] if factores else factor_sin_overviews
+        alto, ancho = max(1, int(np.ceil(win.height / f))), max(1, int(np.ceil(win.width / f)))
+        t0 = time.perf_counter()
+        ok = False
+        data = None
+        try:
+            data = src.read(1, window=win, out_shape=(alto, ancho), resampling=Resampling.nearest)
+            ok = True
+        finally:
+            metricas.registrar(f"{band_key}_ov", time.perf_counter() - t0, data.nbytes if ok else 0, ok)
+        t_win = src.window_transform(win) * Affine.scale(win.width / ancho, win.height / alto)
+        return VentanaCruda(data, t_win, src.crs.to_wkt(), src.nodata)
+
+
+def _con_cache(item, band_key: str, ventana: tuple, leer) -> VentanaCruda:
+    """``leer()`` solo si la ventana no está en la caché local (y entonces se guarda)."""
+    cache = cache_ventanas
+    if cache is None:
+        return leer()
+    clave = cache.clave(item.id, band_key, *ventana)
+    cruda = cache.get(clave)
+    metricas.registrar_cache(band_key, cruda is not None)
+    if cruda is None:
+        cruda = leer()
+        cache.put(clave, cruda)
+    return cruda
+
+
+def leer_banda_rejilla(src, band_key: str, dst_transform, dst_crs, width, height):
+    """
+    Banda reproyectada a la rejilla (height, width): SCL en int16 con nearest,
+    reflectancias (B02...B08) en float32 con bilineal. None si el COG no cubre la rejilla.
+    """
+    cruda = _cruda_rejilla(src, band_key, dst_transform, dst_crs, width, height)
+    if cruda.data is None:
+        return None
+    return _reproyectar(cruda, band_key, dst_transform, dst_crs, width, height)
+
+
+def leer_banda_item_rejilla(pool: PoolDatasets, item, band_key: str, dst_transform, dst_crs, width, height):
+    """``leer_banda_rejilla`` para un item STAC, pasando por la caché: con acierto no se abre el COG."""
+    href = asset_href(item, band_key)
+    if href is None:
+        return None
+    ventana = ("rejilla", tuple(dst_transform)[:6], str(dst_crs), width, height)
+    cruda = _con_cache(
+        item, band_key, ventana,
+        lambda: _cruda_rejilla(pool.get(href), band_key, dst_transform, dst_crs, width, height),
+    )
+    if cruda.data is None:
+        return None
+    return _reproyectar(cruda, band_key, dst_transform, dst_crs, width, height)
+
+
+def leer_banda_bbox(item, band_key: str, bbox_4326, dst_transform, dst_crs, width, height):
+    """
+    Lectura de los scripts NDVI: ventana = intersección entre el tile y el
+    bbox EPSG:4326 de la ROI, reproyectada a la rejilla completa. None si el
+    item no tiene la banda o no cubre la ROI; las excepciones se propagan.
+    La ventana cruda no depende de la rejilla: la caché sirve aunque cambie NDVI_RES_M.
+    """
+    href = asset_href(item, band_key)
+    if href is None:
+        return None
+
+    ventana = ("bbox", tuple(round(float(v), 9) for v in bbox_4326))
+    cruda = _con_cache(item, band_key, ventana, lambda: _cruda_bbox(href, band_key, bbox_4326))
+    if cruda.data is None:
+        return None
+    return _reproyectar(cruda, band_key, dst_transform, dst_crs, width, height)
+
+
+def leer_banda_overview_bbox(item, band_key: str, bbox_4326, dst_transform, dst_crs, width, height,
+                             factor_sin_overviews: int = 16):
+    """
+    Como ``leer_banda_bbox`` pero desde la overview más pequeña del COG, para
+    rejillas gruesas (el cribado por SCL de ``cribado_scl``). Pasa por la caché
+    de ventanas con su propia clave.
+    """
+    href = asset_href(item, band_key)
+    if href is None:
+        return None
+
+    ventana = ("overview", tuple(round(float(v), 9) for v in bbox_4326), factor_sin_overviews)
+    cruda = _con_cache(item, band_key, ventana,
+                       lambda: _cruda_overview_bbox(href, band_key, bbox_4326, factor_sin_overviews))
+    if cruda.data is None:
+        return None
+    return _reproyectar(cruda, band_key, dst_transform, dst_crs, width, height)
+
+
+# ==================== LECTURA CONCURRENTE ====================
+
+class LectorConcurrente:
+    """
+    Lee varias bandas de varios items en paralelo (``hilos`` lecturas a la
+    vez) y los entrega en el orden de entrada como (item, {banda: array|None}).
+    Mientras el llamador procesa un item se leen como mucho los ``prefetch``
+    siguientes (0 = solo se paralelizan las bandas de cada item).
+
+    ``leer(item, band_key)`` hace la lectura; sus excepciones se imprimen (si
+    ``debug``) y la banda queda a None, como hacía read_band_window_cog.
+    """
+
+    def __init__(self, hilos: int = READ_THREADS, prefetch: int = READ_PREFETCH, debug: bool = False):
+        self.hilos = max(1, hilos)
+        self.prefetch = max(0, prefetch)
+        self.debug = debug
+        self._pool: ThreadPoolExecutor | None = None
+        self._lock = threading.Lock()  # bandas_items desde varios hilos (fechas en paralelo)
+
+    def _ejecutor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix="lector-s2")
+            return self._pool
+
+    def _leer(self, leer, item, band_key):
+        # Solo los errores de lectura dejan la banda en None: un fallo al
+        # configurar GDAL o de programación tiene que llegar al script
+        with entorno_gdal():
+            try:
+                return leer(item, band_key)
+            except (RasterioError, OSError) as e:
+                if self.debug:
+                    print(f"[BAND] ✗ Error leyendo {band_key} de {getattr(item, 'id', item)}: {e}")
+                return None
+
+    def bandas_items(self, items, bandas, leer):
+        bandas = tuple(bandas)
+        if self.hilos == 1:
+            for item in items:
+                yield item, {b: self._leer(leer, item, b) for b in bandas}
+            return
+
+        pool = self._ejecutor()
+        pendientes: deque = deque()
+        iterador = iter(items)
+
+        def lanzar() -> bool:
+            item = next(iterador, None)
+            if item is None:
+                return False
+            pendientes.append((item, {b: pool.submit(self._leer, leer, item, b) for b in bandas}))
+            return True
+
+        for _ in range(max(1, self.prefetch)):
+            if not lanzar():
+                break
+
+        while pendientes:
+            item, futuros = pendientes.popleft()
+            resultado = {b: f.result() for b, f in futuros.items()}
+            if self.prefetch:
+                lanzar()
+            yield item, resultado
+            if not self.prefetch:
+                lanzar()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
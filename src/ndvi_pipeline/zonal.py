@@ -0,0 +1,323 @@
+"""
+zonal.py
+--------
+Estadísticas zonales de todos los recintos en una sola pasada sobre el ráster.
+
+En lugar de recortar/enmascarar el ráster geometría a geometría, se
+rasterizan una vez todas las geometrías en un ráster de etiquetas int32
+alineado con la rejilla del NDVI (0 = fuera de todo recinto, i + 1 = la
+geometría i) y se agregan todos los píxeles a la vez:
+
+- nº de píxeles, suma y suma de cuadrados con ``np.bincount``;
+- media y desviación (poblacional, centrada en la media de cada recinto);
+- min, max y percentiles ordenando los píxeles por (etiqueta, valor): cada
+  recinto queda en un segmento contiguo y su percentil es una interpolación
+  lineal dentro del segmento, igual que ``np.percentile``.
+
+Un píxel pertenece a una geometría si su centro cae dentro (como
+``geometry_mask``/``rasterio.mask`` con ``all_touched=False``). Un píxel solo
+admite una etiqueta por capa: las geometrías que se solapan (intersección con
+área > 0) se reparten en varias capas de etiquetas (coloreado voraz del grafo
+de solapes, normalmente 2-4 capas) y cada capa se agrega igual, así que los
+solapes también van vectorizados.
+
+El ráster de etiquetas se guarda en ``ZONAL_CACHE_DIR`` con una clave que
+depende de la rejilla y de los ids/geometrías: las ejecuciones diarias sobre
+la misma ROI no vuelven a rasterizar. Cada edición de recintos o cambio de
+rejilla crea otra entrada, así que la caché expulsa las menos usadas (LRU por
+mtime, como ``cache_ventanas``) al pasar de ``ZONAL_CACHE_MAX_GB``.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import math
+import os
+from pathlib import Path
+
+import numpy as np
+import shapely
+from rasterio.features import geometry_mask, rasterize
+from shapely import STRtree
+from shapely.errors import GEOSException
+
+from project_paths import PROJECT_ROOT
+
+ZONAL_CACHE_DIR = Path(os.getenv("ZONAL_CACHE_DIR", str(PROJECT_ROOT / "data" / "cache" / "etiquetas_recintos")))
+ZONAL_CACHE_MAX_GB = float(os.getenv("ZONAL_CACHE_MAX_GB", "5"))
+
+
+# ==================== GEOMETRÍA A GEOMETRÍA ====================
+
+def ventana_geometria(geom, transform, shape) -> tuple[slice, slice] | None:
+    """Filas/columnas de la rejilla que cubren el bbox de ``geom`` (recortadas a la rejilla)."""
+    minx, miny, maxx, maxy = geom.bounds
+    inv = ~transform
+    cols, rows = zip(*(inv * (x, y) for x in (minx, maxx) for y in (miny, maxy)))
+    r0 = max(math.floor(min(rows)), 0)
+    r1 = min(math.ceil(max(rows)), shape[0])
+    c0 = max(math.floor(min(cols)), 0)
+    c1 = min(math.ceil(max(cols)), shape[1])
+    if r1 <= r0 or c1 <= c0:
+        return None
+    return slice(r0, r1), slice(c0, c1)
+
+
+def valores_geometria(valores: np.ndarray, transform, geom, all_touched: bool = False) -> np.ndarray:
+    """Valores finitos de ``valores`` dentro de ``geom`` (referencia del cálculo por etiquetas)."""
+    ventana = ventana_geometria(geom, transform, valores.shape)
+    if ventana is None:
+        return np.array([], dtype=valores.dtype)
+    filas, cols = ventana
+    arr = valores[filas, cols]
+    t = transform * transform.translation(cols.start, filas.start)
+    dentro = geometry_mask([geom], transform=t, out_shape=arr.shape, invert=True, all_touched=all_touched)
+    vals = arr[dentro]
+    return vals[np.isfinite(vals)]
+
+
+def _pares_solapados(geoms: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Índices (i, j), i < j, de los pares de geometrías cuya intersección tiene área > 0."""
+    vacio = np.array([], dtype=np.intp)
+    if len(geoms) < 2:
+        return vacio, vacio
+
+    izq, der = STRtree(geoms).query(geoms, predicate="intersects")
+    pares = izq < der
+    izq, der = izq[pares], der[pares]
+    if izq.size == 0:
+        return vacio, vacio
+    try:
+        areas = shapely.area(shapely.intersection(geoms[izq], geoms[der]))
+    except GEOSException:
+        # Alguna geometría inválida: par a par, y ante la duda se consideran solapadas
+        areas = np.empty(izq.size)
+        for n, (a, b) in enumerate(zip(geoms[izq], geoms[der])):
+            try:
+                areas[n] = a.intersection(b).area
+            except GEOSException:
+                areas[n] = np.inf
+    conflicto = areas > 0
+    return izq[conflicto], der[conflicto]
+
+
+def recintos_solapados(geoms) -> np.ndarray:
+    """True para las geometrías cuya intersección con alguna otra tiene área > 0."""
+    geoms = np.asarray(geoms, dtype=object)
+    solapados = np.zeros(len(geoms), dtype=bool)
+    izq, der = _pares_solapados(geoms)
+    solapados[izq] = True
+    solapados[der] = True
+    return solapados
+
+
+def capas_recintos(geoms) -> np.ndarray:
+    """
+    Capa de etiquetas de cada geometría: dos geometrías que se solapan nunca
+    comparten capa. Coloreado voraz en orden de índice (determinista); sin
+    solapes todas van a la capa 0.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    capa = np.zeros(len(geoms), dtype=np.int16)
+    izq, der = _pares_solapados(geoms)
+    if izq.size == 0:
+        return capa
+    vecinos: dict[int, list[int]] = {}
+    for a, b in zip(izq.tolist(), der.tolist()):
+        vecinos.setdefault(b, []).append(a)  # Solo hacen falta los vecinos de índice menor
+    for i in sorted(vecinos):
+        ocupadas = {int(capa[j]) for j in vecinos[i]}
+        c = 0
+        while c in ocupadas:
+            c += 1
+        capa[i] = c
+    return capa
+
+
+# ==================== REDUCCIONES POR ETIQUETA ====================
+
+def _lerp(a, b, t):
+    # Misma interpolación que np.percentile (método "linear")
+    diff = b - a
+    res = a + diff * t
+    return np.where(t >= 0.5, b - diff * (1 - t), res)
+
+
+def estadisticas_zonales(valores: np.ndarray, etiquetas: np.ndarray, n: int, percentiles=()) -> dict:
+    """
+    Estadísticas de los píxeles finitos de ``valores`` agrupados por
+    ``etiquetas`` (1..n; 0 se ignora). Devuelve arrays de longitud ``n``:
+    count, sum, sum2, mean, std, min, max y ``p<q>`` por percentil
+    (NaN donde count == 0).
+    """
+    et = etiquetas.ravel()
+    v = valores.ravel()
+    sel = (et > 0) & np.isfinite(v)
+    et = et[sel].astype(np.intp) - 1
+    v = v[sel].astype(np.float64)
+
+    count = np.bincount(et, minlength=n)[:n]
+    suma = np.bincount(et, weights=v, minlength=n)[:n]
+    suma2 = np.bincount(et, weights=v * v, minlength=n)[:n]
+    hay = count > 0
+
+    mean = np.full(n, np.nan)
+    mean[hay] = suma[hay] / count[hay]
+    std = np.full(n, np.nan)
+    desv2 = np.bincount(et, weights=np.square(v - mean[et]), minlength=n)[:n]
+    std[hay] = np.sqrt(desv2[hay] / count[hay])
+
+    # Segmentos contiguos por etiqueta, ordenados por valor dentro del segmento
+    vs = v[np.lexsort((v, et))]
+    fin = np.cumsum(count)
+    ini = fin - count
+
+    resultado = {"count": count, "sum": suma, "sum2": suma2, "mean": mean, "std": std}
+    for nombre, pos in (("min", ini), ("max", fin - 1)):
+        arr = np.full(n, np.nan)
+        arr[hay] = vs[pos[hay]]
+        resultado[nombre] = arr
+
+    for q in percentiles:
+        virtual = (count[hay] - 1) * (np.float64(q) / 100)
+        previo = np.floor(virtual)
+        siguiente = np.minimum(previo + 1, count[hay] - 1)
+        t = virtual - previo
+        a = vs[ini[hay] + previo.astype(np.intp)]
+        b = vs[ini[hay] + siguiente.astype(np.intp)]
+        arr = np.full(n, np.nan)
+        arr[hay] = _lerp(a, b, t)
+        resultado[f"p{q:g}"] = arr
+
+    return resultado
+
+
+def _estadisticas_valores(vals: np.ndarray, percentiles) -> dict:
+    """Mismas claves que ``estadisticas_zonales`` para un único conjunto de valores."""
+    v = vals.astype(np.float64)
+    if v.size == 0:
+        return {"count": 0, "sum": 0.0, "sum2": 0.0, **{k: np.nan for k in ("mean", "std", "min", "max")},
+                **{f"p{q:g}": np.nan for q in percentiles}}
+    media = v.sum() / v.size
+    return {
+        "count": v.size,
+        "sum": v.sum(),
+        "sum2": (v * v).sum(),
+        "mean": media,
+        "std": float(np.sqrt(np.square(v - media).sum() / v.size)),
+        "min": v.min(),
+        "max": v.max(),
+        **{f"p{q:g}": float(np.percentile(v, q)) for q in percentiles},
+    }
+
+
+# ==================== RÁSTER DE ETIQUETAS ====================
+
+def _clave_cache(ids, geoms, transform, crs, shape) -> str:
+    h = hashlib.sha256()
+    h.update(repr((tuple(transform)[:6], str(crs), tuple(shape))).encode("utf-8"))
+    h.update(np.asarray(ids, dtype=np.int64).tobytes())
+    for wkb in shapely.to_wkb(np.asarray(geoms, dtype=object)):
+        h.update(wkb if wkb is not None else b"-")
+    return h.hexdigest()
+
+
+def expulsar_cache(cache_dir, max_bytes: float, conservar: Path | None = None) -> int:
+    """Borra las entradas usadas hace más tiempo hasta quedar por debajo de ``max_bytes``. Devuelve cuántas."""
+    ficheros = []
+    for ruta in Path(cache_dir).glob("*.npz"):
+        if ruta.name.endswith(".tmp.npz") or ruta == conservar:
+            continue
+        try:
+            st = ruta.stat()
+        except OSError:
+            continue
+        ficheros.append((st.st_mtime, st.st_size, ruta))
+    total = sum(tam for _, tam, _ in ficheros)
+    if conservar is not None and conservar.exists():
+        total += conservar.stat().st_size
+    borrados = 0
+    for _, tam, ruta in sorted(ficheros):
+        if total <= max_bytes:
+            break
+        ruta.unlink(missing_ok=True)
+        total -= tam
+        borrados += 1
+    return borrados
+
+
+class EtiquetasRecintos:
+    """
+    Ráster(s) de etiquetas de un conjunto de geometrías sobre una rejilla:
+    ``etiquetas[k]`` tiene las geometrías con ``capa == k`` (-1 = sin geometría).
+    """
+
+    def __init__(self, geoms, transform, etiquetas: np.ndarray, capa: np.ndarray):
+        self.geoms = list(geoms)
+        self.transform = transform
+        self.etiquetas = etiquetas
+        self.capa = capa
+
+    @classmethod
+    def construir(cls, geoms, ids, transform, crs, shape, cache_dir=ZONAL_CACHE_DIR):
+        """
+        ``geoms`` ya en el CRS de la rejilla (None = sin geometría). Con
+        ``cache_dir`` None no se lee ni se guarda nada en disco.
+        """
+        geoms = list(geoms)
+        validas = np.array([g is not None and not g.is_empty for g in geoms], dtype=bool)
+
+        ruta = None
+        if cache_dir is not None:
+            ruta = Path(cache_dir) / f"{_clave_cache(ids, geoms, transform, crs, shape)}.npz"
+            if ruta.exists():
+                try:
+                    with np.load(ruta, allow_pickle=False) as z:
+                        etiquetas, capa = z["etiquetas"], z["capa"]
+                    os.utime(ruta)  # Última vez usada (LRU)
+                    print(f"[ZONAL] ✓ Ráster de etiquetas en caché ({ruta.name[:12]}...)")
+                    return cls(geoms, transform, etiquetas, capa)
+                except (OSError, KeyError, ValueError) as e:
+                    print(f"[ZONAL] ⚠️ Caché ilegible ({e}): se vuelve a rasterizar")
+
+        capa = np.full(len(geoms), -1, dtype=np.int16)
+        idx_validas = np.flatnonzero(validas)
+        capa[idx_validas] = capas_recintos([geoms[i] for i in idx_validas])
+
+        n_capas = int(capa.max()) + 1 if idx_validas.size else 1
+        etiquetas = np.zeros((n_capas, *shape), dtype=np.int32)
+        for k in range(n_capas):
+            formas = [(geoms[i], i + 1) for i in np.flatnonzero(capa == k)]
+            if formas:
+                etiquetas[k] = rasterize(formas, out_shape=shape, transform=transform, fill=0,
+                                         dtype="int32", all_touched=False)
+        print(f"[ZONAL] Rasterizadas {idx_validas.size:,} geometrías en {n_capas} capa(s) de etiquetas "
+              f"({int((capa > 0).sum()):,} fuera de la primera por solapes)")
+
+        if ruta is not None:
+            try:
+                ruta.parent.mkdir(parents=True, exist_ok=True)
+                tmp = ruta.with_name(f"{ruta.stem}.{os.getpid()}.tmp.npz")
+                np.savez_compressed(tmp, etiquetas=etiquetas, capa=capa)
+                os.replace(tmp, ruta)
+                borrados = expulsar_cache(ruta.parent, ZONAL_CACHE_MAX_GB * 1e9, conservar=ruta)
+                if borrados:
+                    print(f"[ZONAL] Caché de etiquetas: {borrados} entrada(s) antiguas borradas "
+                          f"(ZONAL_CACHE_MAX_GB={ZONAL_CACHE_MAX_GB:g})")
+            except OSError as e:
+                print(f"[ZONAL] ⚠️ No se pudo guardar la caché de etiquetas: {e}")
+
+        return cls(geoms, transform, etiquetas, capa)
+
+    def estadisticas(self, valores: np.ndarray, percentiles=()) -> dict:
+        """``estadisticas_zonales`` para todas las geometrías (índice = posición en ``geoms``)."""
+        if valores.shape != self.etiquetas.shape[1:]:
+            raise ValueError(f"Ráster {valores.shape} y etiquetas {self.etiquetas.shape[1:]} no coinciden")
+        n = len(self.geoms)
+        resultado = estadisticas_zonales(valores, self.etiquetas[0], n, percentiles)
+        for k in range(1, self.etiquetas.shape[0]):
+            en_capa = self.capa == k
+            parcial = estadisticas_zonales(valores, self.etiquetas[k], n, percentiles)
+            for clave, arr in parcial.items():
+                resultado[clave][en_capa] = arr[en_capa]
+        return resultado
@@ -0,0 +1,121 @@
+"""
+bench_cache_ventanas.py
+-----------------------
+Mide la caché local de ventanas COG (``ndvi_pipeline.cache_ventanas``)
+sobre los mismos COG sintéticos y servidor HTTP de ``bench_lector_s2``:
+
+- sin caché: todas las lecturas van al servidor;
+- caché fría: igual, pero guardando cada ventana en un directorio temporal;
+- caché caliente: misma pasada otra vez (ninguna petición HTTP esperada);
+- caché caliente + escenas nuevas: simula la ejecución diaria, en la que solo
+  las escenas añadidas se descargan.
+
+Comprueba que todas las pasadas devuelven los mismos arrays.
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_cache_ventanas --items 6 --nuevas 1 --latencia-ms 40
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import ndvi_pipeline.lector_s2 as lector_s2  # noqa: E402
+from ndvi_pipeline.cache_ventanas import CacheVentanas  # noqa: E402
+from scripts.benchmark.bench_lector_s2 import (  # noqa: E402
+    _Contador,
+    crear_fixtures,
+    items_falsos,
+    pasada,
+    rejilla,
+    servidor_cog,
+)
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Benchmark de la caché local de ventanas COG.")
+    p.add_argument("--items", type=int, default=6, help="Escenas sintéticas ya vistas en la ejecución anterior")
+    p.add_argument("--nuevas", type=int, default=1, help="Escenas que aparecen en la ejecución siguiente")
+    p.add_argument("--lado", type=int, default=2048, help="Lado de las bandas de 10 m (px)")
+    p.add_argument("--res", type=float, default=20.0, help="Resolución de la rejilla destino (m)")
+    p.add_argument("--latencia-ms", type=float, default=40.0, help="Latencia añadida por petición GET")
+    p.add_argument("--hilos", type=int, default=8)
+    p.add_argument("--semilla", type=int, default=3)
+    args = p.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directorio = Path(tmp) / "cog"
+        directorio.mkdir()
+        total = args.items + args.nuevas
+        print(f"[FIXTURES] Generando {total} escenas de {args.lado}² px en {directorio}...")
+        nombres = crear_fixtures(directorio, total, args.lado, args.semilla)
+        vistas = nombres[:args.items]
+
+        contador = _Contador()
+        httpd = servidor_cog(directorio, args.latencia_ms / 1000, contador)
+        host, port = httpd.server_address
+        bbox_4326, dst_transform, width, height = rejilla(directorio, nombres, args.res)
+        print(f"[FIXTURES] Servidor en http://{host}:{port} | rejilla {width} x {height} px")
+
+        cache = CacheVentanas(Path(tmp) / "cache", max_bytes=int(50e9))
+        pasadas = (
+            ("sin caché", None, vistas),
+            ("caché fría", cache, vistas),
+            ("caché caliente", cache, vistas),
+            (f"caliente + {args.nuevas} nuevas", cache, nombres),
+        )
+
+        filas = []
+        referencia: dict = {}
+        ok = True
+        try:
+            for n, (nombre_pasada, cache_pasada, escenas) in enumerate(pasadas):
+                lector_s2.cache_ventanas = cache_pasada
+                contador.peticiones = contador.bytes = 0
+                # Prefijo distinto por pasada: la caché /vsicurl/ de GDAL no cuenta
+                base = f"http://{host}:{port}/p{n}"
+                resultados, segundos = pasada(
+                    items_falsos(base, escenas), bbox_4326, dst_transform, width, height, args.hilos, 2,
+                )
+                print(f"\n[{nombre_pasada}]")
+                lector_s2.metricas.imprimir("  ")
+                filas.append((nombre_pasada, segundos, contador.peticiones, contador.bytes))
+
+                for clave, arr in resultados.items():
+                    if clave not in referencia:
+                        referencia[clave] = arr
+                        continue
+                    ref = referencia[clave]
+                    if (arr is None) != (ref is None) or (arr is not None and not np.array_equal(arr, ref, equal_nan=True)):
+                        print(f"  ✗ {clave} difiere de la pasada sin caché")
+                        ok = False
+        finally:
+            httpd.shutdown()
+
+        tam_cache = sum(f.stat().st_size for f in (Path(tmp) / "cache").glob("*/*.npz"))
+
+    print(f"\n{'pasada':<28} {'s':>8} {'peticiones':>11} {'MB servidos':>12}")
+    for nombre_pasada, segundos, peticiones, nbytes in filas:
+        print(f"{nombre_pasada:<28} {segundos:>8.2f} {peticiones:>11} {nbytes / 1e6:>12.2f}")
+    print(f"\nCaché en disco: {tam_cache / 1e6:.2f} MB")
+
+    if filas[2][2] != 0:
+        print("❌ La pasada con caché caliente ha hecho peticiones HTTP")
+        ok = False
+    if not ok:
+        print("❌ Resultados distintos con y sin caché")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+bench_cog_3857.py
+-----------------
+Tiempo y paridad de la salida EPSG:3857 del NDVI:
+
+- antes: ``reproject`` de la banda completa en un hilo a un GeoTIFF en
+  teselas y una segunda pasada para las overviews (``add_overviews``), como
+  hacían ``ndvi_composite.py`` y ``ndvi_diax.py`` (copiado aquí tal cual);
+- ahora: ``webapp.utils.ndvi_warp.warp_a_3857``, el mismo ``reproject`` con
+  ``num_threads``/``warp_mem_limit`` (por defecto) y, con ``cog=True``
+  (``WARP_COG=1``), la copia posterior con el driver COG.
+
+Sobre un NDVI sintético en EPSG:25830 con huecos (NaN) comprueba en los dos
+modos que la resolución completa coincide (mismas posiciones NaN, valores con
+tolerancia de float32) y que hay overviews internas, y en el modo COG el
+layout COG. El speedup depende de los núcleos: con 1 CPU solo cabe esperar
+el mismo tiempo que antes (más la compresión).
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_cog_3857 --lado 12000 --hilos ALL_CPUS
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import Resampling, calculate_default_transform, reproject
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from scripts.benchmark.bench_zonal import ndvi_sintetico  # noqa: E402
+from webapp.utils.ndvi_warp import add_overviews, warp_a_3857  # noqa: E402
+
+
+# ==================== VERSIÓN ANTIGUA (copia literal) ====================
+
+def warp_tif_to_3857_antiguo(src_tif: str, dst_tif: str):
+    """Reproyectar a EPSG:3857 para visualización web"""
+    dst_crs = "EPSG:3857"
+    with rasterio.open(src_tif) as src:
+        transform, width, height = calculate_default_transform(
+            src.crs, dst_crs, src.width, src.height, *src.bounds
+        )
+        kwargs = src.meta.copy()
+        kwargs.update({
+            "crs": dst_crs,
+            "transform": transform,
+            "width": width,
+            "height": height,
+            "nodata": src.nodata,
+            "tiled": True,
+            "blockxsize": 256,
+            "blockysize": 256,
+        })
+
+        with rasterio.open(dst_tif, "w", **kwargs) as dst:
+            reproject(
+                source=rasterio.band(src, 1),
+                destination=rasterio.band(dst, 1),
+                src_transform=src.transform,
+                src_crs=src.crs,
+                dst_transform=transform,
+                dst_crs=dst_crs,
+                resampling=Resampling.bilinear,
+                src_nodata=src.nodata,
+                dst_nodata=src.nodata,
+            )
+            # Overviews para las teselas XYZ del visor
+            add_overviews(dst)
+
+
+# ==================== MAIN ====================
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Paridad y tiempos de la salida EPSG:3857 del NDVI.")
+    p.add_argument("--lado", type=int, default=8000, help="Lado del NDVI 25830 (px)")
+    p.add_argument("--hilos", default="ALL_CPUS", help="num_threads del warp y del driver COG")
+    p.add_argument("--mem", type=int, default=512, help="warp_mem_limit (MB)")
+    p.add_argument("--semilla", type=int, default=5)
+    args = p.parse_args(argv)
+
+    rng = np.random.default_rng(args.semilla)
+    ndvi = ndvi_sintetico(args.lado, rng)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        src = tmp / "ndvi_utm.tif"
+        perfil = {
+            "driver": "GTiff", "height": args.lado, "width": args.lado, "count": 1,
+            "dtype": "float32", "crs": "EPSG:25830", "transform": from_origin(350000, 4650000, 10, 10),
+            "nodata": np.nan, "compress": "deflate", "tiled": True, "blockxsize": 256, "blockysize": 256,
+        }
+        with rasterio.open(src, "w", **perfil) as dst:
+            dst.write(ndvi, 1)
+        print(f"[COG] NDVI 25830 de {args.lado}² px")
+
+        antiguo = tmp / "antiguo_3857.tif"
+        t0 = time.perf_counter()
+        warp_tif_to_3857_antiguo(str(src), str(antiguo))
+        tiempos = {"antes": time.perf_counter() - t0}
+        salidas = {"antes": antiguo}
+        for modo, cog in (("teselas", False), ("cog", True)):
+            salidas[modo] = tmp / f"{modo}_3857.tif"
+            t0 = time.perf_counter()
+            warp_a_3857(str(src), str(salidas[modo]), num_threads=args.hilos, warp_mem_mb=args.mem, cog=cog)
+            tiempos[modo] = time.perf_counter() - t0
+
+        errores = []
+        with rasterio.open(antiguo) as a:
+            rejilla = (a.transform, a.width, a.height)
+            va = a.read(1)
+            ov_a = a.overviews(1)
+        filas = [("reproject + add_overviews (1 hilo)", "antes", ov_a, "-")]
+        for modo in ("teselas", "cog"):
+            with rasterio.open(salidas[modo]) as b:
+                misma_rejilla = (b.transform, b.width, b.height) == rejilla
+                vb = b.read(1)
+                ov_b = b.overviews(1)
+                layout = b.tags(ns="IMAGE_STRUCTURE").get("LAYOUT", "-")
+            filas.append((f"warp_a_3857 {modo} ({args.hilos})", modo, ov_b, layout))
+            if not misma_rejilla:
+                errores.append(f"{modo}: la rejilla 3857 no coincide")
+            elif not np.array_equal(np.isnan(va), np.isnan(vb)):
+                errores.append(f"{modo}: {int((np.isnan(va) != np.isnan(vb)).sum()):,} píxeles NaN distintos")
+            elif not np.allclose(va, vb, rtol=0, atol=1e-6, equal_nan=True):
+                errores.append(f"{modo}: diferencia máxima {float(np.nanmax(np.abs(va - vb))):.2e}")
+            if not ov_b:
+                errores.append(f"{modo}: sin overviews internas")
+            if modo == "cog" and layout != "COG":
+                errores.append(f"cog: layout {layout!r} (GDAL sin driver COG?)")
+        mb = {modo: ruta.stat().st_size / 1e6 for modo, ruta in salidas.items()}
+
+    print(f"\n{'método':<38} {'s':>8} {'x':>6} {'MB':>8}  overviews / layout")
+    for nombre, modo, ov, layout in filas:
+        print(f"{nombre:<38} {tiempos[modo]:>8.2f} {tiempos['antes'] / tiempos[modo]:>6.2f} {mb[modo]:>8.1f}  "
+              f"{ov} / {layout}")
+
+    if errores:
+        print("❌ " + "; ".join(errores))
+        return 1
+    print("✓ Misma rejilla, huecos y valores que el warp antiguo, con overviews (y layout COG con cog=True)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,182 @@
+"""
+bench_colormap.py
+-----------------
+Paridad píxel a píxel y tiempos del coloreado NDVI por LUT
+(``webapp.utils.ndvi_colormap``) frente a las implementaciones anteriores:
+
+- ``ndvi_to_rgba`` de ndvi_composite/ndvi_diax/ndvi_completo/ndvi_26nov y
+  ``ndvi_to_rgba_discrete`` de generate_thumbnails (eran idénticas).
+- ``tif_to_png_singleband`` de utils/ndvi_warp (escala de grises).
+
+Se comprueba en float32 y float64, con valores justo en los límites de clase,
+NaN e infinitos, y que el PNG escrito por franjas se decodifica igual que el
+RGBA en memoria.
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_colormap --tam 2000 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import io
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from webapp.utils.ndvi_colormap import (  # noqa: E402
+    NDVI_LIMITES,
+    escribir_png_por_bloques,
+    gris_to_rgba,
+    ndvi_to_rgba,
+    rgba_por_bloques,
+)
+
+
+def ndvi_to_rgba_original(ndvi):
+    """Copia de la versión por máscaras de los scripts NDVI."""
+    h, w = ndvi.shape
+    rgba = np.zeros((h, w, 4), dtype=np.uint8)
+    valid = np.isfinite(ndvi)
+
+    if not np.any(valid):
+        return rgba
+
+    ranges_colors = [
+        (-0.2, 0.0, (165, 0, 38)),
+        (0.0, 0.1, (215, 48, 39)),
+        (0.1, 0.2, (244, 109, 67)),
+        (0.2, 0.3, (253, 174, 97)),
+        (0.3, 0.4, (254, 224, 139)),
+        (0.4, 0.5, (255, 255, 191)),
+        (0.5, 0.6, (217, 239, 139)),
+        (0.6, 0.7, (166, 217, 106)),
+        (0.7, 0.8, (102, 189, 99)),
+        (0.8, 0.9, (26, 152, 80)),
+        (0.9, 1.0, (0, 104, 55)),
+    ]
+
+    rgba[valid & (ndvi < -0.2)] = [0, 0, 0, 255]
+
+    for vmin, vmax, color in ranges_colors:
+        mask = valid & (ndvi >= vmin) & (ndvi < vmax)
+        if np.any(mask):
+            rgba[mask] = [*color, 255]
+
+    rgba[valid & (ndvi >= 1.0)] = [0, 104, 55, 255]
+    rgba[~valid, 3] = 0
+
+    return rgba
+
+
+def gris_original(arr, nodata_to_transparent=True):
+    """Copia de tif_to_png_singleband (sin la E/S)."""
+    vmin, vmax = -1.0, 1.0
+    norm = (arr - vmin) / (vmax - vmin)
+    norm = np.clip(norm, 0, 1)
+    rgb = (norm * 255).astype(np.uint8)
+    if nodata_to_transparent:
+        alpha = np.where(np.isfinite(arr), 255, 0).astype(np.uint8)
+    else:
+        alpha = np.full_like(rgb, 255, dtype=np.uint8)
+    return np.dstack([rgb, rgb, rgb, alpha])
+
+
+def ndvi_prueba(tam: int, dtype, semilla: int) -> np.ndarray:
+    """NDVI aleatorio en [-1.2, 1.2] con límites exactos, sus vecinos en ULP, NaN e inf."""
+    rng = np.random.default_rng(semilla)
+    ndvi = rng.uniform(-1.2, 1.2, size=(tam, tam)).astype(dtype)
+    plano = ndvi.reshape(-1)
+
+    especiales = []
+    for lim in NDVI_LIMITES:
+        v = dtype(lim)
+        especiales += [v, np.nextafter(v, dtype(-np.inf)), np.nextafter(v, dtype(np.inf))]
+    especiales += [np.nan, np.inf, -np.inf, dtype(-1.0), dtype(1.0)]
+    especiales = np.array(especiales, dtype=dtype)
+
+    pos = rng.choice(plano.size, size=min(plano.size, 200 * especiales.size), replace=False)
+    plano[pos] = np.resize(especiales, pos.size)
+    return ndvi
+
+
+def _mejor_tiempo(fn, repeticiones):
+    mejor = float("inf")
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        fn()
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Paridad y tiempos del coloreado NDVI por LUT.")
+    p.add_argument("--tam", type=int, nargs="+", default=[1000, 4000], help="Lado del ráster (px)")
+    p.add_argument("--repeticiones", type=int, default=3)
+    p.add_argument("--semilla", type=int, default=7)
+    args = p.parse_args(argv)
+
+    ok = True
+
+    print("Paridad:")
+    for dtype in (np.float32, np.float64):
+        ndvi = ndvi_prueba(300, dtype, args.semilla)
+        casos = {
+            "ndvi_to_rgba": (ndvi_to_rgba_original(ndvi), ndvi_to_rgba(ndvi)),
+            "ndvi_to_rgba (todo NaN)": (
+                ndvi_to_rgba_original(np.full((5, 5), np.nan, dtype=dtype)),
+                ndvi_to_rgba(np.full((5, 5), np.nan, dtype=dtype)),
+            ),
+        }
+        # En gris solo se comparan los píxeles finitos: NaN -> uint8 no está definido en NumPy
+        finito = np.isfinite(ndvi)
+        for transparente in (True, False):
+            a = gris_original(ndvi, transparente)
+            b = gris_to_rgba(ndvi, nodata_to_transparent=transparente)
+            casos[f"gris (transparente={transparente})"] = (a[finito], b[finito])
+            casos[f"gris alfa (transparente={transparente})"] = (a[..., 3], b[..., 3])
+
+        for nombre, (a, b) in casos.items():
+            igual = np.array_equal(a, b)
+            ok &= igual
+            print(f"  {np.dtype(dtype).name:>8} {nombre:<36} {'✓' if igual else '✗ DIFERENTE'}")
+
+    ndvi = ndvi_prueba(1000, np.float32, args.semilla)
+    with tempfile.TemporaryDirectory() as tmp:
+        ruta = Path(tmp) / "ndvi.png"
+        escribir_png_por_bloques(ruta, *ndvi.shape, rgba_por_bloques(ndvi, filas=97))
+        leido = np.asarray(Image.open(io.BytesIO(ruta.read_bytes())).convert("RGBA"))
+    igual = np.array_equal(leido, ndvi_to_rgba(ndvi))
+    ok &= igual
+    print(f"  {'float32':>8} {'PNG por franjas == RGBA':<36} {'✓' if igual else '✗ DIFERENTE'}")
+
+    print(f"\n{'tam':>6} {'original s':>11} {'LUT s':>8} {'x':>6} {'PNG PIL s':>10} {'PNG franjas s':>14}")
+    for tam in args.tam:
+        ndvi = ndvi_prueba(tam, np.float32, args.semilla)
+        t_orig = _mejor_tiempo(lambda: ndvi_to_rgba_original(ndvi), args.repeticiones)
+        t_lut = _mejor_tiempo(lambda: ndvi_to_rgba(ndvi), args.repeticiones)
+        with tempfile.TemporaryDirectory() as tmp:
+            ruta = Path(tmp) / "ndvi.png"
+            t_pil = _mejor_tiempo(
+                lambda: Image.fromarray(ndvi_to_rgba_original(ndvi), mode="RGBA").save(ruta, format="PNG", optimize=True),
+                1,
+            )
+            t_png = _mejor_tiempo(lambda: escribir_png_por_bloques(ruta, tam, tam, rgba_por_bloques(ndvi)), 1)
+        print(f"{tam:>6} {t_orig:>11.3f} {t_lut:>8.3f} {t_orig / t_lut:>6.1f} {t_pil:>10.2f} {t_png:>14.2f}")
+
+    if not ok:
+        print("❌ El coloreado por LUT no coincide con la versión original")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
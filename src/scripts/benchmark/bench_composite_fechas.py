@@ -0,0 +1,165 @@
+"""
+bench_composite_fechas.py
+-------------------------
+Tiempo y paridad de las fechas en paralelo (``NDVI_DATE_WORKERS``) frente a
+secuencial en los dos caminos de ``ndvi_composite.py``:
+
+- por bloques (por defecto, ``componer_por_bloques``): hilos que leen y
+  mezclan las fechas de cada bloque, en ``mejor_pixel`` y ``mediana`` y con
+  dos índices (NDVI y SAVI, que salen de las mismas bandas);
+- en memoria (``NDVI_BLOCK_SIZE=0``, ``build_multi_tile_composite``):
+  procesos con memoria compartida acotada por ``NDVI_DATE_MEM_MB``, también
+  con un presupuesto de solo dos fechas en vuelo (los resultados que llegan
+  antes de tiempo tienen que esperar a su turno).
+
+Genera escenas sintéticas con ``fixtures_s2.generar`` en un directorio
+temporal (catálogo ``replay``). Los GeoTIFF de cada índice (o el NDVI en
+memoria) y los metadatos deben ser idénticos en todos los casos. Sin relleno
+de huecos salvo ``--con-gaps``.
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_composite_fechas --fechas 12 --procesos 4 --bloque 256
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import rasterio
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import ndvi_composite as nc  # noqa: E402
+from ndvi_pipeline.compositor import MODO_MEJOR_PIXEL, componer_por_bloques, ruta_indice  # noqa: E402
+from ndvi_pipeline.catalogo_stac import CATALOGO_LOCAL, buscar_items  # noqa: E402
+from ndvi_pipeline.formato_ndvi import leer_ndvi  # noqa: E402
+from scripts.benchmark.fixtures_s2 import generar, guardar_catalogo  # noqa: E402
+
+INDICES_BLOQUES = ("NDVI", "SAVI")
+
+
+def componer_bloques(items_by_date, grid, salida: Path, modo: str, tam_bloque: int, hilos: int):
+    """Composite por bloques con ``hilos`` fechas en paralelo: ({índice: array}, metadatos, segundos)."""
+    width, height, dst_transform, dst_crs = grid
+    t0 = time.perf_counter()
+    meta = componer_por_bloques(
+        items_by_date, dst_transform, dst_crs, width, height, salida,
+        lambda bandas: nc.indices_y_calidad_tile(bandas, INDICES_BLOQUES),
+        tam_bloque=tam_bloque, halo=nc.CLOUD_BUFFER_PIXELS, dias_ventana=nc.LOOKBACK_DAYS,
+        indices=INDICES_BLOQUES, modo=modo, hilos_fechas=hilos,
+    )
+    segundos = time.perf_counter() - t0
+    valores = {}
+    for nombre in INDICES_BLOQUES:
+        with rasterio.open(salida if nombre == INDICES_BLOQUES[0] else ruta_indice(salida, nombre)) as src:
+            valores[nombre] = leer_ndvi(src)
+    # Lo que depende de la ejecución y no del composite
+    meta = {k: v for k, v in meta.items() if k not in ("date_threads", "index_files")}
+    return valores, meta, segundos
+
+
+def distintos(a: np.ndarray, b: np.ndarray) -> int:
+    return int((~((a == b) | (np.isnan(a) & np.isnan(b)))).sum())
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Composite: fechas en secuencial frente a en paralelo.")
+    p.add_argument("--bbox", default="-4.95,41.45,-4.65,41.7", help="minx,miny,maxx,maxy EPSG:4326")
+    p.add_argument("--teselas", default="2x2", help="Columnas x filas de teselas solapadas")
+    p.add_argument("--fechas", type=int, default=10)
+    p.add_argument("--res", type=float, default=10.0)
+    p.add_argument("--procesos", type=int, default=4, help="Hilos (por bloques) y procesos (en memoria)")
+    p.add_argument("--bloque", type=int, default=256)
+    p.add_argument("--nubes", default="dispersas")
+    p.add_argument("--con-gaps", action="store_true", help="Incluir el relleno de huecos")
+    p.add_argument("--semilla", type=int, default=7)
+    args = p.parse_args(argv)
+
+    nc.FILL_LARGE_GAPS = args.con_gaps
+    bbox = tuple(float(v) for v in args.bbox.split(","))
+    columnas, filas = (int(v) for v in args.teselas.lower().split("x"))
+    desde = date(2026, 3, 1)
+    hasta = desde + timedelta(days=5 * (args.fechas - 1))
+
+    filas_tabla = []
+    errores = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        features = generar(tmp, bbox, desde, hasta, 5, args.res, columnas, filas, args.nubes, 0.3, args.semilla)
+        guardar_catalogo(tmp / CATALOGO_LOCAL, features, {"bench": "composite_fechas"})
+        items = buscar_items(bbox, f"{desde}/{hasta}", modo="replay", directorio=tmp)
+        items_by_date = defaultdict(list)
+        for item in items:
+            items_by_date[item.datetime.date()].append(item)
+        items_by_date = {f: sorted(its, key=lambda it: it.id) for f, its in items_by_date.items()}
+
+        dst_crs = "EPSG:25830"
+        width, height, dst_transform, _ = nc.compute_grid_from_bbox_meters(bbox, dst_crs, args.res)
+        mb_fecha = 2 * width * height * 4 / 1e6
+        print(f"\n[DATES] Rejilla {width} x {height} px | {len(items_by_date)} fechas | {mb_fecha:.0f} MB por fecha")
+
+        grid = (width, height, dst_transform, dst_crs)
+        with nc.entorno_gdal():
+            componer_bloques(items_by_date, grid, tmp / "calentar.tif", MODO_MEJOR_PIXEL, args.bloque, 1)
+            for modo in (MODO_MEJOR_PIXEL, "mediana"):
+                ref, ref_meta, base = componer_bloques(items_by_date, grid, tmp / f"{modo}_1.tif", modo,
+                                                       args.bloque, 1)
+                valores, meta, segundos = componer_bloques(items_by_date, grid, tmp / f"{modo}_n.tif", modo,
+                                                           args.bloque, args.procesos)
+                filas_tabla.append((f"bloques {modo}, secuencial", base, base))
+                filas_tabla.append((f"bloques {modo}, {args.procesos} hilos", segundos, base))
+                for nombre in INDICES_BLOQUES:
+                    if not np.array_equal(ref[nombre], valores[nombre], equal_nan=True):
+                        errores.append(f"bloques {modo}: {nombre} distinto en "
+                                       f"{distintos(ref[nombre], valores[nombre]):,} px")
+                if meta != ref_meta:
+                    errores.append(f"bloques {modo}: metadatos distintos")
+
+        casos = (
+            ("secuencial", 1, nc.NDVI_DATE_MEM_MB),
+            (f"{args.procesos} procesos", args.procesos, nc.NDVI_DATE_MEM_MB),
+            (f"{args.procesos} procesos, 2 fechas", args.procesos, 2 * mb_fecha),
+        )
+        resultados = []
+        with nc.entorno_gdal():
+            nc.build_multi_tile_composite(items_by_date, bbox, dst_transform, dst_crs, width, height, workers=1)
+            for nombre, workers, mem_mb in casos:
+                t0 = time.perf_counter()
+                ndvi, meta = nc.build_multi_tile_composite(
+                    items_by_date, bbox, dst_transform, dst_crs, width, height, workers=workers, mem_mb=mem_mb,
+                )
+                segundos = time.perf_counter() - t0
+                resultados.append((nombre, ndvi, meta))
+                if workers == 1:
+                    base = segundos
+                filas_tabla.append((f"en memoria, {nombre}", segundos, base))
+
+    _, ref_ndvi, ref_meta = resultados[0]
+    for nombre, ndvi, meta in resultados[1:]:
+        if not np.array_equal(ref_ndvi, ndvi, equal_nan=True):
+            errores.append(f"en memoria, {nombre}: NDVI distinto en {distintos(ref_ndvi, ndvi):,} px")
+        if meta != ref_meta:
+            errores.append(f"en memoria, {nombre}: metadatos distintos")
+
+    print(f"\n{'modo':<36} {'s':>8} {'x':>6}")
+    for nombre, segundos, base in filas_tabla:
+        print(f"{nombre:<36} {segundos:>8.2f} {base / segundos:>6.2f}")
+
+    if errores:
+        print("❌ " + "; ".join(errores))
+        return 1
+    print("✓ Mismo composite y metadatos en secuencial y con fechas en paralelo, por bloques y en memoria")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+"""
+bench_composite_incremental.py
+------------------------------
+Comprueba que el composite incremental (``componer_por_bloques`` con
+``EstadoComposite``) da exactamente el mismo ráster que recomponer la
+ventana completa, y mide lo que se ahorra.
+
+Con los COG sintéticos de ``bench_lector_s2`` (leídos de disco, sin HTTP):
+
+1. ejecución inicial con las escenas de los días 0..n-2 (guarda el estado);
+2. ejecución siguiente: entra la escena del día n-1 y sale la del día 0;
+3. recomposición completa de esa misma ventana, sin estado.
+
+Las capas NDVI y fecha de 2 y 3 deben coincidir píxel a píxel.
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_composite_incremental --items 7 --bloque 256
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import rasterio
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import ndvi_pipeline.lector_s2 as lector_s2  # noqa: E402
+from ndvi_pipeline.compositor import componer_por_bloques  # noqa: E402
+from ndvi_pipeline.estado_composite import EstadoComposite  # noqa: E402
+from scripts.benchmark.bench_lector_s2 import BANDAS, crear_fixtures, rejilla  # noqa: E402
+
+CALIDAD_SCL = {4: 1.0, 5: 1.0, 6: 0.95, 8: 0.0, 9: 0.0}
+
+
+def indices_y_calidad(bandas):
+    """Versión reducida de ``indices_y_calidad_tile`` (solo NDVI, sin buffer de nubes)."""
+    red = bandas["B04"].astype(np.float32) / 10000.0
+    nir = bandas["B08"].astype(np.float32) / 10000.0
+    scl = bandas["SCL"]
+    calidad = np.zeros(red.shape, dtype=np.float32)
+    for clase, peso in CALIDAD_SCL.items():
+        calidad[scl == clase] = peso
+    den = nir + red
+    ndvi = np.where((den == 0) | (calidad == 0), np.nan, (nir - red) / den).astype(np.float32)
+    return {"NDVI": ndvi}, calidad
+
+
+def items_por_fecha(directorio: Path, nombres: list[str], dia0: date) -> dict:
+    return {
+        dia0 + timedelta(days=5 * i): [
+            SimpleNamespace(
+                id=nombre,
+                properties={"s2:mgrs_tile": "30TUM"},
+                assets={b: SimpleNamespace(href=str(directorio / f"{nombre}_{b}.tif")) for b in BANDAS},
+            )
+        ]
+        for i, nombre in enumerate(nombres)
+    }
+
+
+def ejecutar(items_by_date, grid, salida: Path, estado, tam_bloque: int):
+    _, dst_transform, width, height = grid
+    t0 = time.perf_counter()
+    meta = componer_por_bloques(
+        items_by_date, dst_transform, "EPSG:25830", width, height, salida, indices_y_calidad,
+        tam_bloque=tam_bloque, halo=0, dias_ventana=60, estado=estado,
+        salida_fechas=salida.with_name(salida.stem + "_fechas.tif"),
+    )
+    segundos = time.perf_counter() - t0
+    with rasterio.open(salida) as a, rasterio.open(salida.with_name(salida.stem + "_fechas.tif")) as b:
+        return a.read(1), b.read(1), meta, segundos
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Paridad y tiempos del composite NDVI incremental.")
+    p.add_argument("--items", type=int, default=7, help="Escenas sintéticas (una por fecha, cada 5 días)")
+    p.add_argument("--lado", type=int, default=2048, help="Lado de las bandas de 10 m (px)")
+    p.add_argument("--res", type=float, default=20.0, help="Resolución de la rejilla destino (m)")
+    p.add_argument("--bloque", type=int, default=256)
+    p.add_argument("--semilla", type=int, default=3)
+    args = p.parse_args(argv)
+
+    lector_s2.cache_ventanas = None  # Se mide el composite, no la caché de ventanas
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        cog = tmp / "cog"
+        cog.mkdir()
+        print(f"[FIXTURES] Generando {args.items} escenas de {args.lado}² px...")
+        nombres = crear_fixtures(cog, args.items, args.lado, args.semilla)
+        grid = rejilla(cog, nombres, args.res)
+        todas = items_por_fecha(cog, nombres, date(2025, 6, 1))
+        fechas = sorted(todas)
+
+        estado = EstadoComposite(tmp / "estado")
+        inicial = {f: todas[f] for f in fechas[:-1]}
+        siguiente = {f: todas[f] for f in fechas[1:]}
+
+        _, _, _, s_ini = ejecutar(inicial, grid, tmp / "inicial.tif", estado, args.bloque)
+        ndvi_inc, fechas_inc, meta_inc, s_inc = ejecutar(siguiente, grid, tmp / "incremental.tif", estado, args.bloque)
+        ndvi_full, fechas_full, _, s_full = ejecutar(siguiente, grid, tmp / "completo.tif", None, args.bloque)
+
+    print(f"\n{'ejecución':<26} {'s':>8}")
+    print(f"{'inicial (con estado)':<26} {s_ini:>8.2f}")
+    print(f"{'incremental':<26} {s_inc:>8.2f}   bloques recompuestos: {meta_inc['blocks_rebuilt']}")
+    print(f"{'recomposición completa':<26} {s_full:>8.2f}")
+
+    ok = np.array_equal(ndvi_inc, ndvi_full, equal_nan=True) and np.array_equal(fechas_inc, fechas_full)
+    if not ok:
+        distintos = int((~((ndvi_inc == ndvi_full) | (np.isnan(ndvi_inc) & np.isnan(ndvi_full)))).sum())
+        print(f"❌ El composite incremental difiere de la recomposición completa ({distintos:,} px)")
+        return 1
+    print("✓ Incremental = recomposición completa (NDVI y fecha por píxel)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
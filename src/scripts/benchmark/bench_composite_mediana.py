@@ -0,0 +1,145 @@
+"""
+bench_composite_mediana.py
+--------------------------
+Tiempo, memoria pico y paridad de los modos de ``componer_por_bloques``
+(``ndvi_pipeline/compositor.py``):
+
+- ``mejor_pixel``: score calidad × peso temporal (referencia de tiempos);
+- ``mediana`` y ``pNN``: percentil de las observaciones válidas, con la pila
+  de fechas de cada bloque en un memmap en disco.
+
+Genera escenas sintéticas con ``fixtures_s2.generar`` en un directorio
+temporal (catálogo ``replay``) y compone con ``indices_y_calidad_tile`` de
+``ndvi_composite.py``, sin relleno de huecos. La memoria pico es la de
+``tracemalloc``; la pila en disco, la que indica el composite
+(``date_stack_mb``). Paridad: la mediana con un solo bloque del tamaño de la
+rejilla debe ser idéntica a la de bloques pequeños con otras franjas de
+filas (``NDVI_PILA_FILAS``). Como comprobación, se compara también con
+``np.nanmedian`` sobre los NDVI del día de ``merge_tiles_same_date``.
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_composite_mediana --fechas 12 --bloque 256 --percentil 25
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+import rasterio
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import ndvi_composite as nc  # noqa: E402
+import ndvi_pipeline.compositor as compositor  # noqa: E402
+from ndvi_pipeline.catalogo_stac import CATALOGO_LOCAL, buscar_items  # noqa: E402
+from ndvi_pipeline.formato_ndvi import leer_ndvi  # noqa: E402
+from scripts.benchmark.fixtures_s2 import generar, guardar_catalogo  # noqa: E402
+
+
+def componer(items_by_date, grid, salida: Path, modo: str, tam_bloque: int, filas: int):
+    width, height, dst_transform, dst_crs = grid
+    compositor.NDVI_PILA_FILAS = filas
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    meta = compositor.componer_por_bloques(
+        items_by_date, dst_transform, dst_crs, width, height, salida, nc.indices_y_calidad_tile,
+        tam_bloque=tam_bloque, halo=nc.CLOUD_BUFFER_PIXELS, dias_ventana=nc.LOOKBACK_DAYS, modo=modo,
+    )
+    segundos = time.perf_counter() - t0
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    with rasterio.open(salida) as src:
+        return leer_ndvi(src), meta, segundos, pico / 1e6
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Composite mediana/percentil con pila en disco frente a mejor píxel.")
+    p.add_argument("--bbox", default="-4.95,41.45,-4.75,41.6", help="minx,miny,maxx,maxy EPSG:4326")
+    p.add_argument("--teselas", default="2x1", help="Columnas x filas de teselas solapadas")
+    p.add_argument("--fechas", type=int, default=10)
+    p.add_argument("--res", type=float, default=10.0)
+    p.add_argument("--bloque", type=int, default=256)
+    p.add_argument("--percentil", type=int, default=25)
+    p.add_argument("--nubes", default="dispersas")
+    p.add_argument("--semilla", type=int, default=5)
+    args = p.parse_args(argv)
+
+    bbox = tuple(float(v) for v in args.bbox.split(","))
+    columnas, filas = (int(v) for v in args.teselas.lower().split("x"))
+    desde = date(2026, 4, 1)
+    hasta = desde + timedelta(days=5 * (args.fechas - 1))
+    modos = (compositor.MODO_MEJOR_PIXEL, "mediana", f"p{args.percentil}")
+
+    errores = []
+    tabla = []
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        features = generar(tmp, bbox, desde, hasta, 5, args.res, columnas, filas, args.nubes, 0.3, args.semilla)
+        guardar_catalogo(tmp / CATALOGO_LOCAL, features, {"bench": "composite_mediana"})
+        items = buscar_items(bbox, f"{desde}/{hasta}", modo="replay", directorio=tmp)
+        items_by_date = defaultdict(list)
+        for item in items:
+            items_by_date[item.datetime.date()].append(item)
+        items_by_date = {f: sorted(its, key=lambda it: it.id) for f, its in items_by_date.items()}
+
+        dst_crs = "EPSG:25830"
+        width, height, dst_transform, _ = nc.compute_grid_from_bbox_meters(bbox, dst_crs, args.res)
+        grid = (width, height, dst_transform, dst_crs)
+        print(f"\n[BLOQUES] Rejilla {width} x {height} px | {len(items_by_date)} fechas | bloque {args.bloque} px")
+
+        componer(items_by_date, grid, tmp / "calentar.tif", compositor.MODO_MEJOR_PIXEL, args.bloque, 64)
+        resultados = {}
+        for modo in modos:
+            ndvi, meta, segundos, pico = componer(items_by_date, grid, tmp / f"{modo}.tif", modo, args.bloque, 64)
+            resultados[modo] = ndvi
+            tabla.append((modo, segundos, pico, meta["date_stack_mb"], meta["final_coverage_pct"],
+                          meta["observations_per_pixel_mean"]))
+
+        # Paridad: un solo bloque (toda la rejilla) y franjas de 7 filas
+        unico, _, _, _ = componer(items_by_date, grid, tmp / "mediana_unico.tif", "mediana",
+                                  max(width, height), 7)
+        mediana = resultados["mediana"]
+        if not np.array_equal(unico, mediana, equal_nan=True):
+            distintos = int((~((unico == mediana) | (np.isnan(unico) & np.isnan(mediana)))).sum())
+            errores.append(f"la mediana depende del tamaño de bloque ({distintos:,} px)")
+
+        # Referencia en memoria: NDVI del día de merge_tiles_same_date apilados
+        with nc.entorno_gdal():
+            dias = [nc.merge_tiles_same_date(items_by_date[f], bbox, dst_transform, dst_crs, width, height, f)[0]
+                    for f in sorted(items_by_date)]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", RuntimeWarning)
+            referencia = np.nanmedian(np.stack(dias), axis=0)
+        comunes = np.isfinite(referencia) & np.isfinite(mediana)
+        dif_ref = float(np.abs(referencia[comunes] - mediana[comunes]).max()) if comunes.any() else 0.0
+        nan_ref = int((np.isfinite(referencia) != np.isfinite(mediana)).sum())
+
+    base = tabla[0][1]
+    print(f"\n{'modo':<12} {'s':>8} {'x':>6} {'pico MB':>9} {'pila MB':>9} {'cobertura %':>12} {'obs/px':>7}")
+    for modo, segundos, pico, mb_pila, cobertura, obs in tabla:
+        obs_txt = f"{obs:.1f}" if obs is not None else "-"
+        print(f"{modo:<12} {segundos:>8.2f} {segundos / base:>6.2f} {pico:>9.0f} {mb_pila:>9.0f} "
+              f"{cobertura:>12.2f} {obs_txt:>7}")
+    print(f"\nMediana frente a nanmedian de merge_tiles_same_date: dif. máx. {dif_ref:.2e} | "
+          f"{nan_ref:,} píxeles con distinto nodata")
+
+    if errores:
+        print("❌ " + "; ".join(errores))
+        return 1
+    print("✓ Mediana idéntica con un solo bloque y con bloques pequeños")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
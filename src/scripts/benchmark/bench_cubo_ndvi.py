@@ -0,0 +1,154 @@
+"""
+bench_cubo_ndvi.py
+------------------
+Serie NDVI de un punto y de un recinto:
+
+- antes: abrir el GeoTIFF UTM de cada fecha y leer el píxel / la ventana del
+  recinto (lo único posible sin cubo);
+- ahora: ``webapp.utils.ndvi_cubo.LectorCubo`` (memmap tiempo-mayor por chunk).
+
+Escribe ``--fechas`` mosaicos sintéticos en EPSG:25830, construye el cubo con
+``CuboNDVI.anadir_tif`` (tiempo por fecha) y compara, para puntos y recintos
+aleatorios, latencia por consulta y resultados (mismos NaN en los puntos,
+medias por fecha con tolerancia de float32 en los recintos).
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_cubo_ndvi --lado 4000 --fechas 60 --consultas 200
+"""
+
+from __future__ import annotations
+
+import argparse
+import math
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.transform import from_origin
+from rasterio.windows import Window, from_bounds, transform as transform_ventana
+from shapely.geometry import mapping
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from scripts.benchmark.bench_zonal import ORIGEN, RES, ndvi_sintetico, recintos_sinteticos  # noqa: E402
+from webapp.utils.ndvi_cubo import CuboNDVI, LectorCubo  # noqa: E402
+
+CRS = "EPSG:25830"
+
+
+# ==================== MÉTODO ANTERIOR: UN GEOTIFF POR FECHA ====================
+
+def serie_punto_tifs(tifs: dict, x: float, y: float) -> list[float]:
+    valores = []
+    for ruta in tifs.values():
+        with rasterio.open(ruta) as src:
+            valores.append(float(next(src.sample([(x, y)]))[0]))
+    return valores
+
+
+def media_recinto_tifs(tifs: dict, geom) -> list[float]:
+    medias = []
+    for ruta in tifs.values():
+        with rasterio.open(ruta) as src:
+            win = from_bounds(*geom.bounds, transform=src.transform)
+            fila0, col0 = int(math.floor(win.row_off)), int(math.floor(win.col_off))
+            fila1 = int(math.ceil(win.row_off + win.height))
+            col1 = int(math.ceil(win.col_off + win.width))
+            win = Window(col0, fila0, max(1, col1 - col0), max(1, fila1 - fila0))
+            datos = src.read(1, window=win, boundless=True, fill_value=np.nan)
+            t_win = transform_ventana(win, src.transform)
+            dentro = ~geometry_mask([mapping(geom)], out_shape=datos.shape, transform=t_win)
+            if not dentro.any():
+                dentro = ~geometry_mask([mapping(geom)], out_shape=datos.shape, transform=t_win, all_touched=True)
+            px = datos[dentro]
+            px = px[np.isfinite(px)]
+            medias.append(float(px.mean()) if px.size else np.nan)
+    return medias
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Series NDVI: GeoTIFF por fecha frente al cubo memmap.")
+    p.add_argument("--lado", type=int, default=3000, help="Lado del mosaico (px)")
+    p.add_argument("--fechas", type=int, default=40)
+    p.add_argument("--consultas", type=int, default=100, help="Puntos y recintos consultados")
+    p.add_argument("--semilla", type=int, default=11)
+    args = p.parse_args(argv)
+
+    rng = np.random.default_rng(args.semilla)
+    transform = from_origin(ORIGEN[0], ORIGEN[1], RES, RES)
+    perfil = {
+        "driver": "GTiff", "height": args.lado, "width": args.lado, "count": 1, "dtype": "float32",
+        "crs": CRS, "transform": transform, "nodata": np.nan, "compress": "deflate",
+    }
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        tifs = {}
+        for i in range(args.fechas):
+            fecha = f"2025{1 + i // 28:02d}{1 + i % 28:02d}"
+            tifs[fecha] = tmp / f"ndvi_pc_{fecha}_mosaic_utm.tif"
+            with rasterio.open(tifs[fecha], "w", **perfil) as dst:
+                dst.write(ndvi_sintetico(args.lado, rng), 1)
+        print(f"[CUBO] {args.fechas} mosaicos sintéticos de {args.lado}² px")
+
+        cubo = CuboNDVI(tmp / "cubo")
+        t0 = time.perf_counter()
+        for fecha, ruta in tifs.items():
+            cubo.anadir_tif(fecha, ruta)
+        t_construir = time.perf_counter() - t0
+        lector = LectorCubo(tmp / "cubo")
+
+        ext = args.lado * RES
+        puntos = [(ORIGEN[0] + rng.uniform(0, ext), ORIGEN[1] - rng.uniform(0, ext)) for _ in range(args.consultas)]
+        recintos = recintos_sinteticos(max(args.consultas, 400), args.lado, rng)[:args.consultas]
+
+        t_pt_a, t_pt_b, t_rc_a, t_rc_b = [], [], [], []
+        errores = []
+        for x, y in puntos:
+            t0 = time.perf_counter()
+            a = np.array(serie_punto_tifs(tifs, x, y), dtype=np.float32)
+            t_pt_a.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            b = np.array([np.nan if v is None else v for v in lector.serie_punto(x, y, crs=CRS)["ndvi"]],
+                         dtype=np.float32)
+            t_pt_b.append(time.perf_counter() - t0)
+            if not np.allclose(a, b, rtol=0, atol=1e-4, equal_nan=True):
+                errores.append(f"punto ({x:.0f}, {y:.0f})")
+
+        for geom in recintos:
+            t0 = time.perf_counter()
+            a = np.array(media_recinto_tifs(tifs, geom))
+            t_rc_a.append(time.perf_counter() - t0)
+            t0 = time.perf_counter()
+            b = np.array([np.nan if v is None else v for v in lector.serie_geometria(mapping(geom), crs=CRS)["media"]])
+            t_rc_b.append(time.perf_counter() - t0)
+            if not np.allclose(a, b, rtol=0, atol=1e-4, equal_nan=True):
+                errores.append(f"recinto {geom.bounds[:2]}")
+
+        mb_cubo = sum(f.stat().st_blocks * 512 for f in (tmp / "cubo").glob("*.dat")) / 1e6
+
+    def ms(t):
+        return f"{1e3 * np.median(t):>9.2f} {1e3 * np.percentile(t, 95):>9.2f}"
+
+    print(f"\nConstrucción del cubo: {t_construir:.1f}s ({t_construir / args.fechas:.2f}s/fecha), {mb_cubo:.0f} MB en disco")
+    print(f"\n{'consulta':<28} {'p50 ms':>9} {'p95 ms':>9}")
+    print(f"{'punto: GeoTIFF por fecha':<28} {ms(t_pt_a)}")
+    print(f"{'punto: cubo':<28} {ms(t_pt_b)}")
+    print(f"{'recinto: GeoTIFF por fecha':<28} {ms(t_rc_a)}")
+    print(f"{'recinto: cubo':<28} {ms(t_rc_b)}")
+
+    if errores:
+        print(f"❌ {len(errores)} series distintas, p. ej. {', '.join(errores[:5])}")
+        return 1
+    print(f"✓ Mismas series en {len(puntos)} puntos y {len(recintos)} recintos")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+bench_formato_ndvi.py
+---------------------
+Tamaño, lectura y precisión del GeoTIFF NDVI en los dos ``NDVI_FORMATO``
+(``ndvi_pipeline/formato_ndvi.py``):
+
+- float32 con NaN (perfil del composite por bloques: deflate, teselas 256);
+- int16 × 10000, nodata -32768, ZSTD + predictor 2, teselas 256.
+
+Sobre un NDVI sintético con huecos y recintos sintéticos mide el tamaño en
+disco, la lectura completa y por ventanas aleatorias (como ``zonal_ndvi_mean``
+de ``mapasprediccion_riego.py``) ya decodificada a float32, y compara las
+estadísticas zonales (``ndvi_pipeline.zonal``): mismos píxeles válidos y
+error de media/min/max/percentiles dentro de medio paso de cuantización
+(5e-5). Comprueba también que la webapp (``webapp/utils/ndvi_formato.py``,
+que reexporta ``decodificacion_ndvi``) lee lo mismo que el pipeline y que el
+3857 en int16 (``warp_a_3857``) conserva scale/offset y ZSTD + predictor.
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_formato_ndvi --lado 8000 --recintos 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from ndvi_pipeline.compositor import perfil_salida  # noqa: E402
+from ndvi_pipeline.formato_ndvi import ESCALA_INT16, codificar, leer_ndvi, marcar_escala, perfil_ndvi  # noqa: E402
+from ndvi_pipeline.zonal import EtiquetasRecintos  # noqa: E402
+from scripts.benchmark.bench_zonal import ORIGEN, PERCENTILES, RES, ndvi_sintetico, recintos_sinteticos  # noqa: E402
+from webapp.utils.ndvi_formato import leer_ndvi as leer_ndvi_webapp  # noqa: E402
+from webapp.utils.ndvi_warp import warp_a_3857  # noqa: E402
+
+TOLERANCIA = ESCALA_INT16 / 2 + 1e-7
+
+
+def escribir(ruta: Path, ndvi: np.ndarray, transform, formato: str) -> float:
+    perfil = perfil_ndvi(perfil_salida(transform, "EPSG:25830", ndvi.shape[1], ndvi.shape[0]), formato)
+    t0 = time.perf_counter()
+    with rasterio.open(ruta, "w", **perfil) as dst:
+        marcar_escala(dst)
+        for _, win in dst.block_windows(1):
+            r, c = slice(win.row_off, win.row_off + win.height), slice(win.col_off, win.col_off + win.width)
+            dst.write(codificar(ndvi[r, c], perfil["dtype"]), 1, window=win)
+    return time.perf_counter() - t0
+
+
+def lectura_completa(ruta: Path, repeticiones: int) -> tuple[float, np.ndarray]:
+    mejor = np.inf
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        with rasterio.open(ruta) as src:
+            datos = leer_ndvi(src)
+        mejor = min(mejor, time.perf_counter() - t0)
+    return mejor, datos
+
+
+def lectura_ventanas(ruta: Path, ventanas: list) -> float:
+    t0 = time.perf_counter()
+    with rasterio.open(ruta) as src:
+        for win in ventanas:
+            leer_ndvi(src, window=win)
+    return time.perf_counter() - t0
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Tamaño, lectura y precisión zonal del NDVI float32 frente a int16 escalado.")
+    p.add_argument("--lado", type=int, default=6000, help="Lado del NDVI 25830 (px)")
+    p.add_argument("--recintos", type=int, default=20000)
+    p.add_argument("--ventanas", type=int, default=20000, help="Lecturas por ventana (recintos de ~6-40 px)")
+    p.add_argument("--repeticiones", type=int, default=3)
+    p.add_argument("--sin-3857", action="store_true", help="No comprobar el GeoTIFF 3857")
+    p.add_argument("--semilla", type=int, default=11)
+    args = p.parse_args(argv)
+
+    rng = np.random.default_rng(args.semilla)
+    transform = from_origin(ORIGEN[0], ORIGEN[1], RES, RES)
+    ndvi = ndvi_sintetico(args.lado, rng)
+    geoms = recintos_sinteticos(args.recintos, args.lado, rng)
+    lados = rng.integers(6, 40, size=(args.ventanas, 2))
+    ventanas = [
+        Window(int(rng.integers(0, args.lado - w)), int(rng.integers(0, args.lado - h)), int(w), int(h))
+        for w, h in lados
+    ]
+    print(f"[FORMATO] NDVI {args.lado}² px | {len(geoms):,} recintos | {len(ventanas):,} ventanas")
+
+    etiquetas = EtiquetasRecintos.construir(geoms, list(range(len(geoms))), transform, "EPSG:25830",
+                                            ndvi.shape, cache_dir=None)
+    errores = []
+    filas = []
+    leidos = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        rutas = {f: tmp / f"ndvi_{f}.tif" for f in ("float32", "int16")}
+        for formato, ruta in rutas.items():
+            t_escritura = escribir(ruta, ndvi, transform, formato)
+            t_completa, leidos[formato] = lectura_completa(ruta, args.repeticiones)
+            t_ventanas = lectura_ventanas(ruta, ventanas)
+            filas.append((formato, ruta.stat().st_size / 1e6, t_escritura, t_completa, t_ventanas))
+
+        with rasterio.open(rutas["int16"]) as src:
+            if not np.array_equal(leer_ndvi_webapp(src), leidos["int16"], equal_nan=True):
+                errores.append("la decodificación de la webapp no coincide con la del pipeline")
+
+        if not args.sin_3857:
+            cogs = {f: tmp / f"ndvi_{f}_3857.tif" for f in rutas}
+            for formato, ruta in rutas.items():
+                warp_a_3857(str(ruta), str(cogs[formato]))
+            with rasterio.open(cogs["float32"]) as a, rasterio.open(cogs["int16"]) as b:
+                va, vb = leer_ndvi_webapp(a), leer_ndvi_webapp(b)
+                escala_cog = b.scales[0]
+                compresion_cog = b.profile.get("compress")
+            comunes = np.isfinite(va) & np.isfinite(vb)
+            dif_3857 = float(np.abs(va[comunes] - vb[comunes]).max()) if comunes.any() else 0.0
+            nan_distintos = int((np.isfinite(va) != np.isfinite(vb)).sum())
+            print(f"[FORMATO] 3857: scale en el fichero {escala_cog} | compresión {compresion_cog} | "
+                  f"dif. máx. {dif_3857:.2e} | {nan_distintos:,} píxeles con distinto nodata")
+            if escala_cog != ESCALA_INT16:
+                errores.append(f"3857 int16: scale {escala_cog} en lugar de {ESCALA_INT16}")
+            if str(compresion_cog).lower() != "zstd":
+                errores.append(f"3857 int16: compresión {compresion_cog} en lugar de zstd")
+            if dif_3857 > 2 * TOLERANCIA:
+                errores.append(f"3857 int16: diferencia máxima {dif_3857:.2e}")
+
+    base = filas[0]
+    print(f"\n{'formato':<10} {'MB':>8} {'x':>6} {'escribir s':>11} {'completa s':>11} {'MB/s':>8} {'ventanas s':>11}")
+    for formato, mb, t_e, t_c, t_v in filas:
+        mbs = ndvi.size * 4 / 1e6 / t_c
+        print(f"{formato:<10} {mb:>8.1f} {base[1] / mb:>6.2f} {t_e:>11.2f} {t_c:>11.3f} {mbs:>8.0f} {t_v:>11.2f}")
+
+    # Precisión: píxel a píxel y estadísticas zonales
+    a, b = leidos["float32"], leidos["int16"]
+    if not np.array_equal(np.isnan(a), np.isnan(b)):
+        errores.append(f"{int((np.isnan(a) != np.isnan(b)).sum()):,} píxeles nodata distintos")
+    dif_pixel = float(np.nanmax(np.abs(a - b)))
+    za = etiquetas.estadisticas(a, PERCENTILES)
+    zb = etiquetas.estadisticas(b, PERCENTILES)
+    if not np.array_equal(za["count"], zb["count"]):
+        errores.append("distinto nº de píxeles válidos por recinto")
+    print(f"\nError píxel máx.: {dif_pixel:.2e} (tolerancia {TOLERANCIA:.2e})")
+    for clave in ("mean", "min", "max", *(f"p{q:g}" for q in PERCENTILES)):
+        dif = np.abs(za[clave] - zb[clave])
+        dif_max = float(np.nanmax(dif)) if np.isfinite(dif).any() else 0.0
+        print(f"  {clave:<5} error máx. {dif_max:.2e} | medio {float(np.nanmean(dif)):.2e}")
+        if dif_max > TOLERANCIA:
+            errores.append(f"zonal {clave}: {dif_max:.2e}")
+    if dif_pixel > TOLERANCIA:
+        errores.append(f"error por píxel {dif_pixel:.2e}")
+
+    if errores:
+        print("❌ " + "; ".join(errores))
+        return 1
+    print("✓ int16 escalado: mismos píxeles válidos y error dentro de medio paso de cuantización")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+bench_gap_fill.py
+-----------------
+Compara el relleno de huecos antiguo (bucle por hueco sobre la imagen
+completa) con ``ndvi_pipeline.gap_fill`` sobre máscaras de nubes sintéticas:
+tiempos y comprobación de que el modo ``griddata`` da exactamente el mismo
+ráster.
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_gap_fill --tam 1000 2000 --repeticiones 3
+    python -m scripts.benchmark.bench_gap_fill --tam 4000 --sin-original   # solo la versión nueva
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from scipy import ndimage
+from scipy.interpolate import griddata
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from ndvi_pipeline.gap_fill import rellenar_gaps  # noqa: E402
+
+
+def fill_gaps_original(ndvi, max_gap_size=50):
+    """Copia de fill_gaps_aggressive antes del cambio (sin prints), como referencia."""
+    filled = ndvi.copy()
+    invalid_mask = ~np.isfinite(filled)
+    if not np.any(invalid_mask):
+        return filled
+
+    labeled_gaps, num_gaps = ndimage.label(invalid_mask)
+
+    for gap_id in range(1, num_gaps + 1):
+        gap_mask = (labeled_gaps == gap_id)
+        gap_size = gap_mask.sum()
+        if gap_size > max_gap_size:
+            continue
+
+        dilation_iters = min(5, max(2, int(np.sqrt(gap_size) / 2)))
+        structure = ndimage.generate_binary_structure(2, 2)
+        dilated = ndimage.binary_dilation(gap_mask, structure=structure, iterations=dilation_iters)
+        neighbor_mask = dilated & ~gap_mask & np.isfinite(filled)
+        if not np.any(neighbor_mask):
+            continue
+
+        neighbor_coords = np.column_stack(np.where(neighbor_mask))
+        neighbor_values = filled[neighbor_mask]
+        gap_coords = np.column_stack(np.where(gap_mask))
+        try:
+            method = 'linear' if gap_size < 100 else 'nearest'
+            interpolated = griddata(neighbor_coords, neighbor_values, gap_coords, method=method)
+            if np.any(~np.isfinite(interpolated)):
+                interpolated = griddata(neighbor_coords, neighbor_values, gap_coords, method='nearest')
+            filled[gap_mask] = interpolated
+        except Exception:
+            continue
+
+    return filled
+
+
+def ndvi_sintetico(tam: int, semilla: int, densidad: float) -> np.ndarray:
+    """
+    NDVI suave (ruido filtrado) con una máscara de nubes realista: muchos
+    huecos de 1-50 px (bordes de nube, píxeles sueltos del SCL), algunos
+    medianos y unas pocas nubes grandes que deben quedar sin rellenar.
+    """
+    rng = np.random.default_rng(semilla)
+    ndvi = ndimage.gaussian_filter(rng.normal(size=(tam, tam)), sigma=8)
+    ndvi = (0.45 + 0.35 * ndvi / np.abs(ndvi).max()).astype("float32")
+
+    nubes = np.zeros((tam, tam), dtype=bool)
+
+    # Píxeles y grupos pequeños
+    n_pequenos = int(densidad * tam * tam / 20)
+    filas = rng.integers(0, tam, n_pequenos)
+    cols = rng.integers(0, tam, n_pequenos)
+    nubes[filas, cols] = True
+    nubes |= ndimage.binary_dilation(nubes & (rng.random((tam, tam)) < 0.3))
+
+    # Nubes grandes (círculos de 15-60 px de radio)
+    yy, xx = np.ogrid[:tam, :tam]
+    for _ in range(max(1, tam // 250)):
+        cy, cx = rng.integers(0, tam, 2)
+        r = rng.integers(15, 60)
+        nubes |= (yy - cy) ** 2 + (xx - cx) ** 2 <= r * r
+
+    ndvi[nubes] = np.nan
+    return ndvi
+
+
+def _cronometrar(fn, repeticiones: int):
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        t0 = time.perf_counter()
+        resultado = fn()
+        tiempos.append(time.perf_counter() - t0)
+    return resultado, min(tiempos)
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Benchmark del relleno de huecos del NDVI composite.")
+    p.add_argument("--tam", type=int, nargs="+", default=[500, 1000, 2000], help="Lado del ráster (px)")
+    p.add_argument("--densidad", type=float, default=0.02, help="Fracción aproximada de píxeles nublados sueltos")
+    p.add_argument("--max-gap", type=int, default=50, help="MAX_GAP_SIZE_PIXELS")
+    p.add_argument("--repeticiones", type=int, default=1)
+    p.add_argument("--semilla", type=int, default=42)
+    p.add_argument("--sin-original", action="store_true", help="No ejecutar la versión antigua (lenta en rásters grandes)")
+    args = p.parse_args(argv)
+
+    ok = True
+    print(f"{'tam':>6} {'huecos':>8} {'original s':>11} {'griddata s':>11} {'edt s':>8} {'idéntico':>9} {'MAE edt':>8}")
+    for tam in args.tam:
+        ndvi = ndvi_sintetico(tam, args.semilla, args.densidad)
+
+        (nuevo, resumen), t_nuevo = _cronometrar(
+            lambda: rellenar_gaps(ndvi, args.max_gap, modo="griddata"), args.repeticiones)
+        (edt, _), t_edt = _cronometrar(
+            lambda: rellenar_gaps(ndvi, args.max_gap, modo="edt"), args.repeticiones)
+
+        rellenados = np.isfinite(nuevo) & ~np.isfinite(ndvi)
+        mae = float(np.nanmean(np.abs(edt[rellenados] - nuevo[rellenados]))) if rellenados.any() else 0.0
+
+        t_orig_txt, igual_txt = "-", "-"
+        if not args.sin_original:
+            original, t_orig = _cronometrar(lambda: fill_gaps_original(ndvi, args.max_gap), args.repeticiones)
+            igual = np.array_equal(original, nuevo, equal_nan=True)
+            ok &= igual
+            t_orig_txt, igual_txt = f"{t_orig:.2f}", "sí" if igual else "NO"
+
+        print(f"{tam:>6} {resumen['grupos']:>8} {t_orig_txt:>11} {t_nuevo:>11.2f} {t_edt:>8.2f} {igual_txt:>9} {mae:>8.4f}")
+
+    if not ok:
+        print("❌ El relleno por cajas no coincide con la versión original")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+bench_lector_s2.py
+------------------
+Mide el lector de COG de ``ndvi_pipeline.lector_s2`` sin depender de
+Planetary Computer: genera COG sintéticos (B04, B08 a 10 m y SCL a 20 m en
+EPSG:32630, como Sentinel-2 L2A), los sirve por HTTP en localhost con
+soporte de peticiones Range y latencia artificial, y compara:
+
+- secuencial: una banda tras otra, sin las opciones GDAL del lector;
+- concurrente: ``LectorConcurrente`` + ``entorno_gdal``.
+
+Comprueba que ambas lecturas dan los mismos arrays y muestra tiempo total,
+peticiones HTTP, bytes servidos y las métricas por banda del lector.
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_lector_s2 --items 6 --latencia-ms 40 --hilos 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import rasterio
+import rasterio.shutil
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from ndvi_pipeline.lector_s2 import LectorConcurrente, leer_banda_bbox, metricas  # noqa: E402
+
+BANDAS = ("B04", "B08", "SCL")
+# Esquina de la tesela 30TUM (Valladolid), EPSG:32630
+ORIGEN_X, ORIGEN_Y = 300000.0, 4700040.0
+
+
+# ==================== FIXTURES ====================
+
+def crear_cog(ruta: Path, datos: np.ndarray, transform, crs: str, nodata=0):
+    """GeoTIFF temporal en teselas -> COG (overviews internas, deflate)."""
+    tmp = ruta.with_suffix(".tmp.tif")
+    perfil = {
+        "driver": "GTiff", "height": datos.shape[0], "width": datos.shape[1], "count": 1,
+        "dtype": datos.dtype.name, "crs": crs, "transform": transform, "nodata": nodata,
+        "tiled": True, "blockxsize": 512, "blockysize": 512, "compress": "deflate",
+    }
+    with rasterio.open(tmp, "w", **perfil) as dst:
+        dst.write(datos, 1)
+    rasterio.shutil.copy(tmp, ruta, driver="COG", compress="deflate", blocksize=512)
+    tmp.unlink()
+
+
+def crear_fixtures(directorio: Path, n_items: int, lado_10m: int, semilla: int) -> list[str]:
+    """``n_items`` escenas desplazadas entre sí (solapes parciales, como tiles MGRS vecinos)."""
+    rng = np.random.default_rng(semilla)
+    nombres = []
+    for i in range(n_items):
+        x0 = ORIGEN_X + (i % 3) * lado_10m * 10 * 0.6
+        y0 = ORIGEN_Y - (i // 3) * lado_10m * 10 * 0.6
+        t10 = from_origin(x0, y0, 10, 10)
+        t20 = from_origin(x0, y0, 20, 20)
+
+        red = rng.integers(300, 3000, (lado_10m, lado_10m), dtype=np.uint16)
+        nir = (red + rng.integers(500, 4000, (lado_10m, lado_10m))).astype(np.uint16)
+        scl = rng.choice(np.array([4, 5, 6, 8, 9], dtype=np.uint8), (lado_10m // 2, lado_10m // 2),
+                         p=[0.5, 0.2, 0.1, 0.1, 0.1])
+
+        nombre = f"S2_SINT_{i:02d}"
+        crear_cog(directorio / f"{nombre}_B04.tif", red, t10, "EPSG:32630")
+        crear_cog(directorio / f"{nombre}_B08.tif", nir, t10, "EPSG:32630")
+        crear_cog(directorio / f"{nombre}_SCL.tif", scl, t20, "EPSG:32630")
+        nombres.append(nombre)
+    return nombres
+
+
+# ==================== SERVIDOR HTTP ====================
+
+class _Contador:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.peticiones = 0
+        self.bytes = 0
+
+    def sumar(self, nbytes: int):
+        with self.lock:
+            self.peticiones += 1
+            self.bytes += nbytes
+
+
+def servidor_cog(directorio: Path, latencia_s: float, contador: _Contador) -> ThreadingHTTPServer:
+    """
+    Servidor estático con soporte ``Range: bytes=a-b`` (GDAL /vsicurl/ lo
+    necesita). El primer segmento de la ruta se ignora, para poder usar un
+    prefijo distinto por pasada y que la caché /vsicurl/ no se comparta.
+    """
+
+    class Handler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _ruta_fichero(self) -> Path | None:
+            partes = self.path.split("?", 1)[0].strip("/").split("/")
+            ruta = directorio / partes[-1]
+            return ruta if len(partes) >= 2 and ruta.is_file() else None
+
+        def do_HEAD(self):
+            ruta = self._ruta_fichero()
+            if ruta is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Length", str(ruta.stat().st_size))
+            self.send_header("Accept-Ranges", "bytes")
+            self.end_headers()
+            contador.sumar(0)
+
+        def do_GET(self):
+            time.sleep(latencia_s)
+            ruta = self._ruta_fichero()
+            if ruta is None:
+                self.send_error(404)
+                return
+            total = ruta.stat().st_size
+            rango = self.headers.get("Range")
+            inicio, fin = 0, total - 1
+            if rango and rango.startswith("bytes="):
+                a, _, b = rango[6:].split(",")[0].partition("-")
+                inicio = int(a) if a else max(total - int(b), 0)
+                fin = min(int(b), total - 1) if a and b else fin
+            with open(ruta, "rb") as f:
+                f.seek(inicio)
+                cuerpo = f.read(fin - inicio + 1)
+            self.send_response(206 if rango else 200)
+            self.send_header("Content-Length", str(len(cuerpo)))
+            self.send_header("Accept-Ranges", "bytes")
+            if rango:
+                self.send_header("Content-Range", f"bytes {inicio}-{fin}/{total}")
+            self.end_headers()
+            self.wfile.write(cuerpo)
+            contador.sumar(len(cuerpo))
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+
+# ==================== PASADAS ====================
+
+def items_falsos(base_url: str, nombres: list[str]) -> list:
+    return [
+        SimpleNamespace(
+            id=nombre,
+            properties={"s2:mgrs_tile": "30TUM", "eo:cloud_cover": 10.0},
+            assets={b: SimpleNamespace(href=f"{base_url}/{nombre}_{b}.tif") for b in BANDAS},
+        )
+        for nombre in nombres
+    ]
+
+
+def rejilla(directorio: Path, nombres: list[str], res: float):
+    """Rejilla EPSG:25830 sobre la unión de las escenas (+ su bbox EPSG:4326)."""
+    with rasterio.open(directorio / f"{nombres[0]}_B04.tif") as src:
+        b = src.bounds
+    izq, abajo, der, arriba = b.left, b.bottom, b.right, b.top
+    for nombre in nombres[1:]:
+        with rasterio.open(directorio / f"{nombre}_B04.tif") as src:
+            izq, abajo = min(izq, src.bounds.left), min(abajo, src.bounds.bottom)
+            der, arriba = max(der, src.bounds.right), max(arriba, src.bounds.top)
+    bbox_4326 = transform_bounds("EPSG:32630", "EPSG:4326", izq, abajo, der, arriba, densify_pts=21)
+    minx, miny, maxx, maxy = transform_bounds("EPSG:4326", "EPSG:25830", *bbox_4326, densify_pts=21)
+    width, height = int((maxx - minx) / res), int((maxy - miny) / res)
+    return bbox_4326, from_origin(minx, maxy, res, res), width, height
+
+
+def pasada(items, bbox_4326, dst_transform, width, height, hilos: int | None, prefetch: int):
+    def leer(item, band_key):
+        return leer_banda_bbox(item, band_key, bbox_4326, dst_transform, "EPSG:25830", width, height)
+
+    metricas.reset()
+    t0 = time.perf_counter()
+    resultados = {}
+    if hilos is None:
+        with rasterio.Env():
+            for item in items:
+                for b in BANDAS:
+                    resultados[(item.id, b)] = leer(item, b)
+    else:
+        with LectorConcurrente(hilos=hilos, prefetch=prefetch) as lector:
+            for item, bandas in lector.bandas_items(items, BANDAS, leer):
+                for b, arr in bandas.items():
+                    resultados[(item.id, b)] = arr
+    return resultados, time.perf_counter() - t0
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Benchmark del lector de COG concurrente sobre fixtures locales.")
+    p.add_argument("--items", type=int, default=6, help="Escenas sintéticas (cada una con B04, B08 y SCL)")
+    p.add_argument("--lado", type=int, default=2048, help="Lado de las bandas de 10 m (px)")
+    p.add_argument("--res", type=float, default=20.0, help="Resolución de la rejilla destino (m)")
+    p.add_argument("--latencia-ms", type=float, default=40.0, help="Latencia añadida por petición GET")
+    p.add_argument("--hilos", type=int, default=8)
+    p.add_argument("--prefetch", type=int, default=2)
+    p.add_argument("--semilla", type=int, default=3)
+    args = p.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directorio = Path(tmp)
+        print(f"[FIXTURES] Generando {args.items} escenas de {args.lado}² px en {directorio}...")
+        nombres = crear_fixtures(directorio, args.items, args.lado, args.semilla)
+
+        contador = _Contador()
+        httpd = servidor_cog(directorio, args.latencia_ms / 1000, contador)
+        host, port = httpd.server_address
+        bbox_4326, dst_transform, width, height = rejilla(directorio, nombres, args.res)
+        print(f"[FIXTURES] Servidor en http://{host}:{port} | rejilla {width} x {height} px")
+
+        try:
+            filas = []
+            referencia = None
+            ok = True
+            for nombre_pasada, hilos in (("secuencial", None), (f"concurrente ({args.hilos} hilos)", args.hilos)):
+                contador.peticiones = contador.bytes = 0
+                base = f"http://{host}:{port}/{nombre_pasada.split()[0]}"
+                resultados, segundos = pasada(
+                    items_falsos(base, nombres), bbox_4326, dst_transform, width, height, hilos, args.prefetch,
+                )
+                print(f"\n[{nombre_pasada}]")
+                metricas.imprimir("  ")
+                filas.append((nombre_pasada, segundos, contador.peticiones, contador.bytes))
+
+                if referencia is None:
+                    referencia = resultados
+                else:
+                    for clave, arr in referencia.items():
+                        otro = resultados.get(clave)
+                        if (arr is None) != (otro is None) or (arr is not None and not np.array_equal(arr, otro, equal_nan=True)):
+                            print(f"  ✗ {clave} difiere entre pasadas")
+                            ok = False
+        finally:
+            httpd.shutdown()
+
+    print(f"\n{'pasada':<28} {'s':>8} {'peticiones':>11} {'MB servidos':>12}")
+    for nombre_pasada, segundos, peticiones, nbytes in filas:
+        print(f"{nombre_pasada:<28} {segundos:>8.2f} {peticiones:>11} {nbytes / 1e6:>12.2f}")
+
+    if not ok:
+        print("❌ Las lecturas concurrentes no coinciden con las secuenciales")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
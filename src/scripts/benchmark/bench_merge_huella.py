@@ -0,0 +1,175 @@
+"""
+bench_merge_huella.py
+---------------------
+Tiempo, memoria pico y paridad de ``merge_tiles_same_date`` de
+``ndvi_composite.py``:
+
+- antes: cada tile del día se reproyecta a la rejilla completa de la ROI y se
+  mezcla con máscaras del tamaño de la ROI (copiado aquí tal cual);
+- ahora: cada tile solo en la ventana de su huella (``ventana_huella``) y
+  mezcla en su sitio.
+
+Genera escenas sintéticas con ``fixtures_s2.generar`` (teselas solapadas,
+SCL a 20 m, nubes con sombras) en un directorio temporal y compara, fecha a
+fecha, NDVI y calidad del día: calidad idéntica, NaN en las mismas
+posiciones y NDVI con tolerancia 1e-6 (la reproyección sobre la subventana
+redondea distinto en float32: diferencias del orden de 1e-7 en unos pocos
+píxeles). La memoria pico es la de ``tracemalloc`` (los arrays de numpy
+se registran en él). Con la caché de ventanas activa (``S2_CACHE``) la
+primera pasada la calienta: se mide la segunda.
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_merge_huella --teselas 3x2 --fechas 4
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import date, timedelta
+from pathlib import Path
+
+import numpy as np
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+import ndvi_composite as nc  # noqa: E402
+from ndvi_pipeline.catalogo_stac import CATALOGO_LOCAL, buscar_items  # noqa: E402
+from scripts.benchmark.fixtures_s2 import generar, guardar_catalogo  # noqa: E402
+
+TOLERANCIA_NDVI = 1e-6
+
+
+# ==================== VERSIÓN ANTIGUA (copia literal) ====================
+
+def merge_tiles_same_date_antiguo(items, bbox_4326, dst_transform, dst_crs, width, height, date_key):
+    """
+    Combina múltiples tiles del mismo día en un NDVI único.
+    CLAVE para solucionar el problema de corte.
+    """
+    print(f"\n[MERGE] Combinando {len(items)} tiles de {date_key}")
+
+    # Arrays para acumular
+    merged_ndvi = np.full((height, width), np.nan, dtype=np.float32)
+    merged_quality = np.zeros((height, width), dtype=np.float32)
+
+    def leer(item, band_key):
+        return nc.read_band_window_cog(item, band_key, bbox_4326, dst_transform, dst_crs, width, height)
+
+    # Bandas de todas las tiles del día en paralelo (S2_READ_THREADS)
+    lecturas = nc.LECTOR_S2.bandas_items(items, ('B04', 'B08', 'SCL'), leer)
+
+    for idx, (item, bandas) in enumerate(lecturas, 1):
+        tile_id = item.properties.get('s2:mgrs_tile', f'tile{idx}')
+        clouds = item.properties.get('eo:cloud_cover', -1)
+
+        print(f"[MERGE]   Tile {idx}/{len(items)}: {tile_id} | Nubes: {clouds:.1f}%")
+
+        red, nir, scl = bandas['B04'], bandas['B08'], bandas['SCL']
+
+        if red is None or nir is None:
+            print("[MERGE]     ✗ Faltan bandas - OMITIDA")
+            continue
+
+        ndvi, quality_scores = nc.ndvi_y_calidad_tile(red, nir, scl)
+        valid = np.isfinite(ndvi)
+
+        if not np.any(valid):
+            print("[MERGE]     ✗ Sin píxeles válidos")
+            continue
+
+        valid_count = valid.sum()
+        print(f"[MERGE]     ✓ Píxeles válidos: {valid_count:,}")
+
+        # Actualizar donde el nuevo score es mejor O donde no hay datos
+        update_mask = valid & ((quality_scores > merged_quality) | ~np.isfinite(merged_ndvi))
+
+        merged_ndvi[update_mask] = ndvi[update_mask]
+        merged_quality[update_mask] = quality_scores[update_mask]
+
+    # Estadísticas del merge
+    final_valid = np.isfinite(merged_ndvi)
+    coverage = 100 * final_valid.sum() / merged_ndvi.size
+
+    print(f"[MERGE] ✓ Cobertura del día: {coverage:.2f}%")
+
+    return merged_ndvi, merged_quality
+
+
+# ==================== MAIN ====================
+
+def medir(funcion, *args):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    resultado = funcion(*args)
+    segundos = time.perf_counter() - t0
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return resultado, segundos, pico / 1e6
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="merge_tiles_same_date con ventanas de huella frente a la ROI completa.")
+    p.add_argument("--bbox", default="-4.95,41.45,-4.55,41.75", help="minx,miny,maxx,maxy EPSG:4326")
+    p.add_argument("--teselas", default="3x2", help="Columnas x filas de teselas solapadas")
+    p.add_argument("--fechas", type=int, default=3)
+    p.add_argument("--res", type=float, default=10.0)
+    p.add_argument("--nubes", default="dispersas")
+    p.add_argument("--semilla", type=int, default=3)
+    args = p.parse_args(argv)
+
+    bbox = tuple(float(v) for v in args.bbox.split(","))
+    columnas, filas = (int(v) for v in args.teselas.lower().split("x"))
+    desde = date(2026, 5, 1)
+    hasta = desde + timedelta(days=5 * (args.fechas - 1))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        features = generar(tmp, bbox, desde, hasta, 5, args.res, columnas, filas, args.nubes, 0.3, args.semilla)
+        guardar_catalogo(tmp / CATALOGO_LOCAL, features, {"bench": "merge_huella"})
+        items = buscar_items(bbox, f"{desde}/{hasta}", modo="replay", directorio=tmp)
+        por_fecha = defaultdict(list)
+        for item in items:
+            por_fecha[item.datetime.date()].append(item)
+
+        dst_crs = "EPSG:25830"
+        width, height, dst_transform, _ = nc.compute_grid_from_bbox_meters(bbox, dst_crs, args.res)
+        print(f"\n[HUELLA] Rejilla {width} x {height} px | {len(por_fecha)} fechas de {columnas * filas} tiles")
+
+        filas_tabla = []
+        errores = 0
+        with nc.entorno_gdal():
+            for fecha in sorted(por_fecha):
+                its = sorted(por_fecha[fecha], key=lambda it: it.id)
+                comun = (its, bbox, dst_transform, dst_crs, width, height, fecha)
+                nc.merge_tiles_same_date(*comun)  # calienta la caché de ventanas
+                (a_ndvi, a_cal), t_a, m_a = medir(merge_tiles_same_date_antiguo, *comun)
+                (b_ndvi, b_cal), t_b, m_b = medir(nc.merge_tiles_same_date, *comun)
+                igual = (np.array_equal(np.isnan(a_ndvi), np.isnan(b_ndvi))
+                         and np.allclose(a_ndvi, b_ndvi, rtol=0, atol=TOLERANCIA_NDVI, equal_nan=True)
+                         and np.array_equal(a_cal, b_cal))
+                dif = float(np.nanmax(np.abs(a_ndvi - b_ndvi))) if np.isfinite(a_ndvi).any() else 0.0
+                errores += not igual
+                filas_tabla.append((fecha, len(its), t_a, m_a, t_b, m_b, dif, igual))
+
+    print(f"\n{'fecha':<12} {'tiles':>5} {'antes s':>9} {'antes MB':>9} {'huella s':>9} {'huella MB':>10} "
+          f"{'dif. NDVI':>10}  paridad")
+    for fecha, n, t_a, m_a, t_b, m_b, dif, igual in filas_tabla:
+        print(f"{fecha!s:<12} {n:>5} {t_a:>9.2f} {m_a:>9.0f} {t_b:>9.2f} {m_b:>10.0f} {dif:>10.1e}  "
+              f"{'✓' if igual else '✗'}")
+
+    if errores:
+        print(f"❌ {errores} fechas con calidad o nodata distintos, o NDVI fuera de ±{TOLERANCIA_NDVI:g}")
+        return 1
+    print(f"✓ Misma calidad y NDVI (±{TOLERANCIA_NDVI:g}) por fecha que el merge sobre la ROI completa")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,127 @@
+"""
+bench_thumbnails.py
+-------------------
+Escritura, omisión de existentes y lectura aleatoria de thumbnails de recinto:
+
+- archivos: un PNG por recinto en ``<fecha>/<id>.png`` con un
+  ``os.path.exists`` por recinto para omitir los ya generados (lo que hacía
+  ``generate_thumbnails.py``);
+- sqlite: ``webapp.utils.thumbnails_store`` (un archivo, escrituras en
+  transacciones de ``--lote`` filas y ``existentes()`` en una consulta).
+
+Los PNG son bytes aleatorios del tamaño de un thumbnail típico (el coste del
+renderizado no cambia entre métodos). Se comprueba que lo leído de ambos
+almacenes es idéntico byte a byte.
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_thumbnails --recintos 100000 --lecturas 20000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from webapp.utils.thumbnails_store import ArchivoThumbnails  # noqa: E402
+
+FECHA = "20260219"
+
+
+def png_sintetico(rng: random.Random, media_bytes: int) -> bytes:
+    n = max(64, int(rng.gauss(media_bytes, media_bytes / 4)))
+    return b"\x89PNG\r\n\x1a\n" + rng.randbytes(n)
+
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Thumbnails: PNG sueltos frente a archivo SQLite.")
+    p.add_argument("--recintos", type=int, default=50_000)
+    p.add_argument("--lecturas", type=int, default=10_000, help="Lecturas aleatorias por método")
+    p.add_argument("--bytes", type=int, default=3_000, help="Tamaño medio del PNG")
+    p.add_argument("--lote", type=int, default=1_000, help="Filas por transacción (THUMB_BATCH_SIZE)")
+    p.add_argument("--dir", default=None, help="Directorio de trabajo (por defecto uno temporal)")
+    p.add_argument("--semilla", type=int, default=7)
+    args = p.parse_args(argv)
+
+    rng = random.Random(args.semilla)
+    pngs = {i: png_sintetico(rng, args.bytes) for i in range(1, args.recintos + 1)}
+    ids_lectura = rng.choices(list(pngs), k=args.lecturas)
+    print(f"[THUMBS] {len(pngs):,} PNG sintéticos (~{args.bytes} B), {len(ids_lectura):,} lecturas")
+
+    resultados = []
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        tmp = Path(tmp)
+        carpeta = tmp / FECHA
+        carpeta.mkdir()
+        archivo = ArchivoThumbnails(tmp / "thumbnails.sqlite")
+
+        # ---- escritura ----
+        t0 = time.perf_counter()
+        for i, png in pngs.items():
+            ruta = os.path.join(carpeta, f"{i}.png")
+            if os.path.exists(ruta):
+                continue
+            with open(ruta, "wb") as f:
+                f.write(png)
+        resultados.append(("escritura", "archivos", time.perf_counter() - t0, len(pngs)))
+
+        t0 = time.perf_counter()
+        with archivo.escritor(args.lote) as escritor:
+            for i, png in pngs.items():
+                escritor.put(FECHA, i, png)
+        resultados.append(("escritura", f"sqlite (lote {args.lote})", time.perf_counter() - t0, len(pngs)))
+
+        # ---- omitir existentes (relanzar sin --force) ----
+        t0 = time.perf_counter()
+        pendientes_a = [i for i in pngs if not os.path.exists(os.path.join(carpeta, f"{i}.png"))]
+        resultados.append(("omitir existentes", "exists por recinto", time.perf_counter() - t0, len(pngs)))
+
+        t0 = time.perf_counter()
+        hechos = archivo.existentes(FECHA)
+        pendientes_b = [i for i in pngs if i not in hechos]
+        resultados.append(("omitir existentes", "existentes()", time.perf_counter() - t0, len(pngs)))
+
+        # ---- lectura aleatoria ----
+        t0 = time.perf_counter()
+        leidos_a = []
+        for i in ids_lectura:
+            with open(carpeta / f"{i}.png", "rb") as f:
+                leidos_a.append(f.read())
+        resultados.append(("lectura aleatoria", "archivos", time.perf_counter() - t0, len(ids_lectura)))
+
+        t0 = time.perf_counter()
+        leidos_b = [archivo.get(FECHA, i)[0] for i in ids_lectura]
+        resultados.append(("lectura aleatoria", "sqlite get()", time.perf_counter() - t0, len(ids_lectura)))
+
+        mb_sqlite = sum(f.stat().st_size for f in tmp.glob("thumbnails.sqlite*")) / 1e6
+
+    print(f"\n{'operación':<20} {'método':<24} {'s':>8} {'ops/s':>12}")
+    for operacion, metodo, segundos, n in resultados:
+        print(f"{operacion:<20} {metodo:<24} {segundos:>8.3f} {n / max(segundos, 1e-9):>12,.0f}")
+    print(f"\nArchivo SQLite: {mb_sqlite:.1f} MB | PNG sueltos: {len(pngs):,} ficheros")
+
+    errores = []
+    if pendientes_a or pendientes_b:
+        errores.append(f"pendientes tras escribir: archivos {len(pendientes_a)}, sqlite {len(pendientes_b)}")
+    if leidos_a != leidos_b:
+        errores.append("los PNG leídos no coinciden")
+    if any(leidos_b[k] != pngs[i] for k, i in enumerate(ids_lectura)):
+        errores.append("el archivo SQLite no devuelve los bytes escritos")
+
+    if errores:
+        print("❌ " + "; ".join(errores))
+        return 1
+    print("✓ Mismos PNG en ambos almacenes")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+"""
+bench_zonal.py
+--------------
+Paridad y tiempos de las estadísticas zonales por ráster de etiquetas
+(``ndvi_pipeline.zonal``) frente al cálculo geometría a geometría que hacían
+``ndvi_diax.py`` (``zonal_stats_for_geom_fast``) y
+``evotranspiracion_potencial_csv.py`` (``rasterio.mask`` + ``all_touched``).
+
+Sobre un NDVI sintético con huecos (NaN) y recintos sintéticos (rectángulos
+girados que no se tocan, ~2 % más pequeños que un píxel y, con
+``--solapados``, una fracción que invade al vecino):
+
+- motor vs referencia geometría a geometría (``valores_geometria``): nº de
+  píxeles, min, max y percentiles idénticos; media y desviación con rtol 1e-9;
+- motor vs las dos funciones antiguas (copiadas aquí tal cual): media, min,
+  max y desviación con la tolerancia de float32 (rtol 1e-5).
+
+Diferencia esperada con ``ndvi_diax`` antiguo: redondeaba la ventana del bbox
+(``round_offsets().round_lengths()``) y podía dejar fuera la última fila o
+columna de píxeles cuyo centro sí cae en el recinto. Esos recintos se cuentan
+aparte y no cuentan como fallo; el resto debe coincidir.
+
+Uso (desde src/):
+    python -m scripts.benchmark.bench_zonal --recintos 20000 --lado 4000
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from rasterio.features import geometry_mask
+from rasterio.io import MemoryFile
+from rasterio.mask import mask as rasterio_mask
+from rasterio.transform import from_origin
+from rasterio.windows import from_bounds as window_from_bounds
+from shapely import affinity
+from shapely.geometry import box, mapping
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from ndvi_pipeline.zonal import (  # noqa: E402
+    EtiquetasRecintos,
+    _estadisticas_valores,
+    valores_geometria,
+    ventana_geometria,
+)
+
+PERCENTILES = (10, 50, 90)
+RES = 10.0
+ORIGEN = (350000.0, 4650000.0)
+
+
+# ==================== VERSIONES ANTIGUAS (copia literal) ====================
+
+def zonal_stats_for_geom_fast(dataset, geom):
+    """Calcular estadísticas zonales para una geometría"""
+    minx, miny, maxx, maxy = geom.bounds
+    win = window_from_bounds(minx, miny, maxx, maxy, transform=dataset.transform)
+    win = win.round_offsets().round_lengths()
+
+    if win.width <= 0 or win.height <= 0:
+        return None
+
+    arr = dataset.read(1, window=win).astype(np.float32)
+    if not np.any(np.isfinite(arr)):
+        return None
+
+    win_transform = dataset.window_transform(win)
+    m = geometry_mask(
+        [mapping(geom)],
+        transform=win_transform,
+        out_shape=arr.shape,
+        invert=True
+    )
+
+    vals = arr[m]
+    vals = vals[np.isfinite(vals)]
+
+    if vals.size == 0:
+        return None
+
+    return {
+        "mean": float(vals.mean()),
+        "min": float(vals.min()),
+        "max": float(vals.max()),
+        "std": float(vals.std()),
+    }
+
+
+def media_rasterio_mask(src, geom):
+    """Núcleo de la antigua ``muestrear_ndvi_zonal`` para una geometría."""
+    nodata_val = src.nodata
+
+    def extraer_pixeles(all_touched):
+        pixeles, _ = rasterio_mask(
+            src,
+            [geom],
+            crop=True,
+            nodata=nodata_val if nodata_val is not None else np.nan,
+            all_touched=all_touched,
+        )
+        arr = pixeles[0].astype(float)
+        if nodata_val is not None:
+            arr[arr == nodata_val] = np.nan
+        return arr[~np.isnan(arr)]
+
+    try:
+        validos = extraer_pixeles(all_touched=False)
+        if len(validos) == 0:
+            validos = extraer_pixeles(all_touched=True)
+    except ValueError:
+        return np.nan
+    return validos.mean() if len(validos) else np.nan
+
+
+# ==================== DATOS SINTÉTICOS ====================
+
+def ndvi_sintetico(lado: int, rng) -> np.ndarray:
+    y, x = np.mgrid[0:lado, 0:lado].astype(np.float32) / lado
+    ndvi = 0.4 + 0.3 * np.sin(6 * x) * np.cos(5 * y) + rng.normal(0, 0.05, (lado, lado)).astype(np.float32)
+    nubes = rng.random((lado // 50, lado // 50)) < 0.08
+    ndvi[np.kron(nubes, np.ones((50, 50), dtype=bool))[:lado, :lado]] = np.nan
+    return ndvi.astype(np.float32)
+
+
+def recintos_sinteticos(n: int, lado: int, rng, solapados: float = 0.0) -> list:
+    """
+    Una tesela por celda, girada ±8° y reducida para que no toque a las
+    vecinas; ~2 % diminutas y una fracción ``solapados`` que invade al vecino.
+    """
+    ext = lado * RES
+    cols = int(np.ceil(np.sqrt(n)))
+    paso = ext / cols
+    margen = paso * 0.06  # Un cuadrado girado 8° ocupa 1,13 veces su lado
+    geoms = []
+    for i in range(n):
+        x0 = ORIGEN[0] + (i % cols) * paso
+        y0 = ORIGEN[1] - ext + (i // cols) * paso
+        r = rng.random()
+        if r < 0.02:
+            g = box(x0 + 2, y0 + 2, x0 + 6, y0 + 6)  # menor que un píxel
+        elif r < 0.02 + solapados:
+            g = box(x0, y0, x0 + paso * 1.6, y0 + paso * 1.3)  # invade el vecino
+        else:
+            g = box(x0 + margen, y0 + margen, x0 + paso - margen, y0 + paso - margen)
+        geoms.append(affinity.rotate(g, rng.uniform(-8, 8), origin="centroid"))
+    return geoms
+
+
+def ventana_recortada(ds, geom) -> bool:
+    """True si la ventana redondeada de ``zonal_stats_for_geom_fast`` no cubre todos los píxeles del bbox."""
+    completa = ventana_geometria(geom, ds.transform, ds.shape)
+    if completa is None:
+        return False
+    minx, miny, maxx, maxy = geom.bounds
+    win = window_from_bounds(minx, miny, maxx, maxy, transform=ds.transform).round_offsets().round_lengths()
+    filas, cols = completa
+    return (win.row_off > filas.start or win.row_off + win.height < filas.stop
+            or win.col_off > cols.start or win.col_off + win.width < cols.stop)
+
+
+def tif_en_memoria(ndvi, transform):
+    perfil = {
+        "driver": "GTiff", "height": ndvi.shape[0], "width": ndvi.shape[1], "count": 1,
+        "dtype": "float32", "crs": "EPSG:25830", "transform": transform, "nodata": np.nan,
+    }
+    mem = MemoryFile()
+    with mem.open(**perfil) as dst:
+        dst.write(ndvi, 1)
+    return mem
+
+
+# ==================== MAIN ====================
+
+def main(argv=None) -> int:
+    p = argparse.ArgumentParser(description="Paridad y tiempos de las estadísticas zonales por etiquetas.")
+    p.add_argument("--recintos", type=int, default=20000)
+    p.add_argument("--lado", type=int, default=4000, help="Lado del ráster NDVI (px)")
+    p.add_argument("--solapados", type=float, default=0.0,
+                   help="Fracción de recintos que invaden al vecino (capas de etiquetas)")
+    p.add_argument("--semilla", type=int, default=7)
+    args = p.parse_args(argv)
+
+    rng = np.random.default_rng(args.semilla)
+    transform = from_origin(ORIGEN[0], ORIGEN[1], RES, RES)
+    ndvi = ndvi_sintetico(args.lado, rng)
+    geoms = recintos_sinteticos(args.recintos, args.lado, rng, args.solapados)
+    ids = list(range(len(geoms)))
+    print(f"[ZONAL] {args.lado}² px, {len(geoms):,} recintos")
+
+    t0 = time.perf_counter()
+    etiquetas = EtiquetasRecintos.construir(geoms, ids, transform, "EPSG:25830", ndvi.shape, cache_dir=None)
+    t_etiquetas = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    zonal = etiquetas.estadisticas(ndvi, PERCENTILES)
+    t_motor = time.perf_counter() - t0
+
+    errores = 0
+
+    # 1) Referencia geometría a geometría con el mismo criterio
+    t0 = time.perf_counter()
+    for i, g in enumerate(geoms):
+        ref = _estadisticas_valores(valores_geometria(ndvi, transform, g), PERCENTILES)
+        exactas = ["count", "min", "max", *(f"p{q:g}" for q in PERCENTILES)]
+        ok = all(np.array_equal(zonal[k][i], ref[k], equal_nan=True) for k in exactas)
+        ok &= all(np.allclose(zonal[k][i], ref[k], rtol=1e-9, atol=0, equal_nan=True) for k in ("mean", "std"))
+        if not ok:
+            errores += 1
+            if errores <= 5:
+                print(f"  ✗ recinto {i}: {ref} != {({k: zonal[k][i] for k in ref})}")
+    t_ref = time.perf_counter() - t0
+
+    # 2) Funciones antiguas
+    dif_diax = dif_evo = recortados = 0
+    with tif_en_memoria(ndvi, transform) as mem, mem.open() as ds:
+        t0 = time.perf_counter()
+        for i, g in enumerate(geoms):
+            viejo = zonal_stats_for_geom_fast(ds, g)
+            if viejo is None:
+                distinto = zonal["count"][i] > 0
+            else:
+                nuevo = [zonal[k][i] for k in ("mean", "min", "max", "std")]
+                distinto = not np.allclose(nuevo, [viejo[k] for k in ("mean", "min", "max", "std")],
+                                           rtol=1e-5, atol=1e-6)
+            if distinto:
+                if ventana_recortada(ds, g):
+                    recortados += 1  # Diferencia esperada: la ventana antigua perdía píxeles del borde
+                else:
+                    dif_diax += 1
+        t_diax = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for i, g in enumerate(geoms):
+            viejo = media_rasterio_mask(ds, g)
+            nuevo = zonal["mean"][i]
+            if zonal["count"][i] == 0:
+                vals = valores_geometria(ndvi, transform, g, all_touched=True)
+                nuevo = vals.astype(float).mean() if vals.size else np.nan
+            if not np.allclose(nuevo, viejo, rtol=1e-5, atol=1e-6, equal_nan=True):
+                dif_evo += 1
+        t_evo = time.perf_counter() - t0
+
+    print(f"\n{'método':<36} {'s':>8}")
+    print(f"{'etiquetas: rasterizar (1 vez)':<36} {t_etiquetas:>8.2f}")
+    print(f"{'etiquetas: estadísticas':<36} {t_motor:>8.2f}")
+    print(f"{'referencia geometría a geometría':<36} {t_ref:>8.2f}")
+    print(f"{'ndvi_diax antiguo':<36} {t_diax:>8.2f}")
+    print(f"{'evotranspiración antiguo (x1 fecha)':<36} {t_evo:>8.2f}")
+    print(f"\nCapas de etiquetas: {etiquetas.etiquetas.shape[0]} "
+          f"({int((etiquetas.capa > 0).sum()):,} recintos fuera de la primera por solapes)")
+    print(f"Difieren de ndvi_diax antiguo: {dif_diax:,} (+{recortados:,} por su ventana redondeada, esperado) | "
+          f"de evotranspiración antiguo: {dif_evo:,}")
+
+    if errores or dif_diax or dif_evo:
+        print(f"❌ Sin paridad: {errores:,} recintos difieren de la referencia geometría a geometría, "
+              f"{dif_diax:,} de ndvi_diax antiguo y {dif_evo:,} de evotranspiración antiguo")
+        return 1
+    print("✓ Paridad con el cálculo geometría a geometría")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+fixtures_s2.py
+--------------
+Escenas Sentinel-2 L2A sintéticas para ejecutar los scripts NDVI sin red:
+COG B04 y B08 (10 m, o ``--res``) y SCL (al doble de resolución) en
+EPSG:32630 cada ``--revisita`` días, repartidas en ``--teselas`` columnas x
+filas con solape (como teselas MGRS vecinas), más el catálogo
+``catalogo_local.json`` que lee ``ndvi_pipeline.catalogo_stac`` en modo
+``replay``.
+
+- Suelo: parcelas de 400 m con su propio pico de campaña y amplitud; el NDVI
+  de cada fecha sigue una curva gaussiana en el día del año.
+- Nubes (``--nubes``): ``ninguna``, ``aleatorio`` (píxel a píxel),
+  ``dispersas`` (cúmulos pequeños), ``frentes`` (masas grandes) o
+  ``franjas`` (bandas diagonales). La fracción de cada pasada se sortea
+  alrededor de ``--cobertura``; las nubes son las mismas en las zonas de
+  solape de la misma fecha y proyectan sombra (SCL 3) desplazada.
+- ``eo:cloud_cover`` de cada item es el % de nubes de su SCL.
+
+Los ids llevan un hash de los parámetros: regenerar con otra semilla o
+patrón no reutiliza ventanas de ``cache_ventanas`` de escenas anteriores.
+
+Uso (desde src/):
+    python -m scripts.benchmark.fixtures_s2 --desde 2026-03-01 --hasta 2026-06-30 --nubes frentes
+    STAC_MODE=replay python ndvi_composite.py
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds, transform_geom
+from scipy import ndimage
+from shapely.geometry import box, mapping
+
+SRC_DIR = Path(__file__).resolve().parents[2]
+if str(SRC_DIR) not in sys.path:
+    sys.path.insert(0, str(SRC_DIR))
+
+from ndvi_pipeline.catalogo_stac import CATALOGO_LOCAL, COLECCION_S2, STAC_CACHE_DIR  # noqa: E402
+from project_paths import PROJECT_ROOT  # noqa: E402
+from scripts.benchmark.bench_lector_s2 import crear_cog  # noqa: E402
+
+CRS = "EPSG:32630"
+PATRONES = ("ninguna", "aleatorio", "dispersas", "frentes", "franjas")
+PARCELA_M = 400.0
+SOLAPE = 0.1                       # fracción de solape entre teselas vecinas
+HORA_PASO = "T11:06:21Z"           # hora aproximada de paso sobre la península
+TIPO_COG = "image/tiff; application=geotiff; profile=cloud-optimized"
+ROI_DEFECTO = PROJECT_ROOT / "data" / "processed" / "roi.gpkg"
+
+
+# ==================== SUPERFICIE ====================
+
+def ndvi_suelo(x: np.ndarray, y: np.ndarray, dia_anio: int, semilla: int) -> np.ndarray:
+    """NDVI "real" de cada píxel (coordenadas UTM) según su parcela y el día del año."""
+    px = np.floor(x / PARCELA_M).astype(np.int64)[None, :]
+    py = np.floor(y / PARCELA_M).astype(np.int64)[:, None]
+    h = (px * 73856093 ^ py * 19349663 ^ semilla * 83492791) & 0xFFFFFF
+    pico = 60 + (h % 180)                                 # día del año del máximo
+    amp = 0.25 + 0.5 * ((h >> 8) % 256) / 255             # amplitud de la campaña
+    base = 0.1 + 0.1 * ((h >> 16) % 256) / 255
+    return base + amp * np.exp(-0.5 * ((dia_anio - pico) / 35.0) ** 2)
+
+
+def reflectancias(ndvi: np.ndarray, rng) -> tuple[np.ndarray, np.ndarray]:
+    """B04/B08 (reflectancia) que dan ``ndvi``, con algo de ruido."""
+    nir = 0.22 + 0.25 * ndvi + rng.normal(0, 0.01, ndvi.shape)
+    red = nir * (1 - ndvi) / (1 + ndvi)
+    return red, nir
+
+
+# ==================== NUBES ====================
+
+def mascara_nubes(forma: tuple, patron: str, fraccion: float, rng) -> np.ndarray:
+    """Máscara booleana con ``fraccion`` aproximada de nubes según el patrón."""
+    if patron == "ninguna" or fraccion <= 0:
+        return np.zeros(forma, dtype=bool)
+    if patron == "aleatorio":
+        return rng.random(forma) < fraccion
+    if patron == "franjas":
+        fil, col = np.indices(forma)
+        periodo = max(forma) / 4
+        fase = rng.uniform(0, periodo)
+        return ((fil + col + fase) % periodo) < fraccion * periodo
+    sigma = max(forma) / (60 if patron == "dispersas" else 12)
+    campo = ndimage.gaussian_filter(rng.standard_normal(forma).astype(np.float32), sigma, mode="wrap")
+    return campo > np.quantile(campo, 1 - fraccion)
+
+
+def scl_escena(nubes: np.ndarray, ndvi_20: np.ndarray, rng) -> np.ndarray:
+    """SCL: 4 vegetación / 5 suelo, 8-9-10 nubes, 3 sombra (nubes desplazadas)."""
+    scl = np.where(ndvi_20 > 0.3, 4, 5).astype(np.uint8)
+    desp = max(1, nubes.shape[0] // 50)
+    sombra = np.roll(np.roll(nubes, desp, axis=0), desp, axis=1) & ~nubes
+    scl[sombra] = 3
+    tipo = rng.choice(np.array([8, 9, 10], dtype=np.uint8), nubes.shape, p=[0.5, 0.35, 0.15])
+    scl[nubes] = tipo[nubes]
+    return scl
+
+
+# ==================== ESCENAS ====================
+
+def teselas_utm(bbox_4326, columnas: int, filas: int, res: float) -> tuple[list[tuple[str, tuple]], tuple]:
+    """
+    (nombre, extensión UTM) de cada tesela y extensión total, alineadas a 2·res
+    para que la SCL caiga sobre pares de píxeles de 10 m.
+    """
+    izq, abajo, der, arriba = transform_bounds("EPSG:4326", CRS, *bbox_4326, densify_pts=21)
+    paso = 2 * res
+    izq, abajo = np.floor(izq / paso) * paso, np.floor(abajo / paso) * paso
+    der, arriba = np.ceil(der / paso) * paso, np.ceil(arriba / paso) * paso
+    ancho, alto = (der - izq) / columnas, (arriba - abajo) / filas
+    out = []
+    for j in range(filas):
+        for i in range(columnas):
+            x0 = max(izq, np.floor((izq + i * ancho - SOLAPE * ancho) / paso) * paso)
+            x1 = min(der, np.ceil((izq + (i + 1) * ancho + SOLAPE * ancho) / paso) * paso)
+            y1 = min(arriba, np.ceil((arriba - j * alto + SOLAPE * alto) / paso) * paso)
+            y0 = max(abajo, np.floor((arriba - (j + 1) * alto - SOLAPE * alto) / paso) * paso)
+            out.append((f"30TS{chr(65 + j)}{chr(65 + i)}", (float(x0), float(y0), float(x1), float(y1))))
+    return out, (float(izq), float(abajo), float(der), float(arriba))
+
+
+def item_stac(item_id: str, fecha: date, tesela: str, ext, nubes_pct: float, hrefs: dict) -> dict:
+    huella = transform_geom(CRS, "EPSG:4326", mapping(box(*ext)))
+    xs = [p[0] for p in huella["coordinates"][0]]
+    ys = [p[1] for p in huella["coordinates"][0]]
+    return {
+        "type": "Feature",
+        "stac_version": "1.0.0",
+        "stac_extensions": [],
+        "id": item_id,
+        "collection": COLECCION_S2,
+        "geometry": huella,
+        "bbox": [min(xs), min(ys), max(xs), max(ys)],
+        "properties": {
+            "datetime": fecha.isoformat() + HORA_PASO,
+            "platform": "Sentinel-2X",
+            "eo:cloud_cover": round(nubes_pct, 2),
+            "s2:mgrs_tile": tesela,
+            "proj:epsg": 32630,
+        },
+        "links": [],
+        "assets": {
+            banda: {"href": str(href), "type": TIPO_COG, "roles": ["data"]}
+            for banda, href in hrefs.items()
+        },
+    }
+
+
+def generar(directorio: Path, bbox_4326, desde: date, hasta: date, revisita: int, res: float,
+            columnas: int, filas: int, patron: str, cobertura: float, semilla: int) -> list[dict]:
+    parametros = f"{bbox_4326}|{desde}|{revisita}|{res}|{columnas}x{filas}|{patron}|{cobertura}|{semilla}"
+    sufijo = hashlib.sha1(parametros.encode()).hexdigest()[:6]
+    teselas, (izq, abajo, der, arriba) = teselas_utm(bbox_4326, columnas, filas, res)
+    ancho, alto = int(round((der - izq) / res)), int(round((arriba - abajo) / res))
+    print(f"[FIXTURES] Extensión {ancho} x {alto} px a {res:g} m | {len(teselas)} teselas | nubes: {patron}")
+
+    rng = np.random.default_rng(semilla)
+    xs = izq + (np.arange(ancho) + 0.5) * res
+    ys = arriba - (np.arange(alto) + 0.5) * res
+    features = []
+    fecha = desde
+    while fecha <= hasta:
+        t0 = time.perf_counter()
+        dia_anio = fecha.timetuple().tm_yday
+        ndvi = np.clip(ndvi_suelo(xs, ys, dia_anio, semilla), -0.2, 0.95)
+        red, nir = reflectancias(ndvi, rng)
+        fraccion = float(np.clip(rng.beta(2, 2 / max(cobertura, 1e-3) - 2) if cobertura < 1 else 1.0, 0, 1))
+        nubes = mascara_nubes((alto // 2, ancho // 2), patron, fraccion, rng)
+        scl = scl_escena(nubes, ndvi[::2, ::2], rng)
+        # Bajo la nube ambas bandas son brillantes (NDVI ~0); en la sombra, oscuras.
+        # La extensión está alineada a 2·res: la SCL cubre exactamente las bandas de 10 m.
+        nubes_10 = np.repeat(np.repeat(scl >= 8, 2, axis=0), 2, axis=1)
+        sombra_10 = np.repeat(np.repeat(scl == 3, 2, axis=0), 2, axis=1)
+        red[nubes_10], nir[nubes_10] = 0.35, 0.37
+        red[sombra_10] *= 0.3
+        nir[sombra_10] *= 0.3
+        dn_red = np.clip(red * 10000, 1, 10000).astype(np.uint16)
+        dn_nir = np.clip(nir * 10000, 1, 10000).astype(np.uint16)
+
+        for tesela, (x0, y0, x1, y1) in teselas:
+            c0, c1 = int(round((x0 - izq) / res)), int(round((x1 - izq) / res))
+            f0, f1 = int(round((arriba - y1) / res)), int(round((arriba - y0) / res))
+            item_id = f"S2X_MSIL2A_{fecha:%Y%m%d}_T{tesela}_{sufijo}"
+            hrefs = {b: directorio / f"{item_id}_{b}.tif" for b in ("B04", "B08", "SCL")}
+            t10 = from_origin(x0, y1, res, res)
+            crear_cog(hrefs["B04"], dn_red[f0:f1, c0:c1], t10, CRS)
+            crear_cog(hrefs["B08"], dn_nir[f0:f1, c0:c1], t10, CRS)
+            scl_tesela = scl[f0 // 2:f1 // 2, c0 // 2:c1 // 2]
+            crear_cog(hrefs["SCL"], scl_tesela, from_origin(x0, y1, 2 * res, 2 * res), CRS)
+            nubes_pct = 100.0 * float(np.isin(scl_tesela, (8, 9, 10)).mean())
+            features.append(item_stac(item_id, fecha, tesela, (x0, y0, x1, y1), nubes_pct, hrefs))
+
+        print(f"  ✓ {fecha} | nubes {100 * fraccion:5.1f}% | {time.perf_counter() - t0:.1f}s")
+        fecha += timedelta(days=revisita)
+    return features
+
+
+def guardar_catalogo(ruta: Path, features: list[dict], parametros: dict) -> None:
+    ruta.parent.mkdir(parents=True, exist_ok=True)
+    coleccion = {"type": "FeatureCollection", "parametros": parametros, "features": features}
+    tmp = ruta.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_text(json.dumps(coleccion), encoding="utf-8")
+    os.replace(tmp, ruta)
+
+
+def bbox_roi(ruta: Path) -> tuple:
+    import geopandas as gpd
+
+    return tuple(float(v) for v in gpd.read_file(ruta).to_crs(4326).total_bounds)
+
+
+def main(argv=None) -> int:
+    hoy = date.today()
+    p = argparse.ArgumentParser(description="Escenas Sentinel-2 sintéticas + catálogo local para STAC_MODE=replay.")
+    p.add_argument("--bbox", default="", help="minlon,minlat,maxlon,maxlat (vacío = ROI de data/processed/roi.gpkg)")
+    p.add_argument("--desde", default=(hoy - timedelta(days=60)).isoformat())
+    p.add_argument("--hasta", default=hoy.isoformat())
+    p.add_argument("--revisita", type=int, default=5, help="Días entre pasadas")
+    p.add_argument("--res", type=float, default=10.0, help="Resolución de B04/B08 (m); SCL al doble")
+    p.add_argument("--teselas", default="2x1", help="Columnas x filas de teselas solapadas")
+    p.add_argument("--nubes", choices=PATRONES, default="dispersas")
+    p.add_argument("--cobertura", type=float, default=0.3, help="Fracción media de nubes por pasada")
+    p.add_argument("--semilla", type=int, default=7)
+    p.add_argument("--dir", default=str(PROJECT_ROOT / "data" / "cache" / "s2_sinteticas"),
+                   help="Directorio de los COG")
+    p.add_argument("--catalogo", default=str(STAC_CACHE_DIR), help="Directorio del catálogo (STAC_CACHE_DIR)")
+    args = p.parse_args(argv)
+
+    if args.bbox.strip():
+        bbox = tuple(float(v) for v in args.bbox.split(","))
+    elif ROI_DEFECTO.exists():
+        bbox = bbox_roi(ROI_DEFECTO)
+    else:
+        print(f"❌ No existe {ROI_DEFECTO}: indica --bbox")
+        return 1
+    columnas, filas = (int(v) for v in args.teselas.lower().split("x"))
+    desde, hasta = date.fromisoformat(args.desde), date.fromisoformat(args.hasta)
+
+    directorio = Path(args.dir)
+    directorio.mkdir(parents=True, exist_ok=True)
+    t0 = time.perf_counter()
+    features = generar(directorio, bbox, desde, hasta, args.revisita, args.res, columnas, filas,
+                       args.nubes, args.cobertura, args.semilla)
+    ruta = Path(args.catalogo) / CATALOGO_LOCAL
+    guardar_catalogo(ruta, features, {
+        "bbox": list(bbox), "desde": args.desde, "hasta": args.hasta, "revisita": args.revisita,
+        "res": args.res, "teselas": args.teselas, "nubes": args.nubes, "cobertura": args.cobertura,
+        "semilla": args.semilla, "generado": datetime.now().isoformat(timespec="seconds"),
+    })
+
+    mb = sum(f.stat().st_size for f in directorio.glob("S2X_*.tif")) / 1e6
+    print(f"\n✓ {len(features)} items en {ruta} ({mb:.0f} MB de COG, {time.perf_counter() - t0:.1f}s)")
+    print(f"  STAC_MODE=replay STAC_CACHE_DIR={ruta.parent} python ndvi_composite.py")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+"""
+recorridos.py
+-------------
+Recorridos de usuario que ejecuta ``run_bench.py`` contra la app Flask
+(``app.test_client()``, sin servidor HTTP de por medio).
+
+Cada recorrido es una lista de pasos ``(nombre, metodo, url, json)``
+construida a partir de un usuario sintético y sus recintos. Los nombres de
+paso son estables: son la clave con la que se comparan resultados entre
+commits, así que no deben renombrarse a la ligera.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+
+
+@dataclass
+class UsuarioBench:
+    id_usuario: int
+    recintos: list[int]
+
+
+def _dashboard(u: UsuarioBench) -> list[tuple]:
+    return [
+        ("dashboard", "GET", "/dashboard", None),
+    ]
+
+
+def _visor(u: UsuarioBench) -> list[tuple]:
+    pasos = [("visor", "GET", "/visor", None)]
+    if u.recintos:
+        rid = u.recintos[0]
+        pasos += [
+            ("grafica_ndvi", "GET", f"/api/grafica-ndvi/{rid}", None),
+            ("comparativa_campanias", "GET", f"/api/comparativa-campanias/{rid}", None),
+        ]
+    return pasos
+
+
+def _comparar_ndvi(u: UsuarioBench) -> list[tuple]:
+    if not u.recintos:
+        return []
+    # El endpoint admite como máximo 10 recintos
+    return [
+        ("comparar_ndvi", "POST", "/api/comparar-ndvi", {"recintos": u.recintos[:10]}),
+    ]
+
+
+def _dosis_riego(u: UsuarioBench) -> list[tuple]:
+    return [
+        ("dosis_riego", "GET", "/dosis-riego", None),
+    ]
+
+
+def _plan_cultivo(u: UsuarioBench) -> list[tuple]:
+    return [
+        ("plan_cultivo", "GET", "/plan-cultivo", None),
+        ("plan_cultivo_shp", "GET", "/plan-cultivo/descargar-shp", None),
+    ]
+
+
+RECORRIDOS = {
+    "dashboard": _dashboard,
+    "visor": _visor,
+    "comparar_ndvi": _comparar_ndvi,
+    "dosis_riego": _dosis_riego,
+    "plan_cultivo": _plan_cultivo,
+}
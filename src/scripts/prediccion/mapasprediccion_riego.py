@@ -33,9 +33,11 @@ from sqlalchemy import create_engine, text
 sys.path.insert(0, str(Path(__file__).resolve().parent))
 from kc_calculo import calc_kc, load_kc_catalog, lookup_cultivo
 
-load_dotenv()
-
 ROOT = Path(__file__).resolve().parents[3]
+sys.path.insert(0, str(ROOT / "src"))
+from ndvi_pipeline.formato_ndvi import decodificar, leer_ndvi  # noqa: E402
+
+load_dotenv()
 
 GEOSERVER_BASE_URL = os.getenv("GEOSERVER_WMS_URL", "").replace("/wms", "").rstrip("/")
 GEOSERVER_USER     = os.getenv("GEOSERVER_USER")
@@ -171,9 +173,9 @@ def ndvi_at_centroid(dataset, geom_wgs84) -> float | None:
         centroid = geom_wgs84.centroid
         pt = transform_geom("EPSG:4326", dataset.crs, mapping(centroid))
         x, y = pt["coordinates"][:2]
-        samples = list(dataset.sample([(x, y)]))
+        samples = list(dataset.sample([(x, y)], indexes=1))
         if samples:
-            val = float(samples[0][0])
+            val = float(decodificar(samples[0], dataset)[0])
             if np.isfinite(val):
                 return val
     except Exception:
@@ -196,7 +198,7 @@ def zonal_ndvi_mean(dataset, geom_wgs84) -> float | None:
     if win.width <= 0 or win.height <= 0:
         return None
 
-    arr = dataset.read(1, window=win).astype(np.float32)
+    arr = leer_ndvi(dataset, window=win)
     if not np.any(np.isfinite(arr)):
         return None
 
@@ -0,0 +1,388 @@
+"""
+orquestador.py
+--------------
+Ejecutor local de pasos con dependencias (DAG) para la cadena de predicción
+(lo usa run_all.py).
+
+- Cada ``Paso`` es un módulo que se lanza con ``python -m`` en su propio
+  proceso (los scripts ejecutan código al importarse y generarmodelos.py
+  carga una DLL), con sus dependencias, entradas y salidas declaradas.
+- Los pasos cuyas dependencias ya han terminado se lanzan en paralelo
+  (``paralelo`` procesos a la vez).
+- Huella de entradas: código del módulo + argumentos + ficheros (globs) +
+  consultas SQL baratas sobre las tablas que lee. Si coincide con la de la
+  última ejecución correcta del paso y sus salidas existen, se omite.
+- Tabla de ejecuciones en SQLite (``PRED_RUN_DB``): estado, segundos, pico
+  de memoria (RSS máximo del proceso) y huella de cada paso.
+- ``reanudar``: los pasos que terminaron bien en la última ejecución fallida
+  no se repiten; se sigue desde el que falló.
+"""
+
+from __future__ import annotations
+
+import glob
+import hashlib
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime
+from importlib.util import find_spec
+from pathlib import Path
+from typing import Callable
+
+from project_paths import PROJECT_ROOT
+
+SRC_DIR = PROJECT_ROOT / "src"
+PRED_RUN_DB = Path(os.getenv("PRED_RUN_DB", str(PROJECT_ROOT / "data" / "estado" / "prediccion_ejecuciones.sqlite")))
+PRED_LOG_DIR = Path(os.getenv("PRED_LOG_DIR", str(PROJECT_ROOT / "data" / "logs" / "prediccion")))
+
+# Estados de un paso en la tabla de ejecuciones
+OK, OMITIDO, ERROR, BLOQUEADO = "ok", "omitido", "error", "bloqueado"
+
+
+@dataclass
+class Paso:
+    nombre: str
+    modulo: str                                  # p. ej. "scripts.prediccion.predecir"
+    depende: tuple[str, ...] = ()
+    # Globs de ficheros (relativos a la raíz del proyecto o absolutos),
+    # "sql:SELECT ..." o funciones sin argumentos que devuelven un texto
+    entradas: tuple[str | Callable[[], str], ...] = ()
+    salidas: tuple[str, ...] = ()                # globs que deben existir al terminar
+    args: tuple[str, ...] = ()
+
+
+@dataclass
+class Resultado:
+    estado: str
+    segundos: float = 0.0
+    pico_mb: float | None = None
+    codigo: int | None = None
+    huella: str | None = None
+    detalle: str = ""
+    inicio: str | None = None
+
+
+# ==================== HUELLAS ====================
+
+def _rutas(patron: str) -> list[str]:
+    p = Path(patron)
+    return sorted(glob.glob(str(p if p.is_absolute() else PROJECT_ROOT / p)))
+
+
+class Huellas:
+    """Calcula la huella de entradas de un paso. Las consultas SQL comparten un engine."""
+
+    def __init__(self, url_bd: str | None = None):
+        self._url_bd = url_bd
+        self._engine = None
+        self._lock = threading.Lock()
+
+    def _sql(self, consulta: str) -> str:
+        from sqlalchemy import create_engine, text
+
+        with self._lock:
+            if self._engine is None:
+                if self._url_bd is None:
+                    from webapp.config import Config
+                    self._url_bd = Config.SQLALCHEMY_DATABASE_URI
+                self._engine = create_engine(self._url_bd, pool_size=2)
+        with self._engine.connect() as conn:
+            return repr([tuple(f) for f in conn.execute(text(consulta))])
+
+    def entrada(self, e) -> str:
+        if callable(e):
+            return f"fn:{e.__name__}={e()}"
+        if e.startswith("sql:"):
+            return f"{e}={self._sql(e[4:])}"
+        partes = []
+        for ruta in _rutas(e):
+            st = os.stat(ruta)
+            partes.append(f"{ruta}:{st.st_size}:{st.st_mtime_ns}")
+        return f"{e}=[{','.join(partes)}]"
+
+    def paso(self, paso: Paso) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        origen = find_spec(paso.modulo).origin
+        h.update(Path(origen).read_bytes())
+        h.update(repr(paso.args).encode())
+        for e in paso.entradas:
+            h.update(self.entrada(e).encode())
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def close(self):
+        if self._engine is not None:
+            self._engine.dispose()
+
+
+def salidas_presentes(paso: Paso) -> bool:
+    return all(_rutas(s) for s in paso.salidas)
+
+
+# ==================== TABLA DE EJECUCIONES ====================
+
+class RegistroEjecuciones:
+    _ESQUEMA = """
+    CREATE TABLE IF NOT EXISTS ejecuciones (
+        id      INTEGER PRIMARY KEY AUTOINCREMENT,
+        inicio  TEXT NOT NULL,
+        fin     TEXT,
+        estado  TEXT NOT NULL DEFAULT 'en curso'
+    );
+    CREATE TABLE IF NOT EXISTS pasos (
+        id_ejecucion INTEGER NOT NULL REFERENCES ejecuciones(id),
+        paso         TEXT NOT NULL,
+        estado       TEXT NOT NULL,
+        inicio       TEXT,
+        segundos     REAL,
+        pico_mb      REAL,
+        codigo       INTEGER,
+        huella       TEXT,
+        detalle      TEXT,
+        PRIMARY KEY (id_ejecucion, paso)
+    );
+    CREATE INDEX IF NOT EXISTS pasos_paso_ix ON pasos (paso, estado);
+    """
+
+    def __init__(self, ruta: Path = PRED_RUN_DB):
+        ruta.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(ruta, check_same_thread=False)
+        self.conn.executescript(self._ESQUEMA)
+        self._lock = threading.Lock()
+
+    def nueva(self) -> int:
+        with self._lock, self.conn:
+            cur = self.conn.execute("INSERT INTO ejecuciones (inicio) VALUES (?)",
+                                    (datetime.now().isoformat(timespec="seconds"),))
+            return cur.lastrowid
+
+    def cerrar(self, id_ejecucion: int, estado: str):
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE ejecuciones SET fin = ?, estado = ? WHERE id = ?",
+                              (datetime.now().isoformat(timespec="seconds"), estado, id_ejecucion))
+
+    def guardar(self, id_ejecucion: int, paso: str, r: Resultado):
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pasos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (id_ejecucion, paso, r.estado, r.inicio, r.segundos, r.pico_mb, r.codigo, r.huella, r.detalle),
+            )
+
+    def ultima_huella_ok(self, paso: str) -> str | None:
+        """Huella con la que el paso terminó bien la última vez (omitido cuenta: la huella era la misma)."""
+        fila = self.conn.execute(
+            "SELECT huella FROM pasos WHERE paso = ? AND estado IN (?, ?) AND huella IS NOT NULL "
+            "ORDER BY id_ejecucion DESC LIMIT 1", (paso, OK, OMITIDO),
+        ).fetchone()
+        return fila[0] if fila else None
+
+    def ultima_fallida(self) -> tuple[int, set[str]] | None:
+        """(id, pasos terminados) de la última ejecución si falló o se interrumpió ('en curso')."""
+        fila = self.conn.execute("SELECT id, estado FROM ejecuciones ORDER BY id DESC LIMIT 1").fetchone()
+        if not fila or fila[1] == OK:
+            return None
+        hechos = {p for (p,) in self.conn.execute(
+            "SELECT paso FROM pasos WHERE id_ejecucion = ? AND estado IN (?, ?)", (fila[0], OK, OMITIDO))}
+        return fila[0], hechos
+
+    def historial(self, n: int = 10) -> list[tuple]:
+        return self.conn.execute(
+            "SELECT e.id, e.inicio, e.estado, p.paso, p.estado, p.segundos, p.pico_mb "
+            "FROM ejecuciones e LEFT JOIN pasos p ON p.id_ejecucion = e.id "
+            "WHERE e.id > (SELECT COALESCE(MAX(id), 0) FROM ejecuciones) - ? "
+            "ORDER BY e.id, p.inicio", (n,),
+        ).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+
+# ==================== EJECUCIÓN DE UN PASO ====================
+
+def _pico_windows(handle) -> float | None:
+    """PeakWorkingSetSize (MB) de un proceso terminado, con la API de Windows."""
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+    pmc = PROCESS_MEMORY_COUNTERS()
+    pmc.cb = ctypes.sizeof(pmc)
+    if ctypes.windll.kernel32.K32GetProcessMemoryInfo(int(handle), ctypes.byref(pmc), pmc.cb):
+        return pmc.PeakWorkingSetSize / 2**20
+    return None
+
+
+def lanzar(paso: Paso, log_path: Path) -> tuple[int, float | None]:
+    """
+    ``python -m modulo`` desde src/, con la salida por consola (prefijada con
+    el nombre del paso) y en ``log_path``. Devuelve (código, pico de RSS en MB).
+    """
+    log_path.parent.mkdir(parents=True, exist_ok=True)
+    entorno = {**os.environ, "PYTHONUNBUFFERED": "1", "PYTHONIOENCODING": "utf-8"}
+    proc = subprocess.Popen(
+        [sys.executable, "-m", paso.modulo, *paso.args], cwd=SRC_DIR, env=entorno,
+        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, encoding="utf-8", errors="replace",
+    )
+    with open(log_path, "w", encoding="utf-8") as log:
+        for linea in proc.stdout:
+            log.write(linea)
+            print(f"[{paso.nombre}] {linea}", end="", flush=True)
+    proc.stdout.close()
+
+    if hasattr(os, "wait4"):
+        # wait4 da el rusage de ese hijo (ru_maxrss en KB en Linux, bytes en macOS)
+        _, status, uso = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        escala = 2**20 if sys.platform == "darwin" else 2**10
+        return proc.returncode, uso.ru_maxrss / escala
+    proc.wait()
+    try:
+        return proc.returncode, _pico_windows(proc._handle)
+    except (AttributeError, OSError):
+        return proc.returncode, None
+
+
+# ==================== DAG ====================
+
+def orden_topologico(pasos: list[Paso]) -> list[Paso]:
+    por_nombre = {p.nombre: p for p in pasos}
+    for p in pasos:
+        for d in p.depende:
+            if d not in por_nombre:
+                raise ValueError(f"{p.nombre} depende de un paso inexistente: {d}")
+    orden, visitando, hecho = [], set(), set()
+
+    def visitar(p: Paso):
+        if p.nombre in hecho:
+            return
+        if p.nombre in visitando:
+            raise ValueError(f"Ciclo de dependencias en {p.nombre}")
+        visitando.add(p.nombre)
+        for d in p.depende:
+            visitar(por_nombre[d])
+        visitando.discard(p.nombre)
+        hecho.add(p.nombre)
+        orden.append(p)
+
+    for p in pasos:
+        visitar(p)
+    return orden
+
+
+def ejecutar_dag(pasos: list[Paso], paralelo: int = 2, forzar: set[str] | None = None,
+                 reanudar: bool = False, simular: bool = False,
+                 registro: RegistroEjecuciones | None = None, huellas: Huellas | None = None) -> dict[str, Resultado]:
+    """
+    Ejecuta ``pasos`` respetando las dependencias. ``forzar``: nombres (o
+    "todos") que se ejecutan aunque su huella no haya cambiado. ``simular``:
+    solo calcula qué se ejecutaría.
+    """
+    pasos = orden_topologico(pasos)
+    forzar = forzar or set()
+    propios = registro is None, huellas is None
+    registro = registro or RegistroEjecuciones()
+    huellas = huellas or Huellas()
+    try:
+        return _ejecutar(pasos, paralelo, forzar, reanudar, simular, registro, huellas)
+    finally:
+        if propios[0]:
+            registro.close()
+        if propios[1]:
+            huellas.close()
+
+
+def _ejecutar(pasos, paralelo, forzar, reanudar, simular, registro, huellas) -> dict[str, Resultado]:
+
+    hechos_antes: set[str] = set()
+    if reanudar:
+        fallida = registro.ultima_fallida()
+        if fallida:
+            hechos_antes = fallida[1]
+            print(f"[DAG] Reanudando la ejecución {fallida[0]}: ya hechos {', '.join(sorted(hechos_antes)) or '-'}")
+        else:
+            print("[DAG] La última ejecución no falló: se evalúan todas las huellas")
+
+    id_ejecucion = None if simular else registro.nueva()
+    resultados: dict[str, Resultado] = {}
+    pendientes = {p.nombre: p for p in pasos}
+    lock = threading.Lock()
+
+    def correr(paso: Paso) -> Resultado:
+        inicio = datetime.now().isoformat(timespec="seconds")
+        t0 = time.perf_counter()
+        try:
+            huella = huellas.paso(paso)
+        except Exception as e:
+            return Resultado(ERROR, time.perf_counter() - t0, detalle=f"huella: {e!r}", inicio=inicio)
+
+        forzado = "todos" in forzar or paso.nombre in forzar
+        if not forzado and salidas_presentes(paso):
+            if paso.nombre in hechos_antes:
+                return Resultado(OMITIDO, huella=huella, detalle="hecho en la ejecución anterior", inicio=inicio)
+            if registro.ultima_huella_ok(paso.nombre) == huella:
+                return Resultado(OMITIDO, huella=huella, detalle="entradas sin cambios", inicio=inicio)
+        if simular:
+            return Resultado(OK, huella=huella, detalle="se ejecutaría")
+
+        with lock:
+            print(f"\n[DAG] ▶ {paso.nombre} ({paso.modulo})")
+        log_path = PRED_LOG_DIR / f"{id_ejecucion:05d}_{paso.nombre}.log"
+        codigo, pico = lanzar(paso, log_path)
+        segundos = time.perf_counter() - t0
+        if codigo != 0:
+            return Resultado(ERROR, segundos, pico, codigo, huella, f"código {codigo}, log en {log_path}", inicio)
+        faltan = [s for s in paso.salidas if not _rutas(s)]
+        if faltan:
+            return Resultado(ERROR, segundos, pico, codigo, huella, f"no generó {', '.join(faltan)}", inicio)
+        return Resultado(OK, segundos, pico, codigo, huella, inicio=inicio)
+
+    en_vuelo = {}
+    with ThreadPoolExecutor(max_workers=max(1, paralelo)) as pool:
+        while pendientes or en_vuelo:
+            # Lanzar todo lo que tenga las dependencias resueltas
+            for nombre, paso in list(pendientes.items()):
+                estados = [resultados[d].estado if d in resultados else None for d in paso.depende]
+                if any(e in (ERROR, BLOQUEADO) for e in estados):
+                    resultados[nombre] = Resultado(BLOQUEADO, detalle="dependencia fallida")
+                    del pendientes[nombre]
+                    if id_ejecucion is not None:
+                        registro.guardar(id_ejecucion, nombre, resultados[nombre])
+                elif all(e in (OK, OMITIDO) for e in estados):
+                    en_vuelo[pool.submit(correr, paso)] = paso
+                    del pendientes[nombre]
+            if not en_vuelo:
+                continue
+            listos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+            for fut in listos:
+                paso = en_vuelo.pop(fut)
+                r = fut.result()
+                resultados[paso.nombre] = r
+                if id_ejecucion is not None:
+                    registro.guardar(id_ejecucion, paso.nombre, r)
+                with lock:
+                    icono = {OK: "✓", OMITIDO: "·", ERROR: "✗"}.get(r.estado, "?")
+                    print(f"[DAG] {icono} {paso.nombre}: {r.estado} ({r.segundos:.1f}s) {r.detalle}".rstrip())
+
+    if id_ejecucion is not None:
+        fallo = any(r.estado in (ERROR, BLOQUEADO) for r in resultados.values())
+        registro.cerrar(id_ejecucion, ERROR if fallo else OK)
+    return {p.nombre: resultados[p.nombre] for p in pasos}
+
+
+def imprimir_tabla(resultados: dict[str, Resultado]) -> None:
+    print(f"\n{'paso':<28} {'estado':<10} {'s':>9} {'pico MB':>9}  detalle")
+    for nombre, r in resultados.items():
+        pico = f"{r.pico_mb:>9.0f}" if r.pico_mb is not None else f"{'-':>9}"
+        print(f"{nombre:<28} {r.estado:<10} {r.segundos:>9.1f} {pico}  {r.detalle}")
@@ -1,22 +1,128 @@
-import subprocess
+"""
+Cadena de predicción ETP / riego como DAG (scripts/prediccion/orquestador.py):
+
+  sync_inforiego -> evotranspiracion -> generarmodelos -> predecir -> mapas ETP
+                                                                   \\-> mapas riego
+
+Las dos ramas de mapas van en paralelo. Un paso se omite si su huella de
+entradas (código, ficheros, resumen de las tablas que lee) no ha cambiado
+desde su última ejecución correcta y sus salidas existen. Tiempos y pico de
+memoria de cada paso quedan en data/estado/prediccion_ejecuciones.sqlite.
+
+Uso (desde src/):
+  python scripts/prediccion/run_all.py
+  python scripts/prediccion/run_all.py --reanudar          # sigue desde el paso que falló
+  python scripts/prediccion/run_all.py --forzar predecir   # o --forzar todos
+  python scripts/prediccion/run_all.py --simular           # qué se ejecutaría
+  python scripts/prediccion/run_all.py --historial 5
+"""
+
+import argparse
+import os
 import sys
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[3]
+sys.path.insert(0, str(ROOT / "src"))
+from project_paths import (  # noqa: E402
+    DATOS_SALIDA_DIR, ETP_STATIC_DIR, MODELOS_PRED_DIR, NDVI_COMPOSITE_DIR, RIEGO_STATIC_DIR, SALIDA_PRED_DIR,
+)
+from scripts.prediccion.orquestador import (  # noqa: E402
+    ERROR, BLOQUEADO, Paso, RegistroEjecuciones, ejecutar_dag, imprimir_tabla,
+)
+
+PRED_PARALELO = int(os.getenv("PRED_PARALELO", "2"))
+
+# Misma fecha que usan evotranspiracion_archivo2.py, generarmodelos.py y predecir.py
+AYER = (datetime.today() - timedelta(days=1)).strftime("%Y-%m-%d")
+CSV_CULTIVOS = str(DATOS_SALIDA_DIR / f"datoscultivospred{AYER}.csv")
+CSV_PREDICCIONES = str(SALIDA_PRED_DIR / "predicciones_*.csv")
+
+# Resúmenes baratos de las tablas que leen los pasos. datos_diarios es exacto;
+# en las tablas grandes se usan los contadores de pg_stat (un reinicio de
+# estadísticas solo provoca una ejecución de más).
+SQL_DATOS_DIARIOS = "sql:SELECT count(*), max(fecha), max(id) FROM public.datos_diarios"
+SQL_CAMBIOS = ("sql:SELECT relname, n_tup_ins, n_tup_upd, n_tup_del FROM pg_stat_user_tables "
+               "WHERE relid = to_regclass('{}')")
+
 
-scripts = [
-    "scripts.prediccion.sync_inforiego",
-    "scripts.prediccion.evotranspiracion_archivo2",
-    "scripts.prediccion.generarmodelos",
-    "scripts.prediccion.predecir",
-    "scripts.prediccion.mapasprediccion",
+def dia_actual() -> str:
+    """Inforiego publica datos nuevos cada día: la sincronización se repite una vez al día."""
+    return date.today().isoformat()
+
+
+PASOS = [
+    Paso("sync_inforiego", "scripts.prediccion.sync_inforiego", entradas=(dia_actual,)),
+    Paso("evotranspiracion", "scripts.prediccion.evotranspiracion_archivo2",
+         depende=("sync_inforiego",),
+         entradas=(SQL_DATOS_DIARIOS, SQL_CAMBIOS.format("public.estaciones"),
+                   SQL_CAMBIOS.format("sigpac.cultivo_declarado")),
+         salidas=(CSV_CULTIVOS,)),
+    Paso("generarmodelos", "scripts.prediccion.generarmodelos",
+         depende=("evotranspiracion",),
+         entradas=(CSV_CULTIVOS,),
+         salidas=(str(MODELOS_PRED_DIR / "*.bin"),)),
+    Paso("predecir", "scripts.prediccion.predecir",
+         depende=("generarmodelos",),
+         entradas=(CSV_CULTIVOS, str(MODELOS_PRED_DIR / "*.bin"), str(MODELOS_PRED_DIR / "*.txt")),
+         salidas=(str(SALIDA_PRED_DIR / f"predicciones_{AYER}.csv"),)),
+    Paso("mapas_etp", "scripts.prediccion.mapasprediccion",
+         depende=("predecir",),
+         entradas=(CSV_PREDICCIONES, SQL_CAMBIOS.format("public.recintos")),
+         salidas=(str(ETP_STATIC_DIR / "indice.json"),)),
     # Requiere NDVI reciente (ndvi_diax.py) para Kc preciso; si no hay raster usa fallback BD.
-    "scripts.prediccion.mapasprediccion_riego",
+    Paso("mapas_riego", "scripts.prediccion.mapasprediccion_riego",
+         depende=("predecir",),
+         entradas=(CSV_PREDICCIONES, str(NDVI_COMPOSITE_DIR / "ndvi_pc_*_mosaic_utm.tif"),
+                   "src/scripts/prediccion/cultivos_kc.csv", "src/scripts/prediccion/kc_calculo.py",
+                   SQL_CAMBIOS.format("public.recintos"), SQL_CAMBIOS.format("public.indices_raster")),
+         salidas=(str(RIEGO_STATIC_DIR / "indice.json"),)),
 ]
 
-for script in scripts:
-    print(f"\nEjecutando {script}...")
 
-    subprocess.run(
-        [sys.executable, "-m", script],
-        check=True
-    )
+def imprimir_historial(n: int) -> None:
+    registro = RegistroEjecuciones()
+    actual = None
+    for id_ej, inicio, estado, paso, estado_paso, segundos, pico in registro.historial(n):
+        if id_ej != actual:
+            print(f"\n#{id_ej} {inicio} [{estado}]")
+            actual = id_ej
+        if paso:
+            pico_txt = f"{pico:.0f} MB" if pico is not None else "-"
+            print(f"  {paso:<24} {estado_paso:<10} {segundos or 0:>8.1f}s {pico_txt:>9}")
+    registro.close()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Cadena de predicción ETP / riego con dependencias")
+    parser.add_argument("--paralelo", type=int, default=PRED_PARALELO, help="Pasos a la vez")
+    parser.add_argument("--forzar", default="", help="Pasos a ejecutar aunque no cambien sus entradas (coma) o 'todos'")
+    parser.add_argument("--reanudar", action="store_true", help="Seguir la última ejecución fallida desde el paso que falló")
+    parser.add_argument("--simular", action="store_true", help="Solo mostrar qué pasos se ejecutarían")
+    parser.add_argument("--historial", type=int, default=0, help="Mostrar las últimas N ejecuciones y salir")
+    args = parser.parse_args()
+
+    if args.historial:
+        imprimir_historial(args.historial)
+        return 0
+
+    forzar = {p.strip() for p in args.forzar.split(",") if p.strip()}
+    desconocidos = forzar - {p.nombre for p in PASOS} - {"todos"}
+    if desconocidos:
+        print(f"✗ Pasos desconocidos: {', '.join(sorted(desconocidos))}")
+        return 1
+
+    resultados = ejecutar_dag(PASOS, paralelo=args.paralelo, forzar=forzar,
+                              reanudar=args.reanudar, simular=args.simular)
+    imprimir_tabla(resultados)
+
+    if any(r.estado in (ERROR, BLOQUEADO) for r in resultados.values()):
+        print("\n✗ La cadena no terminó: corrige el paso con error y relanza con --reanudar")
+        return 1
+    print("\nTodos los scripts terminaron correctamente.")
+    return 0
+
 
-print("\nTodos los scripts terminaron correctamente.")
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
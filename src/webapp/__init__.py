@@ -5,6 +5,7 @@ from flask_mail import Mail
 from flask_session import Session
 from .config import Config
 from .filters import formato_tel_es
+from .utils.metrics import init_metrics
 
 
 # Instanciar extensiones
@@ -47,6 +48,9 @@ def create_app():
     app.register_blueprint(api_bp)
     app.register_blueprint(galeria_bp)
     app.register_blueprint(legend_bp)
+
+    # Latencia, SQL y HTTP saliente por endpoint (/metrics + Server-Timing)
+    init_metrics(app)
     
 
     return app
\ No newline at end of file
@@ -0,0 +1,207 @@
+"""
+proxy_async.py
+--------------
+Versiones asyncio de los endpoints que solo hacen de proxy hacia servicios
+externos (GeoServer, Mírame). Las sirve ``webapp.asgi`` con un cliente
+``httpx.AsyncClient`` compartido, de modo que una espera larga de GeoServer
+ocupa un socket y no un hilo del servidor.
+
+La construcción de parámetros y el parseo de respuestas son los mismos que
+usan las vistas Flask de ``routes.py`` / ``services.py`` (las respuestas de
+httpx exponen ``status_code``, ``text``, ``headers`` y ``json()`` igual que
+las de requests); aquí solo cambia la E/S.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+import httpx
+from werkzeug.datastructures import MultiDict
+
+from ..utils.metrics import RequestStats, record_outbound
+from .routes import (
+    _WMS_CAPABILITIES_PARAMS,
+    _chduero_attempts,
+    _etp_fechas_desde_capabilities,
+    _legend_params,
+    _parse_gfi_response,
+    _suelos_params,
+    _suelos_resultado,
+    _wms_getfeatureinfo_params,
+)
+from .services import _enriquecer_recintos, _recintos_wfs_peticion
+
+
+@dataclass
+class PeticionAsync:
+    """Lo que necesita un handler async: app Flask (config), cliente HTTP y query string."""
+
+    app: object
+    http: httpx.AsyncClient
+    args: MultiDict
+    stats: RequestStats = field(default_factory=RequestStats)
+
+    @property
+    def config(self):
+        return self.app.config
+
+    def json(self, payload, status: int = 200) -> "RespuestaAsync":
+        # Mismo serializador que jsonify()
+        body = self.app.json.dumps(payload).encode("utf-8") + b"\n"
+        return RespuestaAsync(status, body, "application/json")
+
+
+@dataclass
+class RespuestaAsync:
+    status: int
+    body: bytes
+    content_type: str
+
+
+async def _get(pet: PeticionAsync, url: str, **kwargs) -> httpx.Response:
+    t0 = time.perf_counter()
+    status = "error"
+    try:
+        resp = await pet.http.get(url, **kwargs)
+        status = resp.status_code
+        return resp
+    finally:
+        record_outbound(url, status, time.perf_counter() - t0, stats=pet.stats)
+
+
+# ==================== HANDLERS ====================
+
+async def geoserver_legend(pet: PeticionAsync) -> RespuestaAsync:
+    layer = pet.args.get("layer")
+    style = pet.args.get("style", "")
+
+    if not layer:
+        return pet.json({"error": "Missing layer"}, 400)
+
+    r = await _get(pet, pet.config["GEOSERVER_WMS_URL"], params=_legend_params(layer, style), timeout=20)
+    return RespuestaAsync(r.status_code, r.content, r.headers.get("Content-Type", "image/png"))
+
+
+async def popup_suelos(pet: PeticionAsync) -> RespuestaAsync:
+    try:
+        lat = pet.args.get("lat", type=float)
+        lng = pet.args.get("lng", type=float)
+
+        if lat is None or lng is None:
+            return pet.json({'ok': False, 'found': False, 'error': 'Coordenadas inválidas'})
+
+        response = await _get(
+            pet, pet.config["GEOSERVER_WMS_URL"], params=_suelos_params(lat, lng), timeout=10,
+        )
+        if response.status_code != 200:
+            return pet.json({'ok': False, 'found': False, 'error': 'Error en GeoServer'})
+
+        return pet.json(_suelos_resultado(response.json(), lat, lng))
+
+    except Exception as e:
+        print(f"❌ Error en popup_suelos (async): {str(e)}")
+        return pet.json({'ok': False, 'found': False, 'error': str(e)})
+
+
+async def popup_chduero(pet: PeticionAsync) -> RespuestaAsync:
+    try:
+        layer = (pet.args.get('layer') or '').strip()
+        lat = pet.args.get('lat', type=float)
+        lng = pet.args.get('lng', type=float)
+        bbox = (pet.args.get('bbox') or '').strip() or None
+        width = pet.args.get('width', type=int)
+        height = pet.args.get('height', type=int)
+        x = pet.args.get('x', type=int)
+        y = pet.args.get('y', type=int)
+
+        if not layer or lat is None or lng is None:
+            return pet.json({'ok': False, 'found': False, 'error': 'Parámetros incompletos'})
+
+        cfg = pet.config
+        auth = None
+        if cfg.get("GEOSERVER_USER") and cfg.get("GEOSERVER_PASSWORD"):
+            auth = (cfg["GEOSERVER_USER"], cfg["GEOSERVER_PASSWORD"])
+
+        attempts = _chduero_attempts(
+            cfg["GEOSERVER_WMS_URL"],
+            cfg.get("CHDUERO_MIRAME_WMS_URL", "https://mirame.chduero.es/geoserver/mirame/wms"),
+            layer, lat, lng, auth,
+            width=width, height=height, x=x, y=y, bbox=bbox,
+        )
+
+        # Los intentos son un orden de preferencia: se mantienen secuenciales
+        # para no multiplicar la carga sobre Mírame/GeoServer.
+        feature = None
+        for wms_url, lyr, req_auth, w, h, xi, yi, bb in attempts:
+            try:
+                params = _wms_getfeatureinfo_params(
+                    lyr, lat, lng, width=w, height=h, x=xi, y=yi, bbox=bb,
+                    info_format="text/html",
+                )
+                resp = await _get(pet, wms_url, params=params, timeout=12, auth=req_auth)
+                feature = _parse_gfi_response(resp, lat, lng)
+                if feature:
+                    break
+            except Exception as exc:
+                print(f"[CH-DUERO] GFI error {lyr}: {exc}")
+
+        if not feature:
+            print(f"[CH-DUERO] Sin GetFeatureInfo para {layer} en ({lat}, {lng})")
+            return pet.json({'ok': True, 'found': False})
+
+        return pet.json({
+            'ok': True,
+            'found': True,
+            'feature': {
+                'properties': feature.get('properties', {}),
+                'geometry': feature.get('geometry'),
+            },
+        })
+
+    except Exception as e:
+        print(f"❌ Error en popup_chduero (async): {str(e)}")
+        return pet.json({'ok': False, 'found': False, 'error': str(e)})
+
+
+async def etp_fechas(pet: PeticionAsync) -> RespuestaAsync:
+    try:
+        r = await _get(pet, pet.config["GEOSERVER_WMS_URL"], params=_WMS_CAPABILITIES_PARAMS, timeout=10)
+        # El GetCapabilities puede ocupar varios MB: se parsea fuera del event loop
+        fechas = await asyncio.to_thread(_etp_fechas_desde_capabilities, r.content)
+        return pet.json({"ok": True, "fechas": fechas})
+    except Exception as e:
+        return pet.json({"ok": False, "error": str(e)}, 500)
+
+
+async def recintos(pet: PeticionAsync) -> RespuestaAsync:
+    try:
+        with pet.app.app_context():
+            peticion = _recintos_wfs_peticion(pet.args.get("bbox"))
+    except ValueError as exc:
+        return pet.json({"error": str(exc)}, 400)
+
+    if peticion is None:
+        return pet.json({"type": "FeatureCollection", "features": []})
+    wfs_url, params, auth = peticion
+
+    try:
+        resp = await _get(pet, wfs_url, params=params, auth=auth, timeout=20)
+        resp.raise_for_status()
+        fc = await asyncio.to_thread(_enriquecer_recintos, resp.json())
+    except Exception:
+        return pet.json({"error": "Error interno en /api/recintos"}, 500)
+
+    return pet.json(fc)
+
+
+# ruta -> (endpoint equivalente en Flask, handler, requiere login)
+RUTAS_ASYNC = {
+    "/api/geoserver/legend": ("geoserver_proxy.geoserver_legend", geoserver_legend, False),
+    "/api/popup/suelos": ("api.popup_suelos", popup_suelos, True),
+    "/api/popup/chduero": ("api.popup_chduero", popup_chduero, True),
+    "/api/etp/fechas": ("api.etp_fechas", etp_fechas, True),
+    "/api/recintos": ("api.recintos", recintos, False),
+}
@@ -12,6 +12,7 @@ from flask import Response, jsonify, request, send_from_directory, current_app
 from xml.etree import ElementTree as ET
 from pathlib import Path
 from flask_login import login_required, current_user
+from werkzeug.exceptions import NotFound
 import requests
 import re as _re_api
 
@@ -37,6 +38,10 @@ from .. import db
 from ..models import ImagenDibujada, IndicesRaster, Recinto, Solicitudrecinto, Variedad, Estacion, DatosDiarios, Recinto, Contador
 from ..dashboard.utils_dashboard import municipios_finder
 from ..utils.legend_loader import load_legend_from_csv
+from ..utils.raster_tiles import TileNotFound, obtener_tile
+from ..utils.ndvi_cubo import CuboNoDisponible, get_lector_cubo
+from ..utils.ndvi_formato import decodificar
+from ..utils.thumbnails_store import THUMBNAILS_STATIC_DIR, get_archivo_thumbnails
 
 from . import api_bp, legend_bp
 from .services import (
@@ -393,17 +398,7 @@ def popup_catastro():
 
 
 
-@legend_bp.get("/api/geoserver/legend")
-def geoserver_legend():
-    layer = request.args.get("layer")
-    style = request.args.get("style", "")
-
-    if not layer:
-        return {"error": "Missing layer"}, 400
-
-
-    GEOSERVER_WMS = current_app.config["GEOSERVER_WMS_URL"]
-
+def _legend_params(layer: str, style: str = "") -> dict:
     params = {
         "SERVICE": "WMS",
         "REQUEST": "GetLegendGraphic",
@@ -414,8 +409,21 @@ def geoserver_legend():
     }
     if style:
         params["STYLE"] = style
+    return params
 
-    r = requests.get(GEOSERVER_WMS, params=params, timeout=20)
+
+@legend_bp.get("/api/geoserver/legend")
+def geoserver_legend():
+    layer = request.args.get("layer")
+    style = request.args.get("style", "")
+
+    if not layer:
+        return {"error": "Missing layer"}, 400
+
+
+    GEOSERVER_WMS = current_app.config["GEOSERVER_WMS_URL"]
+
+    r = requests.get(GEOSERVER_WMS, params=_legend_params(layer, style), timeout=20)
     return Response(
         r.content,
         status=r.status_code,
@@ -445,6 +453,131 @@ def legend_mcsncyl(year: int):
             "message": str(e)
         }), 500
 
+def _suelos_params(lat: float, lng: float) -> dict:
+    """Parámetros GetFeatureInfo de la capa de muestras de suelo."""
+    return {
+        'SERVICE': 'WMS',
+        'VERSION': '1.1.1',
+        'REQUEST': 'GetFeatureInfo',
+        'LAYERS': 'ne:PtosMuestrasSuelosCyL_Etrs89_H30',
+        'QUERY_LAYERS': 'ne:PtosMuestrasSuelosCyL_Etrs89_H30',
+        'INFO_FORMAT': 'application/json',
+        'FEATURE_COUNT': 1,
+        'X': 50,
+        'Y': 50,
+        'SRS': 'EPSG:4326',
+        'WIDTH': 101,
+        'HEIGHT': 101,
+        'BBOX': f'{lng-0.001},{lat-0.001},{lng+0.001},{lat+0.001}'
+    }
+
+
+def _suelos_resultado(data: dict, lat: float, lng: float) -> dict:
+    """
+    Construye la respuesta de /api/popup/suelos a partir del GeoJSON de GeoServer.
+    Devuelve datos con nombres de campos normalizados.
+    """
+    features = data.get('features', [])
+
+    if not features:
+        return {'ok': True, 'found': False}
+
+    # Obtener el primer feature
+    feature = features[0]
+    properties = feature.get('properties', {})
+    geometry = feature.get('geometry', {})
+
+    # Log para ver qué campos vienen realmente de GeoServer
+    print("📋 Campos disponibles en GeoServer:", list(properties.keys()))
+    print("📊 Valores de campos clave:")
+    print(f"   - Campaña: {properties.get('Campaña')}")
+    print(f"   - pH: {properties.get('pH')}")
+    print(f"   - ID_MUESTRA: {properties.get('ID_MUESTRA')}")
+
+    # Función auxiliar mejorada
+    def get_value(*keys):
+        """Busca el valor en diferentes variantes de nombres de campo"""
+        for key in keys:
+            value = properties.get(key)
+            # Importante: considerar "" (string vacío) como None
+            if value is not None and value != "":
+                return value
+        return None
+
+    # MAPEO DE CAMPOS CON VARIANTES (incluye correcciones críticas detectadas)
+    field_mapping = {
+        # Campos principales
+        'id_muestra': get_value('ID_MUESTRA', 'ID_Muestra', 'id_muestra'),
+        'origen': get_value('Origen', 'origen'),
+        'campana': get_value('Campaña', 'Campanya', 'campana'),
+        'laboratori': get_value('Laboratori', 'laboratori'),
+
+        'ph': get_value('pH', 'ph', 'PH'),
+
+        'acidez_basi': get_value('AcidezBasi', 'Acidez_Basi', 'acidez_basi'),
+
+        'conductivi': get_value('Conductivi', 'conductividad', 'CE'),
+
+        # Materia orgánica
+        'mo_porc': get_value('MO_Porc', 'mo_porc', 'MO_%'),
+        'materia_org': get_value('MateriaOrg', 'Materia_Org', 'materia_org'),
+
+        # Textura
+        'arena_porc': get_value('Arena_Porc', 'arena_porc', 'Arena_%'),
+        'limo_porc': get_value('Limo_Porc', 'limo_porc', 'Limo_%'),
+        'arcilla_po': get_value('Arcilla_Po', 'Arcilla_Porc', 'arcilla_porc', 'Arcilla_%'),
+
+        'textura': get_value('Textura', 'textura'),
+        'text_calcu': get_value('TextCalcu', 'Text_Calcu', 'text_calcu'),
+        'grupo_textu': get_value('GrupoTextu', 'Grupo_Textu', 'grupo_textu'),
+        'valoracion': get_value('Valoracion', 'valoracion'),
+
+        # Nutrientes
+        'p_olsen_pp': get_value('P_Olsen_pp', 'P_Olsen_ppm', 'p_olsen_ppm', 'P_ppm'),
+        'p_olsen': get_value('P_Olsen', 'p_olsen', 'POlsen'),
+        'potasio_pp': get_value('Potasio_pp', 'Potasio_ppm', 'potasio_ppm', 'K_ppm'),
+        'potasio': get_value('Potasio', 'potasio'),
+        'nitrogeno_': get_value('Nitrogeno_', 'nitrogeno', 'N', 'Nitrogeno'),
+        'calcio_ppm': get_value('Calcio_ppm', 'calcio_ppm', 'Ca_ppm'),
+        'calcio': get_value('Calcio', 'calcio'),
+        'magnesio_p': get_value('Magnesio_p', 'Magnesio_ppm', 'magnesio_ppm', 'Mg_ppm'),
+        'magnesio': get_value('Magnesio', 'magnesio'),
+
+        # Coordenadas
+        'coor_x_etr': get_value('COOR_X_ETR', 'Coor_X_Etr', 'coor_x', 'X_ETRS89'),
+        'coor_y_etr': get_value('COOR_Y_ETR', 'Coor_Y_Etr', 'coor_y', 'Y_ETRS89'),
+    }
+
+    # Construir la respuesta con campos mapeados
+    resultado = {
+        'ok': True,
+        'found': True,
+        'data': {
+            **field_mapping,  # Campos mapeados
+
+            # Geometría para el highlight
+            'geojson': {
+                'type': 'FeatureCollection',
+                'features': [{
+                    'type': 'Feature',
+                    'properties': field_mapping,
+                    'geometry': geometry
+                }]
+            }
+        }
+    }
+
+    # Log detallado para debugging
+    print(f"✅ Suelo encontrado en ({lat}, {lng})")
+    print(f"   📍 ID Muestra: {field_mapping.get('id_muestra')}")
+    print(f"   📅 Campaña: {field_mapping.get('campana')}")
+    print(f"   🧪 pH: {field_mapping.get('ph')}")
+    print(f"   🏢 Origen: {field_mapping.get('origen')}")
+    print(f"   🔬 Laboratorio: {field_mapping.get('laboratori')}")
+
+    return resultado
+
+
 @api_bp.route('/popup/suelos')
 @login_required
 def popup_suelos():
@@ -462,129 +595,13 @@ def popup_suelos():
         # URL de GeoServer, .env supongo
         GEOSERVER_WMS = current_app.config["GEOSERVER_WMS_URL"]
         
-        # Parámetros para GetFeatureInfo
-        params = {
-            'SERVICE': 'WMS',
-            'VERSION': '1.1.1',
-            'REQUEST': 'GetFeatureInfo',
-            'LAYERS': 'ne:PtosMuestrasSuelosCyL_Etrs89_H30',
-            'QUERY_LAYERS': 'ne:PtosMuestrasSuelosCyL_Etrs89_H30',
-            'INFO_FORMAT': 'application/json',
-            'FEATURE_COUNT': 1,
-            'X': 50,
-            'Y': 50,
-            'SRS': 'EPSG:4326',
-            'WIDTH': 101,
-            'HEIGHT': 101,
-            'BBOX': f'{lng-0.001},{lat-0.001},{lng+0.001},{lat+0.001}'
-        }
-        
-        # Hacer la petición a GeoServer
-        response = requests.get(GEOSERVER_WMS, params=params, timeout=10)
+        # Hacer la petición a GeoServer (GetFeatureInfo)
+        response = requests.get(GEOSERVER_WMS, params=_suelos_params(lat, lng), timeout=10)
         
         if response.status_code != 200:
             return jsonify({'ok': False, 'found': False, 'error': 'Error en GeoServer'})
         
-        data = response.json()
-        features = data.get('features', [])
-        
-        if not features:
-            return jsonify({'ok': True, 'found': False})
-        
-        # Obtener el primer feature
-        feature = features[0]
-        properties = feature.get('properties', {})
-        geometry = feature.get('geometry', {})
-        
-        # Log para ver qué campos vienen realmente de GeoServer
-        print("📋 Campos disponibles en GeoServer:", list(properties.keys()))
-        print("📊 Valores de campos clave:")
-        print(f"   - Campaña: {properties.get('Campaña')}")
-        print(f"   - pH: {properties.get('pH')}")
-        print(f"   - ID_MUESTRA: {properties.get('ID_MUESTRA')}")
-        
-        # Función auxiliar mejorada
-        def get_value(*keys):
-            """Busca el valor en diferentes variantes de nombres de campo"""
-            for key in keys:
-                value = properties.get(key)
-                # Importante: considerar "" (string vacío) como None
-                if value is not None and value != "":
-                    return value
-            return None
-        
-        # MAPEO DE CAMPOS CON VARIANTES (incluye correcciones críticas detectadas)
-        field_mapping = {
-            # Campos principales
-            'id_muestra': get_value('ID_MUESTRA', 'ID_Muestra', 'id_muestra'),
-            'origen': get_value('Origen', 'origen'),
-            'campana': get_value('Campaña', 'Campanya', 'campana'),
-            'laboratori': get_value('Laboratori', 'laboratori'),
-            
-            'ph': get_value('pH', 'ph', 'PH'),
-            
-            'acidez_basi': get_value('AcidezBasi', 'Acidez_Basi', 'acidez_basi'),
-            
-            'conductivi': get_value('Conductivi', 'conductividad', 'CE'),
-            
-            # Materia orgánica
-            'mo_porc': get_value('MO_Porc', 'mo_porc', 'MO_%'),
-            'materia_org': get_value('MateriaOrg', 'Materia_Org', 'materia_org'),
-            
-            # Textura
-            'arena_porc': get_value('Arena_Porc', 'arena_porc', 'Arena_%'),
-            'limo_porc': get_value('Limo_Porc', 'limo_porc', 'Limo_%'),
-            'arcilla_po': get_value('Arcilla_Po', 'Arcilla_Porc', 'arcilla_porc', 'Arcilla_%'),
-            
-            'textura': get_value('Textura', 'textura'),
-            'text_calcu': get_value('TextCalcu', 'Text_Calcu', 'text_calcu'),
-            'grupo_textu': get_value('GrupoTextu', 'Grupo_Textu', 'grupo_textu'),
-            'valoracion': get_value('Valoracion', 'valoracion'),
-            
-            # Nutrientes
-            'p_olsen_pp': get_value('P_Olsen_pp', 'P_Olsen_ppm', 'p_olsen_ppm', 'P_ppm'),
-            'p_olsen': get_value('P_Olsen', 'p_olsen', 'POlsen'),
-            'potasio_pp': get_value('Potasio_pp', 'Potasio_ppm', 'potasio_ppm', 'K_ppm'),
-            'potasio': get_value('Potasio', 'potasio'),
-            'nitrogeno_': get_value('Nitrogeno_', 'nitrogeno', 'N', 'Nitrogeno'),
-            'calcio_ppm': get_value('Calcio_ppm', 'calcio_ppm', 'Ca_ppm'),
-            'calcio': get_value('Calcio', 'calcio'),
-            'magnesio_p': get_value('Magnesio_p', 'Magnesio_ppm', 'magnesio_ppm', 'Mg_ppm'),
-            'magnesio': get_value('Magnesio', 'magnesio'),
-            
-            # Coordenadas
-            'coor_x_etr': get_value('COOR_X_ETR', 'Coor_X_Etr', 'coor_x', 'X_ETRS89'),
-            'coor_y_etr': get_value('COOR_Y_ETR', 'Coor_Y_Etr', 'coor_y', 'Y_ETRS89'),
-        }
-        
-        # Construir la respuesta con campos mapeados
-        resultado = {
-            'ok': True,
-            'found': True,
-            'data': {
-                **field_mapping,  # Campos mapeados
-                
-                # Geometría para el highlight
-                'geojson': {
-                    'type': 'FeatureCollection',
-                    'features': [{
-                        'type': 'Feature',
-                        'properties': field_mapping,
-                        'geometry': geometry
-                    }]
-                }
-            }
-        }
-        
-        # Log detallado para debugging
-        print(f"✅ Suelo encontrado en ({lat}, {lng})")
-        print(f"   📍 ID Muestra: {field_mapping.get('id_muestra')}")
-        print(f"   📅 Campaña: {field_mapping.get('campana')}")
-        print(f"   🧪 pH: {field_mapping.get('ph')}")
-        print(f"   🏢 Origen: {field_mapping.get('origen')}")
-        print(f"   🔬 Laboratorio: {field_mapping.get('laboratori')}")
-        
-        return jsonify(resultado)
+        return jsonify(_suelos_resultado(response.json(), lat, lng))
         
     except Exception as e:
         print(f"❌ Error en popup_suelos: {str(e)}")
@@ -700,12 +717,10 @@ def _parse_gfi_response(response: requests.Response, lat: float, lng: float) ->
     return None
 
 
-def _wms_getfeatureinfo(
-    wms_url: str,
+def _wms_getfeatureinfo_params(
     layer: str,
     lat: float,
     lng: float,
-    auth: tuple[str, str] | None,
     *,
     width: int = 101,
     height: int = 101,
@@ -714,11 +729,11 @@ def _wms_getfeatureinfo(
     bbox: str | None = None,
     info_format: str = "application/json",
     srs: str = "EPSG:4326",
-) -> requests.Response:
+) -> dict:
     if bbox is None:
         delta = 0.002
         bbox = f"{lng - delta},{lat - delta},{lng + delta},{lat + delta}"
-    params = {
+    return {
         "SERVICE": "WMS",
         "VERSION": "1.1.1",
         "REQUEST": "GetFeatureInfo",
@@ -733,10 +748,21 @@ def _wms_getfeatureinfo(
         "Y": y,
         "BBOX": bbox,
     }
+
+
+def _wms_getfeatureinfo(
+    wms_url: str,
+    layer: str,
+    lat: float,
+    lng: float,
+    auth: tuple[str, str] | None,
+    **kwargs,
+) -> requests.Response:
+    params = _wms_getfeatureinfo_params(layer, lat, lng, **kwargs)
     return requests.get(wms_url, params=params, timeout=12, auth=auth)
 
 
-def _chduero_feature_at_point(
+def _chduero_attempts(
     local_wms: str,
     mirame_wms: str,
     layer: str,
@@ -749,10 +775,10 @@ def _chduero_feature_at_point(
     x: int | None = None,
     y: int | None = None,
     bbox: str | None = None,
-) -> dict | None:
+) -> list[tuple]:
     """
-    Capas CH Duero vía store WMS en cascada (Mírame).
-    GetFeatureInfo text/html — primero Mírame directo (sin auth local).
+    Orden de intentos GetFeatureInfo (Mírame directo y luego GeoServer local),
+    primero con la vista del mapa y después con bbox crecientes alrededor del punto.
     """
     mirame_layer = _mirame_layer_name(layer)
     attempts: list[tuple] = []
@@ -766,6 +792,32 @@ def _chduero_feature_at_point(
         attempts.append((mirame_wms, mirame_layer, None, 101, 101, 50, 50, pt_bbox))
         attempts.append((local_wms, layer, auth, 101, 101, 50, 50, pt_bbox))
 
+    return attempts
+
+
+def _chduero_feature_at_point(
+    local_wms: str,
+    mirame_wms: str,
+    layer: str,
+    lat: float,
+    lng: float,
+    auth: tuple[str, str] | None,
+    *,
+    width: int | None = None,
+    height: int | None = None,
+    x: int | None = None,
+    y: int | None = None,
+    bbox: str | None = None,
+) -> dict | None:
+    """
+    Capas CH Duero vía store WMS en cascada (Mírame).
+    GetFeatureInfo text/html — primero Mírame directo (sin auth local).
+    """
+    attempts = _chduero_attempts(
+        local_wms, mirame_wms, layer, lat, lng, auth,
+        width=width, height=height, x=x, y=y, bbox=bbox,
+    )
+
     for wms_url, lyr, req_auth, w, h, xi, yi, bb in attempts:
         try:
             resp = _wms_getfeatureinfo(
@@ -1390,6 +1442,23 @@ def get_indice_by_id(id_indice):
 @login_required
 def grafica_ndvi(recinto_id):
     try:
+        # Curvas suavizadas de fenologia_recinto (fenologia_recintos.py); ?bruto=1 = medias sin suavizar
+        if request.args.get('bruto') != '1':
+            curvas = _curvas_fenologia(recinto_id)
+            if curvas:
+                meses = ['ene', 'feb', 'mar', 'abr', 'may', 'jun',
+                        'jul', 'ago', 'sep', 'oct', 'nov', 'dic']
+                puntos = sorted(
+                    (p for c in curvas.values() for p in c['puntos']),
+                    key=lambda p: p[0], reverse=True
+                )
+                return jsonify({
+                    "fechas": [f"{f.day:02d} {meses[f.month-1]}. {f.year}" for f, _ in puntos],
+                    "valores": [round(v, 2) for _, v in puntos],
+                    "suavizado": True,
+                    "fenologia": [c['fenologia'] for _, c in sorted(curvas.items(), reverse=True)]
+                }), 200
+
         indices = IndicesRaster.query.filter_by(
             id_recinto=recinto_id,
             tipo_indice='NDVI'
@@ -1552,7 +1621,7 @@ def calcular_ndvi(geometry, tiff_path=None):
                 return None, None, None
             
             # 7. Extraer datos NDVI
-            ndvi_data = out_image[0]  # Primera (y única) banda
+            ndvi_data = decodificar(out_image[0], src)  # Primera (y única) banda, float32 o int16 escalado
             
             # 8. Filtrar valores válidos
             # Considerar válidos los valores entre -1 y 1 (rango típico de NDVI)
@@ -1667,6 +1736,125 @@ def serve_ndvi(filename):
     return send_from_directory(NDVI_DIR, filename)
 
 
+@api_bp.route("/raster-tiles/<layer>/<fecha>/<int:z>/<int:x>/<int:y>.png")
+def raster_tile(layer, fecha, z, x, y):
+    """
+    Tesela XYZ 256 px de un ráster 3857 (layer = ndvi | s2rgb, fecha = latest | YYYYMMDD).
+    Usa caché en memoria/disco y ETag ligado al mtime del ráster origen.
+    """
+    try:
+        png, etag = obtener_tile(current_app.config, layer, fecha, z, x, y)
+    except TileNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"❌ Error generando tesela {layer}/{fecha}/{z}/{x}/{y}: {e}")
+        return jsonify({"error": "Error generando la tesela"}), 500
+
+    # "latest" cambia al regenerar el mosaico: caché corta y revalidación por ETag
+    max_age = 300 if fecha == "latest" else 86400
+    if etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = Response(png, mimetype="image/png")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = f"public, max-age={max_age}"
+    return resp
+
+
+@api_bp.route("/thumbnails/<fecha>/<int:id_recinto>.png")
+def thumbnail_recinto(fecha, id_recinto):
+    """
+    Thumbnail NDVI de un recinto (fecha = YYYYMMDD) desde el archivo SQLite de
+    generate_thumbnails.py, con ETag = hash del PNG. Si no está en el archivo
+    se sirve el PNG suelto de static/thumbnails/YYYYMMDD/ (generaciones antiguas).
+    """
+    if not _re_api.fullmatch(r"\d{8}", fecha):
+        return jsonify({"error": "Fecha no válida (YYYYMMDD)"}), 400
+
+    try:
+        archivo = get_archivo_thumbnails(current_app.config)
+        etag = archivo.etag(fecha, id_recinto)
+        if etag is None:
+            return send_from_directory(THUMBNAILS_STATIC_DIR / fecha, f"{id_recinto}.png", max_age=3600)
+
+        if etag in request.if_none_match:
+            resp = Response(status=304)
+        else:
+            encontrado = archivo.get(fecha, id_recinto)
+            if encontrado is None:  # Borrado entre las dos consultas
+                return jsonify({"error": "Thumbnail no encontrado"}), 404
+            png, etag = encontrado
+            resp = Response(png, mimetype="image/png")
+    except NotFound:
+        return jsonify({"error": "Thumbnail no encontrado"}), 404
+    except Exception as e:
+        print(f"❌ Error sirviendo thumbnail {fecha}/{id_recinto}: {e}")
+        return jsonify({"error": "Error al obtener el thumbnail"}), 500
+
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = "public, max-age=3600"
+    return resp
+
+
+# SERIES NDVI DESDE EL CUBO (utils/ndvi_cubo.py)
+@api_bp.route("/ndvi/serie/punto", methods=["GET"])
+@login_required
+def serie_ndvi_punto():
+    """Serie NDVI completa del píxel bajo un punto (?lon=&lat=, EPSG:4326)."""
+    try:
+        lon = float(request.args["lon"])
+        lat = float(request.args["lat"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Parámetros lon y lat obligatorios"}), 400
+
+    try:
+        return jsonify(get_lector_cubo(current_app.config).serie_punto(lon, lat)), 200
+    except CuboNoDisponible as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"❌ Error en serie NDVI del punto ({lon}, {lat}): {e}")
+        return jsonify({"error": "Error al obtener la serie NDVI"}), 500
+
+
+@api_bp.route("/ndvi/serie/recinto/<int:recinto_id>", methods=["GET"])
+@login_required
+def serie_ndvi_recinto(recinto_id):
+    """Media, mín, máx y desviación NDVI por fecha dentro del recinto."""
+    try:
+        geojson = db.session.execute(
+            text("SELECT ST_AsGeoJSON(geom)::json FROM public.recintos WHERE id_recinto = :id"),
+            {"id": recinto_id},
+        ).scalar()
+        if geojson is None:
+            return jsonify({"error": "Recinto no encontrado"}), 404
+        serie = get_lector_cubo(current_app.config).serie_geometria(geojson)
+        serie["id_recinto"] = recinto_id
+        return jsonify(serie), 200
+    except CuboNoDisponible as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"❌ Error en serie NDVI del recinto {recinto_id}: {e}")
+        return jsonify({"error": "Error al obtener la serie NDVI"}), 500
+
+
+@api_bp.route("/ndvi/serie/geometria", methods=["POST"])
+@login_required
+def serie_ndvi_geometria():
+    """Igual que la del recinto para un polígono GeoJSON dibujado ({"geometry": ...}, EPSG:4326)."""
+    data = request.get_json(silent=True) or {}
+    geometria = data.get("geometry") or data.get("geojson")
+    if not isinstance(geometria, dict) or geometria.get("type") not in ("Polygon", "MultiPolygon"):
+        return jsonify({"error": "Se esperaba una geometría Polygon o MultiPolygon"}), 400
+
+    try:
+        return jsonify(get_lector_cubo(current_app.config).serie_geometria(geometria)), 200
+    except CuboNoDisponible as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception as e:
+        print(f"❌ Error en serie NDVI de la geometría: {e}")
+        return jsonify({"error": "Error al obtener la serie NDVI"}), 500
+
+
 
 
 # COMPARAR
@@ -1767,6 +1955,50 @@ def comparar_ndvi():
     
 
 
+def _curvas_fenologia(id_recinto, campanias=None):
+    """
+    {campaña: {'puntos': [(fecha, ndvi)], 'fenologia': {...}}} de
+    public.fenologia_recinto (curva NDVI suavizada cada paso_dias días).
+    Vacío si la tabla aún no existe o el recinto no tiene curvas.
+    """
+    if not db.session.execute(text("SELECT to_regclass('public.fenologia_recinto')")).scalar():
+        return {}
+
+    filtro = "AND campania = ANY(:campanias)" if campanias else ""
+    filas = db.session.execute(text(f"""
+        SELECT campania, metodo, paso_dias, inicio_curva, curva, n_obs, n_atipicos,
+               fecha_inicio, fecha_pico, pico_valor, fecha_senescencia, amplitud, integral
+        FROM public.fenologia_recinto
+        WHERE id_recinto = :id {filtro}
+    """), {"id": id_recinto, "campanias": list(campanias or [])}).mappings().all()
+
+    def _iso(d):
+        return d.isoformat() if d else None
+
+    curvas = {}
+    for f in filas:
+        puntos = [
+            (f['inicio_curva'] + timedelta(days=i * f['paso_dias']), round(v / 10000.0, 4))
+            for i, v in enumerate(f['curva']) if v is not None
+        ]
+        curvas[f['campania']] = {
+            'puntos': puntos,
+            'fenologia': {
+                'campania': f['campania'],
+                'metodo': f['metodo'],
+                'n_obs': f['n_obs'],
+                'n_atipicos': f['n_atipicos'],
+                'inicio': _iso(f['fecha_inicio']),
+                'pico': _iso(f['fecha_pico']),
+                'pico_valor': f['pico_valor'],
+                'senescencia': _iso(f['fecha_senescencia']),
+                'amplitud': f['amplitud'],
+                'integral': f['integral'],
+            },
+        }
+    return curvas
+
+
 @api_bp.route('/comparativa-campanias/<int:id_recinto>', methods=['GET'])
 @login_required
 def comparativa_campanias(id_recinto):
@@ -1802,7 +2034,31 @@ def comparativa_campanias(id_recinto):
         
         resultado = []
         
+        # Curvas suavizadas precalculadas; ?bruto=1 = medias de indices_raster sin suavizar
+        curvas = {} if request.args.get('bruto') == '1' else _curvas_fenologia(
+            id_recinto, [c['year'] for c in campanias]
+        )
+        
         for campania in campanias:
+            curva = curvas.get(campania['year'])
+            if curva:
+                resultado.append({
+                    'nombre': campania['nombre'],
+                    'year': campania['year'],
+                    'suavizado': True,
+                    'fenologia': curva['fenologia'],
+                    'datos': [
+                        {
+                            'fecha': fecha.strftime('%Y-%m-%d'),
+                            'valor_medio': valor,
+                            'valor_min': valor,
+                            'valor_max': valor
+                        }
+                        for fecha, valor in curva['puntos']
+                    ]
+                })
+                continue
+            
             # Consultar datos NDVI para este recinto en el rango de fechas
             indices = IndicesRaster.query.filter(
                 and_(
@@ -2017,40 +2273,48 @@ def api_estacion_datos(estacion_id, fecha):
 
 
 
+_WMS_CAPABILITIES_PARAMS = {
+    "SERVICE": "WMS",
+    "VERSION": "1.1.1",
+    "REQUEST": "GetCapabilities"
+}
+
+
+def _etp_fechas_desde_capabilities(content: bytes) -> list[str]:
+    """Fechas (YYYY-MM-DD) de la dimensión time de la capa mapascontinuos."""
+    root = ET.fromstring(content)
+
+    fechas = []
+    for layer in root.iter("Layer"):
+        name = layer.find("Name")
+        if name is not None and "mapascontinuos" in name.text:
+            for extent in layer.iter("Extent"):
+                if extent.get("name") == "time" and extent.text:  # ← añadir "and extent.text"
+                    fechas = [
+                        f.strip()[:10]
+                        for f in extent.text.strip().split(",")
+                        if f.strip()
+                    ]
+                    break
+            for dim in layer.iter("Dimension"):
+                if dim.get("name") == "time" and dim.text and not fechas:  # ← igual aquí
+                    fechas = [
+                        f.strip()[:10]
+                        for f in dim.text.strip().split(",")
+                        if f.strip()
+                    ]
+                    break
+
+    return sorted(set(fechas))
+
+
 @api_bp.route('/etp/fechas')
 @login_required
 def etp_fechas():
     geoserver_url = current_app.config["GEOSERVER_WMS_URL"]
     try:
-        r = requests.get(geoserver_url, params={
-            "SERVICE": "WMS",
-            "VERSION": "1.1.1",
-            "REQUEST": "GetCapabilities"
-        }, timeout=10)
-        root = ET.fromstring(r.content)
-
-        fechas = []
-        for layer in root.iter("Layer"):
-            name = layer.find("Name")
-            if name is not None and "mapascontinuos" in name.text:
-                for extent in layer.iter("Extent"):
-                    if extent.get("name") == "time" and extent.text:  # ← añadir "and extent.text"
-                        fechas = [
-                            f.strip()[:10]
-                            for f in extent.text.strip().split(",")
-                            if f.strip()
-                        ]
-                        break
-                for dim in layer.iter("Dimension"):
-                    if dim.get("name") == "time" and dim.text and not fechas:  # ← igual aquí
-                        fechas = [
-                            f.strip()[:10]
-                            for f in dim.text.strip().split(",")
-                            if f.strip()
-                        ]
-                        break
-
-        return jsonify({"ok": True, "fechas": sorted(set(fechas))})
+        r = requests.get(geoserver_url, params=_WMS_CAPABILITIES_PARAMS, timeout=10)
+        return jsonify({"ok": True, "fechas": _etp_fechas_desde_capabilities(r.content)})
     except Exception as e:
         return jsonify({"ok": False, "error": str(e)}), 500
     
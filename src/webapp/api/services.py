@@ -31,13 +31,13 @@ def superficie_geom_por_recinto(ids) -> dict[int, float]:
     return {int(r["id_recinto"]): float(r["ha"]) for r in rows if r["ha"] is not None}
 
 
-def recintos_geojson(bbox_str: str | None) -> dict:
+def _recintos_wfs_peticion(bbox_str: str | None) -> tuple[str, dict, tuple | None] | None:
     """
-    Devuelve un FeatureCollection GeoJSON con los recintos obtenidos desde
-    GeoServer (WFS), filtrados por un bounding box en WGS84.
+    (url, params, auth) de la petición WFS de recintos para un bbox WGS84, o
+    None si no hay bbox. Lanza ValueError si el bbox está mal formado.
     """
     if not bbox_str:
-        return {"type": "FeatureCollection", "features": []}
+        return None
 
     try:
         minx, miny, maxx, maxy = map(float, bbox_str.split(","))
@@ -63,15 +63,11 @@ def recintos_geojson(bbox_str: str | None) -> dict:
         "srsName": "EPSG:4326",
         "bbox": f"{minx},{miny},{maxx},{maxy},EPSG:4326",
     }
+    return wfs_url, params, auth
 
-    try:
-        resp = requests.get(wfs_url, params=params, auth=auth, timeout=20)
-        resp.raise_for_status()
-    except requests.RequestException as exc:
-        raise RuntimeError(f"Error al consultar GeoServer WFS: {exc}") from exc
-
-    data = resp.json()
 
+def _enriquecer_recintos(data) -> dict:
+    """Valida el FeatureCollection del WFS y añade nombres de provincia y municipio."""
     if not isinstance(data, dict) or data.get("type") != "FeatureCollection":
         raise RuntimeError("Respuesta de GeoServer no es un FeatureCollection válido")
 
@@ -88,6 +84,25 @@ def recintos_geojson(bbox_str: str | None) -> dict:
 
     return data
 
+
+def recintos_geojson(bbox_str: str | None) -> dict:
+    """
+    Devuelve un FeatureCollection GeoJSON con los recintos obtenidos desde
+    GeoServer (WFS), filtrados por un bounding box en WGS84.
+    """
+    peticion = _recintos_wfs_peticion(bbox_str)
+    if peticion is None:
+        return {"type": "FeatureCollection", "features": []}
+    wfs_url, params, auth = peticion
+
+    try:
+        resp = requests.get(wfs_url, params=params, auth=auth, timeout=20)
+        resp.raise_for_status()
+    except requests.RequestException as exc:
+        raise RuntimeError(f"Error al consultar GeoServer WFS: {exc}") from exc
+
+    return _enriquecer_recintos(resp.json())
+
 def mis_recintos_geojson(bbox: str | None, user_id: int):
     """
     Devuelve GeoJSON de public.recintos del usuario (id_propietario=user_id),
@@ -0,0 +1,223 @@
+"""
+asgi.py
+-------
+Aplicación ASGI que sirve la webapp con dos caminos:
+
+- Los endpoints proxy de ``api/proxy_async.py`` (GeoServer/Mírame) se
+  atienden en el event loop con un ``httpx.AsyncClient`` compartido: la
+  concurrencia la limitan los sockets del pool, no los hilos.
+- Todo lo demás se delega a la app Flask (WSGI) en un pool de hilos acotado,
+  igual que con waitress.
+
+La autenticación de los endpoints async reutiliza la sesión de Flask-Login:
+se abre un contexto de petición Flask con las mismas cabeceras (cookie) en un
+hilo y se comprueba ``current_user``.
+
+Arranque (raíz del proyecto):
+    python server_asgi.py
+    # o: uvicorn server_asgi:app --host 0.0.0.0 --port 5000
+"""
+
+from __future__ import annotations
+
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+import httpx
+from flask import url_for
+from flask_login import current_user
+from werkzeug.datastructures import MultiDict
+
+from .api.proxy_async import RUTAS_ASYNC, PeticionAsync, RespuestaAsync
+from .utils.metrics import registry
+
+
+def _environ(scope: dict, body: bytes) -> dict:
+    """Entorno WSGI (PEP 3333) a partir del scope ASGI."""
+    servidor = scope.get("server") or ("localhost", 80)
+    cliente = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": str(servidor[0]),
+        "SERVER_PORT": str(servidor[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": cliente[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for nombre, valor in scope.get("headers", []):
+        nombre = nombre.decode("latin-1").upper().replace("-", "_")
+        valor = valor.decode("latin-1")
+        if nombre == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = valor
+        elif nombre == "CONTENT_LENGTH":
+            environ["CONTENT_LENGTH"] = valor
+        else:
+            clave = f"HTTP_{nombre}"
+            environ[clave] = f"{environ[clave]},{valor}" if clave in environ else valor
+    return environ
+
+
+def _llamar_wsgi(flask_app, environ: dict) -> tuple[int, list, list[bytes]]:
+    """Ejecuta la app WSGI y devuelve (status, cabeceras, cuerpo) ya materializados."""
+    estado: dict = {}
+    cuerpo: list[bytes] = []
+
+    def start_response(status, headers, exc_info=None):
+        estado["status"] = int(status.split(" ", 1)[0])
+        estado["headers"] = [
+            (k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers
+        ]
+        return cuerpo.append
+
+    resultado = flask_app(environ, start_response)
+    try:
+        for trozo in resultado:
+            if trozo:
+                cuerpo.append(trozo)
+    finally:
+        if hasattr(resultado, "close"):
+            resultado.close()
+    return estado["status"], estado["headers"], cuerpo
+
+
+def _url_login_si_anonimo(flask_app, environ: dict) -> str | None:
+    """None si la cookie corresponde a un usuario activo; si no, la URL de login."""
+    with flask_app.request_context(environ):
+        if current_user.is_authenticated:
+            return None
+        return url_for("auth.login")
+
+
+class GISAsgiApp:
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        cfg = flask_app.config
+        self._wsgi_pool = ThreadPoolExecutor(
+            max_workers=int(cfg.get("ASGI_WSGI_THREADS", 8)),
+            thread_name_prefix="wsgi",
+        )
+        self._limits = httpx.Limits(
+            max_connections=int(cfg.get("ASYNC_HTTP_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(cfg.get("ASYNC_HTTP_MAX_KEEPALIVE", 20)),
+        )
+        self._metrics = bool(cfg.get("METRICS_ENABLED", True))
+        self._http: httpx.AsyncClient | None = None
+
+    def _cliente(self) -> httpx.AsyncClient:
+        if self._http is None:
+            # follow_redirects y verify como requests; pool=espera máxima por un socket libre
+            self._http = httpx.AsyncClient(
+                limits=self._limits,
+                timeout=httpx.Timeout(20.0, connect=5.0, pool=10.0),
+                follow_redirects=True,
+            )
+        return self._http
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        body = bytearray()
+        while True:
+            msg = await receive()
+            if msg["type"] == "http.disconnect":
+                return
+            body += msg.get("body", b"")
+            if not msg.get("more_body"):
+                break
+
+        ruta = RUTAS_ASYNC.get(scope["path"])
+        if ruta is not None and scope["method"] == "GET":
+            await self._async(ruta, scope, bytes(body), send)
+        else:
+            await self._wsgi(scope, bytes(body), send)
+
+    async def _lifespan(self, receive, send):
+        while True:
+            msg = await receive()
+            if msg["type"] == "lifespan.startup":
+                self._cliente()
+                await send({"type": "lifespan.startup.complete"})
+            elif msg["type"] == "lifespan.shutdown":
+                if self._http is not None:
+                    await self._http.aclose()
+                self._wsgi_pool.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _wsgi(self, scope, body: bytes, send):
+        loop = asyncio.get_running_loop()
+        status, headers, cuerpo = await loop.run_in_executor(
+            self._wsgi_pool, _llamar_wsgi, self.flask_app, _environ(scope, body),
+        )
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        for trozo in cuerpo:
+            await send({"type": "http.response.body", "body": trozo, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def _async(self, ruta, scope, body: bytes, send):
+        endpoint, handler, requiere_login = ruta
+        pet = PeticionAsync(
+            app=self.flask_app,
+            http=self._cliente(),
+            args=MultiDict(parse_qsl(scope.get("query_string", b"").decode("latin-1"),
+                                     keep_blank_values=True)),
+        )
+
+        cabeceras = []
+        if requiere_login:
+            # Flask-Session consulta la BD: se hace en un hilo para no bloquear el loop
+            login = await asyncio.to_thread(
+                _url_login_si_anonimo, self.flask_app, _environ(scope, body),
+            )
+            if login is not None:
+                resp = RespuestaAsync(302, b"", "text/html; charset=utf-8")
+                cabeceras.append((b"location", login.encode("latin-1")))
+            else:
+                resp = await self._ejecutar(handler, pet)
+        else:
+            resp = await self._ejecutar(handler, pet)
+
+        cabeceras += [
+            (b"content-type", resp.content_type.encode("latin-1")),
+            (b"content-length", str(len(resp.body)).encode("latin-1")),
+        ]
+        if self._metrics:
+            total = time.perf_counter() - pet.stats.start
+            registry.observe_request(
+                "asgi", endpoint, scope["method"], resp.status, total, len(resp.body), pet.stats,
+            )
+            cabeceras.append((b"server-timing", pet.stats.server_timing(total).encode("latin-1")))
+
+        await send({"type": "http.response.start", "status": resp.status, "headers": cabeceras})
+        await send({"type": "http.response.body", "body": resp.body})
+
+    async def _ejecutar(self, handler, pet: PeticionAsync) -> RespuestaAsync:
+        try:
+            return await handler(pet)
+        except Exception as e:
+            print(f"❌ Error en {handler.__name__} (async): {e}")
+            return pet.json({"error": "Error interno"}, 500)
+
+
+def create_asgi_app(flask_app=None) -> GISAsgiApp:
+    if flask_app is None:
+        from . import create_app
+        flask_app = create_app()
+    return GISAsgiApp(flask_app)
@@ -56,4 +56,32 @@ class Config:
     MAIL_DEFAULT_SENDER = os.getenv("MAIL_DEFAULT_SENDER")
 
     INFORIEGO_API_KEY = os.getenv("INFORIEGO_API_KEY")
-    
\ No newline at end of file
+
+    # Métricas Prometheus (/metrics) y cabecera Server-Timing
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "True") == "True"
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+    
+
+    # Servidor ASGI (server_asgi.py): pool httpx de los proxies async e hilos para Flask
+    ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "100"))
+    ASYNC_HTTP_MAX_KEEPALIVE = int(os.getenv("ASYNC_HTTP_MAX_KEEPALIVE", "20"))
+    ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "8"))
+
+    # Teselas XYZ de NDVI / Sentinel-2 (/api/raster-tiles): caché en disco y nº de teselas en memoria
+    TILE_CACHE_DIR = os.getenv(
+        "TILE_CACHE_DIR",
+        os.path.join(os.path.dirname(__file__), "..", "..", "data", "cache", "tiles"),
+    )
+    TILE_CACHE_MEM_ITEMS = int(os.getenv("TILE_CACHE_MEM_ITEMS", "2000"))
+
+    # Thumbnails NDVI por recinto (/api/thumbnails): archivo SQLite de generate_thumbnails.py
+    THUMB_ARCHIVE_PATH = os.getenv(
+        "THUMB_ARCHIVE_PATH",
+        os.path.join(os.path.dirname(__file__), "..", "..", "data", "thumbnails", "thumbnails.sqlite"),
+    )
+
+    # Cubo NDVI (series por píxel/recinto en /api/ndvi/serie): directorio de construir_cubo_ndvi.py
+    NDVI_CUBE_DIR = os.getenv(
+        "NDVI_CUBE_DIR",
+        os.path.join(os.path.dirname(__file__), "..", "..", "data", "processed", "ndvi_cubo"),
+    )
@@ -495,9 +495,8 @@ def visor():
     s2_bounds = meta["bounds_leaflet"]
     s2_version = meta["updated_utc"]  # para bust cache
     
-    # --- NDVI (mosaico reciente) ---
-    ndvi_path = os.path.join(current_app.root_path, "static", "ndvi", "ndvi_latest.png")
-    ndvi_version = int(os.path.getmtime(ndvi_path)) if os.path.exists(ndvi_path) else 0
+    # --- NDVI (mosaico reciente, servido en teselas desde el GeoTIFF 3857) ---
+    ndvi_version = int(os.path.getmtime(ndvi_tif)) if os.path.exists(ndvi_tif) else 0
     
     # Pasar recinto_data al template
     return render_template("visor.html", 
@@ -0,0 +1,322 @@
+"""
+metrics.py
+----------
+Instrumentación por endpoint de la aplicación Flask.
+
+Por cada petición se registra:
+- latencia total (histograma por endpoint, método y estado),
+- número y tiempo total de sentencias SQL (eventos de SQLAlchemy),
+- número y tiempo de peticiones HTTP salientes (GeoServer, Mírame, AEMET...),
+- tamaño de la respuesta.
+
+Los datos se exponen en formato texto de Prometheus en ``/metrics`` y, para
+cada petición, en la cabecera ``Server-Timing`` (visible en las DevTools del
+navegador), de modo que los patrones N+1 y las llamadas lentas a servicios
+externos se detectan sin añadir ``print``.
+
+El registro vive en memoria del proceso: con waitress (un proceso, varios
+hilos) cubre todo el servidor; con varios procesos cada uno expone lo suyo.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from urllib.parse import urlsplit
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Cubetas (segundos / bytes / nº consultas) al estilo de prometheus_client
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class _Histogram:
+    """Histograma acumulativo con etiquetas (subconjunto del modelo Prometheus)."""
+
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...], buckets: tuple):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, label_values: tuple, value: float) -> None:
+        serie = self._series.get(label_values)
+        if serie is None:
+            # [contadores por cubeta..., suma, total]
+            serie = [0] * len(self.buckets) + [0.0, 0]
+            self._series[label_values] = serie
+        for i, limite in enumerate(self.buckets):
+            if value <= limite:
+                serie[i] += 1
+        serie[-2] += value
+        serie[-1] += 1
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        for label_values, serie in sorted(self._series.items()):
+            base = _format_labels(self.labels, label_values)
+            for i, limite in enumerate(self.buckets):
+                le = _format_labels(self.labels + ("le",), label_values + (_fmt_num(limite),))
+                out.append(f"{self.name}_bucket{le} {serie[i]}")
+            inf = _format_labels(self.labels + ("le",), label_values + ("+Inf",))
+            out.append(f"{self.name}_bucket{inf} {serie[-1]}")
+            out.append(f"{self.name}_sum{base} {_fmt_num(serie[-2])}")
+            out.append(f"{self.name}_count{base} {serie[-1]}")
+        return out
+
+
+class _Counter:
+    def __init__(self, name: str, doc: str, labels: tuple[str, ...]):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        self._series: dict[tuple, float] = {}
+
+    def inc(self, label_values: tuple, value: float = 1.0) -> None:
+        self._series[label_values] = self._series.get(label_values, 0.0) + value
+
+    def render(self) -> list[str]:
+        out = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        for label_values, valor in sorted(self._series.items()):
+            out.append(f"{self.name}{_format_labels(self.labels, label_values)} {_fmt_num(valor)}")
+        return out
+
+
+def _fmt_num(v: float) -> str:
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _format_labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    partes = []
+    for k, v in zip(names, values):
+        v = str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        partes.append(f'{k}="{v}"')
+    return "{" + ",".join(partes) + "}"
+
+
+class MetricsRegistry:
+    """Conjunto de métricas del proceso, protegido por un lock."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_latency = _Histogram(
+            "gis_http_request_duration_seconds",
+            "Latencia de las peticiones atendidas por Flask",
+            ("blueprint", "endpoint", "method", "status"),
+            LATENCY_BUCKETS,
+        )
+        self.response_size = _Histogram(
+            "gis_http_response_size_bytes",
+            "Tamaño del cuerpo de la respuesta",
+            ("blueprint", "endpoint"),
+            SIZE_BUCKETS,
+        )
+        self.sql_queries = _Histogram(
+            "gis_sql_queries_per_request",
+            "Sentencias SQL ejecutadas por petición (N+1 => colas largas)",
+            ("blueprint", "endpoint"),
+            SQL_COUNT_BUCKETS,
+        )
+        self.sql_time = _Histogram(
+            "gis_sql_duration_seconds",
+            "Tiempo total en SQL por petición",
+            ("blueprint", "endpoint"),
+            LATENCY_BUCKETS,
+        )
+        self.outbound_time = _Histogram(
+            "gis_outbound_http_duration_seconds",
+            "Tiempo total en HTTP saliente por petición",
+            ("blueprint", "endpoint"),
+            LATENCY_BUCKETS,
+        )
+        self.outbound_calls = _Counter(
+            "gis_outbound_http_requests_total",
+            "Peticiones HTTP salientes por host de destino",
+            ("host", "status"),
+        )
+        self.outbound_host_time = _Counter(
+            "gis_outbound_http_seconds_total",
+            "Tiempo acumulado en HTTP saliente por host de destino",
+            ("host",),
+        )
+
+    def observe_request(self, blueprint: str, endpoint: str, method: str, status: int,
+                        duration: float, size: int | None, stats: "RequestStats") -> None:
+        bp_ep = (blueprint, endpoint)
+        with self._lock:
+            self.request_latency.observe(bp_ep + (method, str(status)), duration)
+            if size is not None:
+                self.response_size.observe(bp_ep, size)
+            self.sql_queries.observe(bp_ep, stats.sql_count)
+            self.sql_time.observe(bp_ep, stats.sql_time)
+            self.outbound_time.observe(bp_ep, stats.http_time)
+
+    def observe_outbound(self, host: str, status: str, duration: float) -> None:
+        with self._lock:
+            self.outbound_calls.inc((host, status))
+            self.outbound_host_time.inc((host,), duration)
+
+    def render(self) -> str:
+        with self._lock:
+            lineas: list[str] = []
+            for metrica in (
+                self.request_latency, self.response_size, self.sql_queries,
+                self.sql_time, self.outbound_time, self.outbound_calls,
+                self.outbound_host_time,
+            ):
+                lineas.extend(metrica.render())
+        return "\n".join(lineas) + "\n"
+
+
+class RequestStats:
+    """Acumuladores de la petición en curso (se guardan en ``flask.g``)."""
+
+    __slots__ = ("start", "sql_count", "sql_time", "http_count", "http_time")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.http_count = 0
+        self.http_time = 0.0
+
+    def server_timing(self, total: float) -> str:
+        return (
+            f'app;dur={total * 1000:.1f}, '
+            f'db;desc="{self.sql_count} consultas";dur={self.sql_time * 1000:.1f}, '
+            f'http;desc="{self.http_count} peticiones";dur={self.http_time * 1000:.1f}'
+        )
+
+
+registry = MetricsRegistry()
+
+
+def _current_stats() -> RequestStats | None:
+    if not has_request_context():
+        return None
+    return g.get("_metrics")
+
+
+# ==================== SQLALCHEMY ====================
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("_metrics_t0", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    pila = conn.info.get("_metrics_t0")
+    if not pila:
+        return
+    elapsed = time.perf_counter() - pila.pop()
+    stats = _current_stats()
+    if stats is not None:
+        stats.sql_count += 1
+        stats.sql_time += elapsed
+
+
+def _instrument_sqlalchemy() -> None:
+    # Se escucha sobre la clase Engine: cubre db.engine y los engines creados a mano
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+# ==================== HTTP SALIENTE ====================
+
+def record_outbound(url: str, status, duration: float, stats: RequestStats | None = None) -> None:
+    """
+    Registra una petición HTTP saliente (usado también por clientes async).
+    Fuera de Flask (handlers ASGI) se pasan explícitamente los ``stats`` de la petición.
+    """
+    host = urlsplit(str(url)).hostname or "desconocido"
+    registry.observe_outbound(host, str(status), duration)
+    if stats is None:
+        stats = _current_stats()
+    if stats is not None:
+        stats.http_count += 1
+        stats.http_time += duration
+
+
+def _instrument_requests() -> None:
+    """Envuelve ``requests.Session.send``, por donde pasan también ``requests.get/post``."""
+    try:
+        import requests
+    except ImportError:
+        return
+
+    original = requests.Session.send
+    if getattr(original, "_gis_metrics", False):
+        return
+
+    def send(self, req, **kwargs):
+        t0 = time.perf_counter()
+        status = "error"
+        try:
+            resp = original(self, req, **kwargs)
+            status = resp.status_code
+            return resp
+        finally:
+            record_outbound(req.url, status, time.perf_counter() - t0)
+
+    send._gis_metrics = True
+    requests.Session.send = send
+
+
+# ==================== FLASK ====================
+
+def _before_request():
+    g._metrics = RequestStats()
+
+
+def _after_request(response: Response):
+    stats = g.pop("_metrics", None)
+    if stats is None or request.endpoint == "metrics":
+        return response
+
+    total = time.perf_counter() - stats.start
+    if response.direct_passthrough:
+        # send_file / send_from_directory: no consumir el iterable
+        size = response.content_length
+    else:
+        size = response.calculate_content_length()
+
+    registry.observe_request(
+        request.blueprint or "app",
+        request.endpoint or "sin_ruta",
+        request.method,
+        response.status_code,
+        total,
+        size,
+        stats,
+    )
+    response.headers.add("Server-Timing", stats.server_timing(total))
+    return response
+
+
+def metrics_view():
+    token = current_app.config.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        return Response("forbidden\n", status=403, mimetype="text/plain")
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
+def init_metrics(app) -> None:
+    """Registra hooks de petición, eventos SQL, envoltura de requests y /metrics."""
+    if not app.config.get("METRICS_ENABLED", True):
+        return
+
+    _instrument_sqlalchemy()
+    _instrument_requests()
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule("/metrics", "metrics", metrics_view)
@@ -0,0 +1,172 @@
+"""
+ndvi_colormap.py
+----------------
+Paleta NDVI estándar (rojo → verde) de los mosaicos del proyecto y su
+aplicación con tabla de consulta (LUT).
+
+El NDVI se cuantiza a un índice uint8 (``searchsorted`` contra los límites de
+clase, en el mismo dtype que el ráster, así que las comparaciones son las
+mismas que ``ndvi >= vmin`` / ``ndvi < vmax``) y el RGBA sale de un único
+``np.take`` sobre una LUT de 256 entradas. Frente a la versión anterior (una
+máscara booleana del tamaño de la imagen por clase) es una pasada y sin
+temporales por clase.
+
+Las funciones ``*_por_bloques`` recorren el ráster por franjas de filas y
+``escribir_png_por_bloques`` comprime cada franja según llega, de modo que un
+PNG de 15000² px no necesita el RGBA completo en memoria.
+"""
+
+from __future__ import annotations
+
+import struct
+import zlib
+from typing import Iterable, Iterator
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from .ndvi_formato import leer_ndvi
+
+# (min incluido, max excluido, color RGB)
+NDVI_RANGOS = [
+    (-0.2, 0.0, (165, 0, 38)),
+    (0.0, 0.1, (215, 48, 39)),
+    (0.1, 0.2, (244, 109, 67)),
+    (0.2, 0.3, (253, 174, 97)),
+    (0.3, 0.4, (254, 224, 139)),
+    (0.4, 0.5, (255, 255, 191)),
+    (0.5, 0.6, (217, 239, 139)),
+    (0.6, 0.7, (166, 217, 106)),
+    (0.7, 0.8, (102, 189, 99)),
+    (0.8, 0.9, (26, 152, 80)),
+    (0.9, 1.0, (0, 104, 55)),
+]
+COLOR_BAJO = (0, 0, 0)          # NDVI < -0.2
+COLOR_ALTO = (0, 104, 55)       # NDVI >= 1.0
+
+# Índice reservado para "sin dato" (NaN/inf): RGBA (0, 0, 0, 0)
+SIN_DATO = 255
+
+FILAS_BLOQUE = 512
+
+
+def _construir_lut() -> tuple[tuple[float, ...], np.ndarray]:
+    # Límites: -0.2, 0.0, 0.1 ... 0.9, 1.0 -> índices 0 (bajo), 1..11 (rangos), 12 (alto)
+    limites = tuple([NDVI_RANGOS[0][0]] + [vmax for _, vmax, _ in NDVI_RANGOS])
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    lut[0] = [*COLOR_BAJO, 255]
+    for i, (_, _, color) in enumerate(NDVI_RANGOS, start=1):
+        lut[i] = [*color, 255]
+    lut[len(NDVI_RANGOS) + 1] = [*COLOR_ALTO, 255]
+    return limites, lut
+
+
+NDVI_LIMITES, LUT_NDVI = _construir_lut()
+
+# Escala de grises (-1 -> 0, 1 -> 255) de tif_to_png_singleband
+LUT_GRIS = np.zeros((256, 4), dtype=np.uint8)
+LUT_GRIS[:, :3] = np.arange(256, dtype=np.uint8)[:, None]
+LUT_GRIS[:, 3] = 255
+
+
+def ndvi_a_indices(ndvi: np.ndarray) -> np.ndarray:
+    """NDVI -> índice de clase uint8 (0..12, ``SIN_DATO`` para NaN/inf)."""
+    ndvi = np.asarray(ndvi)
+    if not np.issubdtype(ndvi.dtype, np.floating):
+        ndvi = ndvi.astype("float32")
+    # Límites en el dtype del ráster: mismas comparaciones que ndvi >= -0.2 en float32
+    limites = np.asarray(NDVI_LIMITES, dtype=ndvi.dtype)
+    idx = np.searchsorted(limites, ndvi, side="right").astype(np.uint8)
+    idx[~np.isfinite(ndvi)] = SIN_DATO
+    return idx
+
+
+def ndvi_to_rgba(ndvi: np.ndarray) -> np.ndarray:
+    """NDVI (float, NaN = sin dato) -> RGBA uint8 (h, w, 4); sin dato transparente."""
+    return np.take(LUT_NDVI, ndvi_a_indices(ndvi), axis=0)
+
+
+def gris_a_indices(arr: np.ndarray, vmin: float = -1.0, vmax: float = 1.0) -> np.ndarray:
+    """Valor -> nivel de gris 0..255 (misma aritmética que tif_to_png_singleband); NaN -> 0."""
+    norm = np.clip((arr - vmin) / (vmax - vmin), 0, 1)
+    norm[~np.isfinite(norm)] = 0
+    return (norm * 255).astype(np.uint8)
+
+
+def gris_to_rgba(arr: np.ndarray, vmin: float = -1.0, vmax: float = 1.0,
+                 nodata_to_transparent: bool = True) -> np.ndarray:
+    rgba = np.take(LUT_GRIS, gris_a_indices(arr, vmin, vmax), axis=0)
+    if nodata_to_transparent:
+        rgba[..., 3] = np.where(np.isfinite(arr), 255, 0)
+    return rgba
+
+
+# ==================== POR BLOQUES ====================
+
+def rgba_por_bloques(arr: np.ndarray, colorear=ndvi_to_rgba,
+                     filas: int = FILAS_BLOQUE) -> Iterator[tuple[int, np.ndarray]]:
+    """(fila inicial, RGBA) por franjas de ``filas`` filas de un array en memoria."""
+    for f0 in range(0, arr.shape[0], filas):
+        yield f0, colorear(arr[f0:f0 + filas])
+
+
+def rgba_por_bloques_tif(src, banda: int = 1, colorear=ndvi_to_rgba,
+                         filas: int = FILAS_BLOQUE) -> Iterator[tuple[int, np.ndarray]]:
+    """Igual que ``rgba_por_bloques`` leyendo por ventanas de un dataset rasterio abierto (float32 o int16 escalado)."""
+    for f0 in range(0, src.height, filas):
+        alto = min(filas, src.height - f0)
+        datos = leer_ndvi(src, banda, window=Window(0, f0, src.width, alto))
+        yield f0, colorear(datos)
+
+
+def _chunk(tipo: bytes, datos: bytes) -> bytes:
+    return struct.pack(">I", len(datos)) + tipo + datos + struct.pack(">I", zlib.crc32(tipo + datos) & 0xFFFFFFFF)
+
+
+def escribir_png_por_bloques(ruta, alto: int, ancho: int,
+                             bloques: Iterable[tuple[int, np.ndarray]],
+                             compress_level: int = 6) -> None:
+    """
+    PNG RGBA de 8 bits escrito por franjas: cada bloque (h, ancho, 4) se filtra
+    (filtro Sub de PNG) y se comprime en un IDAT según llega.
+    """
+    compresor = zlib.compressobj(compress_level)
+    filas_escritas = 0
+    with open(ruta, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", ancho, alto, 8, 6, 0, 0, 0)))
+
+        for _, rgba in bloques:
+            h = rgba.shape[0]
+            plano = np.ascontiguousarray(rgba, dtype=np.uint8).reshape(h, ancho * 4)
+            filtrado = np.empty((h, ancho * 4 + 1), dtype=np.uint8)
+            filtrado[:, 0] = 1  # Sub: cada byte menos el del píxel anterior (mod 256)
+            filtrado[:, 1:5] = plano[:, :4]
+            np.subtract(plano[:, 4:], plano[:, :-4], out=filtrado[:, 5:])
+            datos = compresor.compress(filtrado.tobytes())
+            if datos:
+                f.write(_chunk(b"IDAT", datos))
+            filas_escritas += h
+
+        f.write(_chunk(b"IDAT", compresor.flush()))
+        f.write(_chunk(b"IEND", b""))
+
+    if filas_escritas != alto:
+        raise ValueError(f"PNG incompleto: {filas_escritas} de {alto} filas")
+
+
+def guardar_png_ndvi(ndvi: np.ndarray, ruta, filas: int = FILAS_BLOQUE) -> None:
+    """PNG con la paleta NDVI de un array en memoria, sin materializar el RGBA completo."""
+    alto, ancho = ndvi.shape
+    escribir_png_por_bloques(ruta, alto, ancho, rgba_por_bloques(ndvi, filas=filas))
+
+
+def tif_a_png(src_tif, dst_png, colorear=ndvi_to_rgba, banda: int = 1,
+              filas: int = FILAS_BLOQUE) -> None:
+    """PNG coloreado de un GeoTIFF de 1 banda, leído y escrito por franjas."""
+    with rasterio.open(src_tif) as src:
+        escribir_png_por_bloques(
+            dst_png, src.height, src.width,
+            rgba_por_bloques_tif(src, banda=banda, colorear=colorear, filas=filas),
+        )
@@ -0,0 +1,326 @@
+"""
+ndvi_cubo.py
+------------
+Cubo de datos NDVI (serie temporal por píxel) en disco, para devolver la
+historia de un punto o de un recinto sin abrir un GeoTIFF por fecha.
+
+Formato (``NDVI_CUBE_DIR``, por defecto ``data/processed/ndvi_cubo``):
+
+- ``indice.json``: rejilla (CRS, transform, ancho, alto), tamaño de chunk
+  espacial, fechas de bloque y ``{YYYYMMDD: slot}``.
+- ``t0000.dat``, ``t0001.dat``...: un fichero cada ``bloque_t`` fechas, array
+  float32 crudo de forma ``(ny, nx, bloque_t, chunk, chunk)``. Dentro de cada
+  chunk espacial las fechas van seguidas (orden tiempo-mayor), así que la serie
+  de un punto o de un recinto pequeño se lee de unos pocos bloques contiguos.
+
+El escritor (``CuboNDVI``) añade cada composite como un corte temporal; la
+rejilla la fija el primer composite y los siguientes se remuestrean a ella si
+no coinciden. El ``indice.json`` se reemplaza de forma atómica después de
+escribir los datos, de modo que un lector nunca ve una fecha a medio escribir.
+
+El lector (``LectorCubo``) abre los ``.dat`` con ``np.memmap`` de solo lectura:
+todos los procesos de la webapp comparten la caché de páginas del sistema y
+no hay copia en memoria por worker. Recarga el índice si cambia su mtime.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.features import geometry_mask
+from rasterio.transform import Affine, rowcol
+from rasterio.warp import Resampling, reproject, transform as transformar, transform_geom
+from rasterio.windows import Window, from_bounds, transform as transform_ventana
+from shapely.geometry import shape
+
+from .ndvi_formato import leer_ndvi
+
+BASE_DIR = Path(__file__).resolve().parents[3]
+
+NDVI_CUBE_DIR = Path(os.getenv("NDVI_CUBE_DIR", str(BASE_DIR / "data" / "processed" / "ndvi_cubo")))
+CUBO_CHUNK = int(os.getenv("NDVI_CUBE_CHUNK", "64"))
+CUBO_BLOQUE_T = int(os.getenv("NDVI_CUBE_BLOQUE_T", "32"))
+
+_DTYPE = np.dtype("float32")
+_INDICE = "indice.json"
+
+
+def _ruta_bloque(directorio: Path, bloque: int) -> Path:
+    return directorio / f"t{bloque:04d}.dat"
+
+
+def _forma_bloque(indice: dict) -> tuple[int, int, int, int, int]:
+    c = indice["chunk"]
+    return (math.ceil(indice["height"] / c), math.ceil(indice["width"] / c), indice["bloque_t"], c, c)
+
+
+def _leer_indice(directorio: Path) -> dict | None:
+    try:
+        with open(directorio / _INDICE, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+# ==================== ESCRITURA ====================
+
+class CuboNDVI:
+    """Escritor del cubo (un único proceso: ndvi_diax.py o construir_cubo_ndvi.py)."""
+
+    def __init__(self, directorio=NDVI_CUBE_DIR, chunk: int = CUBO_CHUNK, bloque_t: int = CUBO_BLOQUE_T):
+        self.directorio = Path(directorio)
+        self.indice = _leer_indice(self.directorio)
+        self._chunk = chunk
+        self._bloque_t = bloque_t
+
+    @property
+    def fechas(self) -> list[str]:
+        return sorted(self.indice["fechas"]) if self.indice else []
+
+    def _crear(self, crs, transform, width: int, height: int):
+        self.directorio.mkdir(parents=True, exist_ok=True)
+        self.indice = {
+            "version": 1,
+            "dtype": _DTYPE.name,
+            "crs": crs.to_string() if hasattr(crs, "to_string") else str(crs),
+            "transform": list(transform)[:6],
+            "width": int(width),
+            "height": int(height),
+            "chunk": self._chunk,
+            "bloque_t": self._bloque_t,
+            "slots": 0,
+            "fechas": {},
+        }
+
+    def _guardar_indice(self):
+        tmp = self.directorio / (_INDICE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.indice, f, indent=2)
+        os.replace(tmp, self.directorio / _INDICE)
+
+    def _memmap_escritura(self, bloque: int) -> np.memmap:
+        ruta = _ruta_bloque(self.directorio, bloque)
+        # Fichero nuevo disperso: los slots no escritos no se leen nunca
+        modo = "r+" if ruta.exists() else "w+"
+        return np.memmap(ruta, dtype=_DTYPE, mode=modo, shape=_forma_bloque(self.indice))
+
+    def anadir(self, fecha: str, ndvi: np.ndarray, crs, transform) -> int:
+        """
+        Añade (o reescribe) el corte de ``fecha`` (YYYYMMDD). ``ndvi`` es float
+        con NaN como nodata; si su rejilla no es la del cubo se remuestrea
+        (vecino más próximo). Devuelve el slot usado.
+        """
+        if self.indice is None:
+            self._crear(crs, transform, ndvi.shape[1], ndvi.shape[0])
+
+        ix = self.indice
+        cubo_crs = CRS.from_string(ix["crs"])
+        cubo_transform = Affine(*ix["transform"])
+        alto, ancho = ix["height"], ix["width"]
+
+        misma_rejilla = (
+            CRS.from_user_input(crs) == cubo_crs
+            and tuple(transform)[:6] == tuple(cubo_transform)[:6]
+            and ndvi.shape == (alto, ancho)
+        )
+        if not misma_rejilla:
+            destino = np.full((alto, ancho), np.nan, dtype=_DTYPE)
+            reproject(
+                source=ndvi.astype(_DTYPE, copy=False),
+                destination=destino,
+                src_transform=transform,
+                src_crs=crs,
+                dst_transform=cubo_transform,
+                dst_crs=cubo_crs,
+                resampling=Resampling.nearest,
+                src_nodata=np.nan,
+                dst_nodata=np.nan,
+            )
+            ndvi = destino
+
+        slot = ix["fechas"].get(fecha)
+        if slot is None:
+            slot = ix["slots"]
+        bloque, t = divmod(slot, ix["bloque_t"])
+        c = ix["chunk"]
+        ny, nx = _forma_bloque(ix)[:2]
+
+        mm = self._memmap_escritura(bloque)
+        try:
+            franja = np.full((c, nx * c), np.nan, dtype=_DTYPE)
+            for cy in range(ny):
+                filas = ndvi[cy * c:(cy + 1) * c]
+                franja[:] = np.nan
+                franja[:filas.shape[0], :ancho] = filas
+                # (c, nx*c) -> (nx, c, c): un chunk espacial por posición de nx
+                mm[cy, :, t] = franja.reshape(c, nx, c).transpose(1, 0, 2)
+            mm.flush()
+        finally:
+            del mm
+
+        ix["fechas"][fecha] = slot
+        ix["slots"] = max(ix["slots"], slot + 1)
+        self._guardar_indice()
+        return slot
+
+    def anadir_tif(self, fecha: str, ruta_tif) -> int:
+        with rasterio.open(ruta_tif) as src:
+            ndvi = leer_ndvi(src).astype(_DTYPE, copy=False)
+            return self.anadir(fecha, ndvi, src.crs, src.transform)
+
+
+# ==================== LECTURA ====================
+
+class CuboNoDisponible(Exception):
+    """No hay cubo construido o el punto/geometría cae fuera de él."""
+
+
+class LectorCubo:
+    def __init__(self, directorio=NDVI_CUBE_DIR):
+        self.directorio = Path(directorio)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._indice: dict | None = None
+        self._memmaps: dict[int, np.memmap] = {}
+
+    def _actual(self) -> dict:
+        """Índice vigente; se recarga (y se reabren los bloques) si ha cambiado."""
+        try:
+            mtime = (self.directorio / _INDICE).stat().st_mtime_ns
+        except FileNotFoundError:
+            raise CuboNoDisponible(f"Sin cubo NDVI en {self.directorio}")
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._indice = _leer_indice(self.directorio)
+                    self._memmaps = {}
+                    self._mtime = mtime
+        return self._indice
+
+    def _bloque(self, indice: dict, bloque: int) -> np.memmap:
+        mm = self._memmaps.get(bloque)
+        if mm is None:
+            with self._lock:
+                mm = self._memmaps.get(bloque)
+                if mm is None:
+                    mm = np.memmap(_ruta_bloque(self.directorio, bloque), dtype=_DTYPE, mode="r",
+                                   shape=_forma_bloque(indice))
+                    self._memmaps[bloque] = mm
+        return mm
+
+    def info(self) -> dict:
+        ix = self._actual()
+        return {
+            "crs": ix["crs"],
+            "width": ix["width"],
+            "height": ix["height"],
+            "fechas": sorted(ix["fechas"]),
+        }
+
+    def ventana(self, fila0: int, fila1: int, col0: int, col1: int) -> tuple[list[str], np.ndarray]:
+        """(fechas ordenadas, array (T, fila1-fila0, col1-col0)) de la ventana de píxeles."""
+        ix = self._actual()
+        c, bt = ix["chunk"], ix["bloque_t"]
+        fila0, col0 = max(0, fila0), max(0, col0)
+        fila1, col1 = min(ix["height"], fila1), min(ix["width"], col1)
+        if fila1 <= fila0 or col1 <= col0:
+            raise CuboNoDisponible("Fuera de la extensión del cubo")
+
+        fechas = sorted(ix["fechas"])
+        slots = np.array([ix["fechas"][f] for f in fechas], dtype=np.int64)
+        salida = np.empty((len(fechas), fila1 - fila0, col1 - col0), dtype=_DTYPE)
+
+        for bloque in np.unique(slots // bt):
+            sel = np.flatnonzero(slots // bt == bloque)
+            t_local = slots[sel] % bt
+            mm = self._bloque(ix, int(bloque))
+            for cy in range(fila0 // c, (fila1 - 1) // c + 1):
+                r0, r1 = max(fila0, cy * c), min(fila1, (cy + 1) * c)
+                for cx in range(col0 // c, (col1 - 1) // c + 1):
+                    q0, q1 = max(col0, cx * c), min(col1, (cx + 1) * c)
+                    trozo = mm[cy, cx, :, r0 - cy * c:r1 - cy * c, q0 - cx * c:q1 - cx * c]
+                    salida[sel, r0 - fila0:r1 - fila0, q0 - col0:q1 - col0] = trozo[t_local]
+        return fechas, salida
+
+    def serie_punto(self, x: float, y: float, crs="EPSG:4326") -> dict:
+        """Serie NDVI del píxel que contiene (x, y) (por defecto lon/lat)."""
+        ix = self._actual()
+        if crs != ix["crs"]:
+            xs, ys = transformar(crs, ix["crs"], [x], [y])
+            x, y = xs[0], ys[0]
+        fila, col = rowcol(Affine(*ix["transform"]), x, y)
+        fechas, valores = self.ventana(fila, fila + 1, col, col + 1)
+        v = valores[:, 0, 0]
+        return {
+            "fila": int(fila),
+            "columna": int(col),
+            "fechas": fechas,
+            "ndvi": [None if np.isnan(a) else round(float(a), 4) for a in v],
+        }
+
+    def serie_geometria(self, geometria: dict, crs="EPSG:4326") -> dict:
+        """
+        Estadísticas NDVI por fecha (media, mín, máx, desviación, píxeles
+        válidos) dentro de una geometría GeoJSON. Si ningún centro de píxel
+        cae dentro (recintos diminutos) se usan los píxeles que toca.
+        """
+        ix = self._actual()
+        if crs != ix["crs"]:
+            geometria = transform_geom(crs, ix["crs"], geometria)
+        cubo_transform = Affine(*ix["transform"])
+
+        win = from_bounds(*shape(geometria).bounds, transform=cubo_transform)
+        fila0, col0 = int(math.floor(win.row_off)), int(math.floor(win.col_off))
+        fila1 = int(math.ceil(win.row_off + win.height))
+        col1 = int(math.ceil(win.col_off + win.width))
+        fila0, col0 = max(0, fila0), max(0, col0)
+        fila1, col1 = max(fila1, fila0 + 1), max(col1, col0 + 1)
+        fechas, valores = self.ventana(fila0, fila1, col0, col1)
+
+        t_win = transform_ventana(Window(col0, fila0, valores.shape[2], valores.shape[1]), cubo_transform)
+        dentro = ~geometry_mask([geometria], out_shape=valores.shape[1:], transform=t_win)
+        if not dentro.any():
+            dentro = ~geometry_mask([geometria], out_shape=valores.shape[1:], transform=t_win, all_touched=True)
+
+        px = valores[:, dentro]  # (T, n)
+        validos = np.isfinite(px)
+        n = validos.sum(axis=1)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            media = np.where(n > 0, np.nansum(px, axis=1) / np.maximum(n, 1), np.nan)
+            px0 = np.where(validos, px, np.nan)
+            std = np.sqrt(np.where(n > 0, np.nansum((px0 - media[:, None]) ** 2, axis=1) / np.maximum(n, 1), np.nan))
+            minimo = np.where(n > 0, np.nanmin(np.where(validos, px, np.inf), axis=1), np.nan)
+            maximo = np.where(n > 0, np.nanmax(np.where(validos, px, -np.inf), axis=1), np.nan)
+
+        def _lista(a):
+            return [None if not np.isfinite(v) else round(float(v), 4) for v in a]
+
+        return {
+            "fechas": fechas,
+            "pixeles": int(dentro.sum()),
+            "media": _lista(media),
+            "min": _lista(minimo),
+            "max": _lista(maximo),
+            "std": _lista(std),
+            "validos": [int(v) for v in n],
+        }
+
+
+_lector: LectorCubo | None = None
+_lector_lock = threading.Lock()
+
+
+def get_lector_cubo(config=None) -> LectorCubo:
+    global _lector
+    if _lector is None:
+        with _lector_lock:
+            if _lector is None:
+                _lector = LectorCubo((config or {}).get("NDVI_CUBE_DIR") or NDVI_CUBE_DIR)
+    return _lector
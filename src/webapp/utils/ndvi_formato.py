@@ -0,0 +1,21 @@
+"""
+ndvi_formato.py
+---------------
+Lectura de los GeoTIFF NDVI del visor en cualquiera de los formatos que
+escriben los scripts (``NDVI_FORMATO``, ver ``src/ndvi_pipeline/formato_ndvi.py``):
+float32 con NaN o int16 × 10000 con nodata -32768.
+
+La decodificación es la de ``src/decodificacion_ndvi.py``, la misma que usan
+los scripts; aquí solo se reexporta. La webapp se importa como ``src.webapp``
+(servidor) o como ``webapp`` con ``src/`` en ``sys.path`` (scripts), y el
+módulo compartido se importa con el mismo prefijo.
+"""
+
+from __future__ import annotations
+
+if __package__.startswith("src."):
+    from src.decodificacion_ndvi import decodificar, leer_ndvi
+else:
+    from decodificacion_ndvi import decodificar, leer_ndvi
+
+__all__ = ["decodificar", "leer_ndvi"]
@@ -1,54 +1,148 @@
-import numpy as np
+import os
+
 import rasterio
-from rasterio.warp import calculate_default_transform, reproject, Resampling
+from rasterio.shutil import copy as rio_copy
+from rasterio.warp import Resampling, calculate_default_transform, reproject
 from rasterio.io import MemoryFile
-from PIL import Image
+from .ndvi_colormap import gris_to_rgba, tif_a_png
 
-def warp_tif_to_3857(src_tif: str, dst_tif: str):
+# Warp a 3857: hilos del warper de GDAL y memoria por trozo (MB)
+WARP_THREADS = os.getenv("WARP_THREADS", "ALL_CPUS")
+WARP_MEM_MB = int(os.getenv("WARP_MEM_MB", "512"))
+# 1 = copiar además el 3857 con el driver COG (layout COG; una pasada más)
+WARP_COG = os.getenv("WARP_COG", "0") == "1"
+
+def add_overviews(dst, resampling=Resampling.nearest, min_size: int = 256):
+    """
+    Añade overviews internas (factores 2, 4, 8... hasta que el lado menor baje
+    de ``min_size``) a un dataset abierto en escritura. Las usan las teselas
+    XYZ del visor (/api/raster-tiles) al leer a zoom bajo.
+    """
+    factores = []
+    f = 2
+    while min(dst.width, dst.height) // f >= min_size:
+        factores.append(f)
+        f *= 2
+    if factores:
+        dst.build_overviews(factores, resampling)
+        dst.update_tags(ns="rio_overview", resampling=resampling.name)
+
+
+def _hay_driver_cog() -> bool:
+    # El driver COG existe desde GDAL 3.1
+    with rasterio.Env() as env:
+        return "COG" in env.drivers()
+
+
+def _hilos(num_threads) -> int:
+    """``num_threads`` de ``reproject`` (entero) a partir de ``WARP_THREADS`` (número o ALL_CPUS)."""
+    if str(num_threads).upper() == "ALL_CPUS":
+        return os.cpu_count() or 1
+    return max(1, int(num_threads))
+
+
+def _compresion_formato(src) -> tuple[str, int | None]:
+    """
+    Compresión del 3857 según el formato del origen (``NDVI_FORMATO``): la del
+    fichero (ZSTD en int16, deflate en float32) y predictor horizontal en enteros.
+    """
+    compresion = (src.profile.get("compress") or "deflate").lower()
+    entero = src.dtypes[0].startswith(("int", "uint"))
+    return compresion, (2 if entero else None)
+
+
+def warp_a_3857(src_tif: str, dst_tif: str, resampling=Resampling.bilinear,
+                overview_resampling=Resampling.nearest, num_threads=WARP_THREADS,
+                warp_mem_mb: int = WARP_MEM_MB, blocksize: int = 256, cog: bool = WARP_COG):
+    """
+    Reproyecta ``src_tif`` a EPSG:3857 (rejilla de ``calculate_default_transform``)
+    con el mismo ``reproject`` de dataset a dataset que el warp antiguo, pero
+    en ``num_threads`` hilos y por trozos de ``warp_mem_mb`` MB: mismos
+    valores y huecos (NaN), sin cargar la banda entera. Escribe un GeoTIFF en
+    teselas de ``blocksize`` px con overviews internas (las usan las teselas
+    XYZ del visor), con la compresión y el scale/offset del origen: un int16
+    ×10000 sigue siendo ZSTD + predictor 2 y se lee con la escala correcta.
+
+    Con ``cog`` (``WARP_COG=1``) se copia además con el driver COG, que
+    reutiliza esas overviews; es una pasada más sobre el fichero, así que no
+    va por defecto. Se escribe en ``*.tmp.tif`` y se renombra al final: las
+    teselas del visor nunca leen un fichero a medias.
+    """
     dst_crs = "EPSG:3857"
+    base = os.path.splitext(dst_tif)[0]
+    tmp, tmp_cog = f"{base}.tmp.tif", f"{base}.tmp_cog.tif"
 
-    with rasterio.open(src_tif) as src:
-        transform, width, height = calculate_default_transform(
-            src.crs, dst_crs, src.width, src.height, *src.bounds
-        )
-
-        kwargs = src.meta.copy()
-        kwargs.update({
-            "crs": dst_crs,
-            "transform": transform,
-            "width": width,
-            "height": height,
-        })
-
-        with rasterio.open(dst_tif, "w", **kwargs) as dst:
-            for i in range(1, src.count + 1):
+    try:
+        with rasterio.Env(GDAL_NUM_THREADS=str(num_threads)), rasterio.open(src_tif) as src:
+            transform, width, height = calculate_default_transform(
+                src.crs, dst_crs, src.width, src.height, *src.bounds
+            )
+            compresion, predictor = _compresion_formato(src)
+            perfil = {
+                **src.meta,
+                "crs": dst_crs,
+                "transform": transform,
+                "width": width,
+                "height": height,
+                "nodata": src.nodata,
+                "compress": compresion,
+                "tiled": True,
+                "blockxsize": blocksize,
+                "blockysize": blocksize,
+                "BIGTIFF": "IF_SAFER",
+            }
+            if predictor:
+                perfil["predictor"] = predictor
+            with rasterio.open(tmp, "w", **perfil) as dst:
+                # int16 ×10000: la escala viaja en scale/offset (QGIS, gdalinfo y decodificar)
+                dst.scales, dst.offsets = src.scales, src.offsets
                 reproject(
-                    source=rasterio.band(src, i),
-                    destination=rasterio.band(dst, i),
+                    source=rasterio.band(src, 1),
+                    destination=rasterio.band(dst, 1),
                     src_transform=src.transform,
                     src_crs=src.crs,
                     dst_transform=transform,
                     dst_crs=dst_crs,
-                    resampling=Resampling.bilinear,
+                    resampling=resampling,
+                    src_nodata=src.nodata,
+                    dst_nodata=src.nodata,
+                    num_threads=_hilos(num_threads),
+                    warp_mem_limit=warp_mem_mb,
                 )
+                add_overviews(dst, overview_resampling, min_size=blocksize)
 
-def tif_to_png_singleband(src_tif: str, dst_png: str, nodata_to_transparent=True):
-    """
-    Convierte un GeoTIFF 1 banda (float NDVI) a PNG (RGBA) sin márgenes ni reescalados raros.
-    """
-    with rasterio.open(src_tif) as src:
-        arr = src.read(1).astype("float32")
+        if cog and _hay_driver_cog():
+            with rasterio.Env(GDAL_NUM_THREADS=str(num_threads)):
+                opciones = {"predictor": "STANDARD"} if predictor else {}
+                rio_copy(
+                    tmp, tmp_cog, driver="COG",
+                    compress=compresion.upper(),
+                    **opciones,
+                    blocksize=blocksize,
+                    overviews="AUTO",  # Las del GeoTIFF: no se recalculan
+                    num_threads=num_threads,
+                    bigtiff="IF_SAFER",
+                )
+            os.replace(tmp_cog, tmp)
+    except BaseException:
+        for ruta in (tmp, tmp_cog):
+            if os.path.exists(ruta):
+                os.remove(ruta)
+        raise
+    os.replace(tmp, dst_tif)
 
-    vmin, vmax = -1.0, 1.0
-    norm = (arr - vmin) / (vmax - vmin)
-    norm = np.clip(norm, 0, 1)
 
-    rgb = (norm * 255).astype(np.uint8)
+def warp_tif_to_3857(src_tif: str, dst_tif: str):
+    """GeoTIFF 3857 del visor: en teselas con overviews (``warp_a_3857``)."""
+    warp_a_3857(src_tif, dst_tif)
 
-    if nodata_to_transparent:
-        alpha = np.where(np.isfinite(arr), 255, 0).astype(np.uint8)
-    else:
-        alpha = np.full_like(rgb, 255, dtype=np.uint8)
 
-    rgba = np.dstack([rgb, rgb, rgb, alpha])  # colormap
-    Image.fromarray(rgba, mode="RGBA").save(dst_png)
\ No newline at end of file
+def tif_to_png_singleband(src_tif: str, dst_png: str, nodata_to_transparent=True):
+    """
+    Convierte un GeoTIFF 1 banda (float NDVI) a PNG (RGBA) sin márgenes ni reescalados raros.
+    Escala de grises -1..1 -> 0..255, por franjas (ndvi_colormap.LUT_GRIS).
+    """
+    tif_a_png(
+        src_tif, dst_png,
+        colorear=lambda arr: gris_to_rgba(arr, nodata_to_transparent=nodata_to_transparent),
+    )
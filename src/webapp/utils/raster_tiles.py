@@ -0,0 +1,296 @@
+"""
+raster_tiles.py
+---------------
+Teselas XYZ (256 px, EPSG:3857) generadas al vuelo desde los GeoTIFF 3857 de
+NDVI y Sentinel-2 RGB, para que el visor descargue solo lo visible y a la
+resolución del zoom en vez del PNG completo de la ROI.
+
+- Se lee únicamente la ventana de la tesela con ``out_shape`` = 256 px, de
+  modo que GDAL usa las overviews del GeoTIFF cuando existen.
+- Caché en dos niveles: LRU en memoria (bytes PNG) y disco
+  (``TILE_CACHE_DIR/<capa>/<fecha>/<mtime>/z/x/y.png``). El mtime del ráster
+  origen forma parte de la clave, así que un mosaico regenerado invalida sus
+  teselas sin borrar nada a mano.
+"""
+
+from __future__ import annotations
+
+import io
+import json
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from PIL import Image
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+
+from .ndvi_colormap import ndvi_to_rgba
+from .ndvi_formato import decodificar
+
+BASE_DIR = Path(__file__).resolve().parents[3]
+WEBAPP_DIR = Path(__file__).resolve().parents[1]
+
+TILE_SIZE = 256
+# Mitad del ancho del mundo en Web Mercator (m)
+ORIGEN_3857 = 20037508.342789244
+
+NDVI_LATEST_DIR = Path(os.getenv("NDVI_DIR", str(BASE_DIR / "data" / "raw" / "ndvi_composite")))
+NDVI_MOSAICOS_DIR = BASE_DIR / "data" / "processed" / "ndvi_composite"
+S2_DIR = WEBAPP_DIR / "static" / "sentinel2"
+
+CAPAS = ("ndvi", "s2rgb")
+_RE_FECHA = re.compile(r"^\d{4}-?\d{2}-?\d{2}$")
+
+
+class TileNotFound(Exception):
+    """Capa o fecha sin ráster disponible."""
+
+
+# ==================== ORIGEN ====================
+
+def _s2_latest() -> Path:
+    nombre = "s2_rgb_latest_3857.tif"
+    meta_path = S2_DIR / "s2_rgb_latest.json"
+    if meta_path.exists():
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            nombre = Path(meta.get("latest_tif_3857") or nombre).name
+        except (OSError, ValueError):
+            pass
+    return S2_DIR / nombre
+
+
+def _ndvi_mosaico_mas_reciente() -> Path | None:
+    if not NDVI_MOSAICOS_DIR.is_dir():
+        return None
+    archivos = list(NDVI_MOSAICOS_DIR.glob("ndvi_pc_*_mosaic_3857.tif"))
+    return max(archivos, key=lambda p: p.stat().st_mtime) if archivos else None
+
+
+def resolver_raster(capa: str, fecha: str) -> Path:
+    """
+    Ruta del GeoTIFF 3857 de una capa/fecha:
+    - ndvi/latest    -> NDVI_DIR/ndvi_latest_3857.tif (o el mosaico diario más reciente)
+    - ndvi/YYYYMMDD  -> data/processed/ndvi_composite/ndvi_pc_YYYYMMDD_mosaic_3857.tif
+    - s2rgb/latest   -> static/sentinel2/<latest_tif_3857 de s2_rgb_latest.json>
+    """
+    if capa not in CAPAS:
+        raise TileNotFound(f"Capa desconocida: {capa}")
+
+    if capa == "ndvi":
+        if fecha == "latest":
+            ruta = NDVI_LATEST_DIR / "ndvi_latest_3857.tif"
+            if not ruta.exists():
+                ruta = _ndvi_mosaico_mas_reciente() or ruta
+        elif _RE_FECHA.match(fecha):
+            ruta = NDVI_MOSAICOS_DIR / f"ndvi_pc_{fecha.replace('-', '')}_mosaic_3857.tif"
+        else:
+            raise TileNotFound(f"Fecha no válida: {fecha}")
+    else:
+        if fecha != "latest":
+            raise TileNotFound("Sentinel-2 RGB solo publica 'latest'")
+        ruta = _s2_latest()
+
+    if not ruta.exists():
+        raise TileNotFound(f"No existe {ruta.name}")
+    return ruta
+
+
+# ==================== RENDER ====================
+
+def tile_bounds_3857(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    tam = 2 * ORIGEN_3857 / (2 ** z)
+    minx = -ORIGEN_3857 + x * tam
+    maxy = ORIGEN_3857 - y * tam
+    return minx, maxy - tam, minx + tam, maxy
+
+
+def _leer_ventana(src, indexes, bounds, resampling, fill) -> tuple[np.ndarray, np.ndarray] | None:
+    """
+    Lee la parte del ráster que cae en la tesela, remuestreada a su tamaño en
+    píxeles de tesela. Devuelve (datos (bandas, 256, 256), máscara válida) o
+    None si no hay solape. Evita lecturas ``boundless`` (van por VRT y no usan overviews).
+    """
+    minx, miny, maxx, maxy = bounds
+    b = src.bounds
+    if maxx <= b.left or minx >= b.right or maxy <= b.bottom or miny >= b.top:
+        return None
+
+    inv = ~src.transform
+    c0, r0 = inv * (minx, maxy)
+    c1, r1 = inv * (maxx, miny)
+
+    cc0, rr0 = max(c0, 0.0), max(r0, 0.0)
+    cc1, rr1 = min(c1, float(src.width)), min(r1, float(src.height))
+    if cc1 <= cc0 or rr1 <= rr0:
+        return None
+
+    # Región destino dentro de la tesela
+    sx = TILE_SIZE / (c1 - c0)
+    sy = TILE_SIZE / (r1 - r0)
+    dx0 = int(round((cc0 - c0) * sx))
+    dy0 = int(round((rr0 - r0) * sy))
+    dx1 = int(round((cc1 - c0) * sx))
+    dy1 = int(round((rr1 - r0) * sy))
+    dw, dh = max(dx1 - dx0, 1), max(dy1 - dy0, 1)
+
+    ventana = Window(cc0, rr0, cc1 - cc0, rr1 - rr0)
+    datos = src.read(indexes, window=ventana, out_shape=(len(indexes), dh, dw), resampling=resampling)
+    mascara = src.dataset_mask(window=ventana, out_shape=(dh, dw)) > 0
+
+    out = np.full((len(indexes), TILE_SIZE, TILE_SIZE), fill, dtype=datos.dtype)
+    valido = np.zeros((TILE_SIZE, TILE_SIZE), dtype=bool)
+    out[:, dy0:dy0 + dh, dx0:dx0 + dw] = datos[:, :TILE_SIZE - dy0, :TILE_SIZE - dx0]
+    valido[dy0:dy0 + dh, dx0:dx0 + dw] = mascara[:TILE_SIZE - dy0, :TILE_SIZE - dx0]
+    return out, valido
+
+
+def _png(rgba: np.ndarray) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(rgba, mode="RGBA").save(buf, format="PNG", optimize=False, compress_level=6)
+    return buf.getvalue()
+
+
+TESELA_VACIA = _png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def render_tile(capa: str, ruta: Path, z: int, x: int, y: int) -> bytes:
+    bounds = tile_bounds_3857(z, x, y)
+    with rasterio.open(ruta) as src:
+        if capa == "ndvi":
+            # nearest: la paleta es por clases, no se interpolan valores entre píxeles
+            leido = _leer_ventana(src, [1], bounds, Resampling.nearest, 0)
+            if leido is None:
+                return TESELA_VACIA
+            datos, valido = leido
+            ndvi = decodificar(datos[0], src)  # float32 o int16 escalado
+            ndvi[~valido] = np.nan
+            rgba = ndvi_to_rgba(ndvi)
+        else:
+            bandas = [1, 2, 3]
+            leido = _leer_ventana(src, bandas, bounds, Resampling.bilinear, 0)
+            if leido is None:
+                return TESELA_VACIA
+            datos, valido = leido
+            if datos.dtype != np.uint8:
+                datos = np.clip(datos, 0, 255).astype(np.uint8)
+            rgba = np.dstack([datos[0], datos[1], datos[2], np.where(valido, 255, 0).astype(np.uint8)])
+
+    if not rgba[..., 3].any():
+        return TESELA_VACIA
+    return _png(rgba)
+
+
+# ==================== CACHÉ ====================
+
+class TileCache:
+    """
+    LRU en memoria + copia en disco, con clave que incluye el mtime del origen.
+
+    En disco solo se conserva la pirámide del mtime más reciente de cada
+    capa/fecha: al escribir la primera tesela de un mtime nuevo se borran los
+    directorios de mtimes anteriores (el ráster se ha regenerado).
+    """
+
+    def __init__(self, directorio: Path | None, max_items: int = 2000):
+        self.directorio = directorio
+        self.max_items = max_items
+        self._mem: OrderedDict[tuple, bytes] = OrderedDict()
+        self._lock = threading.Lock()
+        self._mtime_disco: dict[tuple[str, str], int] = {}
+
+    def _ruta_disco(self, clave: tuple) -> Path | None:
+        if self.directorio is None:
+            return None
+        capa, fecha, mtime, z, x, y = clave
+        return self.directorio / capa / fecha / str(mtime) / str(z) / str(x) / f"{y}.png"
+
+    def get(self, clave: tuple) -> bytes | None:
+        with self._lock:
+            datos = self._mem.get(clave)
+            if datos is not None:
+                self._mem.move_to_end(clave)
+                return datos
+
+        ruta = self._ruta_disco(clave)
+        if ruta is not None and ruta.exists():
+            datos = ruta.read_bytes()
+            self._put_mem(clave, datos)
+            return datos
+        return None
+
+    def put(self, clave: tuple, datos: bytes) -> None:
+        self._put_mem(clave, datos)
+        ruta = self._ruta_disco(clave)
+        if ruta is None or not self._mtime_vigente(clave[0], clave[1], clave[2]):
+            return
+        try:
+            ruta.parent.mkdir(parents=True, exist_ok=True)
+            tmp = ruta.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(datos)
+            os.replace(tmp, ruta)
+        except OSError as e:
+            print(f"⚠️ No se pudo escribir la tesela en caché {ruta}: {e}")
+
+    def _mtime_vigente(self, capa: str, fecha: str, mtime: int) -> bool:
+        """False si ya hay en disco un mtime más reciente; al ver uno nuevo, borra los anteriores."""
+        with self._lock:
+            previo = self._mtime_disco.get((capa, fecha))
+            if previo is not None and mtime <= previo:
+                return mtime == previo
+            self._mtime_disco[(capa, fecha)] = mtime
+        base = self.directorio / capa / fecha
+        if base.is_dir():
+            for d in base.iterdir():
+                if d.is_dir() and d.name.isdigit() and int(d.name) < mtime:
+                    shutil.rmtree(d, ignore_errors=True)
+        return True
+
+    def _put_mem(self, clave: tuple, datos: bytes) -> None:
+        with self._lock:
+            self._mem[clave] = datos
+            self._mem.move_to_end(clave)
+            while len(self._mem) > self.max_items:
+                self._mem.popitem(last=False)
+
+
+_cache: TileCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_tile_cache(config) -> TileCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                directorio = config.get("TILE_CACHE_DIR")
+                _cache = TileCache(
+                    Path(directorio) if directorio else None,
+                    int(config.get("TILE_CACHE_MEM_ITEMS", 2000)),
+                )
+    return _cache
+
+
+def obtener_tile(config, capa: str, fecha: str, z: int, x: int, y: int) -> tuple[bytes, str]:
+    """(PNG, ETag) de la tesela; lanza TileNotFound si no hay ráster."""
+    n = 2 ** z
+    if not (0 <= z <= 22 and 0 <= x < n and 0 <= y < n):
+        raise TileNotFound("Tesela fuera de rango")
+
+    ruta = resolver_raster(capa, fecha)
+    mtime = ruta.stat().st_mtime_ns
+    clave = (capa, fecha, mtime, z, x, y)
+    etag = f"{capa}-{fecha}-{mtime:x}-{z}-{x}-{y}"
+
+    cache = get_tile_cache(config)
+    datos = cache.get(clave)
+    if datos is None:
+        datos = render_tile(capa, ruta, z, x, y)
+        cache.put(clave, datos)
+    return datos, etag
@@ -0,0 +1,238 @@
+"""
+thumbnails_store.py
+-------------------
+Archivo único de thumbnails NDVI por recinto (SQLite, estilo MBTiles) en lugar
+de un PNG suelto por recinto y fecha en ``static/thumbnails/YYYYMMDD/``.
+
+- Tabla ``thumbnails`` (fecha, id_recinto) -> PNG + ETag (hash del PNG),
+  ``WITHOUT ROWID``: la clave primaria es el propio índice y las filas de una
+  fecha quedan contiguas en disco.
+- ``existentes(fecha)`` sustituye a un ``os.path.exists`` por recinto: una
+  sola consulta devuelve los ids ya generados.
+- ``EscritorThumbnails`` agrupa las escrituras en transacciones de ``lote``
+  filas (un único escritor: el proceso principal de generate_thumbnails.py).
+- La webapp lee con conexiones de solo lectura, una por hilo; con WAL las
+  lecturas no se bloquean mientras se escribe.
+- Tabla ``manifiesto`` (fecha, id_recinto) -> hash de la geometría, firma del
+  ráster NDVI, hash de la ventana NDVI del recinto y estado: permite regenerar
+  solo los recintos que han cambiado y reanudar una ejecución interrumpida
+  (se escribe en la misma transacción que el PNG). Lo comparten ambos
+  backends, así que generate_thumbnails.py solo omite un recinto con PNG si
+  este existe en el almacén de destino.
+
+Variables: ``THUMB_STORE`` (``sqlite`` por defecto | ``archivos``) y
+``THUMB_ARCHIVE_PATH`` (por defecto ``data/thumbnails/thumbnails.sqlite``).
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parents[3]
+
+THUMB_STORE = os.getenv("THUMB_STORE", "sqlite")
+THUMB_ARCHIVE_PATH = Path(os.getenv(
+    "THUMB_ARCHIVE_PATH", str(BASE_DIR / "data" / "thumbnails" / "thumbnails.sqlite")
+))
+THUMBNAILS_STATIC_DIR = BASE_DIR / "src" / "webapp" / "static" / "thumbnails"
+
+_ESQUEMA = """
+CREATE TABLE IF NOT EXISTS thumbnails (
+    fecha       TEXT    NOT NULL,
+    id_recinto  INTEGER NOT NULL,
+    png         BLOB    NOT NULL,
+    etag        TEXT    NOT NULL,
+    actualizado REAL    NOT NULL,
+    PRIMARY KEY (fecha, id_recinto)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS manifiesto (
+    fecha        TEXT    NOT NULL,
+    id_recinto   INTEGER NOT NULL,
+    hash_geom    TEXT    NOT NULL,
+    firma_raster TEXT    NOT NULL,
+    hash_ventana TEXT,
+    estado       TEXT    NOT NULL,
+    PRIMARY KEY (fecha, id_recinto)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+INSERT OR IGNORE INTO metadata (name, value) VALUES ('format', 'png'), ('type', 'thumbnails_ndvi_recinto');
+"""
+
+
+def ruta_thumbnail(fecha: str, id_recinto: int, store: str = THUMB_STORE) -> str:
+    """Valor de ``indices_raster.ruta_ndvi`` (URL relativa del thumbnail)."""
+    if store == "sqlite":
+        return f"api/thumbnails/{fecha}/{id_recinto}.png"
+    return f"static/thumbnails/{fecha}/{id_recinto}.png"
+
+
+def etag_png(png: bytes) -> str:
+    return hashlib.blake2b(png, digest_size=12).hexdigest()
+
+
+class ArchivoThumbnails:
+    def __init__(self, ruta=THUMB_ARCHIVE_PATH):
+        self.ruta = Path(ruta)
+        self._local = threading.local()
+
+    # ---- conexiones ----
+
+    def conectar_escritura(self) -> sqlite3.Connection:
+        self.ruta.parent.mkdir(parents=True, exist_ok=True)
+        con = sqlite3.connect(self.ruta, isolation_level=None)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.executescript(_ESQUEMA)
+        return con
+
+    def _lectura(self) -> sqlite3.Connection | None:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            if not self.ruta.exists():
+                return None
+            con = sqlite3.connect(f"file:{self.ruta}?mode=ro", uri=True, check_same_thread=False)
+            self._local.con = con
+        return con
+
+    # ---- lectura ----
+
+    def get(self, fecha: str, id_recinto: int) -> tuple[bytes, str] | None:
+        """(PNG, ETag) o None si no está en el archivo."""
+        con = self._lectura()
+        if con is None:
+            return None
+        fila = con.execute(
+            "SELECT png, etag FROM thumbnails WHERE fecha = ? AND id_recinto = ?",
+            (fecha, int(id_recinto)),
+        ).fetchone()
+        return (bytes(fila[0]), fila[1]) if fila else None
+
+    def etag(self, fecha: str, id_recinto: int) -> str | None:
+        """Solo el ETag (para responder 304 sin leer el PNG)."""
+        con = self._lectura()
+        if con is None:
+            return None
+        fila = con.execute(
+            "SELECT etag FROM thumbnails WHERE fecha = ? AND id_recinto = ?",
+            (fecha, int(id_recinto)),
+        ).fetchone()
+        return fila[0] if fila else None
+
+    def existentes(self, fecha: str) -> set[int]:
+        con = self._lectura()
+        if con is None:
+            return set()
+        return {r for (r,) in con.execute("SELECT id_recinto FROM thumbnails WHERE fecha = ?", (fecha,))}
+
+    def manifiesto(self, fecha: str) -> dict[int, tuple[str, str, str | None, str]]:
+        """
+        {id_recinto: (hash_geom, firma_raster, hash_ventana, estado)} de la
+        fecha. Es común a los dos backends: un ``success``/``unchanged`` no
+        garantiza que el PNG esté en el almacén que se usa ahora.
+        """
+        con = self._lectura()
+        if con is None:
+            return {}
+        try:
+            filas = con.execute(
+                "SELECT id_recinto, hash_geom, firma_raster, hash_ventana, estado FROM manifiesto WHERE fecha = ?",
+                (fecha,),
+            )
+            return {r: (hg, fr, hv, e) for r, hg, fr, hv, e in filas}
+        except sqlite3.OperationalError:  # Archivo anterior al manifiesto
+            return {}
+
+    def escritor(self, lote: int = 1000) -> "EscritorThumbnails":
+        return EscritorThumbnails(self, lote)
+
+
+class EscritorThumbnails:
+    """
+    ``put``/``marcar`` acumulan filas y las escriben en una transacción cada
+    ``lote``. Al salir (también por Ctrl+C) se confirma lo pendiente, salvo
+    error de la propia base.
+    """
+
+    def __init__(self, archivo: ArchivoThumbnails, lote: int = 1000):
+        self.archivo = archivo
+        self.lote = max(1, lote)
+        self._pendientes: list[tuple] = []
+        self._manifiesto: list[tuple] = []
+        self._con: sqlite3.Connection | None = None
+        self.escritos = 0
+
+    def __enter__(self):
+        self._con = self.archivo.conectar_escritura()
+        return self
+
+    def put(self, fecha: str, id_recinto: int, png: bytes):
+        self._pendientes.append((fecha, int(id_recinto), png, etag_png(png), time.time()))
+        if len(self._pendientes) + len(self._manifiesto) >= self.lote:
+            self.flush()
+
+    def marcar(self, fecha: str, id_recinto: int, hash_geom: str, firma_raster: str,
+               hash_ventana: str | None, estado: str):
+        self._manifiesto.append((fecha, int(id_recinto), hash_geom, firma_raster, hash_ventana, estado))
+        if len(self._pendientes) + len(self._manifiesto) >= self.lote:
+            self.flush()
+
+    def flush(self):
+        if not self._pendientes and not self._manifiesto:
+            return
+        con = self._con
+        con.execute("BEGIN")
+        try:
+            con.executemany(
+                "INSERT OR REPLACE INTO thumbnails (fecha, id_recinto, png, etag, actualizado) "
+                "VALUES (?, ?, ?, ?, ?)",
+                self._pendientes,
+            )
+            con.executemany(
+                "INSERT OR REPLACE INTO manifiesto "
+                "(fecha, id_recinto, hash_geom, firma_raster, hash_ventana, estado) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self._manifiesto,
+            )
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        self.escritos += len(self._pendientes)
+        self._pendientes = []
+        self._manifiesto = []
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None or not issubclass(exc_type, sqlite3.Error):
+                self.flush()
+        finally:
+            self._con.close()
+            self._con = None
+
+
+def ids_en_carpeta(directorio) -> set[int]:
+    """Ids con PNG en una carpeta ``static/thumbnails/YYYYMMDD`` (un solo listado)."""
+    try:
+        with os.scandir(directorio) as it:
+            return {int(e.name[:-4]) for e in it if e.name.endswith(".png") and e.name[:-4].isdigit()}
+    except FileNotFoundError:
+        return set()
+
+
+_archivo: ArchivoThumbnails | None = None
+_archivo_lock = threading.Lock()
+
+
+def get_archivo_thumbnails(config=None) -> ArchivoThumbnails:
+    global _archivo
+    if _archivo is None:
+        with _archivo_lock:
+            if _archivo is None:
+                ruta = (config or {}).get("THUMB_ARCHIVE_PATH") or THUMB_ARCHIVE_PATH
+                _archivo = ArchivoThumbnails(ruta)
+    return _archivo